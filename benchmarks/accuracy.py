@@ -0,0 +1,334 @@
+"""Accuracy and speed of reg_aladin and reg_f3d on synthetic phantoms.
+
+Usage::
+
+    uv run python benchmarks/accuracy.py \\
+        --aladin block_step_size_2=0,1 --aladin percent_blocks_to_use=50,100 \\
+        --f3d spacing=-5,-10 --f3d num_levels_to_perform=2,3
+
+Every phantom is an analytic image of ellipsoidal blobs. The floating image
+samples it directly and the reference samples it through a known affine
+transformation composed with a smooth non-rigid deformation, so no external
+data is needed and nothing is interpolated. Every combination of parameters is
+run on every phantom, each in a new process so that the peak memory of the
+NiftyReg binaries can be measured. The target registration error (TRE) is the
+distance between the true and estimated floating positions of landmarks
+inside the phantom. The f3d runs start from the true affine, so that they
+measure the non-rigid stage alone.
+
+A table is printed and a record is appended to a JSON history file.
+"""
+
+from __future__ import annotations
+
+import argparse
+import multiprocessing
+import sys
+import tempfile
+import time
+from dataclasses import asdict, dataclass, field
+from pathlib import Path
+from typing import Any
+
+import nibabel as nib
+import numpy as np
+from run import git_commit, load_history, machine, save_history
+
+import niftyregw
+from niftyregw.chain import read_affine, write_affine
+from niftyregw.resample import compute_deformation
+from niftyregw.sweep import grid_search, parse_parameter
+from niftyregw.wrapper import reg_aladin, reg_f3d
+
+BENCHMARK_DIR = Path(__file__).parent
+DEFAULT_HISTORY = BENCHMARK_DIR / "accuracy_history.json"
+LANDMARK_COUNT = 500
+
+
+@dataclass
+class Phantom:
+    """A pair of images with a known transformation from reference to floating.
+
+    Attributes:
+        reference: Reference image filename.
+        floating: Floating image filename.
+        affine: Filename of the true affine part of the transformation.
+        landmarks: Reference world coordinates of the landmarks, (N, 3).
+        landmark_indices: Reference voxel indices of the landmarks, (N, 3).
+        targets: True floating world coordinates of the landmarks, (N, 3).
+    """
+
+    reference: Path
+    floating: Path
+    affine: Path
+    landmarks: np.ndarray
+    landmark_indices: np.ndarray
+    targets: np.ndarray
+
+
+def _random_affine(rng: np.random.Generator) -> np.ndarray:
+    angles = np.radians(rng.uniform(-10, 10, 3))
+    rotation = np.eye(3)
+    for axis, angle in enumerate(angles):
+        i, j = [k for k in range(3) if k != axis]
+        r = np.eye(3)
+        r[i, i] = r[j, j] = np.cos(angle)
+        r[i, j], r[j, i] = -np.sin(angle), np.sin(angle)
+        rotation = rotation @ r
+    matrix = np.eye(4)
+    matrix[:3, :3] = rotation * rng.uniform(0.95, 1.05, 3)
+    matrix[:3, 3] = rng.uniform(-8, 8, 3)
+    return matrix
+
+
+def make_phantom(
+    directory: Path, seed: int, size: int = 64, voxel_size: float = 2.0
+) -> Phantom:
+    """Write a phantom pair and its true transformation to *directory*."""
+    rng = np.random.default_rng(seed)
+    directory.mkdir(parents=True, exist_ok=True)
+    half = size * voxel_size / 2
+    blobs = [
+        (rng.uniform(-0.5, 0.5, 3) * half, rng.uniform(0.1, 0.3, 3) * half, value)
+        for value in rng.uniform(0.3, 1.0, 12)
+    ]
+    body_radii = np.array([0.8, 0.7, 0.75]) * half
+
+    def _intensity(points: np.ndarray) -> np.ndarray:
+        values = np.where(np.sum((points / body_radii) ** 2, -1) < 1, 0.2, 0.0)
+        for centre, radii, value in blobs:
+            values = values + value * np.exp(
+                -np.sum(((points - centre) / radii) ** 2, -1)
+            )
+        return values.astype(np.float32)
+
+    # Smooth displacement in reference space, a few mm at most
+    bumps = [
+        (rng.uniform(-0.6, 0.6, 3) * half, rng.uniform(-4, 4, 3)) for _ in range(6)
+    ]
+    sigma = 0.35 * half
+
+    def _displacement(points: np.ndarray) -> np.ndarray:
+        total = np.zeros_like(points)
+        for centre, amplitude in bumps:
+            weight = np.exp(-np.sum((points - centre) ** 2, -1) / (2 * sigma**2))
+            total += weight[..., None] * amplitude
+        return total
+
+    affine = _random_affine(rng)
+    image_affine = np.diag([voxel_size, voxel_size, voxel_size, 1.0])
+    image_affine[:3, 3] = -half + voxel_size / 2
+    indices = np.stack(np.indices((size, size, size)), -1).reshape(-1, 3)
+    points = nib.affines.apply_affine(image_affine, indices)
+
+    def _transform(x: np.ndarray) -> np.ndarray:
+        return nib.affines.apply_affine(affine, x + _displacement(x))
+
+    shape = (size, size, size)
+    reference = directory / "reference.nii.gz"
+    floating = directory / "floating.nii.gz"
+    reference_data = _intensity(_transform(points)).reshape(shape)
+    nib.save(nib.Nifti1Image(reference_data, image_affine), reference)
+    nib.save(nib.Nifti1Image(_intensity(points).reshape(shape), image_affine), floating)
+    affine_path = write_affine(affine, directory / "affine.txt")
+
+    inside = np.flatnonzero(reference_data.ravel() > 0.1)
+    chosen = indices[
+        rng.choice(inside, min(LANDMARK_COUNT, len(inside)), replace=False)
+    ]
+    landmarks = nib.affines.apply_affine(image_affine, chosen)
+    return Phantom(
+        reference, floating, affine_path, landmarks, chosen, _transform(landmarks)
+    )
+
+
+def _tre(estimated: np.ndarray, targets: np.ndarray) -> dict[str, float]:
+    errors = np.linalg.norm(estimated - targets, axis=-1)
+    return {
+        "tre_mean": float(errors.mean()),
+        "tre_median": float(np.median(errors)),
+        "tre_p95": float(np.percentile(errors, 95)),
+        "tre_max": float(errors.max()),
+    }
+
+
+def _peak_child_memory_mb() -> float | None:
+    try:
+        import resource
+    except ImportError:  # Windows
+        return None
+    peak = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss
+    # Kilobytes on Linux, bytes on macOS
+    return peak / (1024**2 if sys.platform == "darwin" else 1024)
+
+
+@dataclass
+class Result:
+    """Outcome of one configuration on one phantom."""
+
+    phantom: int
+    tool: str
+    params: dict[str, Any]
+    seconds: float | None = None
+    peak_memory_mb: float | None = None
+    tre: dict[str, float] = field(default_factory=dict)
+    error: str = ""
+
+    def as_row(self) -> dict[str, Any]:
+        """Return the result as a flat mapping."""
+        params = " ".join(f"{name}={value}" for name, value in self.params.items())
+        return {
+            "phantom": self.phantom,
+            "tool": self.tool,
+            "params": params or "default",
+            "seconds": self.seconds,
+            "peak_memory_mb": self.peak_memory_mb,
+            **self.tre,
+            "error": self.error,
+        }
+
+
+def _run_configuration(
+    phantom: Phantom, seed: int, tool: str, params: dict[str, Any], omp_threads: int
+) -> Result:
+    """Run one registration. Called in a new process for every configuration."""
+    result = Result(seed, tool, params)
+    with tempfile.TemporaryDirectory(prefix="niftyregw-accuracy-") as tmp:
+        tmp_dir = Path(tmp)
+        arguments = dict(params)
+        if "spacing" in arguments:
+            spacing = arguments.pop("spacing")
+            arguments.update(spacing_x=spacing, spacing_y=spacing, spacing_z=spacing)
+        start = time.perf_counter()
+        if tool == "reg_aladin":
+            output = tmp_dir / "affine.txt"
+            returncode = reg_aladin(
+                phantom.reference,
+                phantom.floating,
+                output_affine=output,
+                output_result=tmp_dir / "result.nii.gz",
+                omp_threads=omp_threads,
+                **arguments,
+            )
+        else:
+            output = tmp_dir / "cpp.nii.gz"
+            returncode = reg_f3d(
+                phantom.reference,
+                phantom.floating,
+                input_affine=phantom.affine,
+                output_cpp=output,
+                output_result=tmp_dir / "result.nii.gz",
+                omp_threads=omp_threads,
+                **arguments,
+            )
+        result.seconds = time.perf_counter() - start
+        result.peak_memory_mb = _peak_child_memory_mb()
+        if returncode != 0:
+            result.error = f"{tool} exited with code {returncode}"
+            return result
+
+        try:
+            if tool == "reg_aladin":
+                estimated = nib.affines.apply_affine(
+                    read_affine(output), phantom.landmarks
+                )
+            else:
+                field_path = compute_deformation(
+                    output, phantom.reference, tmp_dir / "def.nii.gz"
+                )
+                deformation = np.asarray(nib.load(field_path).dataobj)
+                deformation = deformation.reshape(*deformation.shape[:3], 3)
+                estimated = deformation[tuple(phantom.landmark_indices.T)]
+        except (OSError, ValueError) as e:
+            result.error = f"{type(e).__name__}: {e}"
+            return result
+        result.tre = _tre(estimated, phantom.targets)
+    return result
+
+
+def _print_table(rows: list[dict[str, Any]]) -> None:
+    columns = list(dict.fromkeys(column for row in rows for column in row))
+    cells = [[_format_cell(row.get(column)) for column in columns] for row in rows]
+    widths = [
+        max(len(column), *(len(row[i]) for row in cells))
+        for i, column in enumerate(columns)
+    ]
+    for row in [columns, ["-" * width for width in widths], *cells]:
+        print("  ".join(c.ljust(w) for c, w in zip(row, widths, strict=True)))
+
+
+def _format_cell(value: Any) -> str:
+    if value is None:
+        return ""
+    return f"{value:.3g}" if isinstance(value, float) else str(value)
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument(
+        "--aladin",
+        action="append",
+        default=[],
+        help="reg_aladin parameter values, as 'name=v1,v2'. Can be repeated.",
+    )
+    parser.add_argument(
+        "--f3d",
+        action="append",
+        default=[],
+        help="reg_f3d parameter values, as 'name=v1,v2'. Can be repeated.",
+    )
+    parser.add_argument("--no-aladin", action="store_true")
+    parser.add_argument("--no-f3d", action="store_true")
+    parser.add_argument("--phantoms", type=int, default=2)
+    parser.add_argument("--size", type=int, default=64, help="Voxels per axis.")
+    parser.add_argument("--threads", type=int, default=1, help="OpenMP threads.")
+    parser.add_argument("--history", type=Path, default=DEFAULT_HISTORY)
+    parser.add_argument("--no-save", action="store_true")
+    args = parser.parse_args()
+
+    configurations = []
+    for tool, texts, skip in (
+        ("reg_aladin", args.aladin, args.no_aladin),
+        ("reg_f3d", args.f3d, args.no_f3d),
+    ):
+        if not skip:
+            space = dict(parse_parameter(text) for text in texts)
+            configurations += [(tool, params) for params in grid_search(space)]
+
+    results = []
+    context = multiprocessing.get_context("spawn")
+    with tempfile.TemporaryDirectory(prefix="niftyregw-phantoms-") as tmp:
+        for seed in range(args.phantoms):
+            phantom = make_phantom(Path(tmp) / f"phantom_{seed}", seed, args.size)
+            initial = _tre(phantom.landmarks, phantom.targets)["tre_mean"]
+            print(f"Phantom {seed}: mean TRE before registration {initial:.3g} mm")
+            for tool, params in configurations:
+                # A new process per run, so that peak memory is per run
+                with context.Pool(1) as pool:
+                    result = pool.apply(
+                        _run_configuration, (phantom, seed, tool, params, args.threads)
+                    )
+                results.append(result)
+
+    rows = [result.as_row() for result in results]
+    if rows:
+        _print_table(rows)
+    if not args.no_save:
+        history = load_history(args.history)
+        history.append(
+            {
+                "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+                "commit": git_commit(),
+                "version": niftyregw.__version__,
+                "machine": machine(),
+                "size": args.size,
+                "threads": args.threads,
+                "results": [asdict(result) for result in results],
+            }
+        )
+        save_history(history, args.history)
+    return 1 if any(result.error for result in results) else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,71 @@
+"""Benchmarks of the command lines built from typed arguments.
+
+Every ``bench_*`` function is timed by ``benchmarks/run.py``.
+:func:`niftyregw.wrapper.run` is replaced for the whole module and the
+binaries need not be installed, so the timings measure argument building and
+command logging, not the binaries.
+"""
+
+from __future__ import annotations
+
+import contextlib
+import os
+from pathlib import Path
+from unittest.mock import patch
+
+from loguru import logger
+
+from niftyregw import wrapper
+from niftyregw.commands import setup_logger
+from niftyregw.enums import LogLevel
+
+_stack = contextlib.ExitStack()
+
+
+def setup() -> None:
+    """Replace the runs of the binaries and log to a null sink as the CLI would."""
+    _stack.enter_context(patch.object(wrapper, "run", return_value=0))
+    _stack.enter_context(patch.object(wrapper, "_get_path", side_effect=Path))
+    devnull = _stack.enter_context(open(os.devnull, "w"))  # noqa: SIM115
+    with contextlib.redirect_stderr(devnull):
+        setup_logger(LogLevel.DEBUG)
+    _stack.callback(logger.remove)
+
+
+def teardown() -> None:
+    """Restore the runs of the binaries."""
+    _stack.close()
+
+
+def bench_reg_aladin_arguments() -> None:
+    """Build the reg_aladin command line from typed arguments."""
+    wrapper.reg_aladin(
+        Path("ref.nii.gz"),
+        Path("flo.nii.gz"),
+        output_affine=Path("affine.txt"),
+        output_result=Path("result.nii.gz"),
+        reference_mask=Path("mask.nii.gz"),
+        rigid_only=True,
+        num_levels=4,
+        num_levels_to_perform=3,
+        omp_threads=4,
+    )
+
+
+def bench_reg_f3d_arguments() -> None:
+    """Build the reg_f3d command line from typed arguments."""
+    wrapper.reg_f3d(
+        Path("ref.nii.gz"),
+        Path("flo.nii.gz"),
+        input_affine=Path("affine.txt"),
+        output_cpp=Path("cpp.nii.gz"),
+        output_result=Path("result.nii.gz"),
+        reference_mask=Path("mask.nii.gz"),
+        spacing_x=-5,
+        bending_energy=0.005,
+        jacobian_log_weight=0.01,
+        use_nmi=True,
+        num_levels=3,
+        max_iterations=300,
+        omp_threads=4,
+    )
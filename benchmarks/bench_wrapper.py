@@ -0,0 +1,108 @@
+"""Benchmarks of the Python layer around the NiftyReg binaries.
+
+Every ``bench_*`` function is timed by ``benchmarks/run.py``. The binaries are
+stub shell scripts, so the timings measure process spawning, the reader
+threads and log formatting, not NiftyReg itself. Argument building is timed
+by ``bench_arguments``.
+"""
+
+from __future__ import annotations
+
+import contextlib
+import io
+import os
+import sys
+import tempfile
+from pathlib import Path
+from unittest.mock import patch
+
+from loguru import logger
+
+from niftyregw import wrapper
+from niftyregw.commands import setup_logger
+from niftyregw.enums import LogLevel
+
+LINE_COUNT = 1000
+
+# Lines printed by reg_aladin, including a transformation matrix
+_ALADIN_LINES = [
+    "[NiftyReg INFO] Current level: 1 / 3",
+    "[NiftyReg INFO] Reference image size: 64x64x64 voxels",
+    "[NiftyReg INFO] Block matching parameters: 30 blocks, 50 % inliers",
+    "[NiftyReg WARNING] The floating image has no sform",
+    "1.0012 -0.0153 0.0021 -2.4410",
+    "0.0148 0.9987 -0.0102 1.0233",
+    "-0.0019 0.0105 1.0004 0.3321",
+    "0 0 0 1",
+]
+
+_tmp_dir: tempfile.TemporaryDirectory | None = None
+_stack = contextlib.ExitStack()
+
+
+def _write_stub(directory: Path, name: str, body: str) -> None:
+    path = directory / name
+    path.write_text(f"#!/bin/sh\n{body}\n")
+    path.chmod(0o755)
+
+
+def setup() -> None:
+    """Put stub binaries on ``PATH`` and log to a null sink as the CLI would."""
+    global _tmp_dir
+    _tmp_dir = tempfile.TemporaryDirectory(prefix="niftyregw-bench-")
+    bin_dir = Path(_tmp_dir.name)
+    lines = bin_dir / "lines.txt"
+    lines.write_text(
+        "\n".join(_ALADIN_LINES[i % len(_ALADIN_LINES)] for i in range(LINE_COUNT))
+    )
+    _write_stub(bin_dir, "reg_tools", "exit 0")
+    _write_stub(bin_dir, "reg_aladin", f'cat "{lines}"')
+    _write_stub(bin_dir, "reg_f3d", f'cat "{lines}" >&2')
+
+    _stack.enter_context(
+        patch.dict(os.environ, {"PATH": f"{bin_dir}{os.pathsep}{os.environ['PATH']}"})
+    )
+    devnull = _stack.enter_context(open(os.devnull, "w"))  # noqa: SIM115
+    with contextlib.redirect_stderr(devnull):
+        setup_logger(LogLevel.DEBUG)
+    _stack.callback(logger.remove)
+
+
+def teardown() -> None:
+    """Remove the stub binaries."""
+    _stack.close()
+    if _tmp_dir is not None:
+        _tmp_dir.cleanup()
+
+
+def bench_format_matrix_line() -> None:
+    """Format the lines printed by reg_aladin."""
+    for line in _ALADIN_LINES:
+        wrapper._format_matrix_line(line)
+
+
+def bench_read_stream() -> None:
+    """Log 1000 lines read from a stream."""
+    stream = io.StringIO("\n".join(_ALADIN_LINES * (LINE_COUNT // 8)))
+    tool_logger = logger.bind(executable="reg_aladin")
+    wrapper._read_stream(stream, True, tool_logger)
+
+
+def bench_run_spawn() -> None:
+    """Run a binary that prints nothing."""
+    wrapper.run("reg_tools")
+
+
+def bench_run_stdout() -> None:
+    """Run a binary that prints 1000 lines to stdout."""
+    wrapper.run("reg_aladin", tool_logger=logger.bind(executable="reg_aladin"))
+
+
+def bench_run_with_logging() -> None:
+    """Run a binary printing 1000 lines to stderr, logging the command first."""
+    wrapper._run_with_logging("reg_f3d", "  -ref ref.nii \\", "  -flo flo.nii \\")
+
+
+if sys.platform == "win32":
+    # The stubs are shell scripts
+    del bench_run_spawn, bench_run_stdout, bench_run_with_logging
@@ -0,0 +1,173 @@
+"""Run the benchmarks and compare them with the previous run on this machine.
+
+Usage::
+
+    uv run python benchmarks/run.py [--filter NAME] [--fail-above 1.25]
+
+Results are appended to a JSON history file, one record per run with the
+median and minimum time per call of every benchmark. Every benchmark is
+compared with the latest record from the same machine and Python version.
+"""
+
+from __future__ import annotations
+
+import argparse
+import importlib
+import json
+import platform
+import statistics
+import subprocess
+import sys
+import time
+import timeit
+from pathlib import Path
+
+import niftyregw
+
+BENCHMARK_DIR = Path(__file__).parent
+MODULES = ("bench_wrapper", "bench_arguments")
+DEFAULT_HISTORY = BENCHMARK_DIR / "history.json"
+
+
+def git_commit() -> str | None:
+    """Return the short hash of the checked out commit, if any."""
+    try:
+        output = subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            capture_output=True,
+            text=True,
+            check=True,
+            cwd=BENCHMARK_DIR,
+        )
+    except (OSError, subprocess.CalledProcessError):
+        return None
+    return output.stdout.strip()
+
+
+def machine() -> str:
+    """Return a description of this machine and Python version."""
+    return f"{platform.node()} {platform.machine()} Python {platform.python_version()}"
+
+
+def time_function(function, repeat: int, min_time: float) -> dict[str, float | int]:
+    """Return the median and minimum seconds per call of *function*."""
+    timer = timeit.Timer(function)
+    number, elapsed = timer.autorange()
+    if elapsed < min_time:
+        number = max(number, int(number * min_time / elapsed))
+    times = [t / number for t in timer.repeat(repeat=repeat, number=number)]
+    return {"median": statistics.median(times), "min": min(times), "number": number}
+
+
+def run_benchmarks(
+    pattern: str | None, repeat: int, min_time: float
+) -> dict[str, dict[str, float | int]]:
+    """Time every benchmark whose name contains *pattern*."""
+    sys.path.insert(0, str(BENCHMARK_DIR))
+    results = {}
+    for module_name in MODULES:
+        module = importlib.import_module(module_name)
+        names = [
+            name
+            for name in vars(module)
+            if name.startswith("bench_") and (pattern is None or pattern in name)
+        ]
+        if not names:
+            continue
+        module.setup()
+        try:
+            for name in names:
+                key = f"{module_name}.{name.removeprefix('bench_')}"
+                results[key] = time_function(getattr(module, name), repeat, min_time)
+                print(f"  {key}: {_format_time(results[key]['median'])}")
+        finally:
+            module.teardown()
+    return results
+
+
+def _format_time(seconds: float) -> str:
+    for unit, scale in (("s", 1), ("ms", 1e-3), ("us", 1e-6)):
+        if seconds >= scale:
+            return f"{seconds / scale:.3g} {unit}"
+    return f"{seconds / 1e-9:.3g} ns"
+
+
+def load_history(path: Path) -> list[dict]:
+    """Return the records of *path*, or an empty list if it does not exist."""
+    if not path.exists():
+        return []
+    return json.loads(path.read_text())
+
+
+def save_history(history: list[dict], path: Path) -> None:
+    """Write the records of *history* to *path*."""
+    path.write_text(json.dumps(history, indent=2) + "\n")
+
+
+def compare(
+    results: dict[str, dict[str, float | int]], previous: dict | None
+) -> dict[str, float]:
+    """Return the ratio of the median times to those of the *previous* record."""
+    if previous is None:
+        return {}
+    ratios = {}
+    for name, result in results.items():
+        old = previous["results"].get(name)
+        if old is not None and old["median"] > 0:
+            ratios[name] = result["median"] / old["median"]
+    return ratios
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--filter", help="Run the benchmarks containing this name.")
+    parser.add_argument("--history", type=Path, default=DEFAULT_HISTORY)
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument(
+        "--min-time", type=float, default=0.2, help="Seconds per repetition."
+    )
+    parser.add_argument(
+        "--fail-above",
+        type=float,
+        help="Exit with code 1 if a benchmark is slower than this ratio.",
+    )
+    parser.add_argument(
+        "--no-save", action="store_true", help="Do not add the results to history."
+    )
+    args = parser.parse_args()
+
+    print(f"Running benchmarks of niftyregw {niftyregw.__version__}")
+    results = run_benchmarks(args.filter, args.repeat, args.min_time)
+    record = {
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        "commit": git_commit(),
+        "version": niftyregw.__version__,
+        "machine": machine(),
+        "results": results,
+    }
+
+    history = load_history(args.history)
+    same_machine = [r for r in history if r["machine"] == record["machine"]]
+    previous = same_machine[-1] if same_machine else None
+    ratios = compare(results, previous)
+    if previous is not None:
+        print(f"Compared with {previous['commit']} ({previous['timestamp']}):")
+        for name, ratio in ratios.items():
+            flag = ""
+            if args.fail_above is not None and ratio > args.fail_above:
+                flag = "  REGRESSION"
+            print(f"  {name}: {ratio:.2f}x{flag}")
+
+    if not args.no_save:
+        history.append(record)
+        save_history(history, args.history)
+
+    if args.fail_above is not None and any(
+        ratio > args.fail_above for ratio in ratios.values()
+    ):
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
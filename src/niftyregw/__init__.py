@@ -1,12 +1,13 @@
 from importlib.metadata import version
 
 from .install import download_niftyreg, get_platform
-from .wrapper import reg_aladin, run
+from .wrapper import reg_aladin, reg_f3d, run
 
 __all__ = [
     "download_niftyreg",
     "get_platform",
     "reg_aladin",
+    "reg_f3d",
     "run",
 ]
 
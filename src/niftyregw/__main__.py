@@ -5,10 +5,14 @@ import typer
 from niftyregw.commands.aladin import aladin
 from niftyregw.commands.average import app as average_app
 from niftyregw.commands.f3d import f3d
+from niftyregw.commands.fanout import fanout
 from niftyregw.commands.install import install
 from niftyregw.commands.jacobian import jacobian
+from niftyregw.commands.jobqueue import submit, worker
 from niftyregw.commands.measure import measure
+from niftyregw.commands.pairwise import pairwise
 from niftyregw.commands.resample import resample
+from niftyregw.commands.sweep import sweep
 from niftyregw.commands.tools import tools
 from niftyregw.commands.transform import app as transform_app
 
@@ -29,6 +33,11 @@ app.command(
     help="Fast Free-Form Deformation (F3D) non-rigid registration.",
     no_args_is_help=True,
 )(f3d)
+app.command(
+    "fanout",
+    help="Register one reference against many floating images.",
+    no_args_is_help=True,
+)(fanout)
 app.command(
     "measure", help="Compute similarity measures between images.", no_args_is_help=True
 )(measure)
@@ -37,12 +46,33 @@ app.command(
     help="Compute Jacobian-based maps from transformations.",
     no_args_is_help=True,
 )(jacobian)
+app.command(
+    "pairwise",
+    help="Compute the affines between every pair of images.",
+    no_args_is_help=True,
+)(pairwise)
 app.command(
     "resample",
     help="Resample an image with a given transformation.",
     no_args_is_help=True,
 )(resample)
+app.command(
+    "sweep",
+    help="Search reg_f3d parameters for a pair of images.",
+    no_args_is_help=True,
+)(sweep)
 app.command("tools", help="Image manipulation tools.", no_args_is_help=True)(tools)
+app.command(
+    "submit",
+    help="Add jobs to a queue shared by workers.",
+    no_args_is_help=True,
+    context_settings={"allow_extra_args": True, "ignore_unknown_options": True},
+)(submit)
+app.command(
+    "worker",
+    help="Run jobs from a queue shared by workers.",
+    no_args_is_help=True,
+)(worker)
 app.add_typer(average_app, name="average")
 app.add_typer(transform_app, name="transform")
 
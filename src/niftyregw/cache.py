@@ -0,0 +1,230 @@
+"""Cache of dense deformation fields computed from control point grids."""
+
+from __future__ import annotations
+
+import hashlib
+import re
+import tempfile
+import threading
+from collections import OrderedDict
+from pathlib import Path
+
+import nibabel as nib
+import numpy as np
+from loguru import logger
+
+from .resample import compute_deformation, is_nifti
+from .trace import span
+from .wrapper import RunError
+
+# NiftyReg stores the transformation type in intent_p1 of "NREG_TRANS" images
+_NREG_INTENT_NAME = b"NREG_TRANS"
+_SPLINE_GRID_TYPES = (
+    3,  # CUB_SPLINE_GRID
+    6,  # SPLINE_VEL_GRID
+)
+
+_DEFAULT_MAX_BYTES = 4 * 1024**3
+# Cached fields are named after their key, which no user image is
+_KEY_PATTERN = re.compile(r"[0-9a-f]{32}")
+_HASH_CHUNK_SIZE = 1024 * 1024
+
+
+def is_spline_grid(path: Path) -> bool:
+    """Return whether *path* is a NiftyReg control point grid image."""
+    if not is_nifti(path):
+        return False
+    header = nib.load(path).header
+    try:
+        intent_name = header["intent_name"].tobytes().rstrip(b"\x00")
+        intent_p1 = int(header["intent_p1"])
+    except (KeyError, ValueError):
+        return False
+    return intent_name == _NREG_INTENT_NAME and intent_p1 in _SPLINE_GRID_TYPES
+
+
+def file_hash(path: Path) -> str:
+    """Return the SHA-256 hex digest of the contents of *path*."""
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        while chunk := f.read(_HASH_CHUNK_SIZE):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def grid_hash(reference: Path) -> str:
+    """Return a digest of the voxel grid (shape and affine) of *reference*."""
+    image = nib.load(reference)
+    digest = hashlib.sha256()
+    digest.update(repr(tuple(image.shape[:3])).encode())
+    digest.update(np.round(np.asarray(image.affine, np.float64), 6).tobytes())
+    return digest.hexdigest()
+
+
+class DeformationCache:
+    """Dense deformation fields keyed by control point grid and reference grid.
+
+    Each field is materialised once with ``reg_transform -def`` and stored as
+    uncompressed NIfTI, so that later commands read it instead of rebuilding
+    it from the spline. The least recently used fields are evicted when the
+    total size exceeds *max_bytes*.
+
+    Args:
+        directory: Directory for the cached fields. A temporary directory,
+            removed on :meth:`close`, is used if ``None``. Fields already in
+            an existing directory are reused. Other files in it are never
+            evicted or removed.
+        max_bytes: Maximum total size of the cached fields.
+        omp_threads: Number of OpenMP threads for ``reg_transform``.
+    """
+
+    def __init__(
+        self,
+        directory: Path | None = None,
+        *,
+        max_bytes: int = _DEFAULT_MAX_BYTES,
+        omp_threads: int | None = None,
+    ) -> None:
+        self._tmp_dir = None
+        if directory is None:
+            self._tmp_dir = tempfile.TemporaryDirectory(prefix="niftyregw-cache-")
+            directory = Path(self._tmp_dir.name)
+        self.directory = Path(directory)
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self.max_bytes = max_bytes
+        self.omp_threads = omp_threads
+        self.hits = 0
+        self.misses = 0
+
+        self._lock = threading.Lock()
+        self._key_locks: dict[str, threading.Lock] = {}
+        self._entries: OrderedDict[str, int] = OrderedDict()
+        self._file_hashes: dict[tuple[Path, int, int], str] = {}
+        existing = [
+            path
+            for path in self.directory.glob("*.nii")
+            if _KEY_PATTERN.fullmatch(path.stem)
+        ]
+        for path in sorted(existing, key=lambda p: p.stat().st_mtime):
+            self._entries[path.stem] = path.stat().st_size
+
+    def __enter__(self) -> DeformationCache:
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.close()
+
+    def close(self) -> None:
+        """Remove the cache directory if it is temporary."""
+        if self._tmp_dir is not None:
+            self._tmp_dir.cleanup()
+            self._tmp_dir = None
+
+    @property
+    def total_bytes(self) -> int:
+        """Total size of the cached fields."""
+        with self._lock:
+            return sum(self._entries.values())
+
+    def __len__(self) -> int:
+        with self._lock:
+            return len(self._entries)
+
+    def _content_hash(self, path: Path) -> str:
+        stat = path.stat()
+        stat_key = (path.resolve(), stat.st_size, stat.st_mtime_ns)
+        with self._lock:
+            cached = self._file_hashes.get(stat_key)
+        if cached is None:
+            with span("hash", "io", path=str(path)):
+                cached = file_hash(path)
+            with self._lock:
+                self._file_hashes[stat_key] = cached
+        return cached
+
+    def key(self, transformation: Path, reference: Path) -> str:
+        """Return the cache key of *transformation* on the *reference* grid."""
+        digest = hashlib.sha256()
+        digest.update(self._content_hash(Path(transformation)).encode())
+        digest.update(grid_hash(reference).encode())
+        return digest.hexdigest()[:32]
+
+    def get(self, transformation: Path, reference: Path) -> Path:
+        """Return the deformation field of *transformation*, computing it once.
+
+        Args:
+            transformation: Control point grid (or any transformation).
+            reference: Reference image defining the field's grid.
+
+        Returns:
+            Path to the cached uncompressed deformation field.
+
+        Raises:
+            RunError: If reg_transform fails. Nothing is cached.
+        """
+        transformation = Path(transformation)
+        key = self.key(transformation, reference)
+        path = self.directory / f"{key}.nii"
+        with self._lock:
+            key_lock = self._key_locks.setdefault(key, threading.Lock())
+
+        # Serialise materialisation of the same field across threads
+        with key_lock:
+            with self._lock:
+                if key in self._entries and path.exists():
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return path
+                self.misses += 1
+            logger.bind(executable="niftyregw").debug(
+                f"Caching deformation field of {transformation} in {path}"
+            )
+            try:
+                compute_deformation(
+                    transformation, reference, path, omp_threads=self.omp_threads
+                )
+            except RunError:
+                # A partial field would be reused by the next cache on the
+                # directory
+                path.unlink(missing_ok=True)
+                raise
+            size = path.stat().st_size
+            with self._lock:
+                self._entries[key] = size
+                self._evict(keep=key)
+        return path
+
+    def resolve(self, transformation: Path, reference: Path | None) -> Path:
+        """Return a cached field for spline grids and *transformation* otherwise.
+
+        Args:
+            transformation: Any NiftyReg transformation file.
+            reference: Reference image of the transformation, if any. Nothing
+                is cached without it.
+
+        Returns:
+            The path to pass to NiftyReg in place of *transformation*.
+        """
+        if reference is None or not is_spline_grid(Path(transformation)):
+            return Path(transformation)
+        return self.get(transformation, reference)
+
+    def _evict(self, keep: str) -> None:
+        # Must be called with self._lock held
+        total = sum(self._entries.values())
+        for key in list(self._entries):
+            if total <= self.max_bytes:
+                break
+            if key == keep:
+                continue
+            total -= self._entries.pop(key)
+            (self.directory / f"{key}.nii").unlink(missing_ok=True)
+            self._key_locks.pop(key, None)
+
+    def clear(self) -> None:
+        """Remove all cached fields."""
+        with self._lock:
+            for key in self._entries:
+                (self.directory / f"{key}.nii").unlink(missing_ok=True)
+            self._entries.clear()
+            self._key_locks.clear()
@@ -0,0 +1,242 @@
+"""Collapse a chain of transformations before resampling once."""
+
+from __future__ import annotations
+
+import tempfile
+from dataclasses import dataclass
+from pathlib import Path
+from typing import TYPE_CHECKING
+
+import numpy as np
+from loguru import logger
+
+from .resample import resample_image
+from .wrapper import RunError, run
+
+if TYPE_CHECKING:
+    from .cache import DeformationCache
+
+
+def read_affine(path: Path) -> np.ndarray:
+    """Read a NiftyReg affine text file as a 4x4 matrix."""
+    matrix = np.loadtxt(path, dtype=np.float64)
+    if matrix.shape != (4, 4):
+        msg = f"Expected a 4x4 affine matrix in {path}, got shape {matrix.shape}"
+        raise ValueError(msg)
+    return matrix
+
+
+def write_affine(matrix: np.ndarray, path: Path) -> Path:
+    """Write a 4x4 matrix as a NiftyReg affine text file."""
+    np.savetxt(path, matrix, fmt="%.10g", delimiter=" ")
+    return path
+
+
+def invert_affine(path: Path, output: Path) -> Path:
+    """Invert a NiftyReg affine text file in NumPy, like ``reg_transform -invAff``."""
+    return write_affine(np.linalg.inv(read_affine(path)), output)
+
+
+def compose_transformations(
+    first: Path,
+    second: Path,
+    output: Path,
+    *,
+    reference: Path,
+    reference2: Path | None = None,
+    omp_threads: int | None = None,
+    cache: DeformationCache | None = None,
+) -> Path:
+    """Compose two transformations into a deformation field with reg_transform.
+
+    The output is ``T3(x) = T2(T1(x))``, defined on the *reference* grid.
+
+    Args:
+        first: First transformation (T1).
+        second: Second transformation (T2).
+        output: Output deformation field filename.
+        reference: Reference image for *first*, defining the output grid.
+        reference2: Reference image for *second* if it is a spline.
+        omp_threads: Number of OpenMP threads.
+        cache: Deformation field cache. If given, spline inputs are replaced by
+            their cached dense fields.
+
+    Returns:
+        The output path.
+
+    Raises:
+        RunError: If reg_transform fails.
+    """
+    if cache is not None:
+        first = cache.resolve(first, reference)
+        if reference2 is not None:
+            resolved = cache.resolve(second, reference2)
+            if resolved != Path(second):
+                second, reference2 = resolved, None
+    args = ["-ref", str(reference)]
+    if reference2 is not None:
+        args.extend(["-ref2", str(reference2)])
+    args.extend(["-comp", str(first), str(second), str(output)])
+    if omp_threads is not None:
+        args.extend(["-omp", str(omp_threads)])
+    returncode = run(
+        "reg_transform", *args, tool_logger=logger.bind(executable="reg_transform")
+    )
+    if returncode != 0:
+        raise RunError("reg_transform", returncode)
+    return output
+
+
+@dataclass(frozen=True)
+class _Affine:
+    matrix: np.ndarray
+
+
+@dataclass(frozen=True)
+class _Field:
+    path: Path
+    reference: Path | None
+
+
+class TransformChain:
+    """Transformations applied one after the other, collapsed into one.
+
+    Transformations are added in the order in which they are applied to
+    reference-space coordinates, following ``reg_transform -comp``: a chain
+    ``[T1, T2, T3]`` maps ``x`` to ``T3(T2(T1(x)))``. Consecutive affines are
+    multiplied in NumPy and non-linear parts are composed with
+    ``reg_transform``, so that the floating image is interpolated only once.
+    """
+
+    def __init__(self) -> None:
+        self._steps: list[_Affine | _Field] = []
+
+    def __len__(self) -> int:
+        return len(self._steps)
+
+    def add_affine(self, affine: Path | str | np.ndarray) -> TransformChain:
+        """Append an affine, given as a NiftyReg text file or a 4x4 matrix."""
+        if isinstance(affine, np.ndarray):
+            matrix = np.asarray(affine, dtype=np.float64)
+            if matrix.shape != (4, 4):
+                msg = f"Expected a 4x4 affine matrix, got shape {matrix.shape}"
+                raise ValueError(msg)
+        else:
+            matrix = read_affine(Path(affine))
+        self._steps.append(_Affine(matrix))
+        return self
+
+    def add_field(
+        self, path: Path | str, reference: Path | str | None = None
+    ) -> TransformChain:
+        """Append a non-linear transformation.
+
+        Args:
+            path: Control point grid or deformation/displacement field.
+            reference: Reference image the transformation was estimated in.
+                Required for spline parametrisations.
+        """
+        ref = None if reference is None else Path(reference)
+        self._steps.append(_Field(Path(path), ref))
+        return self
+
+    def _collapsed(self) -> list[_Affine | _Field]:
+        """Fold runs of consecutive affines into single matrices."""
+        steps: list[_Affine | _Field] = []
+        for step in self._steps:
+            if isinstance(step, _Affine) and steps and isinstance(steps[-1], _Affine):
+                steps[-1] = _Affine(step.matrix @ steps[-1].matrix)
+            else:
+                steps.append(step)
+        return steps
+
+    def resolve(
+        self,
+        reference: Path,
+        output_dir: Path,
+        *,
+        omp_threads: int | None = None,
+        cache: DeformationCache | None = None,
+    ) -> Path:
+        """Write the chain as a single transformation file.
+
+        Args:
+            reference: Reference image defining the output grid.
+            output_dir: Directory for the affine and composed field files.
+            omp_threads: Number of OpenMP threads for ``reg_transform``.
+            cache: Deformation field cache for the spline parts of the chain.
+
+        Returns:
+            An affine text file if the chain is purely affine, otherwise a
+            deformation field defined on the *reference* grid.
+        """
+        if not self._steps:
+            raise ValueError("Cannot resolve an empty transformation chain")
+        output_dir = Path(output_dir)
+        output_dir.mkdir(parents=True, exist_ok=True)
+
+        paths: list[tuple[Path, Path | None]] = []
+        for index, step in enumerate(self._collapsed()):
+            if isinstance(step, _Affine):
+                path = write_affine(step.matrix, output_dir / f"affine_{index}.txt")
+                paths.append((path, None))
+            else:
+                paths.append((step.path, step.reference))
+
+        # The first transformation maps reference coordinates, so every
+        # composed field is defined on the reference grid
+        current = paths[0][0]
+        for index, (path, path_reference) in enumerate(paths[1:], start=1):
+            current = compose_transformations(
+                current,
+                path,
+                output_dir / f"composed_{index}.nii",
+                reference=reference,
+                reference2=path_reference,
+                omp_threads=omp_threads,
+                cache=cache,
+            )
+        return current
+
+    def resample(
+        self,
+        reference: Path,
+        floating: Path,
+        output: Path,
+        *,
+        interpolation: int | None = None,
+        padding: float | None = None,
+        scratch_dir: Path | None = None,
+        omp_threads: int | None = None,
+        cache: DeformationCache | None = None,
+    ) -> Path:
+        """Resample *floating* through the whole chain with one interpolation.
+
+        Args:
+            reference: Reference image defining the output grid.
+            floating: Floating image to resample.
+            output: Resampled image filename.
+            interpolation: Interpolation order (0=NN, 1=LIN, 3=CUB, 4=SINC).
+            padding: Interpolation padding value.
+            scratch_dir: Directory for intermediate files. A temporary
+                directory, removed afterwards, is used if ``None``.
+            omp_threads: Number of OpenMP threads.
+            cache: Deformation field cache for the spline parts of the chain.
+
+        Returns:
+            The output path.
+        """
+        with tempfile.TemporaryDirectory(prefix="niftyregw-") as tmp_dir:
+            scratch = Path(tmp_dir) if scratch_dir is None else Path(scratch_dir)
+            transformation = self.resolve(
+                reference, scratch, omp_threads=omp_threads, cache=cache
+            )
+            return resample_image(
+                reference,
+                floating,
+                output,
+                transformation,
+                interpolation=interpolation,
+                padding=padding,
+                omp_threads=omp_threads,
+            )
@@ -1,21 +1,30 @@
 """Shared helpers for CLI commands."""
 
 import sys
+from pathlib import Path
+from typing import Optional
 
 import typer
 from loguru import logger
 
 from niftyregw.enums import LogLevel
-from niftyregw.wrapper import run
+from niftyregw.joblog import LOG_FORMAT, get_job_router
+from niftyregw.wrapper import RunError, run
 
 
 def setup_logger(log_level: LogLevel) -> None:
-    """Configure loguru for CLI output."""
+    """Configure loguru for CLI output.
+
+    Nothing is changed if :func:`niftyregw.joblog.install_job_routing` was
+    called, so that commands run as jobs in a service keep its sinks.
+    """
+    if get_job_router() is not None:
+        return
     logger.configure(extra={"executable": "niftyregw"})
     logger.remove()
     logger.add(
         sys.stderr,
-        format="<green>{time:YYYY-MM-DD HH:mm:ss}</green> | <level>{extra[executable]}</level> | <level>{level: <8}</level> | <level>{message}</level>",
+        format=LOG_FORMAT,
         level=log_level.value,
         colorize=True,
     )
@@ -41,3 +50,22 @@ def make_version_callback(tool: str):
             raise typer.Exit()
 
     return _callback
+
+
+def resolve_cached(
+    transformation: Path, reference: Optional[Path], cache_dir: Optional[Path]
+) -> Path:
+    """Replace a spline *transformation* by its cached deformation field.
+
+    Raises:
+        typer.Exit: If the field cannot be computed, after logging the error.
+    """
+    if cache_dir is None or reference is None:
+        return transformation
+    from niftyregw.cache import DeformationCache
+
+    try:
+        return DeformationCache(cache_dir).resolve(transformation, reference)
+    except RunError as e:
+        logger.bind(executable=e.tool).error(str(e))
+        raise typer.Exit(code=1) from e
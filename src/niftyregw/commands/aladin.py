@@ -4,9 +4,11 @@ from pathlib import Path
 from typing import Annotated, Optional
 
 import typer
+from loguru import logger
 
 from niftyregw.commands import make_help_callback, make_version_callback, setup_logger
 from niftyregw.enums import LogLevel
+from niftyregw.wrapper import RunError
 from niftyregw.wrapper import reg_aladin as _reg_aladin
 
 _help_callback = make_help_callback("reg_aladin")
@@ -172,6 +174,17 @@ def aladin(
         Optional[int], typer.Option(help="Number of threads to use with OpenMP.")
     ] = None,
     verbose_off: Annotated[bool, typer.Option(help="Turn verbose off.")] = False,
+    pyramid_cache: Annotated[
+        Optional[Path],
+        typer.Option(
+            help=(
+                "Directory caching the downsampled images. Levels run coarse to"
+                " fine on the cached images, so the pyramid of a reference is"
+                " built once for all registrations using the same directory."
+            ),
+            rich_help_panel="Pyramid cache",
+        ),
+    ] = None,
     version: Annotated[
         bool,
         typer.Option(
@@ -204,35 +217,52 @@ def aladin(
     """Block-matching global (affine/rigid) registration."""
     setup_logger(log_level)
 
-    _reg_aladin(
-        reference,
-        floating,
-        output_affine=output_affine,
-        output_result=output_result,
-        input_affine=input_affine,
-        reference_mask=reference_mask,
-        floating_mask=floating_mask,
-        no_symmetric=no_symmetric,
-        rigid_only=rigid_only,
-        affine_direct=affine_direct,
-        max_iterations=max_iterations,
-        num_levels=num_levels,
-        num_levels_to_perform=num_levels_to_perform,
-        smooth_reference=smooth_reference,
-        smooth_floating=smooth_floating,
-        reference_lower_threshold=reference_lower_threshold,
-        reference_upper_threshold=reference_upper_threshold,
-        floating_lower_threshold=floating_lower_threshold,
-        floating_upper_threshold=floating_upper_threshold,
-        padding=padding,
-        use_nifti_origin=use_nifti_origin,
-        use_masks_centre_of_mass=use_masks_centre_of_mass,
-        use_images_centre_of_mass=use_images_centre_of_mass,
-        interpolation=interpolation,
-        isotropic=isotropic,
-        percent_blocks_to_use=percent_blocks_to_use,
-        percent_inliers=percent_inliers,
-        block_step_size_2=block_step_size_2,
-        omp_threads=omp_threads,
-        verbose_off=verbose_off,
-    )
+    options = {
+        "output_affine": output_affine,
+        "output_result": output_result,
+        "input_affine": input_affine,
+        "reference_mask": reference_mask,
+        "floating_mask": floating_mask,
+        "no_symmetric": no_symmetric,
+        "rigid_only": rigid_only,
+        "affine_direct": affine_direct,
+        "max_iterations": max_iterations,
+        "num_levels": num_levels,
+        "num_levels_to_perform": num_levels_to_perform,
+        "smooth_reference": smooth_reference,
+        "smooth_floating": smooth_floating,
+        "reference_lower_threshold": reference_lower_threshold,
+        "reference_upper_threshold": reference_upper_threshold,
+        "floating_lower_threshold": floating_lower_threshold,
+        "floating_upper_threshold": floating_upper_threshold,
+        "padding": padding,
+        "use_nifti_origin": use_nifti_origin,
+        "use_masks_centre_of_mass": use_masks_centre_of_mass,
+        "use_images_centre_of_mass": use_images_centre_of_mass,
+        "interpolation": interpolation,
+        "isotropic": isotropic,
+        "percent_blocks_to_use": percent_blocks_to_use,
+        "percent_inliers": percent_inliers,
+        "block_step_size_2": block_step_size_2,
+        "omp_threads": omp_threads,
+        "verbose_off": verbose_off,
+    }
+    if pyramid_cache is None:
+        _reg_aladin(reference, floating, **options)
+        return
+
+    from niftyregw.pyramid import PyramidCache, reg_aladin_pyramid
+
+    del options["num_levels"]
+    try:
+        with PyramidCache(pyramid_cache, omp_threads=omp_threads) as cache:
+            reg_aladin_pyramid(
+                reference,
+                floating,
+                cache=cache,
+                num_levels=3 if num_levels is None else num_levels,
+                **options,
+            )
+    except (ValueError, RunError) as e:
+        logger.bind(executable="reg_aladin").error(str(e))
+        raise typer.Exit(code=1) from e
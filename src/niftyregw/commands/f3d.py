@@ -1,5 +1,7 @@
 """CLI command for reg_f3d."""
 
+from contextlib import nullcontext
+from functools import partial
 from pathlib import Path
 from typing import Annotated, Optional
 
@@ -8,7 +10,9 @@ from loguru import logger
 
 from niftyregw.commands import make_help_callback, make_version_callback, setup_logger
 from niftyregw.enums import LogLevel
-from niftyregw.wrapper import run
+from niftyregw.sampler import sampling
+from niftyregw.wrapper import FoldingError, RunError
+from niftyregw.wrapper import reg_f3d as _reg_f3d
 
 _help_callback = make_help_callback("reg_f3d")
 _version_callback = make_version_callback("reg_f3d")
@@ -196,6 +200,37 @@ def f3d(
     omp_threads: Annotated[
         Optional[int], typer.Option(help="Number of threads to use with OpenMP.")
     ] = None,
+    checkpoint_dir: Annotated[
+        Optional[Path],
+        typer.Option(
+            help=(
+                "Run one pyramid level at a time, saving the grid of every level"
+                " in this directory, and resume from the last completed level."
+            ),
+            rich_help_panel="Checkpoint",
+        ),
+    ] = None,
+    # Fold check
+    max_folded_voxels: Annotated[
+        Optional[int],
+        typer.Option(
+            help=(
+                "Check the result with reg_jacobian and fail if more voxels than"
+                " this have a non-positive Jacobian determinant."
+            ),
+            rich_help_panel="Fold check",
+        ),
+    ] = None,
+    fold_retries: Annotated[
+        int,
+        typer.Option(
+            help=(
+                "Registrations to run again, with 10x the bending energy and"
+                " Jacobian log weights, before failing the fold check."
+            ),
+            rich_help_panel="Fold check",
+        ),
+    ] = 0,
     version: Annotated[
         bool,
         typer.Option(
@@ -215,6 +250,21 @@ def f3d(
             help="Print the original reg_f3d help and exit.",
         ),
     ] = False,
+    sample_dir: Annotated[
+        Optional[Path],
+        typer.Option(
+            help=(
+                "Sample the CPU use and memory of reg_f3d while it runs and save"
+                " a timeline, aligned with levels and iterations, in this"
+                " directory. Linux only."
+            ),
+            rich_help_panel="Logging",
+        ),
+    ] = None,
+    sample_interval: Annotated[
+        float,
+        typer.Option(help="Seconds between samples.", rich_help_panel="Logging"),
+    ] = 0.1,
     log_level: Annotated[
         LogLevel,
         typer.Option(
@@ -235,129 +285,86 @@ def f3d(
         )
         raise typer.Exit(code=1)
 
-    # Check if the default output file exists before registration
-    default_output = Path("outputCPP.nii")
-    existed_before = default_output.exists()
+    register = _reg_f3d
+    if checkpoint_dir is not None:
+        if input_cpp is not None or no_pyramid:
+            tool_logger.error(
+                "--checkpoint-dir cannot be used with --input-cpp or --no-pyramid."
+            )
+            raise typer.Exit(code=1)
+        from niftyregw.resumable import reg_f3d_resumable
 
-    # Determine if user requested the default output path
-    user_requested_default = False
-    if output_cpp is not None:
-        try:
-            # Resolve both paths to absolute paths for comparison
-            user_path = Path(output_cpp).resolve()
-            default_path = default_output.resolve()
-            user_requested_default = user_path == default_path
-        except (OSError, RuntimeError):
-            # If path resolution fails, treat as different paths
-            pass
+        register = partial(reg_f3d_resumable, checkpoint_dir=checkpoint_dir)
 
-    args: list[str] = ["-ref", str(reference), "-flo", str(floating)]
-    # Initial transformation
-    if input_affine is not None:
-        args.extend(["-aff", str(input_affine)])
-    if input_cpp is not None:
-        args.extend(["-incpp", str(input_cpp)])
-    # Output
-    if output_cpp is not None:
-        args.extend(["-cpp", str(output_cpp)])
-    if output_result is not None:
-        args.extend(["-res", str(output_result)])
-    # Input image options
-    if reference_mask is not None:
-        args.extend(["-rmask", str(reference_mask)])
-    if smooth_reference is not None:
-        args.extend(["-smooR", str(smooth_reference)])
-    if smooth_floating is not None:
-        args.extend(["-smooF", str(smooth_floating)])
-    if reference_lower_threshold is not None:
-        args.extend(["--rLwTh", str(reference_lower_threshold)])
-    if reference_upper_threshold is not None:
-        args.extend(["--rUpTh", str(reference_upper_threshold)])
-    if floating_lower_threshold is not None:
-        args.extend(["--fLwTh", str(floating_lower_threshold)])
-    if floating_upper_threshold is not None:
-        args.extend(["--fUpTh", str(floating_upper_threshold)])
-    # Spline
-    if spacing_x is not None:
-        args.extend(["-sx", str(spacing_x)])
-    if spacing_y is not None:
-        args.extend(["-sy", str(spacing_y)])
-    if spacing_z is not None:
-        args.extend(["-sz", str(spacing_z)])
-    # Regularisation
-    if bending_energy is not None:
-        args.extend(["-be", str(bending_energy)])
-    if linear_energy is not None:
-        args.extend(["-le", str(linear_energy)])
-    if jacobian_log_weight is not None:
-        args.extend(["-jl", str(jacobian_log_weight)])
-    if no_approx_jacobian_log:
-        args.append("-noAppJL")
-    if landmarks_weight is not None and landmarks_file is not None:
-        args.extend(["-land", str(landmarks_weight), str(landmarks_file)])
-    # Similarity
-    if use_nmi:
-        args.append("--nmi")
-    if reference_bins is not None:
-        args.extend(["--rbn", str(reference_bins)])
-    if floating_bins is not None:
-        args.extend(["--fbn", str(floating_bins)])
-    if lncc_sigma is not None:
-        args.extend(["--lncc", str(lncc_sigma)])
-    if use_ssd:
-        args.append("--ssd")
-    if use_ssd_no_norm:
-        args.append("--ssdn")
-    if mind_offset is not None:
-        args.extend(["--mind", str(mind_offset)])
-    if mindssc_offset is not None:
-        args.extend(["--mindssc", str(mindssc_offset)])
-    if use_kld:
-        args.append("--kld")
-    if similarity_weight_image is not None:
-        args.extend(["-wSim", str(similarity_weight_image)])
-    if robust_range:
-        args.append("-rr")
-    # Optimisation
-    if max_iterations is not None:
-        args.extend(["-maxit", str(max_iterations)])
-    if num_levels is not None:
-        args.extend(["-ln", str(num_levels)])
-    if num_levels_to_perform is not None:
-        args.extend(["-lp", str(num_levels_to_perform)])
-    if no_pyramid:
-        args.append("-nopy")
-    if no_conjugate_gradient:
-        args.append("-noConj")
-    if perturbation_steps is not None:
-        args.extend(["-pert", str(perturbation_steps)])
-    # F3D2
-    if velocity_field:
-        args.append("-vel")
-    if no_gradient_accumulation:
-        args.append("-nogce")
-    if floating_mask is not None:
-        args.extend(["-fmask", str(floating_mask)])
-    # Other
-    if smooth_gradient is not None:
-        args.extend(["-smoothGrad", str(smooth_gradient)])
-    if padding is not None:
-        args.extend(["-pad", str(padding)])
-    if verbose_off:
-        args.append("-voff")
-    if omp_threads is not None:
-        args.extend(["-omp", str(omp_threads)])
+    fold_check = None
+    if max_folded_voxels is not None:
+        from niftyregw.jacobian import FoldCheck
 
-    run("reg_f3d", *args, tool_logger=tool_logger)
+        fold_check = FoldCheck(
+            max_folded_voxels=max_folded_voxels,
+            retries=fold_retries,
+            omp_threads=omp_threads,
+        )
 
-    # Clean up the default output file if it was created and not requested
-    if not existed_before and default_output.exists() and not user_requested_default:
+    profile = (
+        nullcontext()
+        if sample_dir is None
+        else sampling(sample_dir, interval=sample_interval)
+    )
+    with profile as active:
         try:
-            default_output.unlink()
-            logger.bind(executable="niftyregw").debug(
-                f"Cleaned up default output file: {default_output}"
-            )
-        except OSError as e:
-            logger.bind(executable="niftyregw").warning(
-                f"Failed to clean up {default_output}: {e}"
+            register(
+                reference,
+                floating,
+                input_affine=input_affine,
+                input_cpp=input_cpp,
+                output_cpp=output_cpp,
+                output_result=output_result,
+                reference_mask=reference_mask,
+                smooth_reference=smooth_reference,
+                smooth_floating=smooth_floating,
+                reference_lower_threshold=reference_lower_threshold,
+                reference_upper_threshold=reference_upper_threshold,
+                floating_lower_threshold=floating_lower_threshold,
+                floating_upper_threshold=floating_upper_threshold,
+                spacing_x=spacing_x,
+                spacing_y=spacing_y,
+                spacing_z=spacing_z,
+                bending_energy=bending_energy,
+                linear_energy=linear_energy,
+                jacobian_log_weight=jacobian_log_weight,
+                no_approx_jacobian_log=no_approx_jacobian_log,
+                landmarks_weight=landmarks_weight,
+                landmarks_file=landmarks_file,
+                use_nmi=use_nmi,
+                reference_bins=reference_bins,
+                floating_bins=floating_bins,
+                lncc_sigma=lncc_sigma,
+                use_ssd=use_ssd,
+                use_ssd_no_norm=use_ssd_no_norm,
+                mind_offset=mind_offset,
+                mindssc_offset=mindssc_offset,
+                use_kld=use_kld,
+                similarity_weight_image=similarity_weight_image,
+                robust_range=robust_range,
+                max_iterations=max_iterations,
+                num_levels=num_levels,
+                num_levels_to_perform=num_levels_to_perform,
+                no_pyramid=no_pyramid,
+                no_conjugate_gradient=no_conjugate_gradient,
+                perturbation_steps=perturbation_steps,
+                velocity_field=velocity_field,
+                no_gradient_accumulation=no_gradient_accumulation,
+                floating_mask=floating_mask,
+                smooth_gradient=smooth_gradient,
+                padding=padding,
+                verbose_off=verbose_off,
+                omp_threads=omp_threads,
+                fold_check=fold_check,
             )
+        except (FoldingError, RunError, ValueError) as e:
+            tool_logger.error(str(e))
+            raise typer.Exit(code=1) from e
+    if active is not None:
+        for path in active.timelines:
+            logger.bind(executable="niftyregw").info(f"Saved timeline to {path}")
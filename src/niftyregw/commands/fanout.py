@@ -0,0 +1,248 @@
+"""CLI command registering one reference against many floating images."""
+
+import glob as _glob
+from contextlib import nullcontext
+from pathlib import Path
+from typing import Annotated, Optional
+
+import typer
+from loguru import logger
+
+from niftyregw.commands import setup_logger
+from niftyregw.enums import LogLevel
+from niftyregw.fanout import DEFAULT_METRICS, OutputTemplates
+from niftyregw.fanout import fanout as _fanout
+from niftyregw.tables import read_path_list, write_table
+from niftyregw.trace import tracing
+
+
+def fanout(
+    reference: Annotated[
+        Path, typer.Option("--reference", "-r", help="Reference image filename.")
+    ],
+    floating: Annotated[
+        Optional[list[Path]],
+        typer.Option(
+            "--floating", "-f", help="Floating image filename. Can be repeated."
+        ),
+    ] = None,
+    floating_glob: Annotated[
+        Optional[str],
+        typer.Option(
+            "--glob", help="Glob pattern of floating images, e.g. 'data/*.nii.gz'."
+        ),
+    ] = None,
+    floating_list: Annotated[
+        Optional[Path],
+        typer.Option(help="Text file with one floating image per line."),
+    ] = None,
+    output_dir: Annotated[
+        Path,
+        typer.Option(
+            "--output-dir", "-o", help="Directory the output names are relative to."
+        ),
+    ] = Path(),
+    affine_name: Annotated[
+        str,
+        typer.Option(
+            help="Affine filename template ({subject}, {reference}).",
+            rich_help_panel="Outputs",
+        ),
+    ] = OutputTemplates.affine,
+    cpp_name: Annotated[
+        str,
+        typer.Option(
+            help="Control point grid filename template.", rich_help_panel="Outputs"
+        ),
+    ] = OutputTemplates.cpp,
+    result_name: Annotated[
+        str,
+        typer.Option(
+            help="Resampled image filename template.", rich_help_panel="Outputs"
+        ),
+    ] = OutputTemplates.result,
+    skip_existing: Annotated[
+        bool,
+        typer.Option(
+            help="Do not rerun registrations whose outputs already exist.",
+            rich_help_panel="Outputs",
+        ),
+    ] = False,
+    report: Annotated[
+        Optional[Path],
+        typer.Option(
+            help="CSV/TSV/Parquet report with timings, exit codes and similarity.",
+            rich_help_panel="Outputs",
+        ),
+    ] = None,
+    affine_only: Annotated[
+        bool, typer.Option(help="Run reg_aladin only, without reg_f3d.")
+    ] = False,
+    reference_mask: Annotated[
+        Optional[Path], typer.Option(help="Mask in the reference space.")
+    ] = None,
+    floating_mask: Annotated[
+        Optional[str],
+        typer.Option(
+            help="Floating mask filename template ({subject}, {reference}),"
+            " e.g. 'masks/{subject}_mask.nii.gz'.",
+        ),
+    ] = None,
+    metric: Annotated[
+        Optional[list[str]],
+        typer.Option(
+            help="Similarity measure of each result (ncc, lncc, nmi, ssd)."
+            " Can be repeated. [ncc, nmi]",
+        ),
+    ] = None,
+    num_levels: Annotated[
+        Optional[int],
+        typer.Option(
+            help="Number of pyramid levels of both registrations. [3]",
+            rich_help_panel="Registration",
+        ),
+    ] = None,
+    num_levels_to_perform: Annotated[
+        Optional[int],
+        typer.Option(
+            help="Number of levels run by both registrations. [ln]",
+            rich_help_panel="Registration",
+        ),
+    ] = None,
+    spacing_x: Annotated[
+        Optional[float],
+        typer.Option(
+            help="Final grid spacing along x in mm (voxels if negative). [5 vox]",
+            rich_help_panel="Registration",
+        ),
+    ] = None,
+    spacing_y: Annotated[
+        Optional[float],
+        typer.Option(
+            help="Final grid spacing along y in mm (voxels if negative). [sx]",
+            rich_help_panel="Registration",
+        ),
+    ] = None,
+    spacing_z: Annotated[
+        Optional[float],
+        typer.Option(
+            help="Final grid spacing along z in mm (voxels if negative). [sx]",
+            rich_help_panel="Registration",
+        ),
+    ] = None,
+    bending_energy: Annotated[
+        Optional[float],
+        typer.Option(
+            help="Bending energy penalty weight of reg_f3d. [0.001]",
+            rich_help_panel="Registration",
+        ),
+    ] = None,
+    workers: Annotated[
+        int,
+        typer.Option(help="Number of subjects registered concurrently."),
+    ] = 1,
+    threads: Annotated[
+        Optional[int],
+        typer.Option(
+            help="Total number of OpenMP threads, shared by the workers. [all CPUs]"
+        ),
+    ] = None,
+    omp_threads: Annotated[
+        Optional[int],
+        typer.Option(
+            help="OpenMP threads of each registration, instead of a share of --threads."
+        ),
+    ] = None,
+    trace: Annotated[
+        Optional[Path],
+        typer.Option(
+            help="Write a timeline of the runs to this Chrome trace JSON file,"
+            " which Perfetto (ui.perfetto.dev) opens.",
+            rich_help_panel="Logging",
+        ),
+    ] = None,
+    log_level: Annotated[
+        LogLevel,
+        typer.Option(
+            "--log",
+            case_sensitive=False,
+            help="Set the log level.",
+            rich_help_panel="Logging",
+        ),
+    ] = LogLevel.DEBUG,
+) -> None:
+    """Register one reference against many floating images."""
+    setup_logger(log_level)
+    niftyregw_logger = logger.bind(executable="niftyregw")
+
+    floatings = list(floating or [])
+    if floating_glob is not None:
+        floatings.extend(Path(path) for path in sorted(_glob.glob(floating_glob)))
+    if floating_list is not None:
+        floatings.extend(read_path_list(floating_list))
+    if not floatings:
+        niftyregw_logger.error(
+            "No floating images. Use --floating, --glob or --floating-list."
+        )
+        raise typer.Exit(code=1)
+
+    templates = OutputTemplates(affine_name, cpp_name, result_name)
+    shared = {
+        "num_levels": num_levels,
+        "num_levels_to_perform": num_levels_to_perform,
+        "omp_threads": omp_threads,
+    }
+    # Options left unset keep the defaults of the binaries and of fanout()
+    aladin_options = {key: value for key, value in shared.items() if value is not None}
+    f3d_options = {
+        key: value
+        for key, value in {
+            **shared,
+            "spacing_x": spacing_x,
+            "spacing_y": spacing_y,
+            "spacing_z": spacing_z,
+            "bending_energy": bending_energy,
+        }.items()
+        if value is not None
+    }
+    with tracing(trace) if trace is not None else nullcontext():
+        try:
+            results = _fanout(
+                reference,
+                floatings,
+                output_dir,
+                templates=templates,
+                affine_only=affine_only,
+                skip_existing=skip_existing,
+                max_workers=workers,
+                total_threads=threads,
+                reference_mask=reference_mask,
+                floating_mask=floating_mask,
+                metrics=DEFAULT_METRICS if metric is None else metric,
+                aladin_options=aladin_options,
+                f3d_options=f3d_options,
+            )
+            counts = {"done": 0, "skipped": 0, "failed": 0}
+
+            def _rows():
+                for result in results:
+                    counts[result.status] += 1
+                    yield result.as_row()
+
+            if report is None:
+                for _ in _rows():
+                    pass
+            else:
+                write_table(_rows(), report)
+        except ValueError as e:
+            niftyregw_logger.error(str(e))
+            raise typer.Exit(code=1) from e
+
+    niftyregw_logger.info(
+        f"{counts['done']} registered, {counts['skipped']} skipped,"
+        f" {counts['failed']} failed"
+    )
+    if report is not None:
+        niftyregw_logger.info(f"Wrote report to {report}")
+    if counts["failed"]:
+        raise typer.Exit(code=1)
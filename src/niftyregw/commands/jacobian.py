@@ -6,9 +6,15 @@ from typing import Annotated, Optional
 import typer
 from loguru import logger
 
-from niftyregw.commands import make_help_callback, make_version_callback, setup_logger
+from niftyregw.commands import (
+    make_help_callback,
+    make_version_callback,
+    resolve_cached,
+    setup_logger,
+)
 from niftyregw.enums import LogLevel
-from niftyregw.wrapper import run
+from niftyregw.tables import write_table
+from niftyregw.wrapper import RunError, run
 
 _help_callback = make_help_callback("reg_jacobian")
 _version_callback = make_version_callback("reg_jacobian")
@@ -36,9 +42,35 @@ def jacobian(
     jacobian_log_determinant: Annotated[
         Optional[Path], typer.Option(help="Output log of Jacobian determinant map.")
     ] = None,
+    stats: Annotated[
+        Optional[Path],
+        typer.Option(
+            help=(
+                "Write determinant statistics (folding, log-Jacobian mean and"
+                " percentiles) to this CSV/TSV/Parquet table."
+            ),
+            rich_help_panel="Statistics",
+        ),
+    ] = None,
+    parcellation: Annotated[
+        Optional[Path],
+        typer.Option(
+            help="Label image on the reference grid for per-label --stats.",
+            rich_help_panel="Statistics",
+        ),
+    ] = None,
     omp_threads: Annotated[
         Optional[int], typer.Option(help="Number of threads to use with OpenMP.")
     ] = None,
+    cache_dir: Annotated[
+        Optional[Path],
+        typer.Option(
+            help=(
+                "Directory of cached deformation fields, reused across runs."
+                " The least recently used fields are removed beyond 4 GiB."
+            ),
+        ),
+    ] = None,
     version: Annotated[
         bool,
         typer.Option(
@@ -72,6 +104,32 @@ def jacobian(
     setup_logger(log_level)
     tool_logger = logger.bind(executable="reg_jacobian")
 
+    transformation = resolve_cached(transformation, reference, cache_dir)
+
+    if stats is not None:
+        if jacobian_matrix is not None or jacobian_log_determinant is not None:
+            tool_logger.error(
+                "--stats can only be combined with --jacobian-determinant."
+            )
+            raise typer.Exit(code=1)
+        # Imported here to keep NumPy and nibabel off the plain startup path
+        from niftyregw.jacobian import jacobian_stats
+
+        try:
+            rows = jacobian_stats(
+                transformation,
+                reference,
+                parcellation=parcellation,
+                keep_map=jacobian_determinant,
+                omp_threads=omp_threads,
+            )
+            write_table(rows, stats)
+        except RunError as e:
+            tool_logger.error(str(e))
+            raise typer.Exit(code=1) from e
+        logger.bind(executable="niftyregw").info(f"Wrote statistics to {stats}")
+        return
+
     args: list[str] = ["-trans", str(transformation)]
     if reference is not None:
         args.extend(["-ref", str(reference)])
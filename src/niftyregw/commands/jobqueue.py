@@ -0,0 +1,170 @@
+"""CLI commands to submit jobs to a shared queue and run them."""
+
+import json
+from contextlib import nullcontext
+from pathlib import Path
+from typing import Annotated, Optional
+
+import typer
+from loguru import logger
+
+from niftyregw.commands import setup_logger
+from niftyregw.enums import LogLevel
+from niftyregw.joblog import install_job_routing
+from niftyregw.jobqueue import JobQueue, run_worker
+from niftyregw.metrics import TextfileExporter
+from niftyregw.trace import tracing
+
+
+def submit(
+    ctx: typer.Context,
+    queue: Annotated[
+        Path, typer.Option("--queue", "-q", help="Job queue database file.")
+    ],
+    jobs: Annotated[
+        Optional[Path],
+        typer.Option(
+            help=(
+                "JSON Lines file with one job per line:"
+                ' {"kind": "run", "tool": ..., "args": [...]} or'
+                ' {"kind": "reg_aladin" | "reg_f3d", "reference": ..., ...}.'
+            ),
+        ),
+    ] = None,
+    max_attempts: Annotated[
+        int, typer.Option(help="Number of attempts before a job fails.")
+    ] = 3,
+    status: Annotated[
+        bool, typer.Option("--status", help="Print the number of jobs per status.")
+    ] = False,
+    log_level: Annotated[
+        LogLevel,
+        typer.Option(
+            "--log",
+            case_sensitive=False,
+            help="Set the log level.",
+            rich_help_panel="Logging",
+        ),
+    ] = LogLevel.DEBUG,
+) -> None:
+    """Add jobs to a queue shared by workers.
+
+    A single NiftyReg command can be given after the options, e.g.
+    ``niftyregw submit -q jobs.db -- reg_f3d -ref ref.nii -flo flo.nii``.
+    """
+    setup_logger(log_level)
+    niftyregw_logger = logger.bind(executable="niftyregw")
+    job_queue = JobQueue(queue)
+
+    entries = []
+    if ctx.args:
+        tool, *args = ctx.args
+        entries.append(("run", {"tool": tool, "args": args}))
+    if jobs is not None:
+        for line in jobs.read_text().splitlines():
+            if line.strip():
+                payload = json.loads(line)
+                entries.append((payload.pop("kind", "run"), payload))
+    if entries:
+        try:
+            ids = job_queue.submit_many(entries, max_attempts=max_attempts)
+        except ValueError as e:
+            niftyregw_logger.error(str(e))
+            raise typer.Exit(code=1) from e
+        niftyregw_logger.info(f"Submitted {len(ids)} job(s) to {queue}")
+    elif not status:
+        niftyregw_logger.error("No jobs. Give a command or --jobs.")
+        raise typer.Exit(code=1)
+
+    if status:
+        counts = job_queue.counts()
+        typer.echo(" ".join(f"{name}={count}" for name, count in counts.items()))
+
+
+def worker(
+    queue: Annotated[
+        Path, typer.Option("--queue", "-q", help="Job queue database file.")
+    ],
+    worker_id: Annotated[
+        Optional[str], typer.Option("--id", help="Worker ID. [hostname:pid]")
+    ] = None,
+    poll_interval: Annotated[
+        float, typer.Option(help="Seconds between polls of an empty queue.")
+    ] = 10.0,
+    lease: Annotated[
+        float,
+        typer.Option(
+            help="Seconds without heartbeat before a job is given to another worker."
+        ),
+    ] = 300.0,
+    retry_delay: Annotated[
+        float,
+        typer.Option(help="Seconds before the first retry, doubled at every attempt."),
+    ] = 30.0,
+    max_jobs: Annotated[
+        Optional[int], typer.Option(help="Stop after running this number of jobs.")
+    ] = None,
+    exit_when_empty: Annotated[
+        bool, typer.Option(help="Stop when no job is pending or running.")
+    ] = False,
+    log_dir: Annotated[
+        Optional[Path],
+        typer.Option(
+            help="Directory for a log file per job, job_<id>.log.",
+            rich_help_panel="Logging",
+        ),
+    ] = None,
+    trace: Annotated[
+        Optional[Path],
+        typer.Option(
+            help="Write a timeline of the runs to this Chrome trace JSON file,"
+            " which Perfetto (ui.perfetto.dev) opens.",
+            rich_help_panel="Logging",
+        ),
+    ] = None,
+    metrics_file: Annotated[
+        Optional[Path],
+        typer.Option(
+            help="Write Prometheus metrics of the runs to this .prom file, e.g."
+            " in the directory of the node_exporter textfile collector.",
+            rich_help_panel="Logging",
+        ),
+    ] = None,
+    metrics_interval: Annotated[
+        float,
+        typer.Option(
+            help="Seconds between writes of --metrics-file.", rich_help_panel="Logging"
+        ),
+    ] = 15.0,
+    log_level: Annotated[
+        LogLevel,
+        typer.Option(
+            "--log",
+            case_sensitive=False,
+            help="Set the log level.",
+            rich_help_panel="Logging",
+        ),
+    ] = LogLevel.DEBUG,
+) -> None:
+    """Run jobs from a queue shared by workers."""
+    if log_dir is None:
+        setup_logger(log_level)
+    else:
+        install_job_routing(log_level.value)
+    job_queue = JobQueue(queue, lease_seconds=lease, retry_delay=retry_delay)
+    exporter = (
+        nullcontext()
+        if metrics_file is None
+        else TextfileExporter(metrics_file, metrics_interval)
+    )
+    with tracing(trace) if trace is not None else nullcontext(), exporter:
+        count = run_worker(
+            job_queue,
+            worker=worker_id,
+            poll_interval=poll_interval,
+            max_jobs=max_jobs,
+            exit_when_empty=exit_when_empty,
+            log_dir=log_dir,
+            metrics=metrics_file is not None,
+        )
+    logger.bind(executable="niftyregw").info(f"Ran {count} job(s)")
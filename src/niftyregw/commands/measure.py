@@ -1,5 +1,6 @@
 """CLI command for reg_measure."""
 
+import math
 from pathlib import Path
 from typing import Annotated, Optional
 
@@ -8,6 +9,7 @@ from loguru import logger
 
 from niftyregw.commands import make_help_callback, make_version_callback, setup_logger
 from niftyregw.enums import LogLevel
+from niftyregw.tables import read_path_list, write_table
 from niftyregw.wrapper import run
 
 _help_callback = make_help_callback("reg_measure")
@@ -19,8 +21,9 @@ def measure(
         Path, typer.Option("--reference", "-r", help="Reference image filename.")
     ],
     floating: Annotated[
-        Path, typer.Option("--floating", "-f", help="Floating image filename.")
-    ],
+        Optional[Path],
+        typer.Option("--floating", "-f", help="Floating image filename."),
+    ] = None,
     ncc: Annotated[
         bool, typer.Option(help="Compute NCC (Normalized Cross-Correlation).")
     ] = False,
@@ -33,10 +36,42 @@ def measure(
     ] = False,
     output: Annotated[
         Optional[Path],
-        typer.Option("--output", "-o", help="Output text file. [stdout]"),
+        typer.Option(
+            "--output",
+            "-o",
+            help="Output text file, or CSV/TSV/Parquet table with --floating-list."
+            " [stdout]",
+        ),
+    ] = None,
+    floating_list: Annotated[
+        Optional[Path],
+        typer.Option(
+            help=(
+                "Text file with one floating image per line, all on the reference"
+                " grid. Measures are computed in-process; the reference is read once."
+            ),
+            rich_help_panel="Many pairs",
+        ),
+    ] = None,
+    reference_mask: Annotated[
+        Optional[Path],
+        typer.Option(
+            help="Mask in the reference space (with --floating-list).",
+            rich_help_panel="Many pairs",
+        ),
+    ] = None,
+    workers: Annotated[
+        Optional[int],
+        typer.Option(
+            help="Number of worker threads (with --floating-list).",
+            rich_help_panel="Many pairs",
+        ),
     ] = None,
     omp_threads: Annotated[
-        Optional[int], typer.Option(help="Number of threads to use with OpenMP.")
+        Optional[int],
+        typer.Option(
+            help="Number of threads to use with OpenMP (not with --floating-list)."
+        ),
     ] = None,
     version: Annotated[
         bool,
@@ -71,6 +106,54 @@ def measure(
     setup_logger(log_level)
     tool_logger = logger.bind(executable="reg_measure")
 
+    if (floating_list is None) == (floating is None):
+        tool_logger.error(
+            "Exactly one of --floating and --floating-list must be provided."
+        )
+        raise typer.Exit(code=1)
+
+    if floating_list is not None:
+        # Imported here to keep NumPy and nibabel off the single-pair startup path
+        from niftyregw.similarity import METRICS, measure_many
+
+        if output is None:
+            tool_logger.error("--output is required with --floating-list.")
+            raise typer.Exit(code=1)
+        if omp_threads is not None:
+            tool_logger.error(
+                "--omp-threads cannot be used with --floating-list, use --workers."
+            )
+            raise typer.Exit(code=1)
+        flags = {"ncc": ncc, "lncc": lncc, "nmi": nmi, "ssd": ssd}
+        metrics = [name for name in METRICS if flags[name]] or list(METRICS)
+        floatings = read_path_list(floating_list)
+        results = measure_many(
+            reference,
+            floatings,
+            metrics,
+            mask=reference_mask,
+            max_workers=workers,
+        )
+        failed = 0
+
+        def _rows():
+            nonlocal failed
+            for path, values in results:
+                failed += all(math.isnan(value) for value in values.values())
+                yield {"reference": reference, "floating": path, **values}
+
+        try:
+            count = write_table(_rows(), output, ["reference", "floating", *metrics])
+        except ImportError as e:
+            tool_logger.error(str(e))
+            raise typer.Exit(code=1) from e
+        niftyregw_logger = logger.bind(executable="niftyregw")
+        niftyregw_logger.info(f"Wrote {count} rows to {output}")
+        if failed:
+            niftyregw_logger.error(f"{failed} floating images could not be measured")
+            raise typer.Exit(code=1)
+        return
+
     args: list[str] = ["-ref", str(reference), "-flo", str(floating)]
     if ncc:
         args.append("-ncc")
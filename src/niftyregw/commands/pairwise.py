@@ -0,0 +1,102 @@
+"""CLI command registering every pair of images with reg_aladin."""
+
+import glob as _glob
+from pathlib import Path
+from typing import Annotated, Optional
+
+import typer
+from loguru import logger
+
+from niftyregw.commands import setup_logger
+from niftyregw.enums import LogLevel
+from niftyregw.pairwise import DEFAULT_TEMPLATE, register_all_pairs
+from niftyregw.tables import read_path_list
+
+
+def pairwise(
+    image: Annotated[
+        Optional[list[Path]],
+        typer.Option("--image", "-i", help="Image filename. Can be repeated."),
+    ] = None,
+    image_glob: Annotated[
+        Optional[str],
+        typer.Option("--glob", help="Glob pattern of images, e.g. 'atlases/*.nii.gz'."),
+    ] = None,
+    image_list: Annotated[
+        Optional[Path],
+        typer.Option(help="Text file with one image per line."),
+    ] = None,
+    output_dir: Annotated[
+        Path,
+        typer.Option(
+            "--output-dir", "-o", help="Directory the affine names are relative to."
+        ),
+    ] = Path(),
+    name: Annotated[
+        str,
+        typer.Option(help="Affine filename template ({reference}, {floating})."),
+    ] = DEFAULT_TEMPLATE,
+    checkpoint: Annotated[
+        Optional[Path],
+        typer.Option(
+            help="Completion matrix file, used to resume interrupted runs."
+            " [OUTPUT_DIR/completion.json]",
+        ),
+    ] = None,
+    rigid_only: Annotated[
+        bool, typer.Option(help="Perform a rigid registration only.")
+    ] = False,
+    workers: Annotated[
+        int, typer.Option(help="Number of concurrent reg_aladin processes.")
+    ] = 1,
+    threads: Annotated[
+        Optional[int],
+        typer.Option(
+            help="Total number of OpenMP threads, shared by the workers. [all CPUs]"
+        ),
+    ] = None,
+    log_level: Annotated[
+        LogLevel,
+        typer.Option(
+            "--log",
+            case_sensitive=False,
+            help="Set the log level.",
+            rich_help_panel="Logging",
+        ),
+    ] = LogLevel.DEBUG,
+) -> None:
+    """Compute the affines between every pair of images."""
+    setup_logger(log_level)
+    niftyregw_logger = logger.bind(executable="niftyregw")
+
+    images = list(image or [])
+    if image_glob is not None:
+        images.extend(Path(path) for path in sorted(_glob.glob(image_glob)))
+    if image_list is not None:
+        images.extend(read_path_list(image_list))
+    if len(images) < 2:
+        niftyregw_logger.error(
+            "At least two images are needed. Use --image, --glob or --image-list."
+        )
+        raise typer.Exit(code=1)
+
+    try:
+        matrix = register_all_pairs(
+            images,
+            output_dir,
+            template=name,
+            checkpoint=output_dir / "completion.json"
+            if checkpoint is None
+            else checkpoint,
+            max_workers=workers,
+            total_threads=threads,
+            aladin_options={"rigid_only": rigid_only},
+        )
+    except ValueError as e:
+        niftyregw_logger.error(str(e))
+        raise typer.Exit(code=1) from e
+
+    missing = int((~matrix.done).sum())
+    if missing:
+        niftyregw_logger.error(f"{missing} registrations failed")
+        raise typer.Exit(code=1)
@@ -6,9 +6,15 @@ from typing import Annotated, Optional
 import typer
 from loguru import logger
 
-from niftyregw.commands import make_help_callback, make_version_callback, setup_logger
+from niftyregw.commands import (
+    make_help_callback,
+    make_version_callback,
+    resolve_cached,
+    setup_logger,
+)
 from niftyregw.enums import LogLevel
-from niftyregw.wrapper import run
+from niftyregw.resample import read_batch_file, resample_many
+from niftyregw.wrapper import RunError, run
 
 _help_callback = make_help_callback("reg_resample")
 _version_callback = make_version_callback("reg_resample")
@@ -19,8 +25,9 @@ def resample(
         Path, typer.Option("--reference", "-r", help="Reference image filename.")
     ],
     floating: Annotated[
-        Path, typer.Option("--floating", "-f", help="Floating image filename.")
-    ],
+        Optional[Path],
+        typer.Option("--floating", "-f", help="Floating image filename."),
+    ] = None,
     transformation: Annotated[
         Optional[Path],
         typer.Option(
@@ -58,10 +65,36 @@ def resample(
             help="PSF algorithm: minimise matrix metric (0) or determinant (1). [0]"
         ),
     ] = None,
+    batch: Annotated[
+        Optional[Path],
+        typer.Option(
+            help=(
+                "Batch file with one 'floating output [interpolation]' per line."
+                " The deformation field is computed once and shared."
+            ),
+            rich_help_panel="Batch",
+        ),
+    ] = None,
+    workers: Annotated[
+        Optional[int],
+        typer.Option(
+            help="Number of concurrent reg_resample processes in batch mode.",
+            rich_help_panel="Batch",
+        ),
+    ] = None,
     verbose_off: Annotated[bool, typer.Option(help="Turn verbose off.")] = False,
     omp_threads: Annotated[
         Optional[int], typer.Option(help="Number of threads to use with OpenMP.")
     ] = None,
+    cache_dir: Annotated[
+        Optional[Path],
+        typer.Option(
+            help=(
+                "Directory of cached deformation fields, reused across runs."
+                " The least recently used fields are removed beyond 4 GiB."
+            ),
+        ),
+    ] = None,
     version: Annotated[
         bool,
         typer.Option(
@@ -95,6 +128,42 @@ def resample(
     setup_logger(log_level)
     tool_logger = logger.bind(executable="reg_resample")
 
+    if (batch is None) == (floating is None):
+        tool_logger.error("Exactly one of --floating and --batch must be provided.")
+        raise typer.Exit(code=1)
+
+    if transformation is not None:
+        transformation = resolve_cached(transformation, reference, cache_dir)
+
+    if batch is not None:
+        # Options resample_many has no equivalent for
+        unsupported = {
+            "--output-result": output_result is not None,
+            "--output-blank": output_blank is not None,
+            "--tensor": tensor,
+            "--psf": psf,
+            "--psf-algorithm": psf_algorithm is not None,
+            "--verbose-off": verbose_off,
+        }
+        given = [name for name, value in unsupported.items() if value]
+        if given:
+            tool_logger.error(f"{', '.join(given)} cannot be used with --batch.")
+            raise typer.Exit(code=1)
+        inputs = read_batch_file(batch, default_interpolation=interpolation)
+        try:
+            resample_many(
+                reference,
+                inputs,
+                transformation,
+                padding=padding,
+                max_workers=workers,
+                omp_threads=omp_threads,
+            )
+        except RunError as e:
+            tool_logger.error(str(e))
+            raise typer.Exit(code=1) from e
+        return
+
     args: list[str] = ["-ref", str(reference), "-flo", str(floating)]
     if transformation is not None:
         args.extend(["-trans", str(transformation)])
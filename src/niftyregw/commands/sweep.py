@@ -0,0 +1,159 @@
+"""CLI command running reg_f3d hyperparameter sweeps."""
+
+from pathlib import Path
+from typing import Annotated, Optional
+
+import typer
+from loguru import logger
+
+from niftyregw.commands import setup_logger
+from niftyregw.enums import LogLevel
+from niftyregw.sweep import (
+    MedianPruner,
+    best_trial,
+    grid_search,
+    parse_parameter,
+    random_search,
+    run_sweep,
+)
+from niftyregw.tables import write_table
+
+
+def sweep(
+    reference: Annotated[
+        Path, typer.Option("--reference", "-r", help="Reference image filename.")
+    ],
+    floating: Annotated[
+        Path, typer.Option("--floating", "-f", help="Floating image filename.")
+    ],
+    param: Annotated[
+        list[str],
+        typer.Option(
+            "--param",
+            "-p",
+            help=(
+                "reg_f3d parameter values, as 'name=v1,v2', or 'name=low:high' and"
+                " 'name=log:low:high' for random searches, e.g."
+                " 'bending_energy=log:1e-4:1e-1'. Can be repeated."
+            ),
+        ),
+    ],
+    output_dir: Annotated[
+        Path,
+        typer.Option("--output-dir", "-o", help="Directory for the trial outputs."),
+    ] = Path("sweep"),
+    input_affine: Annotated[
+        Optional[Path],
+        typer.Option("--input-affine", "-a", help="Input affine transformation."),
+    ] = None,
+    trials: Annotated[
+        Optional[int],
+        typer.Option(
+            help="Number of random trials. All combinations are run if not given.",
+            rich_help_panel="Search",
+        ),
+    ] = None,
+    seed: Annotated[
+        Optional[int],
+        typer.Option(help="Seed of the random search.", rich_help_panel="Search"),
+    ] = None,
+    metric: Annotated[
+        str,
+        typer.Option(
+            help="Measure scoring the trials (ncc, lncc, nmi, ssd).",
+            rich_help_panel="Search",
+        ),
+    ] = "nmi",
+    max_folded_voxels: Annotated[
+        int,
+        typer.Option(
+            help="Reject trials with more voxels with a non-positive Jacobian.",
+            rich_help_panel="Search",
+        ),
+    ] = 0,
+    prune: Annotated[
+        bool,
+        typer.Option(
+            help="Stop trials whose objective falls below the median at a level.",
+            rich_help_panel="Search",
+        ),
+    ] = True,
+    min_trials: Annotated[
+        int,
+        typer.Option(
+            help="Number of trials finishing a level before pruning.",
+            rich_help_panel="Search",
+        ),
+    ] = 3,
+    keep_outputs: Annotated[
+        bool,
+        typer.Option(help="Keep the outputs of every trial, not only the best one."),
+    ] = False,
+    report: Annotated[
+        Optional[Path],
+        typer.Option(help="CSV/TSV/Parquet table with one row per trial."),
+    ] = None,
+    workers: Annotated[int, typer.Option(help="Number of concurrent trials.")] = 1,
+    threads: Annotated[
+        Optional[int],
+        typer.Option(
+            help="Total number of OpenMP threads, shared by the trials. [all CPUs]"
+        ),
+    ] = None,
+    log_level: Annotated[
+        LogLevel,
+        typer.Option(
+            "--log",
+            case_sensitive=False,
+            help="Set the log level.",
+            rich_help_panel="Logging",
+        ),
+    ] = LogLevel.DEBUG,
+) -> None:
+    """Search reg_f3d parameters for a pair of images."""
+    setup_logger(log_level)
+    niftyregw_logger = logger.bind(executable="niftyregw")
+
+    try:
+        space = dict(parse_parameter(text) for text in param)
+        if trials is None:
+            params = grid_search(space)
+        else:
+            params = random_search(space, trials, seed=seed)
+        results = run_sweep(
+            reference,
+            floating,
+            params,
+            output_dir,
+            metric=metric,
+            max_workers=workers,
+            total_threads=threads,
+            pruner=MedianPruner(min_trials) if prune else None,
+            max_folded_voxels=max_folded_voxels,
+            keep_outputs=keep_outputs,
+            f3d_options={"input_affine": input_affine},
+        )
+        finished = []
+
+        def _rows():
+            for trial in results:
+                finished.append(trial)
+                yield trial.as_row()
+
+        if report is None:
+            for _ in _rows():
+                pass
+        else:
+            write_table(_rows(), report)
+    except ValueError as e:
+        niftyregw_logger.error(str(e))
+        raise typer.Exit(code=1) from e
+
+    best = best_trial(finished)
+    if best is None:
+        niftyregw_logger.error("No trial completed without folding.")
+        raise typer.Exit(code=1)
+    niftyregw_logger.info(
+        f"Best trial {best.number}: {best.params}"
+        f" ({metric} = {best.similarity[metric]:g})"
+    )
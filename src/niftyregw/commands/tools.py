@@ -1,14 +1,14 @@
 """CLI command for reg_tools."""
 
 from pathlib import Path
-from typing import Annotated, Optional, Tuple
+from typing import Annotated, List, Optional, Tuple
 
 import typer
 from loguru import logger
 
 from niftyregw.commands import make_help_callback, make_version_callback, setup_logger
 from niftyregw.enums import LogLevel
-from niftyregw.wrapper import run
+from niftyregw.wrapper import RunError, run
 
 _help_callback = make_help_callback("reg_tools")
 _version_callback = make_version_callback("reg_tools")
@@ -98,7 +98,32 @@ def tools(
         bool,
         typer.Option(help="Highlight active blocks for reg_aladin (block variance)."),
     ] = False,
+    # Chain
+    chain: Annotated[
+        Optional[List[str]],
+        typer.Option(
+            "--chain",
+            help=(
+                "Operation to run as a step of a chain, e.g."
+                " 'smooth-gaussian 2 2 2' or 'threshold 0.5'. Repeat to add steps,"
+                " which run in order. Element-wise steps run in memory and the"
+                " output is written once. Cannot be combined with other operations."
+            ),
+            rich_help_panel="Chain",
+        ),
+    ] = None,
     # Other
+    in_process: Annotated[
+        bool,
+        typer.Option(
+            help=(
+                "Run a single element-wise operation (add, subtract, multiply,"
+                " divide, binarize, threshold, remove-nan-inf or rms) in-process"
+                " with NumPy instead of reg_tools. The output is float32, or"
+                " float64 for a float64 input."
+            )
+        ),
+    ] = False,
     interpolation: Annotated[
         Optional[int], typer.Option(help="Interpolation order to warp the image.")
     ] = None,
@@ -138,6 +163,88 @@ def tools(
     setup_logger(log_level)
     tool_logger = logger.bind(executable="reg_tools")
 
+    # Element-wise operations that can run in-process, and the others
+    elementwise = {
+        "add": add,
+        "subtract": subtract,
+        "multiply": multiply,
+        "divide": divide,
+        "binarize": binarize,
+        "threshold": threshold,
+        "remove-nan-inf": remove_nan_inf,
+        "rms": rms,
+    }
+    others = [
+        to_float,
+        downsample,
+        isotropic,
+        change_resolution,
+        smooth_spline,
+        smooth_gaussian,
+        smooth_labels,
+        nan_mask,
+        no_scaling,
+        to_rgb,
+        mind,
+        mindssc,
+        test_active_blocks,
+    ]
+    requested = {
+        name: value
+        for name, value in elementwise.items()
+        if value is not None and value is not False
+    }
+    has_others = any(value is not None and value is not False for value in others)
+
+    if chain:
+        if requested or has_others:
+            tool_logger.error("--chain cannot be combined with other operations.")
+            raise typer.Exit(code=1)
+
+        from niftyregw.tools import ToolsChain
+
+        try:
+            tools_chain = ToolsChain.from_strings(chain)
+        except ValueError as e:
+            tool_logger.error(str(e))
+            raise typer.Exit(code=1) from e
+        try:
+            tools_chain.apply(
+                input_image,
+                Path("output.nii") if output is None else output,
+                interpolation=interpolation,
+                omp_threads=omp_threads,
+            )
+        except (ValueError, RunError) as e:
+            tool_logger.error(str(e))
+            raise typer.Exit(code=1) from e
+        return
+
+    if in_process:
+        if len(requested) != 1 or has_others:
+            tool_logger.error(
+                "--in-process requires exactly one element-wise operation."
+            )
+            raise typer.Exit(code=1)
+
+        from niftyregw import voxels
+
+        ((name, value),) = requested.items()
+        try:
+            if name == "rms":
+                typer.echo(voxels.rms(input_image, value))
+            else:
+                voxels.map_voxels(
+                    voxels.OPERATIONS[name],
+                    input_image,
+                    Path("output.nii") if output is None else output,
+                    operands=[] if name == "binarize" else [value],
+                )
+        except ValueError as e:
+            tool_logger.error(str(e))
+            raise typer.Exit(code=1) from e
+        return
+
     args: list[str] = ["-in", str(input_image)]
     if output is not None:
         args.extend(["-out", str(output)])
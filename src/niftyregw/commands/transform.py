@@ -6,7 +6,7 @@ from typing import Annotated, Optional, Tuple
 import typer
 from loguru import logger
 
-from niftyregw.commands import make_help_callback, setup_logger
+from niftyregw.commands import make_help_callback, resolve_cached, setup_logger
 from niftyregw.enums import LogLevel
 from niftyregw.wrapper import run
 
@@ -192,6 +192,15 @@ def compose(
     omp_threads: Annotated[
         Optional[int], typer.Option(help="Number of OpenMP threads.")
     ] = None,
+    cache_dir: Annotated[
+        Optional[Path],
+        typer.Option(
+            help=(
+                "Directory of cached deformation fields, reused across runs."
+                " The least recently used fields are removed beyond 4 GiB."
+            ),
+        ),
+    ] = None,
     log_level: Annotated[
         LogLevel,
         typer.Option(
@@ -203,6 +212,10 @@ def compose(
     ] = LogLevel.DEBUG,
 ) -> None:
     """Compose two transformations into a deformation field."""
+    input1 = resolve_cached(input1, reference, cache_dir)
+    cached2 = resolve_cached(input2, reference2, cache_dir)
+    if cached2 != input2:
+        input2, reference2 = cached2, None
     args: list[str] = []
     if reference is not None:
         args.extend(["-ref", str(reference)])
@@ -234,6 +247,15 @@ def landmarks(
     omp_threads: Annotated[
         Optional[int], typer.Option(help="Number of OpenMP threads.")
     ] = None,
+    cache_dir: Annotated[
+        Optional[Path],
+        typer.Option(
+            help=(
+                "Directory of cached deformation fields, reused across runs."
+                " The least recently used fields are removed beyond 4 GiB."
+            ),
+        ),
+    ] = None,
     log_level: Annotated[
         LogLevel,
         typer.Option(
@@ -245,6 +267,7 @@ def landmarks(
     ] = LogLevel.DEBUG,
 ) -> None:
     """Apply a transformation to a set of landmarks."""
+    transformation = resolve_cached(transformation, reference, cache_dir)
     args: list[str] = []
     if reference is not None:
         args.extend(["-ref", str(reference)])
@@ -341,6 +364,15 @@ def invert_nonrigid(
     omp_threads: Annotated[
         Optional[int], typer.Option(help="Number of OpenMP threads.")
     ] = None,
+    cache_dir: Annotated[
+        Optional[Path],
+        typer.Option(
+            help=(
+                "Directory of cached deformation fields, reused across runs."
+                " The least recently used fields are removed beyond 4 GiB."
+            ),
+        ),
+    ] = None,
     log_level: Annotated[
         LogLevel,
         typer.Option(
@@ -352,6 +384,7 @@ def invert_nonrigid(
     ] = LogLevel.DEBUG,
 ) -> None:
     """Invert a non-rigid transformation (saved as deformation field)."""
+    input_transformation = resolve_cached(input_transformation, reference, cache_dir)
     args: list[str] = []
     if reference is not None:
         args.extend(["-ref", str(reference)])
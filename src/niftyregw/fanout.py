@@ -0,0 +1,308 @@
+"""Register one reference image against many floating images."""
+
+from __future__ import annotations
+
+import os
+import time
+from collections import deque
+from collections.abc import Iterable, Iterator, Mapping, Sequence
+from concurrent.futures import Future, ThreadPoolExecutor
+from contextvars import copy_context
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import TYPE_CHECKING, Any
+
+from loguru import logger
+
+from .resample import NIFTI_SUFFIXES
+from .trace import span
+from .wrapper import reg_aladin, reg_f3d
+
+if TYPE_CHECKING:
+    import numpy as np
+
+DEFAULT_METRICS = ("ncc", "nmi")
+
+
+def subject_name(path: Path) -> str:
+    """Return the filename of *path* without its NIfTI/Analyze suffix."""
+    name = Path(path).name
+    for suffix in NIFTI_SUFFIXES:
+        if name.lower().endswith(suffix):
+            return name[: -len(suffix)]
+    return Path(path).stem
+
+
+@dataclass(frozen=True)
+class OutputTemplates:
+    """Output filename templates, formatted with ``subject`` and ``reference``.
+
+    ``subject`` is the floating filename without its suffix and ``reference``
+    the reference filename without its suffix. Templates are relative to the
+    output directory and may contain subdirectories.
+    """
+
+    affine: str = "{subject}_affine.txt"
+    cpp: str = "{subject}_cpp.nii.gz"
+    result: str = "{subject}_result.nii.gz"
+
+    def format(
+        self, reference: Path, floating: Path, directory: Path
+    ) -> tuple[Path, Path, Path]:
+        """Return the affine, CPP and result paths for *floating*."""
+        fields = {
+            "subject": subject_name(floating),
+            "reference": subject_name(reference),
+        }
+        return (
+            Path(directory) / self.affine.format(**fields),
+            Path(directory) / self.cpp.format(**fields),
+            Path(directory) / self.result.format(**fields),
+        )
+
+
+@dataclass
+class FanoutResult:
+    """Outcome of the registration of one floating image.
+
+    Attributes:
+        subject: Floating filename without its suffix.
+        floating: Floating image path.
+        affine: Affine transformation path.
+        cpp: Control point grid path. ``None`` for affine-only runs.
+        result: Resampled floating image path.
+        status: ``"done"``, ``"skipped"`` (all outputs existed) or ``"failed"``.
+        aladin_exit_code: Exit code of reg_aladin. ``None`` if it did not run.
+        f3d_exit_code: Exit code of reg_f3d. ``None`` if it did not run.
+        aladin_seconds: Wall time of reg_aladin.
+        f3d_seconds: Wall time of reg_f3d.
+        error: Error message of failed registrations.
+        similarity: Measures between the reference and the result.
+    """
+
+    subject: str
+    floating: Path
+    affine: Path
+    cpp: Path | None
+    result: Path
+    status: str = "done"
+    aladin_exit_code: int | None = None
+    f3d_exit_code: int | None = None
+    aladin_seconds: float = 0.0
+    f3d_seconds: float = 0.0
+    error: str = ""
+    similarity: dict[str, float] = field(default_factory=dict)
+
+    def as_row(self) -> dict[str, Any]:
+        """Return the result as a flat mapping for :func:`write_table`."""
+        return {
+            "subject": self.subject,
+            "floating": self.floating,
+            "status": self.status,
+            "aladin_exit_code": self.aladin_exit_code,
+            "f3d_exit_code": self.f3d_exit_code,
+            "aladin_seconds": round(self.aladin_seconds, 3),
+            "f3d_seconds": round(self.f3d_seconds, 3),
+            "affine": self.affine,
+            "cpp": "" if self.cpp is None else self.cpp,
+            "result": self.result,
+            "error": self.error,
+            **self.similarity,
+        }
+
+
+def threads_per_worker(total_threads: int | None, workers: int) -> int:
+    """Split a budget of *total_threads* (all CPUs if ``None``) among workers."""
+    total = (os.cpu_count() or 1) if total_threads is None else total_threads
+    return max(1, total // max(1, workers))
+
+
+def fanout(
+    reference: Path,
+    floatings: Iterable[Path],
+    output_dir: Path,
+    *,
+    templates: OutputTemplates = OutputTemplates(),  # noqa: B008
+    affine_only: bool = False,
+    skip_existing: bool = False,
+    max_workers: int = 1,
+    total_threads: int | None = None,
+    reference_mask: Path | None = None,
+    floating_mask: str | None = None,
+    metrics: Sequence[str] = DEFAULT_METRICS,
+    aladin_options: Mapping[str, Any] | None = None,
+    f3d_options: Mapping[str, Any] | None = None,
+) -> Iterator[FanoutResult]:
+    """Run reg_aladin then reg_f3d from *reference* to every floating image.
+
+    Subjects are registered concurrently by *max_workers* threads, each
+    running one NiftyReg process at a time with an equal share of
+    *total_threads* OpenMP threads. A failed subject does not stop the others.
+
+    Args:
+        reference: Reference image path, shared by all registrations.
+        floatings: Floating image paths.
+        output_dir: Directory the output templates are relative to.
+        templates: Output filename templates.
+        affine_only: Skip reg_f3d and resample the result with reg_aladin.
+        skip_existing: Do not rerun a step whose outputs already exist.
+            reg_f3d always reruns after reg_aladin, whose affine it uses.
+        max_workers: Number of subjects registered concurrently.
+        total_threads: OpenMP threads shared by the workers. All CPUs if
+            ``None``. An ``omp_threads`` option takes precedence.
+        reference_mask: Mask in the reference space, used by both
+            registrations and the similarity measures.
+        floating_mask: Template of the mask of each floating image, formatted
+            like the output templates, e.g. ``"masks/{subject}_mask.nii.gz"``.
+            Used by both registrations.
+        metrics: Measures computed between the reference and each result,
+            from :data:`niftyregw.similarity.METRICS`.
+        aladin_options: Other :func:`niftyregw.wrapper.reg_aladin` arguments.
+        f3d_options: Other :func:`niftyregw.wrapper.reg_f3d` arguments.
+
+    Yields:
+        The result of each subject, in input order.
+    """
+    from .similarity import check_metrics, load_image
+
+    check_metrics(metrics)
+    # The reference is read once for the similarity of every subject
+    reference_data = load_image(reference) if metrics else None
+    mask_data = None
+    if metrics and reference_mask is not None:
+        mask_data = load_image(reference_mask) != 0
+    output_dir = Path(output_dir)
+    omp_threads = threads_per_worker(total_threads, max_workers)
+    aladin_options = {"omp_threads": omp_threads, **(aladin_options or {})}
+    f3d_options = {"omp_threads": omp_threads, **(f3d_options or {})}
+    niftyregw_logger = logger.bind(executable="niftyregw")
+    niftyregw_logger.debug(
+        f"Registering with {max_workers} worker(s) of {omp_threads} thread(s)"
+    )
+
+    def _floating_mask(floating: Path) -> Path | None:
+        if floating_mask is None:
+            return None
+        return Path(
+            floating_mask.format(
+                subject=subject_name(floating), reference=subject_name(reference)
+            )
+        )
+
+    def _register(floating: Path) -> FanoutResult:
+        affine, cpp, result = templates.format(reference, floating, output_dir)
+        outcome = FanoutResult(
+            subject_name(floating),
+            Path(floating),
+            affine,
+            None if affine_only else cpp,
+            result,
+        )
+        with span(outcome.subject, "subject") as trace_args:
+            try:
+                _run_subject(
+                    outcome,
+                    reference,
+                    reference_mask,
+                    _floating_mask(floating),
+                    skip_existing,
+                    aladin_options,
+                    f3d_options,
+                )
+                if reference_data is not None and outcome.status != "failed":
+                    with span("similarity", "stage"):
+                        outcome.similarity = _measure(
+                            reference_data, result, metrics, mask_data
+                        )
+            except Exception as e:  # noqa: BLE001 - one subject must not stop the others
+                outcome.status = "failed"
+                outcome.error = f"{type(e).__name__}: {e}"
+            trace_args["status"] = outcome.status
+        if outcome.status == "failed":
+            niftyregw_logger.error(f"{outcome.subject} failed: {outcome.error}")
+        else:
+            niftyregw_logger.info(f"{outcome.subject} {outcome.status}")
+        return outcome
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        # Bound the subjects in flight so that long lists are consumed lazily
+        pending: deque[Future[FanoutResult]] = deque()
+        for floating in floatings:
+            pending.append(executor.submit(copy_context().run, _register, floating))
+            if len(pending) > 2 * max_workers:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
+
+
+def _run_subject(
+    outcome: FanoutResult,
+    reference: Path,
+    reference_mask: Path | None,
+    floating_mask: Path | None,
+    skip_existing: bool,
+    aladin_options: Mapping[str, Any],
+    f3d_options: Mapping[str, Any],
+) -> None:
+    affine_only = outcome.cpp is None
+    aladin_outputs = (
+        [outcome.affine, outcome.result] if affine_only else [outcome.affine]
+    )
+    run_aladin = not (skip_existing and all(path.exists() for path in aladin_outputs))
+    # A grid built from a previous affine is stale once the affine is rerun
+    run_f3d = not affine_only and (
+        run_aladin
+        or not (skip_existing and outcome.cpp.exists() and outcome.result.exists())
+    )
+    if run_aladin:
+        outcome.affine.parent.mkdir(parents=True, exist_ok=True)
+        outcome.result.parent.mkdir(parents=True, exist_ok=True)
+        start = time.perf_counter()
+        outcome.aladin_exit_code = reg_aladin(
+            reference,
+            outcome.floating,
+            output_affine=outcome.affine,
+            output_result=outcome.result if affine_only else None,
+            reference_mask=reference_mask,
+            floating_mask=floating_mask,
+            **aladin_options,
+        )
+        outcome.aladin_seconds = time.perf_counter() - start
+        if outcome.aladin_exit_code != 0:
+            outcome.status = "failed"
+            outcome.error = f"reg_aladin exited with code {outcome.aladin_exit_code}"
+            return
+    if run_f3d:
+        assert outcome.cpp is not None
+        outcome.cpp.parent.mkdir(parents=True, exist_ok=True)
+        outcome.result.parent.mkdir(parents=True, exist_ok=True)
+        start = time.perf_counter()
+        outcome.f3d_exit_code = reg_f3d(
+            reference,
+            outcome.floating,
+            input_affine=outcome.affine,
+            output_cpp=outcome.cpp,
+            output_result=outcome.result,
+            reference_mask=reference_mask,
+            floating_mask=floating_mask,
+            **f3d_options,
+        )
+        outcome.f3d_seconds = time.perf_counter() - start
+        if outcome.f3d_exit_code != 0:
+            outcome.status = "failed"
+            outcome.error = f"reg_f3d exited with code {outcome.f3d_exit_code}"
+            return
+    if not run_aladin and not run_f3d:
+        outcome.status = "skipped"
+
+
+def _measure(
+    reference: np.ndarray,
+    result: Path,
+    metrics: Sequence[str],
+    mask: np.ndarray | None,
+) -> dict[str, float]:
+    from .similarity import load_image, measure_arrays
+
+    values = measure_arrays(reference, load_image(result), metrics, mask)
+    return {name: float(value) for name, value in values.items()}
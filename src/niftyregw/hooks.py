@@ -0,0 +1,181 @@
+"""Hooks called by :func:`niftyregw.wrapper.run` around every binary.
+
+A hook subclasses :class:`RunHook` and overrides any of its methods:
+
+- :meth:`RunHook.before_spawn` can rewrite the command and the environment,
+  e.g. to prefix ``perf stat`` or to stage inputs in.
+- :meth:`RunHook.on_line` sees every output line.
+- :meth:`RunHook.after_exit` gets the exit code, wall time and resource
+  usage of the run.
+
+Hooks are added with :func:`register_hook`, or by installed packages through
+the ``niftyregw.hooks`` entry point group, loaded at the first run::
+
+    [project.entry-points."niftyregw.hooks"]
+    perf = "my_plugin:PerfStatHook"
+
+The same hook is called by concurrent runs, so state of a run belongs in
+:attr:`RunContext.state`.
+"""
+
+from __future__ import annotations
+
+import os
+import threading
+from collections.abc import Callable, Sequence
+from dataclasses import dataclass, field
+from importlib.metadata import entry_points
+from typing import Any
+
+from loguru import logger
+
+from .metrics import ResourceUsage
+
+ENTRY_POINT_GROUP = "niftyregw.hooks"
+
+
+@dataclass
+class RunContext:
+    """A binary about to run, which hooks can change before it is spawned.
+
+    Attributes:
+        tool: Binary name, e.g. ``"reg_f3d"``.
+        argv: Command line, starting with the path of the binary.
+        env: Environment of the binary. The environment of this process is
+            inherited if ``None``.
+        state: Data kept by hooks between the calls of the same run.
+    """
+
+    tool: str
+    argv: list[str]
+    env: dict[str, str] | None = None
+    state: dict[str, Any] = field(default_factory=dict)
+
+    def set_env(self, **variables: str) -> None:
+        """Set environment variables of the binary."""
+        if self.env is None:
+            self.env = dict(os.environ)
+        self.env.update(variables)
+
+
+@dataclass(frozen=True)
+class RunResult:
+    """A finished run.
+
+    Attributes:
+        tool: Binary name.
+        argv: Command line that was run.
+        returncode: Exit code.
+        wall_seconds: Wall time.
+        usage: Resources used, if known. See :func:`os.wait4`.
+    """
+
+    tool: str
+    argv: list[str]
+    returncode: int
+    wall_seconds: float
+    usage: ResourceUsage | None = None
+
+
+class RunHook:
+    """Base class of hooks. Every method does nothing by default."""
+
+    def before_spawn(self, context: RunContext) -> None:
+        """Called before the binary is spawned. Errors stop the run."""
+
+    def on_line(self, context: RunContext, line: str) -> None:
+        """Called with every output line, from the reader threads.
+
+        Not called when the output goes to a file. Errors are logged.
+        """
+
+    def after_exit(self, context: RunContext, result: RunResult) -> None:
+        """Called once the binary has exited. Errors are logged."""
+
+
+_hooks: list[RunHook] = []
+_entry_points_loaded = False
+_lock = threading.Lock()
+_load_lock = threading.Lock()
+
+
+def register_hook(hook: RunHook) -> RunHook:
+    """Call *hook* around every run, after the hooks registered before."""
+    with _lock:
+        _hooks.append(hook)
+    return hook
+
+
+def unregister_hook(hook: RunHook) -> None:
+    """Stop calling *hook*."""
+    with _lock:
+        if hook in _hooks:
+            _hooks.remove(hook)
+
+
+def load_entry_point_hooks(group: str = ENTRY_POINT_GROUP) -> list[RunHook]:
+    """Register the hooks of the installed packages and return them.
+
+    An entry point can name a :class:`RunHook` subclass, which is
+    instantiated, or an instance. Entry points that cannot be loaded are
+    logged and skipped.
+    """
+    loaded = []
+    for entry_point in entry_points(group=group):
+        try:
+            hook = entry_point.load()
+            if isinstance(hook, type):
+                hook = hook()
+        except Exception as e:  # noqa: BLE001 - a broken plugin must not stop runs
+            logger.bind(executable="niftyregw").warning(
+                f"Could not load hook {entry_point.name!r}: {e}"
+            )
+            continue
+        loaded.append(register_hook(hook))
+    return loaded
+
+
+def get_hooks() -> tuple[RunHook, ...]:
+    """Return the registered hooks, loading the entry points the first time."""
+    global _entry_points_loaded
+    if not _entry_points_loaded:
+        with _load_lock:
+            if not _entry_points_loaded:
+                load_entry_point_hooks()
+                _entry_points_loaded = True
+    with _lock:
+        return tuple(_hooks)
+
+
+def _log_hook_error(hook: RunHook, method: str) -> None:
+    logger.bind(executable="niftyregw").opt(exception=True).error(
+        f"{type(hook).__name__}.{method} failed"
+    )
+
+
+def _wrap_on_line(
+    hooks: Sequence[RunHook],
+    context: RunContext,
+    on_line: Callable[[str], bool | None] | None,
+) -> Callable[[str], bool | None]:
+    """Return a line callback calling the hooks, then *on_line*."""
+
+    def _on_line(line: str) -> bool | None:
+        for hook in hooks:
+            try:
+                hook.on_line(context, line)
+            except Exception:  # noqa: BLE001 - the pipes must still be drained
+                _log_hook_error(hook, "on_line")
+        return None if on_line is None else on_line(line)
+
+    return _on_line
+
+
+def _after_exit(
+    hooks: Sequence[RunHook], context: RunContext, result: RunResult
+) -> None:
+    for hook in hooks:
+        try:
+            hook.after_exit(context, result)
+        except Exception:  # noqa: BLE001 - the run has finished anyway
+            _log_hook_error(hook, "after_exit")
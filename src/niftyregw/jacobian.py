@@ -0,0 +1,325 @@
+"""Summary statistics of Jacobian determinant maps, computed slab by slab."""
+
+from __future__ import annotations
+
+import tempfile
+from collections.abc import Sequence
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import TYPE_CHECKING, Any
+
+import nibabel as nib
+import numpy as np
+from loguru import logger
+
+from .wrapper import RunError, run
+
+if TYPE_CHECKING:
+    from .cache import DeformationCache
+
+# Log-Jacobian histogram used for streaming percentiles. Values outside the
+# range are accumulated in the edge bins.
+_LOG_JAC_RANGE = (-5.0, 5.0)
+_LOG_JAC_BINS = 2000
+_DEFAULT_PERCENTILES = (5.0, 50.0, 95.0)
+_DEFAULT_SLAB_SIZE = 16
+# NiftyReg default for reg_f3d -be
+_DEFAULT_BENDING_ENERGY = 0.001
+
+
+def compute_jacobian_map(
+    transformation: Path,
+    output: Path,
+    *,
+    reference: Path | None = None,
+    omp_threads: int | None = None,
+) -> Path:
+    """Compute a Jacobian determinant map with reg_jacobian.
+
+    Args:
+        transformation: Transformation file.
+        output: Output determinant map filename.
+        reference: Reference image (required for spline parametrisation).
+        omp_threads: Number of OpenMP threads.
+
+    Returns:
+        The output path.
+
+    Raises:
+        RunError: If reg_jacobian fails.
+    """
+    args = ["-trans", str(transformation)]
+    if reference is not None:
+        args.extend(["-ref", str(reference)])
+    args.extend(["-jac", str(output)])
+    if omp_threads is not None:
+        args.extend(["-omp", str(omp_threads)])
+    returncode = run(
+        "reg_jacobian", *args, tool_logger=logger.bind(executable="reg_jacobian")
+    )
+    if returncode != 0:
+        raise RunError("reg_jacobian", returncode)
+    return output
+
+
+@dataclass
+class _LabelStats:
+    voxels: int = 0
+    folded: int = 0
+    log_sum: float = 0.0
+    log_sum_squares: float = 0.0
+    histogram: np.ndarray = field(
+        default_factory=lambda: np.zeros(_LOG_JAC_BINS, dtype=np.int64)
+    )
+
+    def percentile(self, q: float) -> float:
+        total = self.histogram.sum()
+        if total == 0:
+            return float("nan")
+        low, high = _LOG_JAC_RANGE
+        width = (high - low) / _LOG_JAC_BINS
+        cumulative = np.cumsum(self.histogram)
+        target = q / 100 * total
+        index = int(np.searchsorted(cumulative, target))
+        index = min(index, _LOG_JAC_BINS - 1)
+        before = cumulative[index - 1] if index > 0 else 0
+        fraction = (target - before) / max(self.histogram[index], 1)
+        return float(low + (index + fraction) * width)
+
+
+def _slabs(shape: tuple[int, ...], slab_size: int):
+    depth = shape[2] if len(shape) > 2 else 1
+    for start in range(0, depth, slab_size):
+        yield slice(start, min(start + slab_size, depth))
+
+
+def _read_slab(image: Any, slab: slice) -> np.ndarray:
+    if len(image.shape) > 2:
+        data = image.dataobj[:, :, slab]
+    else:
+        data = image.dataobj[:, :]
+    return np.asarray(data, dtype=np.float64).reshape(-1)
+
+
+def count_folded_voxels(
+    jacobian_map: Path, *, slab_size: int = _DEFAULT_SLAB_SIZE
+) -> int:
+    """Count the voxels with a non-positive Jacobian determinant.
+
+    Args:
+        jacobian_map: Jacobian determinant map.
+        slab_size: Number of slices read at a time.
+
+    Returns:
+        The number of folded voxels. Non-finite values are not counted.
+    """
+    image = nib.load(jacobian_map, mmap=True)
+    return sum(
+        int(np.count_nonzero(_read_slab(image, slab) <= 0))
+        for slab in _slabs(image.shape, slab_size)
+    )
+
+
+@dataclass(frozen=True)
+class FoldCheck:
+    """Quality check on the Jacobian determinant of a registration result.
+
+    Passed to :func:`niftyregw.wrapper.reg_f3d`, which computes the
+    determinant map of the output control point grid in scratch and, while
+    more than *max_folded_voxels* voxels fold, runs the registration again
+    with the bending energy and Jacobian log weights multiplied by *factor*.
+
+    Args:
+        max_folded_voxels: Number of folded voxels tolerated.
+        retries: Number of registrations run again before giving up.
+        factor: Factor applied to the regularisation weights on each retry.
+        jacobian_log_weight: Jacobian log weight of the first retry if the
+            registration did not use one.
+        slab_size: Number of slices of the determinant map read at a time.
+        omp_threads: Number of OpenMP threads for ``reg_jacobian``.
+    """
+
+    max_folded_voxels: int = 0
+    retries: int = 0
+    factor: float = 10.0
+    jacobian_log_weight: float = 0.01
+    slab_size: int = _DEFAULT_SLAB_SIZE
+    omp_threads: int | None = None
+
+    def count_folded(self, transformation: Path, reference: Path) -> int:
+        """Return the number of folded voxels of *transformation*.
+
+        Raises:
+            RunError: If ``reg_jacobian`` fails.
+        """
+        with tempfile.TemporaryDirectory(prefix="niftyregw-") as tmp_dir:
+            jacobian_map = compute_jacobian_map(
+                transformation,
+                Path(tmp_dir) / "jacobian.nii",
+                reference=reference,
+                omp_threads=self.omp_threads,
+            )
+            return count_folded_voxels(jacobian_map, slab_size=self.slab_size)
+
+    def escalate(
+        self,
+        bending_energy: float | None,
+        jacobian_log_weight: float | None,
+    ) -> tuple[float, float]:
+        """Return the regularisation weights for the next attempt."""
+        if bending_energy is None:
+            bending_energy = _DEFAULT_BENDING_ENERGY
+        if jacobian_log_weight:
+            jacobian_log_weight *= self.factor
+        else:
+            jacobian_log_weight = self.jacobian_log_weight
+        return bending_energy * self.factor, jacobian_log_weight
+
+
+def summarise_jacobian_map(
+    jacobian_map: Path,
+    *,
+    parcellation: Path | None = None,
+    percentiles: Sequence[float] = _DEFAULT_PERCENTILES,
+    slab_size: int = _DEFAULT_SLAB_SIZE,
+) -> list[dict[str, Any]]:
+    """Summarise a Jacobian determinant map, optionally per label.
+
+    The map is memory-mapped and read in slabs of *slab_size* slices, so that
+    memory use does not depend on the image size. Percentiles of the log
+    determinant are estimated from a histogram with a resolution of 0.005.
+
+    Args:
+        jacobian_map: Jacobian determinant map.
+        parcellation: Label image on the same grid. Label 0 is ignored. The
+            whole image is summarised as a single row if ``None``.
+        percentiles: Percentiles of the log determinant to report.
+        slab_size: Number of slices read at a time.
+
+    Returns:
+        One row per label with the voxel count, the number and fraction of
+        folded (non-positive determinant) voxels, and the mean, standard
+        deviation and percentiles of the log determinant of the other voxels.
+    """
+    image = nib.load(jacobian_map, mmap=True)
+    labels_image = None if parcellation is None else nib.load(parcellation)
+    if labels_image is not None and labels_image.shape[:3] != image.shape[:3]:
+        msg = (
+            f"Parcellation shape {labels_image.shape} does not match"
+            f" Jacobian map shape {image.shape}"
+        )
+        raise ValueError(msg)
+
+    low, high = _LOG_JAC_RANGE
+    stats: dict[int, _LabelStats] = {}
+    for slab in _slabs(image.shape, slab_size):
+        determinant = _read_slab(image, slab)
+        if labels_image is None:
+            labels = np.zeros(determinant.shape, dtype=np.int64)
+        else:
+            labels = _read_slab(labels_image, slab).astype(np.int64)
+        keep = np.isfinite(determinant)
+        if labels_image is not None:
+            keep &= labels != 0
+        determinant, labels = determinant[keep], labels[keep]
+
+        unique, inverse = np.unique(labels, return_inverse=True)
+        positive = determinant > 0
+        log_det = np.log(np.where(positive, determinant, 1.0))
+        bins = np.clip(
+            ((log_det - low) / (high - low) * _LOG_JAC_BINS).astype(np.int64),
+            0,
+            _LOG_JAC_BINS - 1,
+        )
+        count = len(unique)
+        voxels = np.bincount(inverse, minlength=count)
+        folded = np.bincount(inverse, weights=~positive, minlength=count)
+        log_sum = np.bincount(inverse, weights=log_det * positive, minlength=count)
+        log_sum_squares = np.bincount(
+            inverse, weights=log_det**2 * positive, minlength=count
+        )
+        histograms = np.bincount(
+            inverse[positive] * _LOG_JAC_BINS + bins[positive],
+            minlength=count * _LOG_JAC_BINS,
+        ).reshape(count, _LOG_JAC_BINS)
+
+        for index, label in enumerate(unique.tolist()):
+            label_stats = stats.setdefault(label, _LabelStats())
+            label_stats.voxels += int(voxels[index])
+            label_stats.folded += int(folded[index])
+            label_stats.log_sum += float(log_sum[index])
+            label_stats.log_sum_squares += float(log_sum_squares[index])
+            label_stats.histogram += histograms[index]
+
+    rows = []
+    for label in sorted(stats):
+        label_stats = stats[label]
+        unfolded = label_stats.voxels - label_stats.folded
+        mean = label_stats.log_sum / unfolded if unfolded else float("nan")
+        variance = label_stats.log_sum_squares / unfolded - mean**2 if unfolded else 0
+        row: dict[str, Any] = {
+            "label": None if labels_image is None else label,
+            "voxels": label_stats.voxels,
+            "folded": label_stats.folded,
+            "folded_fraction": label_stats.folded / max(label_stats.voxels, 1),
+            "log_jacobian_mean": mean,
+            "log_jacobian_std": float(np.sqrt(max(variance, 0.0))),
+        }
+        for q in percentiles:
+            row[f"log_jacobian_p{q:g}"] = label_stats.percentile(q)
+        rows.append(row)
+    return rows
+
+
+def jacobian_stats(
+    transformation: Path,
+    reference: Path | None = None,
+    *,
+    parcellation: Path | None = None,
+    percentiles: Sequence[float] = _DEFAULT_PERCENTILES,
+    subject: str | None = None,
+    keep_map: Path | None = None,
+    slab_size: int = _DEFAULT_SLAB_SIZE,
+    omp_threads: int | None = None,
+    cache: DeformationCache | None = None,
+) -> list[dict[str, Any]]:
+    """Compute Jacobian determinant statistics of a transformation.
+
+    The determinant map is written uncompressed to scratch by ``reg_jacobian``,
+    summarised slab by slab, and deleted unless *keep_map* is given.
+
+    Args:
+        transformation: Transformation file.
+        reference: Reference image (required for spline parametrisation).
+        parcellation: Label image on the reference grid.
+        percentiles: Percentiles of the log determinant to report.
+        subject: Identifier stored in a ``subject`` column. Defaults to the
+            transformation path.
+        keep_map: Path where the determinant map is kept. Must be
+            uncompressed (``.nii``) for memory-mapping to be effective.
+        slab_size: Number of slices read at a time.
+        omp_threads: Number of OpenMP threads for ``reg_jacobian``.
+        cache: Deformation field cache for spline parametrisations.
+
+    Returns:
+        Tidy rows as returned by :func:`summarise_jacobian_map`, each with a
+        leading ``subject`` column.
+    """
+    subject = str(transformation) if subject is None else subject
+    if cache is not None:
+        transformation = cache.resolve(transformation, reference)
+    with tempfile.TemporaryDirectory(prefix="niftyregw-") as tmp_dir:
+        jacobian_map = Path(tmp_dir) / "jacobian.nii" if keep_map is None else keep_map
+        compute_jacobian_map(
+            transformation,
+            jacobian_map,
+            reference=reference,
+            omp_threads=omp_threads,
+        )
+        rows = summarise_jacobian_map(
+            jacobian_map,
+            parcellation=parcellation,
+            percentiles=percentiles,
+            slab_size=slab_size,
+        )
+    return [{"subject": subject, **row} for row in rows]
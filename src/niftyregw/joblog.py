@@ -0,0 +1,132 @@
+"""Route the log records of concurrent jobs to per-job destinations.
+
+:func:`niftyregw.commands.setup_logger` removes and adds loguru sinks, which
+is fine for one command per process but not for a service running many jobs
+at once. :func:`install_job_routing` instead adds a single sink, once per
+process, that writes every record to the destination of its job. The job of
+a record is the ``job_id`` set by :func:`job_context` with
+:meth:`loguru.Logger.contextualize`, so it follows the context variables of
+the calling code. :func:`niftyregw.wrapper.run` passes them to its reader
+threads and to the log pipeline, and the thread pools of the fan-out,
+pairwise and sweep functions pass them to their workers.
+"""
+
+from __future__ import annotations
+
+import os
+import sys
+import threading
+from collections.abc import Hashable, Iterator
+from contextlib import contextmanager
+from typing import TYPE_CHECKING, TextIO
+
+from loguru import logger
+
+if TYPE_CHECKING:
+    import loguru
+
+LOG_FORMAT = (
+    "<green>{time:YYYY-MM-DD HH:mm:ss}</green> | <level>{extra[executable]}</level>"
+    " | <level>{level: <8}</level> | <level>{message}</level>"
+)
+
+
+class JobLogRouter:
+    """A loguru sink writing each record to the destination of its job.
+
+    Args:
+        default: Destination of the records without a job, or of jobs
+            without a destination. Discarded if ``None``.
+    """
+
+    def __init__(self, default: TextIO | None = sys.stderr) -> None:
+        self.default = default
+        self._destinations: dict[Hashable, TextIO] = {}
+        self._lock = threading.Lock()
+
+    def register(self, job_id: Hashable, destination: TextIO) -> None:
+        """Send the records of *job_id* to *destination*."""
+        with self._lock:
+            self._destinations[job_id] = destination
+
+    def unregister(self, job_id: Hashable) -> TextIO | None:
+        """Stop sending the records of *job_id* and return its destination."""
+        with self._lock:
+            return self._destinations.pop(job_id, None)
+
+    def jobs(self) -> list[Hashable]:
+        """Return the jobs with a destination."""
+        with self._lock:
+            return list(self._destinations)
+
+    def write(self, message: loguru.Message) -> None:
+        """Write *message* to the destination of its job."""
+        job_id = message.record["extra"].get("job_id")
+        with self._lock:
+            destination = self._destinations.get(job_id, self.default)
+        if destination is not None:
+            destination.write(message)
+            destination.flush()
+
+
+_router: JobLogRouter | None = None
+_router_lock = threading.Lock()
+
+
+def install_job_routing(
+    level: str = "DEBUG", default: TextIO | None = sys.stderr
+) -> JobLogRouter:
+    """Replace the loguru sinks by a :class:`JobLogRouter`, once per process.
+
+    Later calls return the installed router and change nothing. Once it is
+    installed, :func:`niftyregw.commands.setup_logger` leaves the sinks alone.
+
+    Args:
+        level: Minimum level of the records written.
+        default: Destination of the records without a job destination.
+    """
+    global _router
+    with _router_lock:
+        if _router is None:
+            router = JobLogRouter(default)
+            logger.configure(extra={"executable": "niftyregw", "job_id": None})
+            logger.remove()
+            logger.add(router.write, format=LOG_FORMAT, level=level, colorize=False)
+            _router = router
+        return _router
+
+
+def get_job_router() -> JobLogRouter | None:
+    """Return the router added by :func:`install_job_routing`, if any."""
+    return _router
+
+
+@contextmanager
+def job_context(
+    job_id: Hashable, log_file: str | os.PathLike[str] | None = None
+) -> Iterator[None]:
+    """Tag the records logged inside the block with *job_id*.
+
+    Args:
+        job_id: Job identifier, added to the ``extra`` of the records.
+        log_file: File the records of the job are appended to. Requires
+            :func:`install_job_routing`.
+
+    Raises:
+        RuntimeError: If *log_file* is given and routing is not installed.
+    """
+    router = get_job_router()
+    if log_file is None:
+        with logger.contextualize(job_id=job_id):
+            yield
+        return
+    if router is None:
+        msg = "Call install_job_routing() before giving a job log file"
+        raise RuntimeError(msg)
+    with open(log_file, "a") as f:
+        router.register(job_id, f)
+        try:
+            with logger.contextualize(job_id=job_id):
+                yield
+        finally:
+            router.unregister(job_id)
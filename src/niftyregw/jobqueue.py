@@ -0,0 +1,509 @@
+"""Job queue in a SQLite file, shared by workers on several nodes."""
+
+from __future__ import annotations
+
+import json
+import os
+import socket
+import sqlite3
+import threading
+import time
+from collections.abc import Callable, Iterator, Mapping, Sequence
+from contextlib import contextmanager
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Any
+
+from loguru import logger
+
+from .joblog import install_job_routing, job_context
+from .metrics import get_metrics
+from .trace import get_tracer, span
+from .wrapper import reg_aladin, reg_f3d, run
+
+# Job kinds: "run" takes a tool and raw arguments, the others keyword arguments
+JOB_KINDS = ("run", "reg_aladin", "reg_f3d")
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    kind TEXT NOT NULL,
+    payload TEXT NOT NULL,
+    status TEXT NOT NULL DEFAULT 'pending',
+    attempts INTEGER NOT NULL DEFAULT 0,
+    max_attempts INTEGER NOT NULL,
+    not_before REAL NOT NULL DEFAULT 0,
+    worker TEXT,
+    lease_expires REAL,
+    returncode INTEGER,
+    error TEXT,
+    created REAL NOT NULL,
+    finished REAL
+);
+CREATE INDEX IF NOT EXISTS jobs_status ON jobs (status, not_before);
+"""
+
+
+@dataclass(frozen=True)
+class Job:
+    """A queued job.
+
+    Attributes:
+        id: Job ID.
+        kind: One of :data:`JOB_KINDS`.
+        payload: ``{"tool": ..., "args": [...]}`` for ``"run"`` jobs, with
+            an optional ``"output"`` file for the output of the binary,
+            keyword arguments of the function otherwise.
+        status: ``"pending"``, ``"running"``, ``"done"`` or ``"failed"``.
+        attempts: Number of times the job was claimed.
+        max_attempts: Number of attempts before the job fails.
+        worker: ID of the last worker that claimed the job.
+        returncode: Exit code of the last attempt.
+        error: Error message of the last failed attempt.
+        created: Time the job was submitted, in seconds since the epoch.
+    """
+
+    id: int
+    kind: str
+    payload: dict[str, Any]
+    status: str
+    attempts: int
+    max_attempts: int
+    worker: str | None
+    returncode: int | None
+    error: str | None
+    created: float | None = None
+
+    @classmethod
+    def _from_row(cls, row: sqlite3.Row) -> Job:
+        return cls(
+            id=row["id"],
+            kind=row["kind"],
+            payload=json.loads(row["payload"]),
+            status=row["status"],
+            attempts=row["attempts"],
+            max_attempts=row["max_attempts"],
+            worker=row["worker"],
+            returncode=row["returncode"],
+            error=row["error"],
+            created=row["created"],
+        )
+
+
+def default_worker_id() -> str:
+    """Return ``hostname:pid``."""
+    return f"{socket.gethostname()}:{os.getpid()}"
+
+
+class JobQueue:
+    """A queue of NiftyReg jobs in a SQLite database.
+
+    Workers claim a job by taking a lease on it, which they renew with
+    heartbeats while the job runs. A job whose lease expires, e.g. because its
+    worker died, is claimed again by another worker. Failed attempts are
+    retried after an exponential backoff until *max_attempts* is reached.
+
+    SQLite's write-ahead log needs shared memory, so it does not work when
+    the database is shared between hosts over NFS. The rollback journal is
+    used by default, and every change runs in a short ``BEGIN IMMEDIATE``
+    transaction. Use *wal* only if all workers run on the same host.
+
+    Args:
+        path: Database file. Created if it does not exist.
+        lease_seconds: Time a worker can go without a heartbeat before its job
+            is given to another worker.
+        retry_delay: Delay before the first retry of a failed job, doubled at
+            every attempt.
+        max_retry_delay: Maximum delay between attempts.
+        wal: Use the write-ahead log journal mode.
+    """
+
+    def __init__(
+        self,
+        path: Path,
+        *,
+        lease_seconds: float = 300.0,
+        retry_delay: float = 30.0,
+        max_retry_delay: float = 3600.0,
+        wal: bool = False,
+    ) -> None:
+        self.path = Path(path)
+        self.lease_seconds = lease_seconds
+        self.retry_delay = retry_delay
+        self.max_retry_delay = max_retry_delay
+        self._journal_mode = "WAL" if wal else "DELETE"
+        with self._transaction() as connection:
+            # executescript would commit the transaction first
+            for statement in _SCHEMA.split(";"):
+                if statement.strip():
+                    connection.execute(statement)
+
+    @contextmanager
+    def _transaction(self, write: bool = True) -> Iterator[sqlite3.Connection]:
+        # A connection per transaction, so that the queue can be used from
+        # several threads and no lock is held between transactions. Reads
+        # only take a shared lock, so they do not wait for other readers.
+        connection = sqlite3.connect(self.path, timeout=60, isolation_level=None)
+        connection.row_factory = sqlite3.Row
+        try:
+            connection.execute(f"PRAGMA journal_mode={self._journal_mode}")
+            connection.execute("BEGIN IMMEDIATE" if write else "BEGIN")
+            try:
+                yield connection
+            except BaseException:
+                connection.execute("ROLLBACK")
+                raise
+            connection.execute("COMMIT")
+        finally:
+            connection.close()
+
+    def submit(
+        self, kind: str, payload: Mapping[str, Any], *, max_attempts: int = 3
+    ) -> int:
+        """Add a job and return its ID.
+
+        Args:
+            kind: One of :data:`JOB_KINDS`.
+            payload: ``{"tool": ..., "args": [...]}`` for ``"run"`` jobs,
+                keyword arguments of :func:`niftyregw.wrapper.reg_aladin` or
+                :func:`niftyregw.wrapper.reg_f3d` otherwise. Paths are
+                stored as strings.
+            max_attempts: Number of attempts before the job fails.
+        """
+        return self.submit_many([(kind, payload)], max_attempts=max_attempts)[0]
+
+    def submit_many(
+        self,
+        jobs: Sequence[tuple[str, Mapping[str, Any]]],
+        *,
+        max_attempts: int = 3,
+    ) -> list[int]:
+        """Add several ``(kind, payload)`` jobs in one transaction."""
+        for kind, payload in jobs:
+            _check_job(kind, payload)
+        now = time.time()
+        ids = []
+        with self._transaction() as connection:
+            for kind, payload in jobs:
+                cursor = connection.execute(
+                    "INSERT INTO jobs (kind, payload, max_attempts, created)"
+                    " VALUES (?, ?, ?, ?)",
+                    (kind, json.dumps(payload, default=str), max_attempts, now),
+                )
+                ids.append(cursor.lastrowid)
+        return ids
+
+    def claim(self, worker: str) -> Job | None:
+        """Lease the next pending job to *worker*, or return ``None``."""
+        now = time.time()
+        with self._transaction() as connection:
+            self._recover(connection, now)
+            row = connection.execute(
+                "SELECT id FROM jobs WHERE status = 'pending' AND not_before <= ?"
+                " ORDER BY id LIMIT 1",
+                (now,),
+            ).fetchone()
+            if row is None:
+                return None
+            connection.execute(
+                "UPDATE jobs SET status = 'running', worker = ?, lease_expires = ?,"
+                " attempts = attempts + 1 WHERE id = ?",
+                (worker, now + self.lease_seconds, row["id"]),
+            )
+            row = connection.execute(
+                "SELECT * FROM jobs WHERE id = ?", (row["id"],)
+            ).fetchone()
+        return Job._from_row(row)
+
+    def _recover(self, connection: sqlite3.Connection, now: float) -> int:
+        """Return jobs whose lease expired to the queue, or fail them."""
+        expired = connection.execute(
+            "SELECT id, attempts, max_attempts, worker FROM jobs"
+            " WHERE status = 'running' AND lease_expires < ?",
+            (now,),
+        ).fetchall()
+        for row in expired:
+            logger.bind(executable="niftyregw").warning(
+                f"Lease of job {row['id']} by {row['worker']} expired"
+            )
+            self._retry_or_fail(
+                connection, row, now, error=f"Worker {row['worker']} lost its lease"
+            )
+        return len(expired)
+
+    def recover(self) -> int:
+        """Requeue the jobs of dead workers and return their number."""
+        with self._transaction() as connection:
+            return self._recover(connection, time.time())
+
+    def heartbeat(self, job_id: int, worker: str) -> bool:
+        """Renew the lease of *worker* on a job.
+
+        Returns:
+            Whether *worker* still holds the lease.
+        """
+        with self._transaction() as connection:
+            cursor = connection.execute(
+                "UPDATE jobs SET lease_expires = ?"
+                " WHERE id = ? AND worker = ? AND status = 'running'",
+                (time.time() + self.lease_seconds, job_id, worker),
+            )
+            return cursor.rowcount == 1
+
+    def complete(self, job_id: int, worker: str, returncode: int = 0) -> bool:
+        """Mark a job leased by *worker* as done.
+
+        Returns:
+            Whether *worker* still held the lease.
+        """
+        with self._transaction() as connection:
+            cursor = connection.execute(
+                "UPDATE jobs SET status = 'done', returncode = ?, finished = ?,"
+                " lease_expires = NULL, error = NULL"
+                " WHERE id = ? AND worker = ? AND status = 'running'",
+                (returncode, time.time(), job_id, worker),
+            )
+            return cursor.rowcount == 1
+
+    def fail(
+        self,
+        job_id: int,
+        worker: str,
+        error: str,
+        returncode: int | None = None,
+    ) -> bool:
+        """Record a failed attempt, retrying the job later if attempts remain.
+
+        Returns:
+            Whether *worker* still held the lease.
+        """
+        with self._transaction() as connection:
+            row = connection.execute(
+                "SELECT id, attempts, max_attempts FROM jobs"
+                " WHERE id = ? AND worker = ? AND status = 'running'",
+                (job_id, worker),
+            ).fetchone()
+            if row is None:
+                return False
+            self._retry_or_fail(connection, row, time.time(), error, returncode)
+            return True
+
+    def _retry_or_fail(
+        self,
+        connection: sqlite3.Connection,
+        row: sqlite3.Row,
+        now: float,
+        error: str,
+        returncode: int | None = None,
+    ) -> None:
+        if row["attempts"] >= row["max_attempts"]:
+            connection.execute(
+                "UPDATE jobs SET status = 'failed', error = ?, returncode = ?,"
+                " finished = ?, lease_expires = NULL WHERE id = ?",
+                (error, returncode, now, row["id"]),
+            )
+            return
+        delay = min(self.retry_delay * 2 ** (row["attempts"] - 1), self.max_retry_delay)
+        connection.execute(
+            "UPDATE jobs SET status = 'pending', error = ?, returncode = ?,"
+            " not_before = ?, lease_expires = NULL WHERE id = ?",
+            (error, returncode, now + delay, row["id"]),
+        )
+
+    def jobs(self, status: str | None = None) -> list[Job]:
+        """Return all jobs, or those with *status*, by ID."""
+        with self._transaction(write=False) as connection:
+            if status is None:
+                rows = connection.execute("SELECT * FROM jobs ORDER BY id").fetchall()
+            else:
+                rows = connection.execute(
+                    "SELECT * FROM jobs WHERE status = ? ORDER BY id", (status,)
+                ).fetchall()
+        return [Job._from_row(row) for row in rows]
+
+    def counts(self) -> dict[str, int]:
+        """Return the number of jobs per status."""
+        counts = dict.fromkeys(("pending", "running", "done", "failed"), 0)
+        with self._transaction(write=False) as connection:
+            rows = connection.execute(
+                "SELECT status, COUNT(*) AS count FROM jobs GROUP BY status"
+            ).fetchall()
+        counts.update({row["status"]: row["count"] for row in rows})
+        return counts
+
+
+def _check_job(kind: str, payload: Mapping[str, Any]) -> None:
+    if kind not in JOB_KINDS:
+        msg = f"Unknown job kind {kind!r}. Choose from: {', '.join(JOB_KINDS)}"
+        raise ValueError(msg)
+    if kind == "run" and not isinstance(payload.get("tool"), str):
+        raise ValueError("'run' jobs need a 'tool' and a list of 'args'")
+    if kind != "run" and not {"reference", "floating"} <= set(payload):
+        msg = f"{kind!r} jobs need 'reference' and 'floating' arguments"
+        raise ValueError(msg)
+
+
+def execute(job: Job, on_line: Callable[[str], bool | None] | None = None) -> int:
+    """Run *job* through the wrapper and return its exit code.
+
+    Args:
+        job: Job to run.
+        on_line: Callback called with each output line. The binary is
+            terminated if it returns ``True``. Not called for ``"run"`` jobs
+            whose output goes to a file.
+    """
+    if job.kind == "run":
+        args = [str(arg) for arg in job.payload.get("args", [])]
+        output = job.payload.get("output")
+        return run(
+            job.payload["tool"],
+            *args,
+            tool_logger=logger.bind(executable=job.payload["tool"]),
+            on_line=None if output is not None else on_line,
+            output=output,
+        )
+    function = reg_aladin if job.kind == "reg_aladin" else reg_f3d
+    return function(**job.payload, on_line=on_line)
+
+
+def _record_end(
+    record: Callable[..., bool], job_id: int, worker: str, *args: Any
+) -> None:
+    """Complete or fail a job with *record*, logging instead of raising."""
+    niftyregw_logger = logger.bind(executable="niftyregw")
+    try:
+        recorded = record(job_id, worker, *args)
+    except sqlite3.Error as e:
+        niftyregw_logger.error(f"Could not record the end of job {job_id}: {e}")
+        return
+    if not recorded:
+        niftyregw_logger.warning(
+            f"Job {job_id} is no longer leased by {worker}, its end was not recorded"
+        )
+
+
+def run_worker(
+    queue: JobQueue,
+    *,
+    worker: str | None = None,
+    poll_interval: float = 10.0,
+    max_jobs: int | None = None,
+    exit_when_empty: bool = False,
+    log_dir: Path | None = None,
+    metrics: bool = False,
+) -> int:
+    """Run jobs from *queue* until stopped.
+
+    A heartbeat thread renews the lease of the running job every third of
+    the lease duration. If the lease is lost, e.g. because the worker could
+    not reach the database for longer than the lease, another worker may
+    already run the job: the binary is terminated at its next output line
+    and the job is neither completed nor failed by this worker. Database
+    errors while renewing are retried until the lease is about to expire,
+    and errors while completing or failing a job are logged.
+
+    Args:
+        queue: Job queue.
+        worker: Worker ID. ``hostname:pid`` if ``None``.
+        poll_interval: Seconds between polls of an empty queue.
+        max_jobs: Stop after running this number of jobs.
+        exit_when_empty: Stop when no job is pending or running.
+        log_dir: Directory for a ``job_<id>.log`` file per job, with the
+            records logged while it runs. Installs job log routing, see
+            :func:`niftyregw.joblog.install_job_routing`.
+        metrics: Record the number of jobs per status in
+            :func:`niftyregw.metrics.get_metrics` after every claim. They are
+            only counted when the queue is empty otherwise.
+
+    Returns:
+        The number of jobs run.
+    """
+    worker = default_worker_id() if worker is None else worker
+    if log_dir is not None:
+        install_job_routing()
+        log_dir.mkdir(parents=True, exist_ok=True)
+    niftyregw_logger = logger.bind(executable="niftyregw")
+    niftyregw_logger.info(f"Worker {worker} polling {queue.path}")
+    count = 0
+    while max_jobs is None or count < max_jobs:
+        job = queue.claim(worker)
+        counts = None
+        if metrics or (job is None and exit_when_empty):
+            counts = queue.counts()
+        if metrics:
+            get_metrics().set_queue_jobs(counts)
+        if job is None:
+            if counts is not None and counts["pending"] == counts["running"] == 0:
+                break
+            time.sleep(poll_interval)
+            continue
+
+        niftyregw_logger.info(
+            f"Running job {job.id} ({job.kind}), attempt {job.attempts}"
+        )
+        stop, lost = threading.Event(), threading.Event()
+
+        def _heartbeat(
+            job_id: int = job.id,
+            stop: threading.Event = stop,
+            lost: threading.Event = lost,
+        ) -> None:
+            interval = queue.lease_seconds / 3
+            renewed = time.monotonic()
+            while not stop.wait(interval):
+                try:
+                    held = queue.heartbeat(job_id, worker)
+                except sqlite3.Error as e:
+                    # Give the job up before the lease expires and another
+                    # worker may claim it
+                    if time.monotonic() - renewed + interval < queue.lease_seconds:
+                        niftyregw_logger.warning(
+                            f"Could not renew the lease of job {job_id}: {e}"
+                        )
+                        continue
+                    held = False
+                if held:
+                    renewed = time.monotonic()
+                    continue
+                niftyregw_logger.warning(
+                    f"Lost the lease of job {job_id}, terminating it"
+                )
+                lost.set()
+                return
+
+        heartbeat = threading.Thread(target=_heartbeat, name="heartbeat", daemon=True)
+        heartbeat.start()
+        tracer = get_tracer()
+        if tracer is not None and job.created is not None:
+            tracer.name_thread(worker)
+            tracer.add_span(
+                "queue wait", "queue", job.created, time.time(), {"job": job.id}
+            )
+        log_file = None if log_dir is None else log_dir / f"job_{job.id}.log"
+        try:
+            with (
+                span(f"job {job.id}", "job", kind=job.kind, attempt=job.attempts),
+                job_context(job.id, log_file),
+            ):
+                returncode = execute(job, on_line=lambda _, lost=lost: lost.is_set())
+        except Exception as e:  # noqa: BLE001 - a failed job must not stop the worker
+            if lost.is_set():
+                niftyregw_logger.warning(f"Job {job.id} abandoned: {e}")
+            else:
+                _record_end(queue.fail, job.id, worker, f"{type(e).__name__}: {e}")
+                niftyregw_logger.error(f"Job {job.id} failed: {e}")
+        else:
+            if lost.is_set():
+                # The job belongs to whichever worker claims it next
+                niftyregw_logger.warning(f"Job {job.id} abandoned")
+            elif returncode == 0:
+                _record_end(queue.complete, job.id, worker)
+            else:
+                message = f"{job.kind} exited with code {returncode}"
+                _record_end(queue.fail, job.id, worker, message, returncode)
+                niftyregw_logger.error(f"Job {job.id} failed: {message}")
+        finally:
+            stop.set()
+            heartbeat.join()
+        count += 1
+    return count
@@ -0,0 +1,189 @@
+"""Bounded queue between the threads draining NiftyReg pipes and the log sinks.
+
+The reader threads of :func:`niftyregw.wrapper.run` only put lines in the queue
+and a single emitter thread passes them to loguru, so a slow sink (a log file
+on NFS, a remote handler) does not stop the pipes from being drained and the
+binaries never block on write. When the queue is full, the policy decides
+whether a reader waits (a stall) or drops the line.
+"""
+
+from __future__ import annotations
+
+import contextvars
+import queue
+import threading
+import time
+from collections.abc import Callable
+from dataclasses import asdict, dataclass
+
+from loguru import logger
+
+POLICIES = ("block", "drop", "sample")
+
+
+@dataclass
+class LogStats:
+    """Counters of a :class:`LogPipeline`.
+
+    Attributes:
+        lines: Lines submitted.
+        emitted: Lines passed to the sinks.
+        dropped: Lines dropped because the queue was full.
+        stalls: Times a reader waited for space in the queue.
+        stall_seconds: Total time readers waited.
+    """
+
+    lines: int = 0
+    emitted: int = 0
+    dropped: int = 0
+    stalls: int = 0
+    stall_seconds: float = 0.0
+
+
+class LogPipeline:
+    """Emit log lines from a dedicated thread through a bounded queue.
+
+    Args:
+        maxsize: Maximum number of lines waiting to be emitted.
+        policy: What to do with a line when the queue is full. ``"block"``
+            waits for space, ``"drop"`` drops the line and ``"sample"`` keeps
+            one line in *sample_every* and drops the others. Warnings and
+            errors are never dropped.
+        sample_every: Lines kept under pressure with the ``"sample"`` policy.
+
+    Raises:
+        ValueError: If *policy* is unknown.
+    """
+
+    def __init__(
+        self, maxsize: int = 10_000, policy: str = "sample", sample_every: int = 10
+    ) -> None:
+        if policy not in POLICIES:
+            msg = f"Unknown policy {policy!r}. Choose from {', '.join(POLICIES)}"
+            raise ValueError(msg)
+        self.maxsize = maxsize
+        self.policy = policy
+        self.sample_every = sample_every
+        self._queue: queue.Queue = queue.Queue(maxsize)
+        self._stats = LogStats()
+        self._unreported_drops = 0
+        self._lock = threading.Lock()
+        self._thread: threading.Thread | None = None
+
+    def _start(self) -> None:
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(
+                    target=self._emit, name="log-emitter", daemon=True
+                )
+                self._thread.start()
+
+    def submit(
+        self,
+        log: Callable[[str], object],
+        message: str,
+        important: bool = False,
+        context: contextvars.Context | None = None,
+    ) -> None:
+        """Queue *message* to be passed to *log*, e.g. ``tool_logger.info``.
+
+        *log* is called in *context*, so that the variables set with
+        :meth:`loguru.Logger.contextualize` are kept.
+
+        Args:
+            log: Logging method called from the emitter thread.
+            message: Message to log.
+            important: Whether the line is a warning or an error, which are
+                never dropped.
+            context: Context to call *log* in. A copy of the current context
+                if ``None``. Readers submitting many lines from the same
+                context pass a single copy, which is cheaper.
+        """
+        if self._thread is None:
+            self._start()
+        with self._lock:
+            self._stats.lines += 1
+        if context is None:
+            context = contextvars.copy_context()
+        item = (log, message, context)
+        try:
+            self._queue.put_nowait(item)
+            return
+        except queue.Full:
+            pass
+
+        with self._lock:
+            keep = important or self.policy == "block"
+            if not keep and self.policy == "sample":
+                keep = self._stats.lines % self.sample_every == 0
+            if not keep:
+                self._stats.dropped += 1
+                self._unreported_drops += 1
+                return
+            self._stats.stalls += 1
+        start = time.perf_counter()
+        self._queue.put(item)
+        with self._lock:
+            self._stats.stall_seconds += time.perf_counter() - start
+
+    def flush(self) -> None:
+        """Wait until the lines submitted so far have been emitted."""
+        if self._thread is None:
+            return
+        self._start()
+        done = threading.Event()
+        self._queue.put((None, done, None))
+        done.wait()
+
+    def stats(self) -> LogStats:
+        """Return a copy of the counters."""
+        with self._lock:
+            return LogStats(**asdict(self._stats))
+
+    def _report_drops(self) -> None:
+        with self._lock:
+            dropped, self._unreported_drops = self._unreported_drops, 0
+        if dropped:
+            logger.bind(executable="niftyregw").warning(
+                f"{dropped} output line(s) dropped because logging was too slow"
+            )
+
+    def _emit(self) -> None:
+        while True:
+            log, message, context = self._queue.get()
+            self._report_drops()
+            if log is None:
+                message.set()
+                continue
+            try:
+                context.run(log, message)
+            except Exception:  # noqa: BLE001
+                # The emitter must keep running for the other lines
+                logger.bind(executable="niftyregw").opt(exception=True).error(
+                    "Could not log an output line"
+                )
+                continue
+            with self._lock:
+                self._stats.emitted += 1
+
+
+_pipeline = LogPipeline()
+
+
+def get_log_pipeline() -> LogPipeline:
+    """Return the pipeline used by :func:`niftyregw.wrapper.run`."""
+    return _pipeline
+
+
+def configure_log_pipeline(
+    maxsize: int = 10_000, policy: str = "sample", sample_every: int = 10
+) -> LogPipeline:
+    """Replace the pipeline used by :func:`niftyregw.wrapper.run`.
+
+    Lines waiting in the previous pipeline are emitted first.
+    """
+    global _pipeline
+    pipeline = LogPipeline(maxsize, policy, sample_every)
+    _pipeline.flush()
+    _pipeline = pipeline
+    return pipeline
@@ -0,0 +1,327 @@
+"""Metrics of the NiftyReg runs in the Prometheus text format.
+
+:func:`niftyregw.wrapper.run` records every run in a process-wide
+:class:`MetricsRegistry`: invocations and failures, wall and CPU seconds,
+peak resident memory and block I/O, per binary. The job queue worker records
+the number of jobs per status, and the log pipeline its dropped lines and
+stalls. :class:`TextfileExporter` writes the metrics
+to a ``.prom`` file for the textfile collector of node_exporter, and
+:func:`serve_metrics` serves them over HTTP.
+"""
+
+from __future__ import annotations
+
+import os
+import sys
+import threading
+from bisect import bisect_left
+from collections.abc import Sequence
+from dataclasses import dataclass
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+
+from .logpipe import get_log_pipeline
+
+WALL_SECONDS_BUCKETS = (1, 5, 15, 30, 60, 120, 300, 600, 1800, 3600, 7200)
+CPU_SECONDS_BUCKETS = WALL_SECONDS_BUCKETS + (14400, 28800)
+PEAK_RSS_BUCKETS = tuple(2**n * 1024**2 for n in range(6, 16))  # 64 MiB to 32 GiB
+# Size of the blocks counted by getrusage
+_BLOCK_BYTES = 512
+
+
+@dataclass(frozen=True)
+class ResourceUsage:
+    """Resources used by a finished binary.
+
+    Attributes:
+        cpu_seconds: User and system CPU time.
+        peak_rss_bytes: Peak resident memory.
+        read_bytes: Bytes read from block devices.
+        written_bytes: Bytes written to block devices.
+    """
+
+    cpu_seconds: float
+    peak_rss_bytes: int
+    read_bytes: int
+    written_bytes: int
+
+    @classmethod
+    def from_rusage(cls, rusage) -> ResourceUsage:
+        """Convert the result of :func:`os.wait4` or :func:`resource.getrusage`."""
+        # Kilobytes on Linux, bytes on macOS
+        scale = 1 if sys.platform == "darwin" else 1024
+        return cls(
+            cpu_seconds=rusage.ru_utime + rusage.ru_stime,
+            peak_rss_bytes=rusage.ru_maxrss * scale,
+            read_bytes=rusage.ru_inblock * _BLOCK_BYTES,
+            written_bytes=rusage.ru_oublock * _BLOCK_BYTES,
+        )
+
+
+class _Histogram:
+    def __init__(self, buckets: Sequence[float]) -> None:
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.sum = 0.0
+
+    def observe(self, value: float) -> None:
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+
+    def lines(self, name: str, labels: str) -> list[str]:
+        lines = []
+        total = 0
+        for bound, count in zip((*self.buckets, "+Inf"), self.counts, strict=True):
+            total += count
+            lines.append(f'{name}_bucket{{{labels},le="{bound}"}} {total}')
+        lines.append(f"{name}_sum{{{labels}}} {self.sum:g}")
+        lines.append(f"{name}_count{{{labels}}} {total}")
+        return lines
+
+
+class _BinaryMetrics:
+    def __init__(self) -> None:
+        self.runs = 0
+        self.failures = 0
+        self.read_bytes = 0
+        self.written_bytes = 0
+        self.wall_seconds = _Histogram(WALL_SECONDS_BUCKETS)
+        self.cpu_seconds = _Histogram(CPU_SECONDS_BUCKETS)
+        self.peak_rss_bytes = _Histogram(PEAK_RSS_BUCKETS)
+
+
+# Name, type and help of the exported metrics
+_METRICS = {
+    "runs": ("niftyregw_runs_total", "counter", "Runs of the binary."),
+    "failures": (
+        "niftyregw_run_failures_total",
+        "counter",
+        "Runs of the binary with a nonzero exit code.",
+    ),
+    "wall_seconds": (
+        "niftyregw_run_wall_seconds",
+        "histogram",
+        "Wall time of the runs.",
+    ),
+    "cpu_seconds": (
+        "niftyregw_run_cpu_seconds",
+        "histogram",
+        "User and system CPU time of the runs.",
+    ),
+    "peak_rss_bytes": (
+        "niftyregw_run_peak_rss_bytes",
+        "histogram",
+        "Peak resident memory of the runs.",
+    ),
+    "read_bytes": (
+        "niftyregw_run_read_bytes_total",
+        "counter",
+        "Bytes read from block devices by the runs.",
+    ),
+    "written_bytes": (
+        "niftyregw_run_written_bytes_total",
+        "counter",
+        "Bytes written to block devices by the runs.",
+    ),
+}
+
+
+class MetricsRegistry:
+    """Counters and histograms of the runs of every binary."""
+
+    def __init__(self) -> None:
+        self._binaries: dict[str, _BinaryMetrics] = {}
+        self._queue_jobs: dict[str, int] = {}
+        self._lock = threading.Lock()
+
+    def record_run(
+        self,
+        binary: str,
+        returncode: int,
+        wall_seconds: float,
+        usage: ResourceUsage | None = None,
+    ) -> None:
+        """Record a finished run of *binary*.
+
+        Args:
+            binary: Binary name, e.g. ``"reg_f3d"``.
+            returncode: Exit code.
+            wall_seconds: Wall time of the run.
+            usage: Resources used, if known.
+        """
+        with self._lock:
+            metrics = self._binaries.setdefault(binary, _BinaryMetrics())
+            metrics.runs += 1
+            metrics.failures += returncode != 0
+            metrics.wall_seconds.observe(wall_seconds)
+            if usage is not None:
+                metrics.cpu_seconds.observe(usage.cpu_seconds)
+                metrics.peak_rss_bytes.observe(usage.peak_rss_bytes)
+                metrics.read_bytes += usage.read_bytes
+                metrics.written_bytes += usage.written_bytes
+
+    def set_queue_jobs(self, counts: dict[str, int]) -> None:
+        """Set the number of jobs per status in the job queue."""
+        with self._lock:
+            self._queue_jobs = dict(counts)
+
+    def render(self) -> str:
+        """Return the metrics in the Prometheus text exposition format."""
+        lines = []
+        with self._lock:
+            for attribute, (name, kind, description) in _METRICS.items():
+                lines += [f"# HELP {name} {description}", f"# TYPE {name} {kind}"]
+                for binary, metrics in sorted(self._binaries.items()):
+                    labels = f'binary="{binary}"'
+                    value = getattr(metrics, attribute)
+                    if kind == "histogram":
+                        lines += value.lines(name, labels)
+                    else:
+                        lines.append(f"{name}{{{labels}}} {value}")
+            if self._queue_jobs:
+                name = "niftyregw_queue_jobs"
+                lines += [
+                    f"# HELP {name} Jobs in the queue per status.",
+                    f"# TYPE {name} gauge",
+                ]
+                lines += [
+                    f'{name}{{status="{status}"}} {count}'
+                    for status, count in sorted(self._queue_jobs.items())
+                ]
+        stats = get_log_pipeline().stats()
+        for name, description, value in (
+            (
+                "niftyregw_log_lines_dropped_total",
+                "Output lines dropped because logging was too slow.",
+                stats.dropped,
+            ),
+            (
+                "niftyregw_log_stalls_total",
+                "Times a pipe reader waited because logging was too slow.",
+                stats.stalls,
+            ),
+            (
+                "niftyregw_log_stall_seconds_total",
+                "Time pipe readers waited because logging was too slow.",
+                f"{stats.stall_seconds:g}",
+            ),
+        ):
+            lines += [
+                f"# HELP {name} {description}",
+                f"# TYPE {name} counter",
+                f"{name} {value}",
+            ]
+        return "\n".join(lines) + "\n"
+
+
+_registry = MetricsRegistry()
+
+
+def get_metrics() -> MetricsRegistry:
+    """Return the registry used by :func:`niftyregw.wrapper.run`."""
+    return _registry
+
+
+def write_textfile(path: Path, registry: MetricsRegistry | None = None) -> Path:
+    """Write the metrics to *path* atomically, for the textfile collector."""
+    path = Path(path)
+    registry = get_metrics() if registry is None else registry
+    # node_exporter ignores files not ending in .prom, so it never reads this
+    tmp = path.with_name(f".{path.name}.{os.getpid()}.tmp")
+    tmp.write_text(registry.render())
+    os.replace(tmp, path)
+    return path
+
+
+class TextfileExporter:
+    """Write the metrics to a ``.prom`` file every *interval* seconds.
+
+    Used as a context manager, which writes the file a last time on exit.
+
+    Args:
+        path: Output file, in the directory of the textfile collector.
+        interval: Seconds between writes.
+        registry: Metrics to write. The registry of
+            :func:`niftyregw.wrapper.run` if ``None``.
+    """
+
+    def __init__(
+        self,
+        path: Path,
+        interval: float = 15.0,
+        registry: MetricsRegistry | None = None,
+    ) -> None:
+        self.path = Path(path)
+        self.interval = interval
+        self.registry = get_metrics() if registry is None else registry
+        self._stop = threading.Event()
+        self._thread: threading.Thread | None = None
+
+    def __enter__(self) -> TextfileExporter:
+        self.start()
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.stop()
+
+    def start(self) -> None:
+        """Write the file now and then every *interval* seconds."""
+        write_textfile(self.path, self.registry)
+        self._stop.clear()
+        self._thread = threading.Thread(
+            target=self._loop, name="metrics-exporter", daemon=True
+        )
+        self._thread.start()
+
+    def stop(self) -> None:
+        """Stop the writes and write the file a last time."""
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        write_textfile(self.path, self.registry)
+
+    def _loop(self) -> None:
+        while not self._stop.wait(self.interval):
+            write_textfile(self.path, self.registry)
+
+
+def serve_metrics(
+    port: int = 0, host: str = "127.0.0.1", registry: MetricsRegistry | None = None
+) -> ThreadingHTTPServer:
+    """Serve the metrics at ``/metrics`` from a background thread.
+
+    Args:
+        port: Port to listen on. A free port is chosen if 0, see
+            ``server.server_address``.
+        host: Address to listen on.
+        registry: Metrics to serve. The registry of
+            :func:`niftyregw.wrapper.run` if ``None``.
+
+    Returns:
+        The server. Call ``shutdown()`` to stop it.
+    """
+    registry = get_metrics() if registry is None else registry
+
+    class _Handler(BaseHTTPRequestHandler):
+        def do_GET(self) -> None:  # noqa: N802 - name required by http.server
+            if self.path.split("?")[0] != "/metrics":
+                self.send_error(404)
+                return
+            body = registry.render().encode()
+            self.send_response(200)
+            self.send_header("Content-Type", "text/plain; version=0.0.4")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format: str, *args) -> None:  # noqa: A002
+            # Requests are not logged
+            pass
+
+    server = ThreadingHTTPServer((host, port), _Handler)
+    thread = threading.Thread(
+        target=server.serve_forever, name="metrics-server", daemon=True
+    )
+    thread.start()
+    return server
@@ -0,0 +1,168 @@
+"""Register every pair of images, running one direction per pair."""
+
+from __future__ import annotations
+
+import json
+import os
+import threading
+from collections.abc import Mapping, Sequence
+from concurrent.futures import ThreadPoolExecutor
+from contextvars import copy_context
+from pathlib import Path
+from typing import Any
+
+import numpy as np
+from loguru import logger
+
+from .chain import invert_affine
+from .fanout import subject_name, threads_per_worker
+from .wrapper import reg_aladin
+
+DEFAULT_TEMPLATE = "{floating}_to_{reference}_affine.txt"
+
+
+def pair_order(count: int) -> list[tuple[int, int]]:
+    """Return the pairs ``(i, j)`` with ``i < j`` in an image-sharing order.
+
+    Rows are traversed in alternating directions, so that consecutive jobs
+    share an image and its file is likely to still be in the page cache:
+    ``(0, 1), (0, 2), (0, 3), (1, 3), (1, 2), (2, 3)``.
+    """
+    pairs = []
+    for i in range(count - 1):
+        columns = range(i + 1, count)
+        pairs.extend((i, j) for j in (columns if i % 2 == 0 else reversed(columns)))
+    return pairs
+
+
+class CompletionMatrix:
+    """Which directed registrations between *images* are done, saved as JSON.
+
+    Args:
+        images: Image paths, in matrix order.
+        path: Checkpoint file. Loaded if it exists and saved on every update.
+            Nothing is saved if ``None``.
+    """
+
+    def __init__(self, images: Sequence[Path], path: Path | None = None) -> None:
+        self.images = [Path(image) for image in images]
+        self.path = None if path is None else Path(path)
+        self.done = np.eye(len(self.images), dtype=bool)
+        self._lock = threading.Lock()
+        if self.path is not None and self.path.exists():
+            self._load()
+
+    def _load(self) -> None:
+        assert self.path is not None
+        data = json.loads(self.path.read_text())
+        if data["images"] != [str(image) for image in self.images]:
+            msg = f"Checkpoint {self.path} was written for a different image list"
+            raise ValueError(msg)
+        self.done = np.asarray(data["done"], dtype=bool)
+
+    def mark(self, i: int, j: int) -> None:
+        """Mark the registrations ``i -> j`` and ``j -> i`` as done and save."""
+        with self._lock:
+            self.done[i, j] = self.done[j, i] = True
+            if self.path is None:
+                return
+            data = {
+                "images": [str(image) for image in self.images],
+                "done": self.done.astype(int).tolist(),
+            }
+            # Written atomically, so that an interrupted run keeps the last one
+            tmp_path = self.path.with_name(f"{self.path.name}.tmp")
+            tmp_path.write_text(json.dumps(data))
+            os.replace(tmp_path, self.path)
+
+    @property
+    def complete(self) -> bool:
+        """Whether all registrations are done."""
+        return bool(self.done.all())
+
+
+def register_all_pairs(
+    images: Sequence[Path],
+    output_dir: Path,
+    *,
+    template: str = DEFAULT_TEMPLATE,
+    checkpoint: Path | None = None,
+    max_workers: int = 1,
+    total_threads: int | None = None,
+    aladin_options: Mapping[str, Any] | None = None,
+) -> CompletionMatrix:
+    """Compute the affines between every pair of *images*.
+
+    ``reg_aladin`` is symmetric by default, so it runs once per unordered pair
+    and the opposite direction is its inverse, computed in NumPy. That is
+    ``N (N - 1) / 2`` registrations instead of ``N (N - 1)``. Jobs are
+    submitted in :func:`pair_order`, and completed pairs are skipped when the
+    *checkpoint* of a previous run exists. A failed pair is logged and left
+    undone.
+
+    Args:
+        images: Image paths.
+        output_dir: Directory the output template is relative to.
+        template: Affine filename template, formatted with ``reference`` and
+            ``floating`` (filenames without suffix).
+        checkpoint: Completion matrix file, saved after every pair.
+        max_workers: Number of concurrent ``reg_aladin`` processes.
+        total_threads: OpenMP threads shared by the workers. All CPUs if
+            ``None``.
+        aladin_options: Other :func:`niftyregw.wrapper.reg_aladin` arguments.
+
+    Returns:
+        The completion matrix. ``done[i, j]`` is whether the affine with
+        reference ``images[i]`` and floating ``images[j]`` was written.
+    """
+    aladin_options = {
+        "omp_threads": threads_per_worker(total_threads, max_workers),
+        **(aladin_options or {}),
+    }
+    if aladin_options.get("no_symmetric"):
+        raise ValueError("Pairwise reuse requires the symmetric reg_aladin")
+    names = [subject_name(image) for image in images]
+    if len(set(names)) != len(names):
+        raise ValueError("Image filenames must be unique without their suffix")
+    output_dir = Path(output_dir)
+    output_dir.mkdir(parents=True, exist_ok=True)
+
+    def _affine(i: int, j: int) -> Path:
+        return output_dir / template.format(reference=names[i], floating=names[j])
+
+    matrix = CompletionMatrix(images, checkpoint)
+    niftyregw_logger = logger.bind(executable="niftyregw")
+
+    def _register(i: int, j: int) -> None:
+        forward, backward = _affine(i, j), _affine(j, i)
+        try:
+            returncode = reg_aladin(
+                images[i], images[j], output_affine=forward, **aladin_options
+            )
+            if returncode != 0:
+                niftyregw_logger.error(
+                    f"reg_aladin exited with code {returncode} for"
+                    f" {names[j]} to {names[i]}"
+                )
+                return
+            invert_affine(forward, backward)
+        except Exception as e:  # noqa: BLE001 - one pair must not stop the others
+            niftyregw_logger.error(f"Registration of {names[j]} to {names[i]}: {e}")
+            return
+        matrix.mark(i, j)
+
+    pairs = [
+        (i, j)
+        for i, j in pair_order(len(images))
+        if not (matrix.done[i, j] and _affine(i, j).exists() and _affine(j, i).exists())
+    ]
+    niftyregw_logger.info(
+        f"Registering {len(pairs)} pairs of {len(images)} images"
+        f" ({len(pair_order(len(images))) - len(pairs)} already done)"
+    )
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        for future in [
+            executor.submit(copy_context().run, _register, i, j) for i, j in pairs
+        ]:
+            future.result()
+    return matrix
@@ -0,0 +1,246 @@
+"""Cache of image pyramids shared across registrations."""
+
+from __future__ import annotations
+
+import os
+import re
+import shutil
+import tempfile
+import threading
+from pathlib import Path
+from typing import Any
+
+from loguru import logger
+
+from .cache import file_hash
+from .resample import resample_image
+from .tools import ToolsChain
+from .wrapper import RunError, reg_aladin
+
+# Names of the cached levels, e.g. "<32 hex digits>_s2_mask_l1.nii"
+_LEVEL_NAME = re.compile(r"[0-9a-f]{32}(?:_s[^_]+)?(?:_mask)?_l\d+\.nii")
+
+
+class PyramidCache:
+    """Smoothed and downsampled versions of images, computed once per content.
+
+    Levels are numbered as in NiftyReg: level 0 is the full-resolution image
+    and each level is downsampled 2 times from the previous one with
+    ``reg_tools -down``. Images are keyed by the SHA-256 of their contents, so
+    the same reference is processed once however many registrations use it,
+    and files are written atomically so that several processes can share a
+    cache directory.
+
+    Note that ``reg_tools -down`` downsamples every axis, while the internal
+    pyramids of NiftyReg keep axes of fewer than 32 voxels.
+
+    Args:
+        directory: Directory for the cached images. A temporary directory,
+            removed on :meth:`close`, is used if ``None``.
+        omp_threads: Number of OpenMP threads for ``reg_tools``.
+    """
+
+    def __init__(
+        self, directory: Path | None = None, *, omp_threads: int | None = None
+    ) -> None:
+        self._tmp_dir = None
+        if directory is None:
+            self._tmp_dir = tempfile.TemporaryDirectory(prefix="niftyregw-pyramid-")
+            directory = Path(self._tmp_dir.name)
+        self.directory = Path(directory)
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self.omp_threads = omp_threads
+        self.hits = 0
+        self.misses = 0
+
+        self._lock = threading.Lock()
+        self._key_locks: dict[str, threading.Lock] = {}
+        self._hashes: dict[tuple[Path, int, int], str] = {}
+
+    def __enter__(self) -> PyramidCache:
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.close()
+
+    def close(self) -> None:
+        """Remove the cache directory if it is temporary."""
+        if self._tmp_dir is not None:
+            self._tmp_dir.cleanup()
+            self._tmp_dir = None
+
+    def _content_hash(self, path: Path) -> str:
+        stat = path.stat()
+        stat_key = (path.resolve(), stat.st_size, stat.st_mtime_ns)
+        with self._lock:
+            cached = self._hashes.get(stat_key)
+        if cached is None:
+            cached = file_hash(path)[:32]
+            with self._lock:
+                self._hashes[stat_key] = cached
+        return cached
+
+    def _get(self, name: str, chain: ToolsChain, source: Path) -> Path:
+        path = self.directory / name
+        with self._lock:
+            key_lock = self._key_locks.setdefault(name, threading.Lock())
+        with key_lock:
+            if path.exists():
+                with self._lock:
+                    self.hits += 1
+                return path
+            with self._lock:
+                self.misses += 1
+            logger.bind(executable="niftyregw").debug(f"Caching {path} from {source}")
+            with tempfile.TemporaryDirectory(dir=self.directory) as tmp_dir:
+                tmp_path = chain.apply(
+                    source, Path(tmp_dir) / name, omp_threads=self.omp_threads
+                )
+                os.replace(tmp_path, path)
+        return path
+
+    def smoothed(self, image: Path, sigma: float) -> Path:
+        """Return *image* smoothed with a Gaussian kernel (mm, voxels if < 0)."""
+        image = Path(image)
+        name = f"{self._content_hash(image)}_s{sigma:g}_l0.nii"
+        chain = ToolsChain().smooth_gaussian((sigma, sigma, sigma))
+        return self._get(name, chain, image)
+
+    def level(
+        self,
+        image: Path,
+        level: int,
+        *,
+        smooth: float | None = None,
+        mask: bool = False,
+    ) -> Path:
+        """Return pyramid *level* of *image*, optionally smoothed first.
+
+        Args:
+            image: Image path.
+            level: Pyramid level. Level 0 is *image* itself, or its smoothed
+                version.
+            smooth: Gaussian kernel standard deviation applied to level 0.
+            mask: Threshold each downsampled level at 0.5 to keep masks
+                binary.
+        """
+        image = Path(image)
+        if level < 0:
+            msg = f"Pyramid level must be non-negative, got {level}"
+            raise ValueError(msg)
+        if level == 0:
+            return image if smooth is None else self.smoothed(image, smooth)
+        finer = self.level(image, level - 1, smooth=smooth, mask=mask)
+        suffix = "" if smooth is None else f"_s{smooth:g}"
+        chain = ToolsChain().downsample()
+        if mask:
+            suffix += "_mask"
+            chain.threshold(0.5)
+        name = f"{self._content_hash(image)}{suffix}_l{level}.nii"
+        return self._get(name, chain, finer)
+
+    def levels(
+        self,
+        image: Path,
+        num_levels: int,
+        *,
+        smooth: float | None = None,
+        mask: bool = False,
+    ) -> list[Path]:
+        """Return levels ``0`` to ``num_levels - 1`` of *image*, finest first."""
+        return [
+            self.level(image, i, smooth=smooth, mask=mask) for i in range(num_levels)
+        ]
+
+    def clear(self) -> None:
+        """Remove all cached images, leaving other files in the directory."""
+        with self._lock:
+            for path in self.directory.glob("*.nii"):
+                if _LEVEL_NAME.fullmatch(path.name):
+                    path.unlink(missing_ok=True)
+            self._key_locks.clear()
+
+
+def reg_aladin_pyramid(
+    reference: Path,
+    floating: Path,
+    *,
+    cache: PyramidCache,
+    num_levels: int = 3,
+    num_levels_to_perform: int | None = None,
+    output_affine: Path | None = None,
+    output_result: Path | None = None,
+    input_affine: Path | None = None,
+    **kwargs: Any,
+) -> Path:
+    """Run reg_aladin coarse to fine on cached pyramid levels.
+
+    Each level runs as a single-level ``reg_aladin`` on the cached
+    downsampled images, initialised with the affine of the previous level.
+    As with ``-lp``, only the *num_levels_to_perform* coarsest levels run.
+
+    Args:
+        reference: Reference image path.
+        floating: Floating image path.
+        cache: Pyramid cache.
+        num_levels: Number of pyramid levels.
+        num_levels_to_perform: Number of levels to run. All if ``None``.
+        output_affine: Output affine filename.
+        output_result: Resampled image filename. At least one of the outputs
+            is required.
+        input_affine: Affine initialising the coarsest level.
+        **kwargs: Other :func:`niftyregw.wrapper.reg_aladin` arguments.
+
+    Returns:
+        The output affine path, or *output_result* if no affine was requested.
+
+    Raises:
+        RunError: If a level fails, before the next level starts.
+    """
+    if output_affine is None and output_result is None:
+        raise ValueError("output_affine or output_result is required")
+    perform = num_levels if num_levels_to_perform is None else num_levels_to_perform
+    if not 0 < perform <= num_levels:
+        msg = f"num_levels_to_perform must be between 1 and {num_levels}, got {perform}"
+        raise ValueError(msg)
+    smooth_reference = kwargs.pop("smooth_reference", None)
+    smooth_floating = kwargs.pop("smooth_floating", None)
+    references = cache.levels(reference, num_levels, smooth=smooth_reference)
+    floatings = cache.levels(floating, num_levels, smooth=smooth_floating)
+    masks = {}
+    for name in ("reference_mask", "floating_mask"):
+        if kwargs.get(name) is not None:
+            masks[name] = cache.levels(kwargs.pop(name), num_levels, mask=True)
+        kwargs.pop(name, None)
+
+    with tempfile.TemporaryDirectory(prefix="niftyregw-") as tmp_dir:
+        affine = input_affine
+        for level in range(num_levels - 1, num_levels - 1 - perform, -1):
+            level_affine = Path(tmp_dir) / f"affine_level_{level}.txt"
+            returncode = reg_aladin(
+                references[level],
+                floatings[level],
+                output_affine=level_affine,
+                input_affine=affine,
+                num_levels=1,
+                **{name: paths[level] for name, paths in masks.items()},
+                **kwargs,
+            )
+            if returncode != 0:
+                raise RunError("reg_aladin", returncode)
+            affine = level_affine
+        assert affine is not None
+        if output_result is not None:
+            resample_image(
+                reference,
+                floating,
+                output_result,
+                affine,
+                interpolation=kwargs.get("interpolation"),
+                padding=kwargs.get("padding"),
+                omp_threads=kwargs.get("omp_threads"),
+            )
+        if output_affine is None:
+            return Path(output_result)
+        shutil.copyfile(affine, output_affine)
+    return Path(output_affine)
@@ -0,0 +1,219 @@
+"""Resample several floating images through a single transformation."""
+
+from __future__ import annotations
+
+import tempfile
+from collections.abc import Sequence
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from pathlib import Path
+from typing import TYPE_CHECKING
+
+from loguru import logger
+
+from .wrapper import RunError, run
+
+if TYPE_CHECKING:
+    from .cache import DeformationCache
+
+# Suffixes of the image files read by NiftyReg
+NIFTI_SUFFIXES = (".nii", ".nii.gz", ".hdr", ".img", ".img.gz")
+
+
+@dataclass(frozen=True)
+class ResampleInput:
+    """A floating image to resample, with its own output and interpolation.
+
+    Args:
+        floating: Floating image path.
+        output: Resampled image path.
+        interpolation: Interpolation order (0=NN, 1=LIN, 3=CUB, 4=SINC).
+            Uses the ``reg_resample`` default if ``None``.
+    """
+
+    floating: Path
+    output: Path
+    interpolation: int | None = None
+
+
+def is_nifti(path: Path) -> bool:
+    """Return whether *path* looks like a NIfTI/Analyze image filename."""
+    name = str(path).lower()
+    return name.endswith(NIFTI_SUFFIXES)
+
+
+def read_batch_file(
+    path: Path, default_interpolation: int | None = None
+) -> list[ResampleInput]:
+    """Parse a batch file with one ``floating output [interpolation]`` per line.
+
+    Empty lines and lines starting with ``#`` are ignored.
+
+    Args:
+        path: Batch file path.
+        default_interpolation: Interpolation order for lines that omit it.
+
+    Returns:
+        The parsed inputs, in file order.
+    """
+    inputs = []
+    for number, raw_line in enumerate(Path(path).read_text().splitlines(), start=1):
+        line = raw_line.strip()
+        if not line or line.startswith("#"):
+            continue
+        parts = line.split()
+        if len(parts) not in (2, 3):
+            msg = (
+                f"{path}:{number}: expected 'floating output [interpolation]',"
+                f" got {raw_line!r}"
+            )
+            raise ValueError(msg)
+        interpolation = int(parts[2]) if len(parts) == 3 else default_interpolation
+        inputs.append(ResampleInput(Path(parts[0]), Path(parts[1]), interpolation))
+    return inputs
+
+
+def compute_deformation(
+    transformation: Path,
+    reference: Path,
+    output: Path,
+    *,
+    omp_threads: int | None = None,
+) -> Path:
+    """Compute the dense deformation field of *transformation* with reg_transform.
+
+    Args:
+        transformation: Input transformation (affine, CPP, or field).
+        reference: Reference image defining the field's grid.
+        output: Output deformation field filename.
+        omp_threads: Number of OpenMP threads.
+
+    Returns:
+        The output path.
+
+    Raises:
+        RunError: If reg_transform fails.
+    """
+    args = ["-ref", str(reference), "-def", str(transformation), str(output)]
+    if omp_threads is not None:
+        args.extend(["-omp", str(omp_threads)])
+    returncode = run(
+        "reg_transform", *args, tool_logger=logger.bind(executable="reg_transform")
+    )
+    if returncode != 0:
+        raise RunError("reg_transform", returncode)
+    return output
+
+
+def resample_image(
+    reference: Path,
+    floating: Path,
+    output: Path,
+    transformation: Path | None = None,
+    *,
+    interpolation: int | None = None,
+    padding: float | None = None,
+    omp_threads: int | None = None,
+) -> Path:
+    """Resample a single floating image with reg_resample.
+
+    Args:
+        reference: Reference image defining the output grid.
+        floating: Floating image to resample.
+        output: Resampled image filename.
+        transformation: Transformation file. Identity if ``None``.
+        interpolation: Interpolation order (0=NN, 1=LIN, 3=CUB, 4=SINC).
+        padding: Interpolation padding value.
+        omp_threads: Number of OpenMP threads.
+
+    Returns:
+        The output path.
+
+    Raises:
+        RunError: If reg_resample fails.
+    """
+    args = ["-ref", str(reference), "-flo", str(floating)]
+    if transformation is not None:
+        args.extend(["-trans", str(transformation)])
+    args.extend(["-res", str(output)])
+    if interpolation is not None:
+        args.extend(["-inter", str(interpolation)])
+    if padding is not None:
+        args.extend(["-pad", str(padding)])
+    if omp_threads is not None:
+        args.extend(["-omp", str(omp_threads)])
+    returncode = run(
+        "reg_resample", *args, tool_logger=logger.bind(executable="reg_resample")
+    )
+    if returncode != 0:
+        raise RunError("reg_resample", returncode)
+    return output
+
+
+def resample_many(
+    reference: Path,
+    inputs: Sequence[ResampleInput],
+    transformation: Path | None = None,
+    *,
+    padding: float | None = None,
+    scratch_dir: Path | None = None,
+    max_workers: int | None = None,
+    omp_threads: int | None = None,
+    cache: DeformationCache | None = None,
+) -> list[Path]:
+    """Resample many floating images through the same transformation.
+
+    Spline parametrisations (CPP images) are converted once into a dense
+    deformation field on scratch, so that ``reg_resample`` does not rebuild it
+    for every image. Affine transformations are passed through unchanged.
+
+    Args:
+        reference: Reference image defining the output grid.
+        inputs: Floating images with their outputs and interpolation orders.
+        transformation: Transformation shared by all inputs. Identity if
+            ``None``.
+        padding: Interpolation padding value.
+        scratch_dir: Directory for the intermediate deformation field. A
+            temporary directory, removed afterwards, is used if ``None``.
+        max_workers: Maximum number of concurrent ``reg_resample`` processes.
+        omp_threads: Number of OpenMP threads per process.
+        cache: Deformation field cache. If given, the field is taken from (or
+            added to) the cache instead of being computed on scratch.
+
+    Returns:
+        The resampled image paths, in the same order as *inputs*.
+
+    Raises:
+        RunError: If computing the field or resampling any image fails.
+    """
+    niftyregw_logger = logger.bind(executable="niftyregw")
+    with tempfile.TemporaryDirectory(prefix="niftyregw-") as tmp_dir:
+        scratch = Path(tmp_dir) if scratch_dir is None else Path(scratch_dir)
+        scratch.mkdir(parents=True, exist_ok=True)
+
+        field = transformation
+        if transformation is not None and cache is not None:
+            field = cache.resolve(transformation, reference)
+        elif transformation is not None and is_nifti(transformation):
+            field = scratch / "deformation.nii"
+            niftyregw_logger.debug(f"Computing deformation field into {field}")
+            compute_deformation(
+                transformation, reference, field, omp_threads=omp_threads
+            )
+
+        niftyregw_logger.debug(f"Resampling {len(inputs)} images")
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            futures = [
+                executor.submit(
+                    resample_image,
+                    reference,
+                    item.floating,
+                    item.output,
+                    field,
+                    interpolation=item.interpolation,
+                    padding=padding,
+                    omp_threads=omp_threads,
+                )
+                for item in inputs
+            ]
+            return [future.result() for future in futures]
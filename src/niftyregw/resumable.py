@@ -0,0 +1,236 @@
+"""Resumable reg_f3d runs checkpointing the control point grid of every level."""
+
+from __future__ import annotations
+
+import json
+import os
+from pathlib import Path
+from typing import TYPE_CHECKING, Any
+
+import nibabel as nib
+import numpy as np
+from loguru import logger
+
+from .cache import file_hash
+from .wrapper import reg_f3d
+
+if TYPE_CHECKING:
+    from .jacobian import FoldCheck
+
+MANIFEST_NAME = "checkpoint.json"
+# Default control point spacing of reg_f3d: 5 voxels
+_DEFAULT_SPACING = -5.0
+# Arguments that do not change the result
+_IGNORED_ARGUMENTS = ("verbose_off", "omp_threads", "on_line")
+
+
+def _refine_axis(data: np.ndarray, axis: int) -> np.ndarray:
+    points = np.moveaxis(data, axis, 0)
+    refined = np.empty((2 * len(points) - 3, *points.shape[1:]), np.float64)
+    refined[0::2] = (points[:-1] + points[1:]) / 2
+    refined[1::2] = (points[:-2] + 6 * points[1:-1] + points[2:]) / 8
+    return np.moveaxis(refined, 0, axis)
+
+
+def refine_control_point_grid(cpp: Path, output: Path) -> Path:
+    """Halve the spacing of a cubic B-spline control point grid.
+
+    The new grid describes the same transformation, as between pyramid levels
+    of ``reg_f3d``: its first control point is half a spacing before the
+    reference origin and every axis with at least 4 control points gets
+    ``2 * n - 3`` of them.
+
+    Args:
+        cpp: Control point grid written by ``reg_f3d``.
+        output: Refined control point grid filename.
+
+    Returns:
+        *output*.
+    """
+    image = nib.load(cpp)
+    data = np.asarray(image.dataobj, np.float64)
+    scale = np.eye(4)
+    for axis in range(3):
+        if data.ndim > axis and data.shape[axis] >= 4:
+            data = _refine_axis(data, axis)
+            scale[axis, axis] = scale[axis, 3] = 0.5
+    header = image.header.copy()
+    affine = image.affine @ scale
+    refined = nib.Nifti1Image(data.astype(image.get_data_dtype()), affine, header)
+    refined.set_qform(affine, int(header["qform_code"]))
+    refined.set_sform(affine, int(header["sform_code"]))
+    _save_atomic(refined, Path(output))
+    return Path(output)
+
+
+def _save_atomic(image: nib.Nifti1Image, path: Path) -> None:
+    tmp = path.with_name(f".{os.getpid()}.{path.name}")
+    nib.save(image, tmp)
+    os.replace(tmp, path)
+
+
+def _level_path(directory: Path, level: int, kind: str) -> Path:
+    return directory / f"level_{level}_{kind}.nii.gz"
+
+
+def _manifest(
+    reference: Path,
+    floating: Path,
+    input_affine: Path | None,
+    num_levels: int,
+    spacing: tuple[float, float, float],
+    kwargs: dict[str, Any],
+) -> dict[str, Any]:
+    arguments = {
+        name: str(value) if isinstance(value, Path) else value
+        for name, value in sorted(kwargs.items())
+        if name not in _IGNORED_ARGUMENTS and value not in (None, False)
+    }
+    return {
+        "reference": file_hash(reference),
+        "floating": file_hash(floating),
+        "input_affine": None if input_affine is None else file_hash(input_affine),
+        "num_levels": num_levels,
+        "spacing": list(spacing),
+        "arguments": arguments,
+    }
+
+
+def reg_f3d_resumable(
+    reference: Path,
+    floating: Path,
+    checkpoint_dir: Path,
+    *,
+    output_cpp: Path | None = None,
+    output_result: Path | None = None,
+    input_affine: Path | None = None,
+    num_levels: int | None = None,
+    num_levels_to_perform: int | None = None,
+    spacing_x: float | None = None,
+    spacing_y: float | None = None,
+    spacing_z: float | None = None,
+    fold_check: FoldCheck | None = None,
+    **kwargs: Any,
+) -> int:
+    """Run reg_f3d one pyramid level at a time, resuming after interruptions.
+
+    Level ``k`` of ``n`` runs ``reg_f3d -ln n-k+1 -lp 1``, i.e. only the
+    coarsest level of a shorter pyramid, which has the resolution of level
+    ``k`` of the full one. The first level starts from *input_affine* with the
+    final spacing multiplied by ``2**(p-1)``, where ``p`` is the number of
+    levels to perform, as ``reg_f3d -lp p`` does, so that the grid has the
+    final spacing once refined at every level. The grid of every level is saved
+    in *checkpoint_dir* and, refined with :func:`refine_control_point_grid`,
+    passed as ``-incpp`` to the next level. Running the function again with
+    the same directory starts after the last completed level.
+
+    Args:
+        reference: Reference image path.
+        floating: Floating image path.
+        checkpoint_dir: Directory for the grid and result of every level.
+        output_cpp: Output control point grid filename.
+        output_result: Resampled image filename.
+        input_affine: Input affine transformation (Affine*Reference=Floating).
+        num_levels: Number of pyramid levels. 3 if ``None``.
+        num_levels_to_perform: Number of levels to perform. All if ``None``.
+        spacing_x: Final control point spacing in x (mm, or voxels if
+            negative). 5 voxels if ``None``.
+        spacing_y: Final control point spacing in y. *spacing_x* if ``None``.
+        spacing_z: Final control point spacing in z. *spacing_x* if ``None``.
+        fold_check: Fold check of the last level.
+        **kwargs: Other keyword arguments of
+            :func:`~niftyregw.wrapper.reg_f3d`, used at every level.
+
+    Returns:
+        The exit code of the last reg_f3d run.
+
+    Raises:
+        ValueError: If *checkpoint_dir* was created for other inputs or
+            arguments.
+    """
+    reference = Path(reference)
+    floating = Path(floating)
+    checkpoint_dir = Path(checkpoint_dir)
+    if num_levels is None:
+        num_levels = 3
+    levels = num_levels if num_levels_to_perform is None else num_levels_to_perform
+    sx = _DEFAULT_SPACING if spacing_x is None else spacing_x
+    sy = sx if spacing_y is None else spacing_y
+    sz = sx if spacing_z is None else spacing_z
+
+    manifest = _manifest(
+        reference, floating, input_affine, num_levels, (sx, sy, sz), kwargs
+    )
+    manifest_path = checkpoint_dir / MANIFEST_NAME
+    checkpoint_dir.mkdir(parents=True, exist_ok=True)
+    if manifest_path.exists():
+        if json.loads(manifest_path.read_text()) != manifest:
+            msg = (
+                f"Checkpoint directory {checkpoint_dir} was created for other"
+                " inputs or arguments"
+            )
+            raise ValueError(msg)
+    else:
+        manifest_path.write_text(json.dumps(manifest, indent=2))
+
+    niftyregw_logger = logger.bind(executable="niftyregw")
+    completed = 0
+    while (
+        completed < levels
+        and _level_path(checkpoint_dir, completed + 1, "cpp").exists()
+    ):
+        completed += 1
+    if completed:
+        niftyregw_logger.info(
+            f"Levels 1 to {completed} of {levels} already completed in {checkpoint_dir}"
+        )
+
+    returncode = 0
+    for level in range(completed + 1, levels + 1):
+        cpp = _level_path(checkpoint_dir, level, "cpp")
+        result = _level_path(checkpoint_dir, level, "result")
+        partial_cpp = cpp.with_name(f"partial_{cpp.name}")
+        partial_result = result.with_name(f"partial_{result.name}")
+        level_kwargs: dict[str, Any] = dict(kwargs)
+        if level == 1:
+            # Halved by every refinement between the levels performed
+            factor = 2 ** (levels - 1)
+            level_kwargs.update(
+                input_affine=input_affine,
+                spacing_x=sx * factor,
+                spacing_y=sy * factor,
+                spacing_z=sz * factor,
+            )
+        else:
+            previous = _level_path(checkpoint_dir, level - 1, "cpp")
+            refined = _level_path(checkpoint_dir, level - 1, "refined_cpp")
+            level_kwargs["input_cpp"] = refine_control_point_grid(previous, refined)
+        if level == levels:
+            level_kwargs["fold_check"] = fold_check
+
+        niftyregw_logger.info(f"Running reg_f3d level {level}/{levels}")
+        returncode = reg_f3d(
+            reference,
+            floating,
+            output_cpp=partial_cpp,
+            output_result=partial_result,
+            num_levels=num_levels - level + 1,
+            num_levels_to_perform=1,
+            **level_kwargs,
+        )
+        if returncode != 0:
+            niftyregw_logger.error(
+                f"reg_f3d level {level}/{levels} failed with exit code {returncode}"
+            )
+            return returncode
+        # The grid marks the level as completed, so it is moved last
+        os.replace(partial_result, result)
+        os.replace(partial_cpp, cpp)
+
+    # Saved again in case the output format differs
+    if output_cpp is not None:
+        nib.save(nib.load(_level_path(checkpoint_dir, levels, "cpp")), output_cpp)
+    if output_result is not None:
+        result = _level_path(checkpoint_dir, levels, "result")
+        nib.save(nib.load(result), output_result)
+    return returncode
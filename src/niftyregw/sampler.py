@@ -0,0 +1,294 @@
+"""CPU and memory timelines of the NiftyReg binaries while they run.
+
+Inside :func:`sampling`, :func:`niftyregw.wrapper.run` starts a thread per
+binary that reads ``/proc/<pid>/stat`` and ``/proc/<pid>/status`` at a fixed
+interval. It records the CPU use (100% per busy core), the resident memory
+and the number of threads. The level and iteration printed by the binary are
+parsed from its output, so every sample belongs to a phase of the
+registration. A JSON timeline is saved per run, which shows the phases that
+leave cores idle with ``-omp``. Sampling needs Linux. Lines are not seen when
+the output goes to a file, so those runs have no progress events.
+"""
+
+from __future__ import annotations
+
+import json
+import os
+import re
+import threading
+import time
+from collections.abc import Callable, Iterator, Sequence
+from contextlib import contextmanager
+from dataclasses import asdict, dataclass, field
+from datetime import datetime
+from pathlib import Path
+from subprocess import Popen
+
+from loguru import logger
+
+_PROC = Path("/proc")
+# Lines printed by reg_aladin and reg_f3d
+LEVEL_PATTERN = re.compile(r"Current level:?\s*(\d+)\s*/\s*(\d+)", re.IGNORECASE)
+OBJECTIVE_PATTERN = re.compile(
+    r"objective function:?\s*([-+]?(?:\d+\.?\d*|\.\d+)(?:[eE][-+]?\d+)?)",
+    re.IGNORECASE,
+)
+# Iterations are numbered in brackets, e.g. "[NiftyReg F3D] [12] Current ..."
+ITERATION_PATTERN = re.compile(r"\]\s*\[(\d+)\]")
+
+
+@dataclass
+class Sample:
+    """Resources used by a binary at one time.
+
+    Attributes:
+        time: Seconds since the binary started.
+        cpu_percent: CPU use since the previous sample, 100 per busy core.
+        rss_bytes: Resident memory.
+        threads: Number of threads.
+        level: Level printed last, if any.
+        iteration: Iteration printed last, if any.
+    """
+
+    time: float
+    cpu_percent: float
+    rss_bytes: int
+    threads: int
+    level: int | None = None
+    iteration: int | None = None
+
+
+@dataclass
+class ProgressEvent:
+    """A level or iteration printed by a binary.
+
+    Attributes:
+        time: Seconds since the binary started.
+        level: Current level.
+        iteration: Current iteration in the level, if any.
+        line: Line the event was parsed from.
+    """
+
+    time: float
+    level: int | None
+    iteration: int | None
+    line: str
+
+
+@dataclass
+class RunTimeline:
+    """Samples and progress events of one run.
+
+    Attributes:
+        tool: Binary name.
+        args: Arguments of the binary.
+        pid: Process ID.
+        start: Start time, in seconds since the epoch.
+        interval: Seconds between samples.
+        returncode: Exit code, ``None`` while running.
+        samples: Resource samples, in order.
+        events: Progress events, in order.
+    """
+
+    tool: str
+    args: list[str]
+    pid: int | None = None
+    start: float = 0.0
+    interval: float = 0.1
+    returncode: int | None = None
+    samples: list[Sample] = field(default_factory=list)
+    events: list[ProgressEvent] = field(default_factory=list)
+
+    def cpu_by_level(self) -> dict[int | None, float]:
+        """Return the mean CPU use of the samples at each level."""
+        by_level: dict[int | None, list[float]] = {}
+        for sample in self.samples:
+            by_level.setdefault(sample.level, []).append(sample.cpu_percent)
+        return {level: sum(v) / len(v) for level, v in by_level.items()}
+
+    def save(self, path: Path) -> Path:
+        """Write the timeline to *path* as JSON."""
+        path = Path(path)
+        path.write_text(json.dumps(asdict(self), indent=1) + "\n")
+        return path
+
+    @classmethod
+    def load(cls, path: Path) -> RunTimeline:
+        """Read a timeline written by :meth:`save`."""
+        data = json.loads(Path(path).read_text())
+        data["samples"] = [Sample(**sample) for sample in data["samples"]]
+        data["events"] = [ProgressEvent(**event) for event in data["events"]]
+        return cls(**data)
+
+
+def read_proc(pid: int) -> tuple[float, int, int] | None:
+    """Return the CPU seconds, resident bytes and threads of *pid*.
+
+    Returns:
+        ``None`` if the process has exited or ``/proc`` is not available.
+    """
+    try:
+        stat = (_PROC / str(pid) / "stat").read_text()
+        status = (_PROC / str(pid) / "status").read_text()
+    except OSError:
+        return None
+    # The command name, in parentheses, may contain spaces
+    fields = stat[stat.rindex(")") + 2 :].split()
+    # utime and stime, fields 14 and 15 of proc(5)
+    cpu_seconds = (int(fields[11]) + int(fields[12])) / os.sysconf("SC_CLK_TCK")
+    values = {}
+    for line in status.splitlines():
+        name, _, value = line.partition(":")
+        values[name] = value.split()
+    if "VmRSS" not in values:
+        # A zombie, which has released its memory
+        return None
+    rss_bytes = int(values["VmRSS"][0]) * 1024
+    return cpu_seconds, rss_bytes, int(values["Threads"][0])
+
+
+class ProcessSampler:
+    """Sample one running binary and follow its progress.
+
+    Args:
+        tool: Binary name.
+        args: Arguments of the binary.
+        interval: Seconds between samples.
+    """
+
+    def __init__(self, tool: str, args: Sequence[str], interval: float = 0.1) -> None:
+        self.timeline = RunTimeline(tool, list(args), interval=interval)
+        self._start = time.perf_counter()
+        self._level: int | None = None
+        self._iteration: int | None = None
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread: threading.Thread | None = None
+
+    def observe(self, line: str) -> None:
+        """Record the level or iteration printed in *line*, if any."""
+        match = LEVEL_PATTERN.search(line)
+        if match is not None:
+            level, iteration = int(match.group(1)), None
+        else:
+            match = ITERATION_PATTERN.search(line)
+            if match is None:
+                return
+            level, iteration = self._level, int(match.group(1))
+        with self._lock:
+            self._level, self._iteration = level, iteration
+            self.timeline.events.append(
+                ProgressEvent(self._elapsed(), level, iteration, line)
+            )
+
+    def wrap(
+        self, on_line: Callable[[str], bool | None] | None
+    ) -> Callable[[str], bool | None]:
+        """Return a line callback that observes lines, then calls *on_line*."""
+
+        def _on_line(line: str) -> bool | None:
+            self.observe(line)
+            return None if on_line is None else on_line(line)
+
+        return _on_line
+
+    def start(self, process: Popen) -> None:
+        """Start sampling *process* from a background thread."""
+        self._start = time.perf_counter()
+        self.timeline.pid = process.pid
+        self.timeline.start = time.time()
+        self._thread = threading.Thread(
+            target=self._sample, args=(process.pid,), name="sampler", daemon=True
+        )
+        self._thread.start()
+
+    def stop(self, returncode: int) -> RunTimeline:
+        """Stop sampling and return the timeline."""
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+        self.timeline.returncode = returncode
+        return self.timeline
+
+    def _elapsed(self) -> float:
+        return time.perf_counter() - self._start
+
+    def _sample(self, pid: int) -> None:
+        previous = None
+        while True:
+            reading = read_proc(pid)
+            now = self._elapsed()
+            if reading is None:
+                return
+            cpu_seconds, rss_bytes, threads = reading
+            if previous is not None and now > previous[0]:
+                cpu = 100 * (cpu_seconds - previous[1]) / (now - previous[0])
+                with self._lock:
+                    level, iteration = self._level, self._iteration
+                self.timeline.samples.append(
+                    Sample(now, cpu, rss_bytes, threads, level, iteration)
+                )
+            previous = (now, cpu_seconds)
+            if self._stop.wait(self.timeline.interval):
+                return
+
+
+@dataclass
+class Sampling:
+    """Where and how often :func:`sampling` samples the binaries.
+
+    Attributes:
+        directory: Directory of the timelines.
+        interval: Seconds between samples.
+        timelines: Timelines saved so far.
+    """
+
+    directory: Path
+    interval: float = 0.1
+    timelines: list[Path] = field(default_factory=list)
+
+    def sampler(self, tool: str, args: Sequence[str]) -> ProcessSampler:
+        """Return a sampler for a run of *tool*."""
+        return ProcessSampler(tool, args, self.interval)
+
+    def save(self, timeline: RunTimeline) -> Path:
+        """Save *timeline* in :attr:`directory` and return its path.
+
+        The file is named after the tool, start time and process ID, so that a
+        reused process ID does not overwrite an earlier timeline.
+        """
+        self.directory.mkdir(parents=True, exist_ok=True)
+        start = datetime.fromtimestamp(timeline.start).strftime("%Y%m%d-%H%M%S-%f")
+        path = self.directory / f"{timeline.tool}_{start}_{timeline.pid}.json"
+        timeline.save(path)
+        self.timelines.append(path)
+        return path
+
+
+_sampling: Sampling | None = None
+
+
+def get_sampling() -> Sampling | None:
+    """Return the active sampling, or ``None`` if sampling is off."""
+    return _sampling
+
+
+@contextmanager
+def sampling(directory: Path, interval: float = 0.1) -> Iterator[Sampling]:
+    """Sample the binaries run inside the block and save their timelines.
+
+    Args:
+        directory: Directory of the timelines, one
+            ``<tool>_<start>_<pid>.json`` file per run.
+        interval: Seconds between samples.
+    """
+    global _sampling
+    if not _PROC.is_dir():
+        logger.bind(executable="niftyregw").warning(
+            "Sampling needs /proc, so only progress events are recorded"
+        )
+    previous, _sampling = _sampling, Sampling(Path(directory), interval)
+    try:
+        yield _sampling
+    finally:
+        _sampling = previous
@@ -0,0 +1,342 @@
+"""In-process similarity measures matching those of reg_measure.
+
+All measures are computed over the voxels that are inside the optional mask and
+finite in both images. The floating array may have an extra leading axis to
+evaluate a batch of floating images against the same reference at once.
+"""
+
+from __future__ import annotations
+
+from collections import deque
+from collections.abc import Iterable, Iterator, Sequence
+from concurrent.futures import Future, ThreadPoolExecutor
+from pathlib import Path
+
+import nibabel as nib
+import numpy as np
+from loguru import logger
+
+METRICS = ("ncc", "lncc", "nmi", "ssd")
+
+_NMI_BINS = 64
+_LNCC_SIGMA = 5.0
+_EPSILON = 1e-12
+# Cubic B-spline values at integer offsets, used as Parzen window for NMI
+_BSPLINE_KERNEL = np.array([1.0, 4.0, 1.0]) / 6.0
+
+
+def load_image(path: Path) -> np.ndarray:
+    """Load a 2D or 3D image as a float64 array."""
+    data = np.asarray(nib.load(path).dataobj, dtype=np.float64)
+    while data.ndim > 3 and data.shape[-1] == 1:
+        data = data[..., 0]
+    if data.ndim > 3:
+        msg = f"Only single-volume images are supported, {path} has shape {data.shape}"
+        raise ValueError(msg)
+    return data
+
+
+def _prepare(
+    reference: np.ndarray, floating: np.ndarray, mask: np.ndarray | None
+) -> tuple[np.ndarray, np.ndarray, np.ndarray, bool]:
+    """Return zero-filled arrays, their validity and whether it is a batch."""
+    reference = np.asarray(reference, dtype=np.float64)
+    floating = np.asarray(floating, dtype=np.float64)
+    batched = floating.ndim == reference.ndim + 1
+    if floating.shape[batched:] != reference.shape:
+        msg = (
+            f"Floating shape {floating.shape} does not match"
+            f" reference shape {reference.shape}"
+        )
+        raise ValueError(msg)
+    valid = np.isfinite(reference) & np.isfinite(floating)
+    if mask is not None:
+        valid &= np.asarray(mask, dtype=bool)
+    if not batched:
+        floating, valid = floating[None], valid[None]
+    reference = np.where(valid, reference, 0.0)
+    floating = np.where(valid, floating, 0.0)
+    return reference, floating, valid, batched
+
+
+def _result(values: np.ndarray, batched: bool) -> float | np.ndarray:
+    return values if batched else float(values[0])
+
+
+def _spatial_axes(valid: np.ndarray) -> tuple[int, ...]:
+    return tuple(range(1, valid.ndim))
+
+
+def ncc(
+    reference: np.ndarray, floating: np.ndarray, mask: np.ndarray | None = None
+) -> float | np.ndarray:
+    """Normalised cross-correlation (Pearson correlation coefficient)."""
+    ref, flo, valid, batched = _prepare(reference, floating, mask)
+    axes = _spatial_axes(valid)
+    count = np.maximum(valid.sum(axis=axes), 1)
+    mean_ref = ref.sum(axis=axes) / count
+    mean_flo = flo.sum(axis=axes) / count
+    cov = (ref * flo).sum(axis=axes) / count - mean_ref * mean_flo
+    var_ref = (ref * ref).sum(axis=axes) / count - mean_ref**2
+    var_flo = (flo * flo).sum(axis=axes) / count - mean_flo**2
+    denominator = np.sqrt(np.maximum(var_ref * var_flo, 0.0))
+    values = np.where(
+        denominator > _EPSILON, cov / np.maximum(denominator, _EPSILON), 0
+    )
+    return _result(values, batched)
+
+
+def ssd(
+    reference: np.ndarray, floating: np.ndarray, mask: np.ndarray | None = None
+) -> float | np.ndarray:
+    """Sum of squared differences, normalised by the number of voxels."""
+    ref, flo, valid, batched = _prepare(reference, floating, mask)
+    axes = _spatial_axes(valid)
+    count = np.maximum(valid.sum(axis=axes), 1)
+    values = ((ref - flo) ** 2).sum(axis=axes) / count
+    return _result(values, batched)
+
+
+def _bin_indices(data: np.ndarray, valid: np.ndarray, bins: int) -> np.ndarray:
+    """Rescale each image to [2, bins - 3] and return integer bin indices.
+
+    The margin leaves room for the Parzen window at both ends of the histogram.
+    """
+    axes = _spatial_axes(valid)
+    low = np.where(valid, data, np.inf).min(axis=axes, keepdims=True)
+    high = np.where(valid, data, -np.inf).max(axis=axes, keepdims=True)
+    span = np.where(high > low, high - low, 1.0)
+    low = np.where(np.isfinite(low), low, 0.0)
+    scaled = 2 + (data - low) / span * (bins - 5)
+    return np.clip(np.floor(scaled), 0, bins - 1).astype(np.intp)
+
+
+def _reference_bins(
+    reference: np.ndarray, mask: np.ndarray | None, bins: int
+) -> np.ndarray:
+    """Bin the reference over its own valid voxels, independently of floating."""
+    valid = np.isfinite(reference)
+    if mask is not None:
+        valid &= np.asarray(mask, dtype=bool)
+    data = np.where(valid, reference, 0.0)
+    return _bin_indices(data[None], valid[None], bins)
+
+
+def _nmi_from_bins(
+    ref_bins: np.ndarray, flo_bins: np.ndarray, valid: np.ndarray, bins: int
+) -> np.ndarray:
+    batch = valid.shape[0]
+    rows = np.arange(batch).reshape((batch,) + (1,) * (valid.ndim - 1))
+    joint_index = (rows * bins + ref_bins) * bins + flo_bins
+    joint = np.bincount(joint_index[valid], minlength=batch * bins * bins)
+    joint = joint.reshape(batch, bins, bins).astype(np.float64)
+    for axis in (1, 2):
+        joint = _convolve(joint, _BSPLINE_KERNEL, axis)
+    joint /= np.maximum(joint.sum(axis=(1, 2), keepdims=True), _EPSILON)
+
+    def _entropy(p: np.ndarray, axes: tuple[int, ...]) -> np.ndarray:
+        return -(p * np.log(np.where(p > 0, p, 1.0))).sum(axis=axes)
+
+    joint_entropy = _entropy(joint, (1, 2))
+    ref_entropy = _entropy(joint.sum(axis=2), (1,))
+    flo_entropy = _entropy(joint.sum(axis=1), (1,))
+    return (ref_entropy + flo_entropy) / np.maximum(joint_entropy, _EPSILON)
+
+
+def nmi(
+    reference: np.ndarray,
+    floating: np.ndarray,
+    mask: np.ndarray | None = None,
+    bins: int = _NMI_BINS,
+) -> float | np.ndarray:
+    """Normalised mutual information ``(H(R) + H(F)) / H(R, F)``.
+
+    Intensities are rescaled to the histogram range and the joint histogram is
+    smoothed with a cubic B-spline Parzen window, as in NiftyReg.
+    """
+    ref_bins = _reference_bins(np.asarray(reference, np.float64), mask, bins)
+    _, flo, valid, batched = _prepare(reference, floating, mask)
+    flo_bins = _bin_indices(flo, valid, bins)
+    ref_bins = np.broadcast_to(ref_bins, valid.shape)
+    return _result(_nmi_from_bins(ref_bins, flo_bins, valid, bins), batched)
+
+
+def _convolve(data: np.ndarray, kernel: np.ndarray, axis: int) -> np.ndarray:
+    """Convolve along *axis* with a symmetric kernel and zero padding."""
+    radius = len(kernel) // 2
+    pad = [(0, 0)] * data.ndim
+    pad[axis] = (radius, radius)
+    padded = np.pad(data, pad)
+    size = data.shape[axis]
+    result = np.zeros_like(data)
+    for offset, weight in enumerate(kernel):
+        result += weight * np.take(padded, range(offset, offset + size), axis=axis)
+    return result
+
+
+def _gaussian_kernel(sigma: float) -> np.ndarray:
+    radius = max(int(np.ceil(3 * sigma)), 1)
+    positions = np.arange(-radius, radius + 1)
+    kernel = np.exp(-(positions**2) / (2 * sigma**2))
+    return kernel / kernel.sum()
+
+
+def lncc(
+    reference: np.ndarray,
+    floating: np.ndarray,
+    mask: np.ndarray | None = None,
+    sigma: float = _LNCC_SIGMA,
+) -> float | np.ndarray:
+    """Local normalised cross-correlation with a Gaussian window.
+
+    Args:
+        reference: Reference image.
+        floating: Floating image, or a batch of them.
+        mask: Optional reference mask.
+        sigma: Standard deviation of the Gaussian window, in voxels.
+    """
+    ref, flo, valid, batched = _prepare(reference, floating, mask)
+    ref = np.broadcast_to(ref, valid.shape)
+    kernel = _gaussian_kernel(sigma)
+
+    def _smooth(data: np.ndarray) -> np.ndarray:
+        for axis in _spatial_axes(valid):
+            data = _convolve(data, kernel, axis)
+        return data
+
+    weights = _smooth(valid.astype(np.float64))
+    safe_weights = np.maximum(weights, _EPSILON)
+    mean_ref = _smooth(ref) / safe_weights
+    mean_flo = _smooth(flo) / safe_weights
+    var_ref = _smooth(ref * ref) / safe_weights - mean_ref**2
+    var_flo = _smooth(flo * flo) / safe_weights - mean_flo**2
+    cov = _smooth(ref * flo) / safe_weights - mean_ref * mean_flo
+
+    local_valid = valid & (var_ref > _EPSILON) & (var_flo > _EPSILON)
+    denominator = np.sqrt(np.where(local_valid, var_ref * var_flo, 1.0))
+    local = np.where(local_valid, cov / denominator, 0.0)
+    axes = _spatial_axes(valid)
+    count = np.maximum(local_valid.sum(axis=axes), 1)
+    return _result(local.sum(axis=axes) / count, batched)
+
+
+def measure_arrays(
+    reference: np.ndarray,
+    floating: np.ndarray,
+    metrics: Sequence[str] = METRICS,
+    mask: np.ndarray | None = None,
+) -> dict[str, float | np.ndarray]:
+    """Compute several measures between a reference and floating image(s)."""
+    functions = {"ncc": ncc, "lncc": lncc, "nmi": nmi, "ssd": ssd}
+    check_metrics(metrics)
+    return {name: functions[name](reference, floating, mask) for name in metrics}
+
+
+def check_metrics(metrics: Sequence[str]) -> None:
+    """Raise a ValueError if a name of *metrics* is not in :data:`METRICS`."""
+    unknown = sorted(set(metrics) - set(METRICS))
+    if unknown:
+        msg = f"Unknown metrics {unknown}. Choose from {list(METRICS)}"
+        raise ValueError(msg)
+
+
+def measure_many(
+    reference: Path,
+    floatings: Iterable[Path],
+    metrics: Sequence[str] = METRICS,
+    *,
+    mask: Path | None = None,
+    batch_size: int = 8,
+    max_workers: int | None = None,
+) -> Iterator[tuple[Path, dict[str, float]]]:
+    """Compare one reference image against many floating images.
+
+    The reference (and mask) are read and binned once. Floating images must be
+    defined on the reference grid, e.g. resampled with ``reg_resample``, and
+    are evaluated in stacked batches of *batch_size*. With *max_workers*,
+    batches are read and evaluated concurrently by a thread pool, and results
+    are still yielded in input order. A floating image that cannot be read or
+    is not on the reference grid is logged and gets NaN values, so that it
+    does not stop the others.
+
+    Args:
+        reference: Reference image path.
+        floatings: Floating image paths.
+        metrics: Names of the measures to compute, from :data:`METRICS`.
+        mask: Optional mask in the reference space.
+        batch_size: Number of floating images evaluated together.
+        max_workers: Number of worker threads. Batches are evaluated in the
+            calling thread if ``None``.
+
+    Yields:
+        Each floating path with a mapping from metric name to value, NaN if
+        the image could not be measured.
+    """
+    check_metrics(metrics)
+    ref = load_image(reference)
+    ref_mask = None if mask is None else load_image(mask) != 0
+    ref_bins = _reference_bins(ref, ref_mask, _NMI_BINS)
+    niftyregw_logger = logger.bind(executable="niftyregw")
+
+    def _load(path: Path) -> np.ndarray | None:
+        try:
+            data = load_image(path)
+            if data.shape != ref.shape:
+                msg = f"shape {data.shape} does not match reference shape {ref.shape}"
+                raise ValueError(msg)
+        except Exception as e:  # noqa: BLE001 - one image must not stop the others
+            niftyregw_logger.error(f"Cannot measure {path}: {e}")
+            return None
+        return data
+
+    def _evaluate(paths: list[Path]) -> list[tuple[Path, dict[str, float]]]:
+        images = [_load(path) for path in paths]
+        loaded = [data for data in images if data is not None]
+        failed = dict.fromkeys(metrics, float("nan"))
+        if not loaded:
+            return [(path, dict(failed)) for path in paths]
+        stacked = np.stack(loaded)
+        results: dict[str, np.ndarray] = {}
+        for name in metrics:
+            if name == "nmi":
+                _, flo, valid, _ = _prepare(ref, stacked, ref_mask)
+                flo_bins = _bin_indices(flo, valid, _NMI_BINS)
+                ref_batch = np.broadcast_to(ref_bins, valid.shape)
+                results[name] = _nmi_from_bins(ref_batch, flo_bins, valid, _NMI_BINS)
+            else:
+                results[name] = measure_arrays(ref, stacked, [name], ref_mask)[name]
+        rows = []
+        index = 0
+        for path, data in zip(paths, images, strict=True):
+            if data is None:
+                rows.append((path, dict(failed)))
+                continue
+            rows.append((path, {name: float(results[name][index]) for name in metrics}))
+            index += 1
+        return rows
+
+    if max_workers is None:
+        for batch in _batches(floatings, batch_size):
+            yield from _evaluate(batch)
+        return
+
+    # Bound the number of batches in flight so that memory stays constant
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        pending: deque[Future] = deque()
+        for batch in _batches(floatings, batch_size):
+            pending.append(executor.submit(_evaluate, batch))
+            if len(pending) >= 2 * max_workers:
+                yield from pending.popleft().result()
+        while pending:
+            yield from pending.popleft().result()
+
+
+def _batches(paths: Iterable[Path], batch_size: int) -> Iterator[list[Path]]:
+    batch: list[Path] = []
+    for path in paths:
+        batch.append(Path(path))
+        if len(batch) == batch_size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
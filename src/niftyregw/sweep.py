@@ -0,0 +1,367 @@
+"""Hyperparameter sweeps of reg_f3d with parallel trials and pruning."""
+
+from __future__ import annotations
+
+import itertools
+import math
+import random
+import shutil
+import statistics
+import threading
+import time
+from collections import deque
+from collections.abc import Iterable, Iterator, Mapping, Sequence
+from concurrent.futures import Future, ThreadPoolExecutor
+from contextvars import copy_context
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Any
+
+from loguru import logger
+
+from .fanout import threads_per_worker
+from .sampler import LEVEL_PATTERN, OBJECTIVE_PATTERN
+from .wrapper import reg_f3d
+
+# Measures for which lower values are better
+_LOWER_IS_BETTER = ("ssd",)
+
+
+@dataclass(frozen=True)
+class Uniform:
+    """Values sampled uniformly between *low* and *high* in random searches.
+
+    Integers are sampled if both bounds are integers. With *log*, values are
+    uniform in log scale, e.g. for weights spanning several decades.
+    """
+
+    low: float
+    high: float
+    log: bool = False
+
+    def sample(self, rng: random.Random) -> float:
+        """Return a random value."""
+        if isinstance(self.low, int) and isinstance(self.high, int) and not self.log:
+            return rng.randint(self.low, self.high)
+        if self.log:
+            return math.exp(rng.uniform(math.log(self.low), math.log(self.high)))
+        return rng.uniform(self.low, self.high)
+
+
+Space = Mapping[str, "Sequence[Any] | Uniform"]
+
+
+def grid_search(space: Space) -> list[dict[str, Any]]:
+    """Return every combination of the values in *space*."""
+    if any(isinstance(values, Uniform) for values in space.values()):
+        raise ValueError("Grid searches need lists of values, not ranges")
+    names = list(space)
+    return [
+        dict(zip(names, values))
+        for values in itertools.product(*(space[name] for name in names))
+    ]
+
+
+def random_search(space: Space, count: int, seed: int | None = None) -> list[dict]:
+    """Return *count* random combinations of the values in *space*."""
+    rng = random.Random(seed)
+    return [
+        {
+            name: values.sample(rng)
+            if isinstance(values, Uniform)
+            else rng.choice(list(values))
+            for name, values in space.items()
+        }
+        for _ in range(count)
+    ]
+
+
+def parse_parameter(text: str) -> tuple[str, Sequence[Any] | Uniform]:
+    """Parse ``name=v1,v2``, ``name=low:high`` or ``name=log:low:high``.
+
+    Raises:
+        ValueError: If *text* has none of these forms.
+    """
+    name, sep, values = text.partition("=")
+    name = name.strip().replace("-", "_")
+    if not sep or not name or not values.strip():
+        msg = (
+            "Expected 'name=v1,v2', 'name=low:high' or 'name=log:low:high',"
+            f" got {text!r}"
+        )
+        raise ValueError(msg)
+    if ":" not in values:
+        return name, [_number(value) for value in values.split(",")]
+    parts = values.split(":")
+    log = parts[0].strip().lower() == "log"
+    if log:
+        parts = parts[1:]
+    if len(parts) != 2:
+        msg = f"Expected 'name=low:high' or 'name=log:low:high', got {text!r}"
+        raise ValueError(msg)
+    return name, Uniform(_number(parts[0]), _number(parts[1]), log=log)
+
+
+def _number(text: str) -> int | float:
+    text = text.strip()
+    try:
+        return int(text)
+    except ValueError:
+        pass
+    try:
+        return float(text)
+    except ValueError:
+        msg = f"Expected a number, got {text!r}"
+        raise ValueError(msg) from None
+
+
+def _f3d_arguments(params: Mapping[str, Any]) -> dict[str, Any]:
+    """Expand ``spacing`` into ``spacing_x``, ``spacing_y`` and ``spacing_z``."""
+    arguments = dict(params)
+    if "spacing" in arguments:
+        spacing = arguments.pop("spacing")
+        for axis in "xyz":
+            arguments[f"spacing_{axis}"] = spacing
+    return arguments
+
+
+class MedianPruner:
+    """Prune trials whose objective at a level is below the median.
+
+    The objective of ``reg_f3d`` (similarity minus penalties) is maximised.
+    After *min_trials* trials have finished a level, a trial whose last
+    objective value at that level is below their median is pruned. The last
+    level is never pruned. Penalty weights and similarity measures change the
+    scale of the objective, so the comparison is only a heuristic when they
+    vary between trials.
+
+    Args:
+        min_trials: Number of values required at a level before pruning.
+    """
+
+    def __init__(self, min_trials: int = 3) -> None:
+        self.min_trials = min_trials
+        self._values: dict[int, list[float]] = {}
+        self._lock = threading.Lock()
+
+    def report(self, level: int, value: float) -> bool:
+        """Record *value* at *level* and return whether to prune the trial."""
+        with self._lock:
+            values = self._values.setdefault(level, [])
+            prune = len(values) >= self.min_trials and value < statistics.median(values)
+            values.append(value)
+        return prune
+
+
+class _ObjectiveParser:
+    """Follow the levels and objective values printed by reg_f3d."""
+
+    def __init__(self, pruner: MedianPruner | None) -> None:
+        self.pruner = pruner
+        self.objectives: dict[int, float] = {}
+        self.pruned_at: int | None = None
+        self._level = 0
+        self._lock = threading.Lock()
+
+    def __call__(self, line: str) -> bool:
+        with self._lock:
+            if self.pruned_at is not None:
+                return True
+            match = LEVEL_PATTERN.search(line)
+            if match is not None:
+                level = int(match.group(1))
+                # The previous level has finished
+                finished = self._level in self.objectives and level > self._level
+                if finished and self._report(self._level):
+                    return True
+                self._level = level
+                return False
+            match = OBJECTIVE_PATTERN.search(line)
+            if match is not None:
+                self.objectives[self._level] = float(match.group(1))
+            return False
+
+    def _report(self, level: int) -> bool:
+        if self.pruner is None:
+            return False
+        if self.pruner.report(level, self.objectives[level]):
+            self.pruned_at = level
+        return self.pruned_at is not None
+
+
+@dataclass
+class Trial:
+    """A reg_f3d run with one set of parameters.
+
+    Attributes:
+        number: Trial number, from 0.
+        params: reg_f3d parameters of the trial.
+        status: ``"complete"``, ``"pruned"``, ``"folded"`` (more folded
+            voxels than allowed) or ``"failed"``.
+        score: Similarity between the reference and the result, negated for
+            SSD so that higher is better. ``None`` unless complete.
+        similarity: Measures between the reference and the result.
+        folded: Number of voxels with a non-positive Jacobian determinant.
+        objectives: Last objective value printed at each level.
+        seconds: Wall time.
+        error: Error message of failed trials.
+    """
+
+    number: int
+    params: dict[str, Any]
+    status: str = "complete"
+    score: float | None = None
+    similarity: dict[str, float] = field(default_factory=dict)
+    folded: int | None = None
+    objectives: dict[int, float] = field(default_factory=dict)
+    seconds: float = 0.0
+    error: str = ""
+
+    def as_row(self) -> dict[str, Any]:
+        """Return the trial as a flat mapping for :func:`write_table`."""
+        return {
+            "trial": self.number,
+            **self.params,
+            "status": self.status,
+            "score": self.score,
+            **self.similarity,
+            "folded": self.folded,
+            "seconds": round(self.seconds, 3),
+            "error": self.error,
+        }
+
+
+def run_sweep(
+    reference: Path,
+    floating: Path,
+    trials: Iterable[Mapping[str, Any]],
+    output_dir: Path,
+    *,
+    metric: str = "nmi",
+    max_workers: int = 1,
+    total_threads: int | None = None,
+    pruner: MedianPruner | None = None,
+    max_folded_voxels: int = 0,
+    keep_outputs: bool = False,
+    f3d_options: Mapping[str, Any] | None = None,
+) -> Iterator[Trial]:
+    """Run reg_f3d once per parameter set and score the results.
+
+    Trials run concurrently with an equal share of *total_threads* OpenMP
+    threads each. A trial is scored with *metric* between the reference and
+    its result, and rejected if its control point grid folds more than
+    *max_folded_voxels* voxels. With a *pruner*, trials that fall behind at a
+    coarse level are stopped early.
+
+    Args:
+        reference: Reference image path.
+        floating: Floating image path.
+        trials: reg_f3d parameters of each trial, e.g. from
+            :func:`grid_search` or :func:`random_search`. ``spacing`` sets the
+            control point spacing along all axes.
+        output_dir: Directory for the outputs of each trial.
+        metric: Measure used as score, from
+            :data:`niftyregw.similarity.METRICS`.
+        max_workers: Number of concurrent trials.
+        total_threads: OpenMP threads shared by the trials. All CPUs if
+            ``None``.
+        pruner: Pruner of the trials. Trials always run to the end if
+            ``None``.
+        max_folded_voxels: Maximum number of folded voxels of a valid trial.
+        keep_outputs: Keep the control point grid and result of every trial.
+            Only those of the best trial so far are kept otherwise.
+        f3d_options: reg_f3d arguments shared by all trials.
+
+    Yields:
+        The trials, in input order.
+    """
+    # Imported here to keep NumPy and nibabel off the import path
+    from .jacobian import FoldCheck
+    from .similarity import check_metrics, load_image, measure_arrays
+
+    check_metrics([metric])
+    output_dir = Path(output_dir)
+    output_dir.mkdir(parents=True, exist_ok=True)
+    omp_threads = threads_per_worker(total_threads, max_workers)
+    f3d_options = {"omp_threads": omp_threads, **(f3d_options or {})}
+    fold_check = FoldCheck(omp_threads=omp_threads)
+    reference_data = load_image(reference)
+    sign = -1 if metric in _LOWER_IS_BETTER else 1
+    niftyregw_logger = logger.bind(executable="niftyregw")
+    best: list[Trial] = []
+    best_lock = threading.Lock()
+
+    def _run(number: int, params: Mapping[str, Any]) -> Trial:
+        trial = Trial(number, dict(params))
+        trial_dir = output_dir / f"trial_{number:04d}"
+        trial_dir.mkdir(parents=True, exist_ok=True)
+        cpp, result = trial_dir / "cpp.nii", trial_dir / "result.nii"
+        parser = _ObjectiveParser(pruner)
+        start = time.perf_counter()
+        try:
+            returncode = reg_f3d(
+                reference,
+                floating,
+                output_cpp=cpp,
+                output_result=result,
+                on_line=parser,
+                **{**f3d_options, **_f3d_arguments(params)},
+            )
+            trial.objectives = dict(parser.objectives)
+            if parser.pruned_at is not None:
+                trial.status = "pruned"
+            elif returncode != 0:
+                trial.status = "failed"
+                trial.error = f"reg_f3d exited with code {returncode}"
+            else:
+                trial.folded = fold_check.count_folded(cpp, reference)
+                values = measure_arrays(reference_data, load_image(result), [metric])
+                trial.similarity = {metric: float(values[metric])}
+                if trial.folded > max_folded_voxels:
+                    trial.status = "folded"
+                else:
+                    trial.score = sign * trial.similarity[metric]
+        except Exception as e:  # noqa: BLE001 - one trial must not stop the others
+            trial.status = "failed"
+            trial.error = f"{type(e).__name__}: {e}"
+        trial.seconds = time.perf_counter() - start
+        niftyregw_logger.info(
+            f"Trial {number} {trial.status}: {trial.params}"
+            + ("" if trial.score is None else f", {metric} = {trial.score * sign:g}")
+        )
+        if not keep_outputs:
+            _keep_best(trial, trial_dir)
+        return trial
+
+    def _keep_best(trial: Trial, trial_dir: Path) -> None:
+        with best_lock:
+            best_score = best[0].score if best else None
+            if trial.score is not None and (
+                best_score is None or trial.score > best_score
+            ):
+                if best:
+                    shutil.rmtree(
+                        output_dir / f"trial_{best[0].number:04d}", ignore_errors=True
+                    )
+                best[:] = [trial]
+                return
+        shutil.rmtree(trial_dir, ignore_errors=True)
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        pending: deque[Future[Trial]] = deque()
+        for number, params in enumerate(trials):
+            pending.append(executor.submit(copy_context().run, _run, number, params))
+            if len(pending) > 2 * max_workers:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
+
+
+def best_trial(trials: Iterable[Trial]) -> Trial | None:
+    """Return the complete trial with the highest score."""
+    scored = [trial for trial in trials if trial.score is not None]
+    return max(
+        scored,
+        key=lambda trial: -math.inf if trial.score is None else trial.score,
+        default=None,
+    )
@@ -0,0 +1,85 @@
+"""Write rows of results as CSV, TSV or Parquet tables."""
+
+from __future__ import annotations
+
+import csv
+from collections.abc import Iterable, Mapping, Sequence
+from pathlib import Path
+from typing import Any
+
+
+def read_path_list(path: Path) -> list[Path]:
+    """Read one path per line, ignoring empty lines and ``#`` comments."""
+    paths = []
+    for line in Path(path).read_text().splitlines():
+        line = line.strip()
+        if line and not line.startswith("#"):
+            paths.append(Path(line))
+    return paths
+
+
+def write_table(
+    rows: Iterable[Mapping[str, Any]],
+    output: Path,
+    columns: Sequence[str] | None = None,
+) -> int:
+    """Write *rows* to *output*, choosing the format from its suffix.
+
+    CSV (default) and TSV rows are written as they arrive, so that results are
+    kept if a long run is interrupted. Parquet requires ``pyarrow``, from the
+    ``parquet`` extra.
+
+    Args:
+        rows: Mappings with the same keys, which become the columns.
+        output: Output path ending in ``.csv``, ``.tsv`` or ``.parquet``.
+        columns: Column names, written even if there are no rows. Taken from
+            the first row if ``None``.
+
+    Returns:
+        The number of rows written.
+
+    Raises:
+        ImportError: If the output is Parquet and ``pyarrow`` is missing.
+    """
+    output = Path(output)
+    if output.suffix.lower() == ".parquet":
+        return _write_parquet(rows, output, columns)
+    delimiter = "\t" if output.suffix.lower() == ".tsv" else ","
+    count = 0
+    with open(output, "w", newline="") as f:
+        writer = None
+        if columns is not None:
+            writer = csv.DictWriter(f, fieldnames=list(columns), delimiter=delimiter)
+            writer.writeheader()
+        for row in rows:
+            if writer is None:
+                writer = csv.DictWriter(f, fieldnames=list(row), delimiter=delimiter)
+                writer.writeheader()
+            writer.writerow({key: _to_cell(value) for key, value in row.items()})
+            f.flush()
+            count += 1
+    return count
+
+
+def _to_cell(value: Any) -> Any:
+    return str(value) if isinstance(value, Path) else value
+
+
+def _write_parquet(
+    rows: Iterable[Mapping[str, Any]],
+    output: Path,
+    columns: Sequence[str] | None,
+) -> int:
+    try:
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+    except ImportError as e:
+        msg = "Writing Parquet files requires pyarrow: pip install 'niftyregw[parquet]'"
+        raise ImportError(msg) from e
+    records = [{key: _to_cell(value) for key, value in row.items()} for row in rows]
+    if records or columns is None:
+        table = pa.Table.from_pylist(records)
+    else:
+        table = pa.table({name: pa.array([], pa.null()) for name in columns})
+    pq.write_table(table, output)
+    return len(records)
@@ -0,0 +1,294 @@
+"""Fake NiftyReg binaries for deterministic load and throughput tests.
+
+:class:`FakeNiftyReg` writes an executable for every name in
+:data:`niftyregw.install.BINARIES` and puts them first on ``PATH``. The fake
+binaries print NiftyReg-style lines to stdout and stderr at a configurable
+rate, sleep or keep a CPU busy, write plausible output files and exit with a
+chosen code, so pipes, back-pressure and concurrency can be tested without
+NiftyReg. The executables are Python scripts, so they run on Linux and macOS.
+"""
+
+from __future__ import annotations
+
+import json
+import math
+import os
+import sys
+import time
+from dataclasses import asdict, dataclass, fields, replace
+from pathlib import Path
+from typing import Any
+
+from .install import BINARIES
+
+_CONFIG_NAME = "config.json"
+_CALLS_NAME = "calls.jsonl"
+# Options followed by an output filename
+_OUTPUT_OPTIONS = (
+    "-aff",
+    "-res",
+    "-cpp",
+    "-out",
+    "-jac",
+    "-jacM",
+    "-jacL",
+    "-blank",
+)
+# Options whose value can be used as the template of output images
+_IMAGE_OPTIONS = ("-ref", "-in", "-flo", "-target", "-source")
+_IDENTITY = "1 0 0 0\n0 1 0 0\n0 0 1 0\n0 0 0 1\n"
+
+
+@dataclass(frozen=True)
+class FakeBehaviour:
+    """What a fake binary does when it runs.
+
+    Attributes:
+        lines: Number of lines printed.
+        line_rate: Lines printed per second. As fast as possible if ``None``.
+        stderr_ratio: Fraction of the lines printed to stderr as warnings.
+        sleep: Seconds to sleep before exiting.
+        cpu_seconds: Seconds to keep a CPU busy before exiting.
+        exit_code: Exit code.
+        write_outputs: Whether output files are written.
+    """
+
+    lines: int = 20
+    line_rate: float | None = None
+    stderr_ratio: float = 0.1
+    sleep: float = 0.0
+    cpu_seconds: float = 0.0
+    exit_code: int = 0
+    write_outputs: bool = True
+
+
+class FakeNiftyReg:
+    """Fake NiftyReg binaries on ``PATH``, used as a context manager.
+
+    Example::
+
+        with FakeNiftyReg(tmp_path, lines=1000, line_rate=500) as fake:
+            fake.configure("reg_f3d", exit_code=1)
+            reg_f3d("ref.nii", "flo.nii", output_cpp="cpp.nii")
+            assert fake.calls("reg_f3d")[0][:2] == ["-ref", "ref.nii"]
+
+    Args:
+        directory: Directory for the executables, their configuration and
+            the log of calls.
+        **behaviour: Fields of :class:`FakeBehaviour` for every binary.
+    """
+
+    def __init__(self, directory: Path, **behaviour: Any) -> None:
+        self.directory = Path(directory)
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self._default = FakeBehaviour(**behaviour)
+        self._tools: dict[str, FakeBehaviour] = {}
+        self._old_path: str | None = None
+        self._write_config()
+        for tool in BINARIES:
+            path = self.directory / tool
+            path.write_text(
+                f"#!{sys.executable}\n"
+                "import sys\n"
+                "from niftyregw.testing import _main\n"
+                f"sys.exit(_main({tool!r}, {str(self.directory)!r}, sys.argv[1:]))\n"
+            )
+            path.chmod(0o755)
+
+    def __enter__(self) -> FakeNiftyReg:
+        self._old_path = os.environ.get("PATH", "")
+        os.environ["PATH"] = f"{self.directory}{os.pathsep}{self._old_path}"
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        if self._old_path is not None:
+            os.environ["PATH"] = self._old_path
+            self._old_path = None
+
+    def configure(self, tool: str | None = None, **changes: Any) -> None:
+        """Change the behaviour of one binary, or of all if *tool* is ``None``.
+
+        Raises:
+            ValueError: If *tool* is not a NiftyReg binary.
+        """
+        if tool is None:
+            self._default = replace(self._default, **changes)
+        elif tool not in BINARIES:
+            msg = f"Unknown binary {tool!r}. Choose from {', '.join(BINARIES)}"
+            raise ValueError(msg)
+        else:
+            self._tools[tool] = replace(self.behaviour(tool), **changes)
+        self._write_config()
+
+    def behaviour(self, tool: str) -> FakeBehaviour:
+        """Return the behaviour of *tool*."""
+        return self._tools.get(tool, self._default)
+
+    def _write_config(self) -> None:
+        config = {tool: asdict(self.behaviour(tool)) for tool in BINARIES}
+        tmp = self.directory / f".{_CONFIG_NAME}"
+        tmp.write_text(json.dumps(config))
+        os.replace(tmp, self.directory / _CONFIG_NAME)
+
+    def calls(self, tool: str | None = None) -> list[list[str]]:
+        """Return the arguments of every call, of *tool* or of all binaries."""
+        path = self.directory / _CALLS_NAME
+        if not path.exists():
+            return []
+        records = [json.loads(line) for line in path.read_text().splitlines()]
+        return [r["args"] for r in records if tool is None or r["tool"] == tool]
+
+
+def _option(args: list[str], name: str) -> str | None:
+    try:
+        return args[args.index(name) + 1]
+    except (ValueError, IndexError):
+        return None
+
+
+def _lines(tool: str, args: list[str], count: int) -> list[str]:
+    levels = int(_option(args, "-lp") or _option(args, "-ln") or 3)
+    lines = []
+    if tool == "reg_f3d":
+        per_level = max(count // levels, 2)
+        for level in range(1, levels + 1):
+            objective = -1.0 + 0.1 * level
+            lines.append(f"[NiftyReg F3D] Current level: {level} / {levels}")
+            lines.append(f"[NiftyReg F3D] Initial objective function: {objective:g}")
+            for i in range(1, per_level - 1):
+                objective += 0.01 / i
+                lines.append(
+                    f"[NiftyReg F3D] [{i}] Current objective function: {objective:g}"
+                    f" = (wSIM){objective:g} - (wBE)0.001 [+ 0.5 mm]"
+                )
+    elif tool == "reg_aladin":
+        # Each level, then the final matrix
+        per_level = max((count - 5) // levels, 1)
+        for level in range(1, levels + 1):
+            lines.append(f"[NiftyReg INFO] Current level {level} / {levels}")
+            lines.extend(
+                f"[NiftyReg INFO] [{i}] Block matching: {50 + i % 50}% inliers"
+                for i in range(1, per_level)
+            )
+        lines.append("[NiftyReg INFO] Final affine transformation matrix:")
+        lines.extend(_IDENTITY.splitlines())
+    else:
+        lines = [f"[NiftyReg INFO] {tool} step {i}" for i in range(1, count + 1)]
+    return lines
+
+
+def _template(args: list[str]):
+    import nibabel as nib
+    import numpy as np
+
+    candidates = [_option(args, name) for name in _IMAGE_OPTIONS] + args
+    for candidate in candidates:
+        if candidate is None or not candidate.endswith((".nii", ".nii.gz")):
+            continue
+        try:
+            image = nib.load(candidate)
+            data = np.asarray(image.dataobj, np.float32)
+        except (OSError, EOFError, ValueError, nib.filebasedimages.ImageFileError):
+            continue
+        return nib.Nifti1Image(data, image.affine)
+    return nib.Nifti1Image(np.zeros((8, 8, 8), np.float32), np.eye(4))
+
+
+def _control_point_grid(template):
+    import nibabel as nib
+    import numpy as np
+
+    # Identity grid with a spacing of 5 voxels, as reg_f3d by default
+    shape = template.shape[:3]
+    spacing = 5.0
+    size = [math.ceil(n / spacing) + 3 for n in shape]
+    index_to_grid = np.diag([spacing, spacing, spacing, 1.0])
+    index_to_grid[:3, 3] = -spacing
+    affine = template.affine @ index_to_grid
+    indices = np.stack(np.indices(size), -1)
+    positions = nib.affines.apply_affine(affine, indices)
+    image = nib.Nifti1Image(positions[..., None, :].astype(np.float32), affine)
+    image.header.set_intent("vector", name="NREG_TRANS")
+    image.header["intent_p1"] = 3  # CUB_SPLINE_GRID
+    return image
+
+
+def _deformation_field(template):
+    import nibabel as nib
+    import numpy as np
+
+    # Identity deformation: the position of every voxel
+    indices = np.stack(np.indices(template.shape[:3]), -1)
+    positions = nib.affines.apply_affine(template.affine, indices)
+    image = nib.Nifti1Image(positions[..., None, :].astype(np.float32), template.affine)
+    image.header.set_intent("vector", name="NREG_TRANS")
+    image.header["intent_p1"] = 4  # DEF_FIELD
+    return image
+
+
+def _write_outputs(tool: str, args: list[str]) -> None:
+    import nibabel as nib
+
+    outputs = [_option(args, name) for name in _OUTPUT_OPTIONS if name in args]
+    if tool == "reg_transform" and args:
+        outputs.append(args[-1])
+    elif tool == "reg_average" and args:
+        outputs.append(args[0])
+    template = None
+    for output in outputs:
+        if output is None:
+            continue
+        if output.endswith(".txt"):
+            Path(output).write_text(_IDENTITY)
+            continue
+        if template is None:
+            template = _template(args)
+        if tool == "reg_f3d" and output == _option(args, "-cpp"):
+            nib.save(_control_point_grid(template), output)
+        elif tool == "reg_transform" and "-def" in args:
+            nib.save(_deformation_field(template), output)
+        else:
+            nib.save(template, output)
+
+
+def _main(tool: str, directory: str, args: list[str]) -> int:
+    """Entry point of the fake binaries."""
+    config = json.loads((Path(directory) / _CONFIG_NAME).read_text())
+    behaviour = FakeBehaviour(
+        **{f.name: config[tool][f.name] for f in fields(FakeBehaviour)}
+    )
+    start = time.time()
+
+    if "--version" in args or "-v" in args:
+        print("2.0.0")
+        return 0
+    if "-h" in args or "--help" in args:
+        print(f"Usage: {tool} [OPTIONS] (fake NiftyReg binary)")
+        return 0
+
+    lines = _lines(tool, args, behaviour.lines)
+    every = round(1 / behaviour.stderr_ratio) if behaviour.stderr_ratio > 0 else 0
+    delay = 0.0 if behaviour.line_rate is None else 1 / behaviour.line_rate
+    for i, line in enumerate(lines, start=1):
+        if every and i % every == 0:
+            print(f"[NiftyReg WARNING] {line}", file=sys.stderr, flush=True)
+        else:
+            print(line, flush=True)
+        if delay:
+            time.sleep(delay)
+
+    time.sleep(behaviour.sleep)
+    deadline = time.process_time() + behaviour.cpu_seconds
+    while time.process_time() < deadline:
+        pass
+
+    if behaviour.exit_code != 0:
+        print(f"[NiftyReg ERROR] {tool} failed", file=sys.stderr, flush=True)
+    elif behaviour.write_outputs:
+        _write_outputs(tool, args)
+
+    record = {"tool": tool, "args": args, "pid": os.getpid(), "start": start}
+    record["end"] = time.time()
+    with open(Path(directory) / _CALLS_NAME, "a") as f:
+        f.write(json.dumps(record) + "\n")
+    return behaviour.exit_code
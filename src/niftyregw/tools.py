@@ -0,0 +1,287 @@
+"""Chain image operations, running ``reg_tools`` only where it is needed."""
+
+from __future__ import annotations
+
+import itertools
+import tempfile
+from collections.abc import Callable, Sequence
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Any
+
+import numpy as np
+from loguru import logger
+
+from .trace import span
+from .voxels import DEFAULT_CHUNK_VOXELS, OPERATIONS, Operand, map_voxels
+from .wrapper import RunError, run
+
+# Operations only available in reg_tools: step name -> (flag, number of values)
+_REG_TOOLS_STEPS: dict[str, tuple[str, int]] = {
+    "downsample": ("-down", 0),
+    "isotropic": ("-iso", 0),
+    "change-resolution": ("-chgres", 3),
+    "smooth-spline": ("-smoS", 3),
+    "smooth-gaussian": ("-smoG", 3),
+    "smooth-labels": ("-smoL", 3),
+    "to-rgb": ("-4d2rgb", 0),
+    "mind": ("-mind", 0),
+    "mindssc": ("-mindssc", 0),
+}
+
+# Operations run in NumPy: step name -> number of values
+_NUMPY_STEPS: dict[str, int] = {
+    "add": 1,
+    "subtract": 1,
+    "multiply": 1,
+    "divide": 1,
+    "binarize": 0,
+    "threshold": 1,
+    "nan-mask": 1,
+    "remove-nan-inf": 1,
+    "no-scaling": 0,
+    "to-float": 0,
+}
+
+STEP_NAMES = (*_NUMPY_STEPS, *_REG_TOOLS_STEPS)
+
+
+@dataclass(frozen=True)
+class _Step:
+    name: str
+    values: tuple[Any, ...] = ()
+
+    @property
+    def in_memory(self) -> bool:
+        return self.name in _NUMPY_STEPS
+
+
+def _compose(steps: Sequence[_Step]) -> tuple[Callable[..., np.ndarray], list[Any]]:
+    """Return one element-wise function running *steps* and its operands."""
+    operands: list[Any] = []
+    plan = []
+    for step in steps:
+        plan.append((OPERATIONS[step.name], len(operands), len(step.values)))
+        operands.extend(step.values)
+
+    def function(data: np.ndarray, *values: Any) -> np.ndarray:
+        for operation, start, count in plan:
+            data = operation(data, *values[start : start + count])
+        return data
+
+    return function, operands
+
+
+def parse_step(text: str) -> tuple[str, tuple[str, ...]]:
+    """Parse a step such as ``"smooth-gaussian 2 2 2"`` into name and values.
+
+    Raises:
+        ValueError: If the name is unknown or the number of values is wrong.
+    """
+    if not text.split():
+        raise ValueError("Empty tools chain step")
+    name, *values = text.split()
+    name = name.lstrip("-").replace("_", "-")
+    if name in _NUMPY_STEPS:
+        arity = _NUMPY_STEPS[name]
+    elif name in _REG_TOOLS_STEPS:
+        arity = _REG_TOOLS_STEPS[name][1]
+    else:
+        msg = f"Unknown step {name!r}. Choose from: {', '.join(STEP_NAMES)}"
+        raise ValueError(msg)
+    if len(values) != arity:
+        msg = f"Step {name!r} takes {arity} value(s), got {len(values)}: {text!r}"
+        raise ValueError(msg)
+    return name, tuple(values)
+
+
+class ToolsChain:
+    """A sequence of ``reg_tools`` operations written to a single output.
+
+    Element-wise operations (arithmetic, binarisation, thresholding, NaN
+    masking and replacement, scaling and type conversion) run in NumPy, and
+    consecutive ones are applied together chunk by chunk with
+    :func:`niftyregw.voxels.map_voxels`. Only the operations that need
+    ``reg_tools``, such as smoothing and resampling, go through disk, so a
+    chain that contains none of them reads the input once and writes the
+    output once. Steps run in the order they are added, and the output is
+    floating point.
+
+    Operands of arithmetic steps can be scalars, arrays or image filenames.
+    """
+
+    def __init__(self) -> None:
+        self._steps: list[_Step] = []
+
+    def __len__(self) -> int:
+        return len(self._steps)
+
+    @classmethod
+    def from_strings(cls, steps: Sequence[str]) -> ToolsChain:
+        """Build a chain from steps such as ``["smooth-gaussian 2 2 2", "binarize"]``.
+
+        Step names are the ``niftyregw tools`` option names without dashes.
+        """
+        chain = cls()
+        for text in steps:
+            name, values = parse_step(text)
+            chain._steps.append(_Step(name, values))
+        return chain
+
+    def _append(self, name: str, *values: Any) -> ToolsChain:
+        self._steps.append(_Step(name, values))
+        return self
+
+    def add(self, value: Operand) -> ToolsChain:
+        """Add an image or value."""
+        return self._append("add", value)
+
+    def subtract(self, value: Operand) -> ToolsChain:
+        """Subtract an image or value."""
+        return self._append("subtract", value)
+
+    def multiply(self, value: Operand) -> ToolsChain:
+        """Multiply by an image or value."""
+        return self._append("multiply", value)
+
+    def divide(self, value: Operand) -> ToolsChain:
+        """Divide by an image or value."""
+        return self._append("divide", value)
+
+    def binarize(self) -> ToolsChain:
+        """Set non-zero voxels to 1."""
+        return self._append("binarize")
+
+    def threshold(self, value: float) -> ToolsChain:
+        """Set voxels below *value* to 0 and the others to 1."""
+        return self._append("threshold", value)
+
+    def nan_mask(self, mask: Operand) -> ToolsChain:
+        """Set voxels outside *mask* to NaN."""
+        return self._append("nan-mask", mask)
+
+    def remove_nan_inf(self, value: float) -> ToolsChain:
+        """Replace NaN and Inf with *value*."""
+        return self._append("remove-nan-inf", value)
+
+    def no_scaling(self) -> ToolsChain:
+        """Ignore the header scaling (scl_slope and scl_inter) of the image."""
+        return self._append("no-scaling")
+
+    def to_float(self) -> ToolsChain:
+        """Convert the image to float."""
+        return self._append("to-float")
+
+    def downsample(self) -> ToolsChain:
+        """Downsample the image 2 times with reg_tools."""
+        return self._append("downsample")
+
+    def isotropic(self) -> ToolsChain:
+        """Make the image isotropic with reg_tools."""
+        return self._append("isotropic")
+
+    def change_resolution(self, spacing: tuple[float, float, float]) -> ToolsChain:
+        """Resample to *spacing* in mm with reg_tools."""
+        return self._append("change-resolution", *spacing)
+
+    def smooth_spline(self, sigmas: tuple[float, float, float]) -> ToolsChain:
+        """Smooth with a cubic B-spline kernel with reg_tools."""
+        return self._append("smooth-spline", *sigmas)
+
+    def smooth_gaussian(self, sigmas: tuple[float, float, float]) -> ToolsChain:
+        """Smooth with a Gaussian kernel with reg_tools."""
+        return self._append("smooth-gaussian", *sigmas)
+
+    def smooth_labels(self, sigmas: tuple[float, float, float]) -> ToolsChain:
+        """Smooth a label image with a Gaussian kernel with reg_tools."""
+        return self._append("smooth-labels", *sigmas)
+
+    def apply(
+        self,
+        input_image: Path,
+        output: Path,
+        *,
+        scratch_dir: Path | None = None,
+        interpolation: int | None = None,
+        omp_threads: int | None = None,
+        chunk_voxels: int = DEFAULT_CHUNK_VOXELS,
+    ) -> Path:
+        """Run the chain on *input_image* and write *output*.
+
+        Args:
+            input_image: Input image filename.
+            output: Output image filename.
+            scratch_dir: Directory for the images passed to and from
+                ``reg_tools``. A temporary directory, removed afterwards, is
+                used if ``None``.
+            interpolation: Interpolation order for resampling steps.
+            omp_threads: Number of OpenMP threads for ``reg_tools``.
+            chunk_voxels: Maximum number of voxels processed at a time by
+                element-wise steps.
+
+        Returns:
+            The output path.
+
+        Raises:
+            ValueError: If the chain is empty, or if ``no-scaling`` follows an
+                element-wise step.
+            RunError: If a ``reg_tools`` step fails.
+        """
+        if not self._steps:
+            raise ValueError("Cannot apply an empty tools chain")
+        for previous, step in itertools.pairwise(self._steps):
+            # The scaling is removed when the image is read, which would
+            # also change the result of the steps before it
+            if step.name == "no-scaling" and previous.in_memory:
+                msg = (
+                    "no-scaling must be the first step or follow a reg_tools "
+                    f"step, not {previous.name!r}"
+                )
+                raise ValueError(msg)
+        tool_logger = logger.bind(executable="reg_tools")
+        with tempfile.TemporaryDirectory(prefix="niftyregw-") as tmp_dir:
+            scratch = Path(tmp_dir) if scratch_dir is None else Path(scratch_dir)
+            scratch.mkdir(parents=True, exist_ok=True)
+
+            current = Path(input_image)
+            index = 0
+            for in_memory, group in itertools.groupby(
+                self._steps, key=lambda step: step.in_memory
+            ):
+                steps = list(group)
+                if in_memory:
+                    index += len(steps)
+                    target = self._target(index, output, scratch)
+                    function, operands = _compose(steps)
+                    names = " ".join(step.name for step in steps)
+                    with span(names, "stage"):
+                        current = map_voxels(
+                            function,
+                            current,
+                            target,
+                            operands=operands,
+                            unscaled=steps[0].name == "no-scaling",
+                            chunk_voxels=chunk_voxels,
+                        )
+                    continue
+                for step in steps:
+                    index += 1
+                    target = self._target(index, output, scratch)
+                    flag, _ = _REG_TOOLS_STEPS[step.name]
+                    args = ["-in", str(current), "-out", str(target), flag]
+                    args.extend(str(value) for value in step.values)
+                    if interpolation is not None:
+                        args.extend(["-interp", str(interpolation)])
+                    if omp_threads is not None:
+                        args.extend(["-omp", str(omp_threads)])
+                    returncode = run("reg_tools", *args, tool_logger=tool_logger)
+                    if returncode != 0:
+                        raise RunError("reg_tools", returncode)
+                    current = target
+        return Path(output)
+
+    def _target(self, index: int, output: Path, scratch: Path) -> Path:
+        # Intermediate images are uncompressed so that they can be mapped
+        if index == len(self._steps):
+            return Path(output)
+        return scratch / f"step_{index}.nii"
@@ -0,0 +1,168 @@
+"""Timeline of runs, stages and I/O in the Chrome trace event format.
+
+While tracing is on, :func:`niftyregw.wrapper.run` records a span for every
+binary. The fan-out records its subjects and similarity stages, the tools
+chain its in-memory steps, the voxel functions their compression, the
+deformation cache its hashing, and the job queue worker its jobs and their
+queue waits. Every span has the process and thread that recorded it.
+:meth:`Tracer.save` writes a JSON file that https://ui.perfetto.dev and
+``chrome://tracing`` open, with a row per thread, so idle workers, long jobs
+and slow I/O stand out. :func:`merge_traces` combines the traces of several
+processes, with a row per host and process.
+
+Example::
+
+    with tracing("trace.json"):
+        list(fanout("ref.nii.gz", floatings, "out", max_workers=4))
+"""
+
+from __future__ import annotations
+
+import json
+import os
+import socket
+import threading
+import time
+from collections.abc import Iterator, Sequence
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Any
+
+
+class Tracer:
+    """Collect spans from every thread of the process."""
+
+    def __init__(self) -> None:
+        # Timestamps are monotonic but start at the wall clock, so that the
+        # traces of processes on several nodes can be merged
+        self._origin = time.time() - time.perf_counter()
+        self._events: list[dict[str, Any]] = []
+        self._threads: dict[int, str] = {}
+        self._lock = threading.Lock()
+
+    def now(self) -> float:
+        """Return the current timestamp, in seconds since the epoch."""
+        return self._origin + time.perf_counter()
+
+    def add_span(
+        self,
+        name: str,
+        category: str,
+        start: float,
+        end: float,
+        args: dict[str, Any] | None = None,
+    ) -> None:
+        """Record a span between two timestamps from :meth:`now` or the epoch."""
+        thread = threading.current_thread()
+        event = {
+            "name": name,
+            "cat": category,
+            "ph": "X",
+            "ts": start * 1e6,
+            "dur": max(end - start, 0.0) * 1e6,
+            "pid": os.getpid(),
+            "tid": thread.ident,
+            "args": args or {},
+        }
+        with self._lock:
+            self._events.append(event)
+            self._threads.setdefault(thread.ident, thread.name)
+
+    def name_thread(self, name: str) -> None:
+        """Show the current thread as *name*, e.g. a worker ID."""
+        with self._lock:
+            self._threads[threading.get_ident()] = name
+
+    def events(self) -> list[dict[str, Any]]:
+        """Return the events recorded so far, with the process and thread names."""
+        pid = os.getpid()
+        process = {
+            "name": "process_name",
+            "ph": "M",
+            "pid": pid,
+            "args": {"name": f"{socket.gethostname()}:{pid}"},
+        }
+        with self._lock:
+            names = [
+                {
+                    "name": "thread_name",
+                    "ph": "M",
+                    "pid": pid,
+                    "tid": tid,
+                    "args": {"name": name},
+                }
+                for tid, name in self._threads.items()
+            ]
+            return [process, *names, *self._events]
+
+    def save(self, path: Path) -> Path:
+        """Write the trace to *path* and return it."""
+        path = Path(path)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        trace = {"traceEvents": self.events(), "displayTimeUnit": "ms"}
+        tmp = path.with_name(f".{path.name}.tmp")
+        tmp.write_text(json.dumps(trace))
+        os.replace(tmp, path)
+        return path
+
+
+_tracer: Tracer | None = None
+
+
+def get_tracer() -> Tracer | None:
+    """Return the active tracer, or ``None`` if tracing is off."""
+    return _tracer
+
+
+@contextmanager
+def tracing(path: Path | None = None) -> Iterator[Tracer]:
+    """Record spans inside the block and write them to *path*, if given.
+
+    The trace is written even if the block raises.
+    """
+    global _tracer
+    previous, _tracer = _tracer, Tracer()
+    tracer = _tracer
+    try:
+        yield tracer
+    finally:
+        _tracer = previous
+        if path is not None:
+            tracer.save(path)
+
+
+@contextmanager
+def span(name: str, category: str, **args: Any) -> Iterator[dict[str, Any]]:
+    """Record the block as a span, if tracing is on.
+
+    Yields:
+        The arguments of the span, which the block can add to.
+    """
+    tracer = _tracer
+    if tracer is None:
+        yield args
+        return
+    start = tracer.now()
+    try:
+        yield args
+    finally:
+        tracer.add_span(name, category, start, tracer.now(), args)
+
+
+def merge_traces(paths: Sequence[Path], output: Path) -> Path:
+    """Merge the traces of several processes, e.g. workers, into *output*.
+
+    Processes on different nodes can have the same ID, so every process of
+    every input is given a new one. Its name, ``<hostname>:<pid>``, is kept.
+    """
+    events = []
+    pids: dict[tuple[int, Any], int] = {}
+    for index, path in enumerate(paths):
+        for event in json.loads(Path(path).read_text())["traceEvents"]:
+            key = (index, event.get("pid"))
+            if key not in pids:
+                pids[key] = len(pids) + 1
+            events.append({**event, "pid": pids[key]})
+    output = Path(output)
+    output.write_text(json.dumps({"traceEvents": events, "displayTimeUnit": "ms"}))
+    return output
@@ -2,15 +2,34 @@
 
 from __future__ import annotations
 
+import contextlib
+import contextvars
+import os
+import shlex
+import tempfile
+import time
+from collections.abc import Callable
 from pathlib import Path
-from subprocess import PIPE, Popen
+from subprocess import PIPE, STDOUT, Popen
 from threading import Thread
-from typing import TextIO
+from typing import TYPE_CHECKING, BinaryIO, TextIO
 
 import loguru
 from loguru import logger
 
+from .hooks import RunContext, RunResult, _after_exit, _wrap_on_line, get_hooks
 from .install import find as _find
+from .logpipe import LogPipeline, get_log_pipeline
+from .metrics import ResourceUsage, get_metrics
+from .sampler import get_sampling
+from .trace import span
+
+if TYPE_CHECKING:
+    from .jacobian import FoldCheck
+
+# Output kept for errors when the output of a binary goes to a file
+_TAIL_BYTES = 8192
+_TAIL_LINES = 20
 
 # Matrix formatting constants
 _MATRIX_COLUMN_COUNT = 4
@@ -49,6 +68,37 @@ def _format_matrix_line(line: str) -> str:
     return " " + "  ".join(formatted_parts)
 
 
+class FoldingError(RuntimeError):
+    """Raised when a registration result has too many folded voxels.
+
+    Attributes:
+        transformation: The rejected transformation file.
+        folded: Number of voxels with a non-positive Jacobian determinant.
+    """
+
+    def __init__(self, transformation: Path, folded: int) -> None:
+        self.transformation = transformation
+        self.folded = folded
+        super().__init__(
+            f"{transformation} has {folded} voxels with a non-positive"
+            " Jacobian determinant"
+        )
+
+
+class RunError(RuntimeError):
+    """Raised when a binary whose output is needed exits with an error.
+
+    Attributes:
+        tool: Binary name.
+        returncode: Exit code.
+    """
+
+    def __init__(self, tool: str, returncode: int) -> None:
+        self.tool = tool
+        self.returncode = returncode
+        super().__init__(f"{tool} exited with code {returncode}")
+
+
 def _get_path(tool: str) -> Path:
     path = _find(tool)
     if path is None:
@@ -64,6 +114,9 @@ def _read_stream(
     stream: TextIO,
     is_stderr: bool,
     tool_logger: loguru.Logger | None,
+    on_line: Callable[[str], bool | None] | None = None,
+    process: Popen | None = None,
+    pipeline: LogPipeline | None = None,
 ) -> None:
     """Read lines from a stream and log them appropriately.
 
@@ -71,17 +124,32 @@ def _read_stream(
         stream: The stream to read from.
         is_stderr: Whether this is the stderr stream.
         tool_logger: Optional loguru logger for structured output.
+        on_line: Optional callback called with each line. *process* is
+            terminated if it returns ``True``.
+        process: The process writing to *stream*.
+        pipeline: Pipeline emitting the lines from another thread. Lines are
+            logged from this thread if ``None``.
     """
+    # The context of this thread does not change while it reads
+    context = None if pipeline is None else contextvars.copy_context()
     for line in stream:
         line = line.rstrip("\n")
+        if on_line is not None and on_line(line) and process is not None:
+            process.terminate()
         # Format matrix lines for better readability
         line = _format_matrix_line(line)
         if tool_logger is None:
-            logger.info(line)
+            if pipeline is None:
+                logger.info(line)
+            else:
+                pipeline.submit(logger.info, line, context=context)
             continue
 
         # Determine log level and strip NiftyReg prefix
         message = line
+        important = is_stderr and line.startswith(
+            ("[NiftyReg WARNING]", "[NiftyReg ERROR]")
+        )
         if is_stderr:
             if line.startswith("[NiftyReg WARNING]"):
                 log = tool_logger.warning
@@ -98,35 +166,120 @@ def _read_stream(
         if message.startswith("[NiftyReg INFO]"):
             message = message[len("[NiftyReg INFO]") :].lstrip()
 
-        log(message)
+        if pipeline is None:
+            log(message)
+        else:
+            pipeline.submit(log, message, important=important, context=context)
 
 
-def run(tool: str, *args: str, tool_logger: loguru.Logger | None = None) -> None:
+def run(
+    tool: str,
+    *args: str,
+    tool_logger: loguru.Logger | None = None,
+    on_line: Callable[[str], bool | None] | None = None,
+    output: str | os.PathLike[str] | None = None,
+) -> int:
     """Run any NiftyReg binary with raw CLI arguments.
 
     Args:
         tool: Binary name (e.g. ``"reg_aladin"``).
         *args: Raw CLI arguments.
         tool_logger: Optional loguru logger for structured output.
+        on_line: Optional callback called with each stdout and stderr line,
+            from two threads. The binary is terminated if it returns ``True``.
+        output: File the binary writes its stdout and stderr to, appending,
+            e.g. a per-job log file or :data:`os.devnull`. No line is read
+            or logged by Python, except the last lines if the binary fails.
+
+    The hooks of :mod:`niftyregw.hooks` are called before the binary is
+    spawned, with each output line and after it exits.
+
+    Returns:
+        The exit code of the binary.
+
+    Raises:
+        ValueError: If both *on_line* and *output* are given.
     """
     tool_path = _get_path(tool)
     args_list = [arg.strip("\\\n") for arg in args]
     args_list = [arg for arg in args_list if arg]
 
     cmd = [str(tool_path), *args_list]
-    with Popen(cmd, stdout=PIPE, stderr=PIPE, text=True, bufsize=1) as p:
+    if output is not None and on_line is not None:
+        msg = "on_line cannot be used when the output goes to a file"
+        raise ValueError(msg)
+    hooks = get_hooks()
+    context = None
+    if hooks:
+        context = RunContext(tool, cmd)
+        for hook in hooks:
+            hook.before_spawn(context)
+        cmd = context.argv
+        if output is None:
+            on_line = _wrap_on_line(hooks, context, on_line)
+    env = None if context is None else context.env
+    sampling = get_sampling()
+    sampler = None if sampling is None else sampling.sampler(tool, args_list)
+    on_start = None if sampler is None else sampler.start
+    start = time.perf_counter()
+    with span(tool, "run", args=" ".join(args_list)) as trace_args:
+        if output is None:
+            if sampler is not None:
+                on_line = sampler.wrap(on_line)
+            returncode, usage = _run_piped(cmd, tool_logger, on_line, on_start, env)
+        else:
+            returncode, usage = _run_to_file(
+                tool, cmd, Path(output), tool_logger or logger, on_start, env
+            )
+        trace_args["returncode"] = returncode
+    wall_seconds = time.perf_counter() - start
+    get_metrics().record_run(tool, returncode, wall_seconds, usage)
+    if sampler is not None:
+        sampling.save(sampler.stop(returncode))
+    if context is not None:
+        result = RunResult(tool, cmd, returncode, wall_seconds, usage)
+        _after_exit(hooks, context, result)
+    return returncode
+
+
+def _wait(process: Popen) -> tuple[int, ResourceUsage | None]:
+    """Wait for *process* and return its exit code and resource usage."""
+    if not hasattr(os, "wait4") or process.returncode is not None:
+        return process.wait(), None
+    try:
+        _, status, rusage = os.wait4(process.pid, 0)
+    except ChildProcessError:
+        # Already reaped by Popen.poll, e.g. when terminating it
+        return process.wait(), None
+    process.returncode = os.waitstatus_to_exitcode(status)
+    return process.returncode, ResourceUsage.from_rusage(rusage)
+
+
+def _run_piped(
+    cmd: list[str],
+    tool_logger: loguru.Logger | None,
+    on_line: Callable[[str], bool | None] | None,
+    on_start: Callable[[Popen], None] | None = None,
+    env: dict[str, str] | None = None,
+) -> tuple[int, ResourceUsage | None]:
+    """Run *cmd*, logging its output from reader threads."""
+    pipeline = get_log_pipeline()
+    with Popen(cmd, stdout=PIPE, stderr=PIPE, text=True, bufsize=1, env=env) as p:
         assert p.stdout is not None
         assert p.stderr is not None
+        if on_start is not None:
+            on_start(p)
 
-        # Read both streams concurrently using threads
+        # Read both streams concurrently using threads, in the context of the
+        # caller so that records keep their job ID
         stderr_thread = Thread(
-            target=_read_stream,
-            args=(p.stderr, True, tool_logger),
+            target=contextvars.copy_context().run,
+            args=(_read_stream, p.stderr, True, tool_logger, on_line, p, pipeline),
             name="stderr-reader",
         )
         stdout_thread = Thread(
-            target=_read_stream,
-            args=(p.stdout, False, tool_logger),
+            target=contextvars.copy_context().run,
+            args=(_read_stream, p.stdout, False, tool_logger, on_line, p, pipeline),
             name="stdout-reader",
         )
 
@@ -137,8 +290,52 @@ def run(tool: str, *args: str, tool_logger: loguru.Logger | None = None) -> None
         stderr_thread.join()
         stdout_thread.join()
 
-        # Wait for process to complete
-        p.wait()
+        # Wait for process to complete and its output to be logged
+        returncode, usage = _wait(p)
+        pipeline.flush()
+        return returncode, usage
+
+
+def _read_tail(f: BinaryIO, start: int) -> list[str]:
+    """Return the last lines written to *f* after offset *start*."""
+    end = f.seek(0, os.SEEK_END)
+    f.seek(max(start, end - _TAIL_BYTES))
+    lines = f.read().decode(errors="replace").splitlines()
+    if f.tell() - start > _TAIL_BYTES:
+        # The first line is probably incomplete
+        lines = lines[1:]
+    return lines[-_TAIL_LINES:]
+
+
+def _run_to_file(
+    tool: str,
+    cmd: list[str],
+    output: Path,
+    tool_logger: loguru.Logger,
+    on_start: Callable[[Popen], None] | None = None,
+    env: dict[str, str] | None = None,
+) -> tuple[int, ResourceUsage | None]:
+    """Run *cmd* with its output going directly to *output*."""
+    with open(output, "ab") as out, tempfile.TemporaryFile() as stderr_file:
+        # Keep stderr apart only if it would be lost, for the tail
+        discard = os.path.realpath(output) == os.path.realpath(os.devnull)
+        start = 0 if discard else out.seek(0, os.SEEK_END)
+        stderr = stderr_file if discard else STDOUT
+        with Popen(cmd, stdout=out, stderr=stderr, env=env) as p:
+            if on_start is not None:
+                on_start(p)
+            returncode, usage = _wait(p)
+        if returncode == 0:
+            return returncode, usage
+        if discard:
+            tail = _read_tail(stderr_file, 0)
+        else:
+            with open(output, "rb") as f:
+                tail = _read_tail(f, start)
+    tool_logger.error(
+        f"{tool} exited with code {returncode}." + "".join(f"\n{line}" for line in tail)
+    )
+    return returncode, usage
 
 
 def reg_aladin(
@@ -173,7 +370,8 @@ def reg_aladin(
     block_step_size_2: bool = False,
     omp_threads: int | None = None,
     verbose_off: bool = False,
-) -> None:
+    on_line: Callable[[str], bool | None] | None = None,
+) -> int:
     """Run reg_aladin with structured arguments.
 
     Args:
@@ -207,6 +405,11 @@ def reg_aladin(
         block_step_size_2: Use block step size of 2 for faster registration.
         omp_threads: Number of OpenMP threads.
         verbose_off: Turn verbose off.
+        on_line: Callback called with each output line. reg_aladin is
+            terminated if it returns ``True``.
+
+    Returns:
+        The exit code of reg_aladin.
     """
     # Check if the default output file exists before registration
     default_output = Path("outputAffine.txt")
@@ -286,7 +489,288 @@ def reg_aladin(
     if verbose_off:
         command_lines.append("  -voff \\")
 
-    _run_with_logging("reg_aladin", *command_lines)
+    returncode = _run_with_logging("reg_aladin", *command_lines, on_line=on_line)
+
+    # Clean up the default output file if it was created and not requested
+    if not existed_before and default_output.exists() and not user_requested_default:
+        try:
+            default_output.unlink()
+            logger.bind(executable="niftyregw").debug(
+                f"Cleaned up default output file: {default_output}"
+            )
+        except OSError as e:
+            logger.bind(executable="niftyregw").warning(
+                f"Failed to clean up {default_output}: {e}"
+            )
+    return returncode
+
+
+def reg_f3d(
+    reference: Path,
+    floating: Path,
+    *,
+    input_affine: Path | None = None,
+    input_cpp: Path | None = None,
+    output_cpp: Path | None = None,
+    output_result: Path | None = None,
+    reference_mask: Path | None = None,
+    smooth_reference: float | None = None,
+    smooth_floating: float | None = None,
+    reference_lower_threshold: float | None = None,
+    reference_upper_threshold: float | None = None,
+    floating_lower_threshold: float | None = None,
+    floating_upper_threshold: float | None = None,
+    spacing_x: float | None = None,
+    spacing_y: float | None = None,
+    spacing_z: float | None = None,
+    bending_energy: float | None = None,
+    linear_energy: float | None = None,
+    jacobian_log_weight: float | None = None,
+    no_approx_jacobian_log: bool = False,
+    landmarks_weight: float | None = None,
+    landmarks_file: Path | None = None,
+    use_nmi: bool = False,
+    reference_bins: int | None = None,
+    floating_bins: int | None = None,
+    lncc_sigma: float | None = None,
+    use_ssd: bool = False,
+    use_ssd_no_norm: bool = False,
+    mind_offset: int | None = None,
+    mindssc_offset: int | None = None,
+    use_kld: bool = False,
+    similarity_weight_image: Path | None = None,
+    robust_range: bool = False,
+    max_iterations: int | None = None,
+    num_levels: int | None = None,
+    num_levels_to_perform: int | None = None,
+    no_pyramid: bool = False,
+    no_conjugate_gradient: bool = False,
+    perturbation_steps: int | None = None,
+    velocity_field: bool = False,
+    no_gradient_accumulation: bool = False,
+    floating_mask: Path | None = None,
+    smooth_gradient: float | None = None,
+    padding: float | None = None,
+    verbose_off: bool = False,
+    omp_threads: int | None = None,
+    fold_check: FoldCheck | None = None,
+    on_line: Callable[[str], bool | None] | None = None,
+) -> int:
+    """Run reg_f3d with structured arguments.
+
+    Args:
+        reference: Reference image path.
+        floating: Floating image path.
+        input_affine: Input affine transformation (Affine*Reference=Floating).
+        input_cpp: Input control point grid.
+        output_cpp: Output control point grid filename.
+        output_result: Resampled image filename.
+        reference_mask: Mask image in the reference space.
+        smooth_reference: Gaussian smoothing std dev (mm) for reference.
+        smooth_floating: Gaussian smoothing std dev (mm) for floating.
+        reference_lower_threshold: Lower threshold for reference image.
+        reference_upper_threshold: Upper threshold for reference image.
+        floating_lower_threshold: Lower threshold for floating image.
+        floating_upper_threshold: Upper threshold for floating image.
+        spacing_x: Final grid spacing along x (mm, voxels if negative).
+        spacing_y: Final grid spacing along y (mm, voxels if negative).
+        spacing_z: Final grid spacing along z (mm, voxels if negative).
+        bending_energy: Bending energy penalty weight.
+        linear_energy: Linear energy penalty weight.
+        jacobian_log_weight: Log of Jacobian determinant penalty weight.
+        no_approx_jacobian_log: Do not approximate JL at control points only.
+        landmarks_weight: Weight for landmark distance regularisation.
+        landmarks_file: Landmark positions file.
+        use_nmi: Force NMI even when other measures are specified.
+        reference_bins: NMI: number of bins for reference histogram.
+        floating_bins: NMI: number of bins for floating histogram.
+        lncc_sigma: Use LNCC with this Gaussian kernel std dev.
+        use_ssd: Use SSD (images normalised to 0-1).
+        use_ssd_no_norm: Use SSD without normalisation.
+        mind_offset: Use MIND descriptor with this offset.
+        mindssc_offset: Use MIND-SSC descriptor with this offset.
+        use_kld: Use Kullback-Leibler divergence.
+        similarity_weight_image: Per-voxel weight image for similarity.
+        robust_range: Threshold intensities between 2nd and 98th percentile.
+        max_iterations: Max iterations at the final level.
+        num_levels: Number of levels for pyramids.
+        num_levels_to_perform: Number of levels to run.
+        no_pyramid: Do not use a pyramidal approach.
+        no_conjugate_gradient: Use simple gradient ascent.
+        perturbation_steps: Perturbation step(s) after each optimisation.
+        velocity_field: Use velocity field integration.
+        no_gradient_accumulation: Disable gradient accumulation.
+        floating_mask: Mask image in the floating space.
+        smooth_gradient: Smooth the metric derivative (mm).
+        padding: Padding value.
+        verbose_off: Turn verbose off.
+        omp_threads: Number of OpenMP threads.
+        fold_check: Check the output control point grid for folding and
+            retry with stronger regularisation if needed.
+        on_line: Callback called with each output line. reg_f3d is
+            terminated if it returns ``True``.
+
+    Returns:
+        The exit code of the last reg_f3d run. The fold check is skipped if
+        it is nonzero.
+
+    Raises:
+        FoldingError: If the result still folds after the retries of
+            *fold_check*.
+        RunError: If ``reg_jacobian`` fails during the fold check.
+    """
+    if (landmarks_weight is None) != (landmarks_file is None):
+        msg = "landmarks_weight and landmarks_file must be provided together"
+        raise ValueError(msg)
+
+    # Check if the default output file exists before registration
+    default_output = Path("outputCPP.nii")
+    existed_before = default_output.exists()
+
+    # Determine if user requested the default output path
+    user_requested_default = False
+    if output_cpp is not None:
+        try:
+            # Resolve both paths to absolute paths for comparison
+            user_path = Path(output_cpp).resolve()
+            default_path = default_output.resolve()
+            user_requested_default = user_path == default_path
+        except (OSError, RuntimeError):
+            # If path resolution fails, treat as different paths
+            pass
+
+    with contextlib.ExitStack() as stack:
+        # The fold check needs the grid even if it was not requested
+        cpp = output_cpp
+        if fold_check is not None and cpp is None:
+            tmp_dir = stack.enter_context(
+                tempfile.TemporaryDirectory(prefix="niftyregw-")
+            )
+            cpp = Path(tmp_dir) / "cpp.nii"
+
+        args = ["-ref", str(reference), "-flo", str(floating)]
+
+        if input_affine is not None:
+            args += ["-aff", str(input_affine)]
+        if input_cpp is not None:
+            args += ["-incpp", str(input_cpp)]
+        if cpp is not None:
+            args += ["-cpp", str(cpp)]
+        if output_result is not None:
+            args += ["-res", str(output_result)]
+        if reference_mask is not None:
+            args += ["-rmask", str(reference_mask)]
+        if smooth_reference is not None:
+            args += ["-smooR", str(smooth_reference)]
+        if smooth_floating is not None:
+            args += ["-smooF", str(smooth_floating)]
+        if reference_lower_threshold is not None:
+            args += ["--rLwTh", str(reference_lower_threshold)]
+        if reference_upper_threshold is not None:
+            args += ["--rUpTh", str(reference_upper_threshold)]
+        if floating_lower_threshold is not None:
+            args += ["--fLwTh", str(floating_lower_threshold)]
+        if floating_upper_threshold is not None:
+            args += ["--fUpTh", str(floating_upper_threshold)]
+        if spacing_x is not None:
+            args += ["-sx", str(spacing_x)]
+        if spacing_y is not None:
+            args += ["-sy", str(spacing_y)]
+        if spacing_z is not None:
+            args += ["-sz", str(spacing_z)]
+        if linear_energy is not None:
+            args += ["-le", str(linear_energy)]
+        if no_approx_jacobian_log:
+            args.append("-noAppJL")
+        if landmarks_weight is not None and landmarks_file is not None:
+            args += ["-land", str(landmarks_weight), str(landmarks_file)]
+        if use_nmi:
+            args.append("--nmi")
+        if reference_bins is not None:
+            args += ["--rbn", str(reference_bins)]
+        if floating_bins is not None:
+            args += ["--fbn", str(floating_bins)]
+        if lncc_sigma is not None:
+            args += ["--lncc", str(lncc_sigma)]
+        if use_ssd:
+            args.append("--ssd")
+        if use_ssd_no_norm:
+            args.append("--ssdn")
+        if mind_offset is not None:
+            args += ["--mind", str(mind_offset)]
+        if mindssc_offset is not None:
+            args += ["--mindssc", str(mindssc_offset)]
+        if use_kld:
+            args.append("--kld")
+        if similarity_weight_image is not None:
+            args += ["-wSim", str(similarity_weight_image)]
+        if robust_range:
+            args.append("-rr")
+        if max_iterations is not None:
+            args += ["-maxit", str(max_iterations)]
+        if num_levels is not None:
+            args += ["-ln", str(num_levels)]
+        if num_levels_to_perform is not None:
+            args += ["-lp", str(num_levels_to_perform)]
+        if no_pyramid:
+            args.append("-nopy")
+        if no_conjugate_gradient:
+            args.append("-noConj")
+        if perturbation_steps is not None:
+            args += ["-pert", str(perturbation_steps)]
+        if velocity_field:
+            args.append("-vel")
+        if no_gradient_accumulation:
+            args.append("-nogce")
+        if floating_mask is not None:
+            args += ["-fmask", str(floating_mask)]
+        if smooth_gradient is not None:
+            args += ["-smoothGrad", str(smooth_gradient)]
+        if padding is not None:
+            args += ["-pad", str(padding)]
+        if verbose_off:
+            args.append("-voff")
+        if omp_threads is not None:
+            args += ["-omp", str(omp_threads)]
+
+        retries = 0 if fold_check is None else fold_check.retries
+        for attempt in range(retries + 1):
+            # The regularisation weights are the only arguments that change
+            # between attempts
+            regularisation = []
+            if bending_energy is not None:
+                regularisation += ["-be", str(bending_energy)]
+            if jacobian_log_weight is not None:
+                regularisation += ["-jl", str(jacobian_log_weight)]
+            command = [*args, *regularisation]
+            logger.bind(executable="niftyregw").debug(
+                "The following command will be run:\n"
+                + shlex.join(["reg_f3d", *command])
+            )
+            # Arguments are passed whole, so paths may contain spaces
+            returncode = run(
+                "reg_f3d",
+                *command,
+                tool_logger=logger.bind(executable="reg_f3d"),
+                on_line=on_line,
+            )
+
+            # A failed registration is not retried, and has no grid to check
+            if returncode != 0 or fold_check is None or cpp is None:
+                break
+            folded = fold_check.count_folded(cpp, reference)
+            if folded <= fold_check.max_folded_voxels:
+                break
+            if attempt == retries:
+                raise FoldingError(cpp, folded)
+            bending_energy, jacobian_log_weight = fold_check.escalate(
+                bending_energy, jacobian_log_weight
+            )
+            logger.bind(executable="niftyregw").warning(
+                f"{folded} folded voxels in {cpp}. Retrying with bending energy"
+                f" {bending_energy:g} and Jacobian log weight"
+                f" {jacobian_log_weight:g}"
+            )
 
     # Clean up the default output file if it was created and not requested
     if not existed_before and default_output.exists() and not user_requested_default:
@@ -299,9 +783,14 @@ def reg_aladin(
             logger.bind(executable="niftyregw").warning(
                 f"Failed to clean up {default_output}: {e}"
             )
+    return returncode
 
 
-def _run_with_logging(tool: str, *lines: str) -> None:
+def _run_with_logging(
+    tool: str,
+    *lines: str,
+    on_line: Callable[[str], bool | None] | None = None,
+) -> int:
     tool_path = _get_path(tool)
     loggerw = logger.bind(executable="niftyregw")
     loggerx = logger.bind(executable=tool)
@@ -313,4 +802,4 @@ def _run_with_logging(tool: str, *lines: str) -> None:
     for line in lines:
         args.extend(line.strip(" \\").split())
 
-    run(tool, *args, tool_logger=loggerx)
+    return run(tool, *args, tool_logger=loggerx, on_line=on_line)
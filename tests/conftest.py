@@ -5,6 +5,8 @@ from pathlib import Path
 
 import pytest
 
+from niftyregw.testing import FakeNiftyReg
+
 
 @pytest.fixture
 def tmp_path_factory_session(tmp_path_factory):
@@ -32,3 +34,10 @@ def mock_affine_file(temp_dir):
     affine_path = temp_dir / "test_affine.txt"
     affine_path.write_text("1 0 0 0\n0 1 0 0\n0 0 1 0\n0 0 0 1\n")
     return affine_path
+
+
+@pytest.fixture
+def fake_niftyreg(temp_dir):
+    """Put fake NiftyReg binaries on PATH."""
+    with FakeNiftyReg(temp_dir / "fake_niftyreg") as fake:
+        yield fake
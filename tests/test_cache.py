@@ -0,0 +1,278 @@
+"""Tests for niftyregw.cache module."""
+
+import threading
+from pathlib import Path
+from unittest.mock import patch
+
+import nibabel as nib
+import numpy as np
+import pytest
+import typer
+
+from niftyregw.cache import DeformationCache, file_hash, grid_hash, is_spline_grid
+from niftyregw.commands import resolve_cached
+from niftyregw.wrapper import RunError
+
+
+def _save_transformation(path, intent_p1, value=0.0):
+    image = nib.Nifti1Image(np.full((4, 4, 4, 1, 3), value, np.float32), np.eye(4))
+    image.header.set_intent("vector", (), name="NREG_TRANS")
+    image.header["intent_p1"] = intent_p1
+    nib.save(image, path)
+    return path
+
+
+def _save_image(path, shape=(8, 8, 8), spacing=1.0):
+    nib.save(
+        nib.Nifti1Image(np.zeros(shape, np.float32), np.diag([spacing] * 3 + [1])), path
+    )
+    return path
+
+
+def _fake_reg_transform(size=1000):
+    """Return a side effect writing a *size*-byte output for reg_transform -def."""
+
+    def _run(tool, *args, **kwargs):
+        if tool == "reg_transform":
+            output = Path(args[args.index("-def") + 2])
+            output.write_bytes(b"\0" * size)
+        return 0
+
+    return _run
+
+
+@pytest.fixture
+def cpp(temp_dir):
+    return _save_transformation(temp_dir / "cpp.nii.gz", intent_p1=3)
+
+
+@pytest.fixture
+def reference(temp_dir):
+    return _save_image(temp_dir / "ref.nii.gz")
+
+
+def test_is_spline_grid(temp_dir, cpp, reference, mock_affine_file):
+    """Test control point grids are told apart from other files."""
+    field = _save_transformation(temp_dir / "def.nii.gz", intent_p1=1)
+    velocity = _save_transformation(temp_dir / "vel.nii.gz", intent_p1=6)
+    assert is_spline_grid(cpp)
+    assert is_spline_grid(velocity)
+    assert not is_spline_grid(field)
+    assert not is_spline_grid(reference)
+    assert not is_spline_grid(mock_affine_file)
+
+
+def test_hashes(temp_dir, cpp, reference):
+    """Test content and grid digests."""
+    copy = temp_dir / "copy.nii.gz"
+    copy.write_bytes(cpp.read_bytes())
+    assert file_hash(copy) == file_hash(cpp)
+
+    same_grid = _save_image(temp_dir / "same.nii.gz")
+    other_spacing = _save_image(temp_dir / "other.nii.gz", spacing=2.0)
+    other_shape = _save_image(temp_dir / "shape.nii.gz", shape=(8, 8, 9))
+    assert grid_hash(same_grid) == grid_hash(reference)
+    assert grid_hash(other_spacing) != grid_hash(reference)
+    assert grid_hash(other_shape) != grid_hash(reference)
+
+
+def test_get_materialises_once(temp_dir, cpp, reference):
+    """Test a field is computed on the first request and reused afterwards."""
+    with (
+        DeformationCache(temp_dir / "cache") as cache,
+        patch("niftyregw.resample.run", side_effect=_fake_reg_transform()) as mock_run,
+    ):
+        first = cache.get(cpp, reference)
+        second = cache.get(cpp, reference)
+
+        assert first == second
+        assert first.suffix == ".nii"
+        assert first.parent == temp_dir / "cache"
+        mock_run.assert_called_once()
+        args = mock_run.call_args[0]
+        assert args[args.index("-ref") + 1] == str(reference)
+        assert (cache.hits, cache.misses) == (1, 1)
+        assert cache.total_bytes == 1000
+
+
+def test_get_concurrent_requests_compute_once(temp_dir, cpp, reference):
+    """Test concurrent requests for the same field compute it only once."""
+    with (
+        DeformationCache(temp_dir / "cache") as cache,
+        patch("niftyregw.resample.run", side_effect=_fake_reg_transform()) as mock_run,
+    ):
+        threads = [
+            threading.Thread(target=cache.get, args=(cpp, reference)) for _ in range(8)
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        mock_run.assert_called_once()
+
+
+def test_get_failure_is_not_cached(temp_dir, cpp, reference):
+    """Test a failed reg_transform run raises and leaves no entry behind."""
+
+    def _fail(tool, *args, **kwargs):
+        Path(args[args.index("-def") + 2]).write_bytes(b"partial")
+        return 1
+
+    with (
+        DeformationCache(temp_dir / "cache") as cache,
+        patch("niftyregw.resample.run", side_effect=_fail),
+    ):
+        with pytest.raises(RunError, match="reg_transform exited with code 1"):
+            cache.get(cpp, reference)
+        assert len(cache) == 0
+        assert list((temp_dir / "cache").iterdir()) == []
+
+
+def test_different_reference_grid_is_new_entry(temp_dir, cpp, reference):
+    """Test the same CPP on another grid is cached separately."""
+    other = _save_image(temp_dir / "other.nii.gz", spacing=2.0)
+    with (
+        DeformationCache(temp_dir / "cache") as cache,
+        patch("niftyregw.resample.run", side_effect=_fake_reg_transform()),
+    ):
+        assert cache.get(cpp, reference) != cache.get(cpp, other)
+        assert len(cache) == 2
+
+
+def test_eviction_by_total_bytes(temp_dir, reference):
+    """Test least recently used fields are evicted above max_bytes."""
+    cpps = [
+        _save_transformation(temp_dir / f"cpp{i}.nii.gz", 3, value=i) for i in range(3)
+    ]
+    with (
+        DeformationCache(temp_dir / "cache", max_bytes=2500) as cache,
+        patch("niftyregw.resample.run", side_effect=_fake_reg_transform()),
+    ):
+        first = cache.get(cpps[0], reference)
+        second = cache.get(cpps[1], reference)
+        cache.get(cpps[0], reference)  # Mark the first as recently used
+        third = cache.get(cpps[2], reference)
+
+        assert first.exists()
+        assert not second.exists()
+        assert third.exists()
+        assert cache.total_bytes == 2000
+
+
+def test_existing_directory_is_reused(temp_dir, cpp, reference):
+    """Test fields persisted by a previous session are hits."""
+    directory = temp_dir / "cache"
+    with patch("niftyregw.resample.run", side_effect=_fake_reg_transform()) as mock_run:
+        DeformationCache(directory).get(cpp, reference)
+        cache = DeformationCache(directory)
+        assert len(cache) == 1
+        cache.get(cpp, reference)
+        mock_run.assert_called_once()
+
+
+def test_temporary_directory_removed_on_close(cpp, reference):
+    """Test the default directory is temporary."""
+    cache = DeformationCache()
+    directory = cache.directory
+    assert directory.is_dir()
+    cache.close()
+    assert not directory.exists()
+
+
+def test_clear(temp_dir, cpp, reference):
+    """Test clear removes every field."""
+    with (
+        DeformationCache(temp_dir / "cache") as cache,
+        patch("niftyregw.resample.run", side_effect=_fake_reg_transform()),
+    ):
+        path = cache.get(cpp, reference)
+        cache.clear()
+        assert not path.exists()
+        assert len(cache) == 0
+
+
+def test_other_files_survive_eviction_and_clear(temp_dir, reference):
+    """Test a cache on a data directory only removes the fields it cached."""
+    data = [_save_image(temp_dir / name) for name in ("subject_T1.nii", "ref.nii")]
+    cpp = _save_transformation(temp_dir / "cpp.nii", 3)
+    with (
+        DeformationCache(temp_dir, max_bytes=500) as cache,
+        patch("niftyregw.resample.run", side_effect=_fake_reg_transform()),
+    ):
+        assert len(cache) == 0
+        cache.get(cpp, reference)
+        cache.get(_save_transformation(temp_dir / "cpp2.nii.gz", 3, value=1), reference)
+        cache.clear()
+    assert all(path.exists() for path in [*data, cpp])
+
+
+def test_resolve_passthrough(temp_dir, cpp, reference, mock_affine_file):
+    """Test only spline grids with a reference are replaced."""
+    field = _save_transformation(temp_dir / "def.nii.gz", intent_p1=1)
+    with (
+        DeformationCache(temp_dir / "cache") as cache,
+        patch("niftyregw.resample.run", side_effect=_fake_reg_transform()) as mock_run,
+    ):
+        assert cache.resolve(mock_affine_file, reference) == mock_affine_file
+        assert cache.resolve(field, reference) == field
+        assert cache.resolve(cpp, None) == cpp
+        mock_run.assert_not_called()
+        assert cache.resolve(cpp, reference).parent == temp_dir / "cache"
+
+
+def test_resample_many_uses_cache(temp_dir, cpp, reference):
+    """Test batched resampling reads the field from the cache."""
+    from niftyregw.resample import ResampleInput, resample_many
+
+    inputs = [ResampleInput(Path("t1.nii.gz"), temp_dir / "t1_res.nii.gz")]
+    with (
+        DeformationCache(temp_dir / "cache") as cache,
+        patch("niftyregw.resample.run", side_effect=_fake_reg_transform()) as mock_run,
+    ):
+        resample_many(reference, inputs, cpp, cache=cache)
+        resample_many(reference, inputs, cpp, cache=cache)
+        tools = [call[0][0] for call in mock_run.call_args_list]
+        assert tools == ["reg_transform", "reg_resample", "reg_resample"]
+
+
+def test_compose_uses_cache(temp_dir, cpp, reference):
+    """Test composition replaces spline inputs by cached fields."""
+    from niftyregw.chain import compose_transformations
+
+    with (
+        DeformationCache(temp_dir / "cache") as cache,
+        patch("niftyregw.resample.run", side_effect=_fake_reg_transform()),
+        patch("niftyregw.chain.run", return_value=0) as mock_run,
+    ):
+        compose_transformations(
+            cpp,
+            cpp,
+            temp_dir / "out.nii",
+            reference=reference,
+            reference2=reference,
+            cache=cache,
+        )
+        args = mock_run.call_args[0]
+        assert "-ref2" not in args
+        comp = args.index("-comp")
+        assert Path(args[comp + 1]).parent == temp_dir / "cache"
+        assert args[comp + 1] == args[comp + 2]
+
+
+def test_resolve_cached_cli_helper(temp_dir, cpp, reference):
+    """Test the CLI helper only caches when a directory and reference are given."""
+    assert resolve_cached(cpp, reference, None) == cpp
+    assert resolve_cached(cpp, None, temp_dir / "cache") == cpp
+    with patch("niftyregw.resample.run", side_effect=_fake_reg_transform()):
+        cached = resolve_cached(cpp, reference, temp_dir / "cache")
+    assert cached.parent == temp_dir / "cache"
+
+
+def test_resolve_cached_failure_exits(temp_dir, cpp, reference):
+    """Test a failing reg_transform ends the command instead of raising."""
+    with (
+        patch("niftyregw.resample.run", return_value=1),
+        pytest.raises(typer.Exit) as excinfo,
+    ):
+        resolve_cached(cpp, reference, temp_dir / "cache")
+    assert excinfo.value.exit_code == 1
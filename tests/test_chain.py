@@ -0,0 +1,159 @@
+"""Tests for niftyregw.chain module."""
+
+from pathlib import Path
+from unittest.mock import patch
+
+import numpy as np
+import pytest
+
+from niftyregw import chain
+from niftyregw.chain import TransformChain, invert_affine, read_affine, write_affine
+from niftyregw.wrapper import RunError
+
+
+def _translation(tx, ty, tz):
+    matrix = np.eye(4)
+    matrix[:3, 3] = (tx, ty, tz)
+    return matrix
+
+
+def _scaling(s):
+    return np.diag([s, s, s, 1.0])
+
+
+def test_affine_roundtrip(temp_dir):
+    """Test affine matrices survive a write/read cycle."""
+    matrix = _translation(1.5, -2.25, 3e-4) @ _scaling(1.1)
+    path = write_affine(matrix, temp_dir / "affine.txt")
+    np.testing.assert_allclose(read_affine(path), matrix)
+
+
+def test_invert_affine(temp_dir):
+    """Test affines are inverted in NumPy."""
+    matrix = _translation(1, 2, 3) @ _scaling(2)
+    path = write_affine(matrix, temp_dir / "affine.txt")
+    inverse = read_affine(invert_affine(path, temp_dir / "inverse.txt"))
+    np.testing.assert_allclose(inverse @ matrix, np.eye(4), atol=1e-12)
+
+
+def test_read_affine_invalid_shape(temp_dir):
+    """Test non-4x4 files are rejected."""
+    path = temp_dir / "bad.txt"
+    path.write_text("1 0 0\n0 1 0\n0 0 1\n")
+    with pytest.raises(ValueError, match="4x4"):
+        read_affine(path)
+
+
+def test_add_affine_from_file(mock_affine_file):
+    """Test affines can be added from NiftyReg text files."""
+    transform_chain = TransformChain().add_affine(mock_affine_file)
+    assert len(transform_chain) == 1
+
+
+def test_add_affine_invalid_matrix():
+    """Test in-memory affines must be 4x4."""
+    with pytest.raises(ValueError, match="4x4"):
+        TransformChain().add_affine(np.eye(3))
+
+
+def test_resolve_empty_chain(temp_dir):
+    """Test resolving an empty chain fails."""
+    with pytest.raises(ValueError, match="empty"):
+        TransformChain().resolve(Path("ref.nii.gz"), temp_dir)
+
+
+def test_resolve_folds_affines(temp_dir):
+    """Test consecutive affines are folded in application order."""
+    first = _translation(10, 0, 0)
+    second = _scaling(2)
+    transform_chain = TransformChain().add_affine(first).add_affine(second)
+
+    with patch.object(chain, "run", return_value=0) as mock_run:
+        path = transform_chain.resolve(Path("ref.nii.gz"), temp_dir)
+
+    mock_run.assert_not_called()
+    folded = read_affine(path)
+    point = np.array([1.0, 1.0, 1.0, 1.0])
+    np.testing.assert_allclose(folded @ point, second @ (first @ point))
+    np.testing.assert_allclose(folded[:3, 3], [20, 0, 0])
+
+
+def test_resolve_single_field_is_passthrough(temp_dir):
+    """Test a chain with one field returns it unchanged."""
+    transform_chain = TransformChain().add_field("cpp.nii.gz", reference="ref.nii.gz")
+    with patch.object(chain, "run", return_value=0) as mock_run:
+        path = transform_chain.resolve(Path("ref.nii.gz"), temp_dir)
+    mock_run.assert_not_called()
+    assert path == Path("cpp.nii.gz")
+
+
+def test_resolve_composes_nonlinear_parts(temp_dir):
+    """Test affine A, CPP B, affines C and D need two compositions."""
+    transform_chain = (
+        TransformChain()
+        .add_affine(_translation(1, 0, 0))
+        .add_field("cpp.nii.gz", reference="mid.nii.gz")
+        .add_affine(_scaling(2))
+        .add_affine(_translation(0, 1, 0))
+    )
+
+    with patch.object(chain, "run", return_value=0) as mock_run:
+        path = transform_chain.resolve(Path("ref.nii.gz"), temp_dir)
+
+    assert mock_run.call_count == 2
+    first_args = mock_run.call_args_list[0][0]
+    assert first_args[0] == "reg_transform"
+    assert first_args[first_args.index("-ref") + 1] == "ref.nii.gz"
+    assert first_args[first_args.index("-ref2") + 1] == "mid.nii.gz"
+    comp = first_args.index("-comp")
+    assert first_args[comp + 1] == str(temp_dir / "affine_0.txt")
+    assert first_args[comp + 2] == "cpp.nii.gz"
+
+    second_args = mock_run.call_args_list[1][0]
+    assert "-ref2" not in second_args
+    comp = second_args.index("-comp")
+    assert second_args[comp + 1] == str(temp_dir / "composed_1.nii")
+    np.testing.assert_allclose(
+        read_affine(Path(second_args[comp + 2])), _translation(0, 1, 0) @ _scaling(2)
+    )
+    assert path == temp_dir / "composed_2.nii"
+
+
+def test_resample_runs_reg_resample_once(temp_dir):
+    """Test resampling a chain interpolates the floating image once."""
+    transform_chain = TransformChain().add_affine(np.eye(4)).add_field("def.nii.gz")
+
+    with (
+        patch.object(chain, "run", return_value=0) as mock_chain_run,
+        patch("niftyregw.resample.run", return_value=0) as mock_resample_run,
+    ):
+        transform_chain.resample(
+            Path("ref.nii.gz"),
+            Path("flo.nii.gz"),
+            temp_dir / "out.nii.gz",
+            interpolation=0,
+            scratch_dir=temp_dir / "scratch",
+        )
+
+    assert mock_chain_run.call_count == 1
+    mock_resample_run.assert_called_once()
+    args = mock_resample_run.call_args[0]
+    assert args[0] == "reg_resample"
+    assert args[args.index("-trans") + 1] == str(
+        temp_dir / "scratch" / "composed_1.nii"
+    )
+    assert args[args.index("-inter") + 1] == "0"
+
+
+def test_compose_fails(temp_dir):
+    """Test a failed composition raises instead of chaining a missing field."""
+    with (
+        patch.object(chain, "run", return_value=1),
+        pytest.raises(RunError, match="reg_transform exited with code 1"),
+    ):
+        chain.compose_transformations(
+            Path("a.nii.gz"),
+            Path("b.nii.gz"),
+            temp_dir / "ab.nii",
+            reference=Path("ref.nii.gz"),
+        )
@@ -232,3 +232,40 @@ def test_aladin_log_level_default():
     sig = inspect.signature(aladin)
     log_level_param = sig.parameters["log_level"]
     assert log_level_param.default == LogLevel.DEBUG
+
+
+def test_aladin_with_pyramid_cache(mock_nifti_image, temp_dir):
+    """Test aladin runs on cached pyramid levels when requested."""
+    flo_img = temp_dir / "flo.nii.gz"
+    flo_img.touch()
+    aff_out = temp_dir / "output.txt"
+
+    with (
+        patch("niftyregw.commands.aladin.setup_logger"),
+        patch("niftyregw.commands.aladin._reg_aladin") as mock_reg_aladin,
+        patch("niftyregw.pyramid.reg_aladin_pyramid") as mock_pyramid,
+    ):
+        app = typer.Typer()
+        app.command()(aladin)
+        result = runner.invoke(
+            app,
+            [
+                "-r",
+                str(mock_nifti_image),
+                "-f",
+                str(flo_img),
+                "-a",
+                str(aff_out),
+                "--pyramid-cache",
+                str(temp_dir / "cache"),
+                "--rigid-only",
+            ],
+        )
+
+        assert result.exit_code == 0
+        mock_reg_aladin.assert_not_called()
+        call_kwargs = mock_pyramid.call_args[1]
+        assert call_kwargs["cache"].directory == temp_dir / "cache"
+        assert call_kwargs["num_levels"] == 3
+        assert call_kwargs["output_affine"] == aff_out
+        assert call_kwargs["rigid_only"]
@@ -19,7 +19,7 @@ def test_f3d_minimal_args(mock_nifti_image, temp_dir):
 
     with (
         patch("niftyregw.commands.f3d.setup_logger"),
-        patch("niftyregw.commands.f3d.run") as mock_run,
+        patch("niftyregw.wrapper.run", return_value=0) as mock_run,
     ):
         app = typer.Typer()
         app.command()(f3d)
@@ -37,7 +37,7 @@ def test_f3d_landmarks_validation(mock_nifti_image, temp_dir):
 
     with (
         patch("niftyregw.commands.f3d.setup_logger"),
-        patch("niftyregw.commands.f3d.run"),
+        patch("niftyregw.wrapper.run", return_value=0),
     ):
         app = typer.Typer()
         app.command()(f3d)
@@ -57,7 +57,7 @@ def test_f3d_with_spline_options(mock_nifti_image, temp_dir):
 
     with (
         patch("niftyregw.commands.f3d.setup_logger"),
-        patch("niftyregw.commands.f3d.run") as mock_run,
+        patch("niftyregw.wrapper.run", return_value=0) as mock_run,
     ):
         app = typer.Typer()
         app.command()(f3d)
@@ -93,7 +93,7 @@ def test_f3d_with_regularisation(mock_nifti_image, temp_dir):
 
     with (
         patch("niftyregw.commands.f3d.setup_logger"),
-        patch("niftyregw.commands.f3d.run") as mock_run,
+        patch("niftyregw.wrapper.run", return_value=0) as mock_run,
     ):
         app = typer.Typer()
         app.command()(f3d)
@@ -126,7 +126,7 @@ def test_f3d_with_similarity_measures(mock_nifti_image, temp_dir):
 
     with (
         patch("niftyregw.commands.f3d.setup_logger"),
-        patch("niftyregw.commands.f3d.run") as mock_run,
+        patch("niftyregw.wrapper.run", return_value=0) as mock_run,
     ):
         app = typer.Typer()
         app.command()(f3d)
@@ -191,7 +191,7 @@ def test_f3d_with_masks(mock_nifti_image, temp_dir):
 
     with (
         patch("niftyregw.commands.f3d.setup_logger"),
-        patch("niftyregw.commands.f3d.run") as mock_run,
+        patch("niftyregw.wrapper.run", return_value=0) as mock_run,
     ):
         app = typer.Typer()
         app.command()(f3d)
@@ -224,7 +224,7 @@ def test_f3d_with_optimisation_params(mock_nifti_image, temp_dir):
 
     with (
         patch("niftyregw.commands.f3d.setup_logger"),
-        patch("niftyregw.commands.f3d.run") as mock_run,
+        patch("niftyregw.wrapper.run", return_value=0) as mock_run,
     ):
         app = typer.Typer()
         app.command()(f3d)
@@ -262,10 +262,11 @@ def test_f3d_cleanup_default_file(mock_nifti_image, temp_dir):
     # Simulate creating the default file during registration
     def create_default_file(*args, **kwargs):
         (Path.cwd() / "outputCPP.nii").touch()
+        return 0
 
     with (
         patch("niftyregw.commands.f3d.setup_logger"),
-        patch("niftyregw.commands.f3d.run", side_effect=create_default_file),
+        patch("niftyregw.wrapper.run", side_effect=create_default_file),
     ):
         # Ensure default file doesn't exist before
         default_file = Path.cwd() / "outputCPP.nii"
@@ -295,7 +296,7 @@ def test_f3d_keeps_default_file_if_requested(mock_nifti_image, temp_dir):
 
     with (
         patch("niftyregw.commands.f3d.setup_logger"),
-        patch("niftyregw.commands.f3d.run", side_effect=create_default_file),
+        patch("niftyregw.wrapper.run", side_effect=create_default_file),
     ):
         # Clean up before test
         if default_file.exists():
@@ -326,7 +327,7 @@ def test_f3d_handles_existing_default_file(mock_nifti_image, temp_dir):
 
     with (
         patch("niftyregw.commands.f3d.setup_logger"),
-        patch("niftyregw.commands.f3d.run"),
+        patch("niftyregw.wrapper.run", return_value=0),
     ):
         app = typer.Typer()
         app.command()(f3d)
@@ -339,3 +340,133 @@ def test_f3d_handles_existing_default_file(mock_nifti_image, temp_dir):
 
     # Clean up
     default_file.unlink()
+
+
+def test_f3d_fold_check(mock_nifti_image, temp_dir):
+    """Test f3d fails when the fold check fails."""
+    from niftyregw.jacobian import FoldCheck
+    from niftyregw.wrapper import FoldingError
+
+    flo_img = temp_dir / "flo.nii.gz"
+    flo_img.touch()
+
+    with (
+        patch("niftyregw.commands.f3d.setup_logger"),
+        patch(
+            "niftyregw.commands.f3d._reg_f3d",
+            side_effect=FoldingError(Path("cpp.nii"), 7),
+        ) as mock_reg_f3d,
+    ):
+        app = typer.Typer()
+        app.command()(f3d)
+        result = runner.invoke(
+            app,
+            [
+                "-r",
+                str(mock_nifti_image),
+                "-f",
+                str(flo_img),
+                "--max-folded-voxels",
+                "5",
+                "--fold-retries",
+                "2",
+            ],
+        )
+
+    assert result.exit_code == 1
+    fold_check = mock_reg_f3d.call_args[1]["fold_check"]
+    assert fold_check == FoldCheck(max_folded_voxels=5, retries=2)
+
+
+def test_f3d_fold_check_jacobian_failure(mock_nifti_image, temp_dir):
+    """Test f3d exits cleanly when reg_jacobian fails during the fold check."""
+    from niftyregw.wrapper import RunError
+
+    flo_img = temp_dir / "flo.nii.gz"
+    flo_img.touch()
+
+    with (
+        patch("niftyregw.commands.f3d.setup_logger"),
+        patch(
+            "niftyregw.commands.f3d._reg_f3d",
+            side_effect=RunError("reg_jacobian", 1),
+        ),
+    ):
+        app = typer.Typer()
+        app.command()(f3d)
+        result = runner.invoke(
+            app,
+            [
+                "-r",
+                str(mock_nifti_image),
+                "-f",
+                str(flo_img),
+                "--max-folded-voxels",
+                "5",
+            ],
+        )
+
+    assert result.exit_code == 1
+    assert not isinstance(result.exception, RunError)
+
+
+def test_f3d_checkpoint_dir(mock_nifti_image, temp_dir):
+    """Test f3d runs resumable levels with --checkpoint-dir."""
+    flo_img = temp_dir / "flo.nii.gz"
+    flo_img.touch()
+    checkpoint = temp_dir / "checkpoint"
+
+    with (
+        patch("niftyregw.commands.f3d.setup_logger"),
+        patch("niftyregw.resumable.reg_f3d_resumable") as mock_resumable,
+    ):
+        app = typer.Typer()
+        app.command()(f3d)
+        args = ["-r", str(mock_nifti_image), "-f", str(flo_img)]
+        result = runner.invoke(
+            app, [*args, "--checkpoint-dir", str(checkpoint), "--num-levels", "4"]
+        )
+        assert result.exit_code == 0
+        kwargs = mock_resumable.call_args[1]
+        assert kwargs["checkpoint_dir"] == checkpoint
+        assert kwargs["num_levels"] == 4
+
+        result = runner.invoke(
+            app, [*args, "--checkpoint-dir", str(checkpoint), "--no-pyramid"]
+        )
+        assert result.exit_code == 1
+
+
+def test_f3d_sample_dir(mock_nifti_image, temp_dir):
+    """Test f3d samples the run with --sample-dir."""
+    flo_img = temp_dir / "flo.nii.gz"
+    flo_img.touch()
+
+    def _register(*args, **kwargs):
+        from niftyregw.sampler import get_sampling
+
+        assert get_sampling().interval == 0.5
+        assert get_sampling().directory == temp_dir / "timelines"
+        return 0
+
+    with (
+        patch("niftyregw.commands.f3d.setup_logger"),
+        patch("niftyregw.commands.f3d._reg_f3d", side_effect=_register) as mock_f3d,
+    ):
+        app = typer.Typer()
+        app.command()(f3d)
+        result = runner.invoke(
+            app,
+            [
+                "-r",
+                str(mock_nifti_image),
+                "-f",
+                str(flo_img),
+                "--sample-dir",
+                str(temp_dir / "timelines"),
+                "--sample-interval",
+                "0.5",
+            ],
+        )
+    assert result.exit_code == 0
+    mock_f3d.assert_called_once()
@@ -6,11 +6,15 @@ from unittest.mock import patch
 import typer
 from typer.testing import CliRunner
 
+from niftyregw.commands.fanout import fanout
 from niftyregw.commands.jacobian import jacobian
 from niftyregw.commands.measure import measure
+from niftyregw.commands.pairwise import pairwise
 from niftyregw.commands.resample import resample
+from niftyregw.commands.sweep import sweep
 from niftyregw.commands.tools import tools
 from niftyregw.commands.transform import app as transform_app
+from niftyregw.wrapper import RunError
 
 runner = CliRunner()
 
@@ -80,6 +84,120 @@ def test_measure_with_output(mock_nifti_image, temp_dir):
         assert result.exit_code == 0
 
 
+def test_measure_floating_list(temp_dir):
+    """Test measure --floating-list writes one row per pair in-process."""
+    import nibabel as nib
+    import numpy as np
+
+    rng = np.random.default_rng(0)
+    data = rng.normal(size=(6, 6, 6)).astype(np.float32)
+    ref_img = temp_dir / "atlas.nii.gz"
+    nib.save(nib.Nifti1Image(data, np.eye(4)), ref_img)
+    floatings = []
+    for index in range(3):
+        path = temp_dir / f"subject{index}.nii.gz"
+        nib.save(nib.Nifti1Image(data + index, np.eye(4)), path)
+        floatings.append(path)
+    floating_list = temp_dir / "files.txt"
+    floating_list.write_text("\n".join(str(path) for path in floatings))
+    output = temp_dir / "results.csv"
+
+    with (
+        patch("niftyregw.commands.measure.setup_logger"),
+        patch("niftyregw.commands.measure.run") as mock_run,
+    ):
+        app = typer.Typer()
+        app.command()(measure)
+        result = runner.invoke(
+            app,
+            [
+                "-r",
+                str(ref_img),
+                "--floating-list",
+                str(floating_list),
+                "--ncc",
+                "--ssd",
+                "--workers",
+                "2",
+                "-o",
+                str(output),
+            ],
+        )
+
+        assert result.exit_code == 0
+        mock_run.assert_not_called()
+        lines = output.read_text().splitlines()
+        assert lines[0] == "reference,floating,ncc,ssd"
+        assert len(lines) == 4
+        assert lines[1].startswith(f"{ref_img},{floatings[0]},1.0,0.0")
+
+
+def test_measure_floating_list_parquet_without_pyarrow(mock_nifti_image, temp_dir):
+    """Test a Parquet output without pyarrow is reported without a traceback."""
+    import sys
+
+    floating_list = temp_dir / "files.txt"
+    floating_list.write_text("")
+    args = ["-r", str(mock_nifti_image), "--floating-list", str(floating_list)]
+
+    with (
+        patch("niftyregw.commands.measure.setup_logger"),
+        patch.dict(sys.modules, {"pyarrow": None, "pyarrow.parquet": None}),
+    ):
+        app = typer.Typer()
+        app.command()(measure)
+        result = runner.invoke(app, [*args, "-o", str(temp_dir / "out.parquet")])
+
+    assert result.exit_code == 1
+    assert not isinstance(result.exception, ImportError)
+
+
+def test_measure_floating_list_requires_output(mock_nifti_image, temp_dir):
+    """Test measure --floating-list requires --output."""
+    floating_list = temp_dir / "files.txt"
+    floating_list.write_text("flo.nii.gz\n")
+
+    with patch("niftyregw.commands.measure.setup_logger"):
+        app = typer.Typer()
+        app.command()(measure)
+        result = runner.invoke(
+            app, ["-r", str(mock_nifti_image), "--floating-list", str(floating_list)]
+        )
+        assert result.exit_code == 1
+        result = runner.invoke(app, ["-r", str(mock_nifti_image)])
+        assert result.exit_code == 1
+
+
+def test_measure_floating_list_bad_image_and_empty_list(temp_dir):
+    """Test a bad pair is reported, and an empty list still writes a header."""
+    import nibabel as nib
+    import numpy as np
+
+    ref_img = temp_dir / "atlas.nii.gz"
+    nib.save(nib.Nifti1Image(np.zeros((4, 4, 4), np.float32), np.eye(4)), ref_img)
+    floating_list = temp_dir / "files.txt"
+    floating_list.write_text(f"{temp_dir / 'missing.nii.gz'}\n")
+    output = temp_dir / "results.csv"
+    args = ["-r", str(ref_img), "--floating-list", str(floating_list), "--ncc"]
+
+    with patch("niftyregw.commands.measure.setup_logger"):
+        app = typer.Typer()
+        app.command()(measure)
+        result = runner.invoke(app, [*args, "-o", str(output)])
+        assert result.exit_code == 1
+        lines = output.read_text().splitlines()
+        assert lines[0] == "reference,floating,ncc"
+        assert lines[1].endswith("missing.nii.gz,nan")
+
+        floating_list.write_text("")
+        result = runner.invoke(app, [*args, "-o", str(output)])
+        assert result.exit_code == 0
+        assert output.read_text().splitlines() == ["reference,floating,ncc"]
+
+        result = runner.invoke(app, [*args, "-o", str(output), "--omp-threads", "2"])
+        assert result.exit_code == 1
+
+
 def test_measure_help():
     """Test measure --help."""
     app = typer.Typer()
@@ -91,6 +209,149 @@ def test_measure_help():
 
 
 # Jacobian tests
+def test_fanout_report(mock_nifti_image, temp_dir):
+    """Test fanout registers every matched image and writes a report."""
+    from niftyregw.fanout import FanoutResult
+
+    (temp_dir / "sub1.nii.gz").touch()
+    (temp_dir / "sub2.nii.gz").touch()
+    report = temp_dir / "report.csv"
+
+    def _fake_fanout(reference, floatings, output_dir, **kwargs):
+        for path in floatings:
+            yield FanoutResult(
+                "sub", path, Path("a.txt"), None, Path("r.nii"), status="done"
+            )
+
+    with (
+        patch("niftyregw.commands.fanout.setup_logger"),
+        patch(
+            "niftyregw.commands.fanout._fanout", side_effect=_fake_fanout
+        ) as mock_fanout,
+    ):
+        app = typer.Typer()
+        app.command()(fanout)
+        result = runner.invoke(
+            app,
+            [
+                "-r",
+                str(mock_nifti_image),
+                "--glob",
+                str(temp_dir / "sub*.nii.gz"),
+                "--workers",
+                "2",
+                "--threads",
+                "8",
+                "--skip-existing",
+                "--report",
+                str(report),
+            ],
+        )
+
+        assert result.exit_code == 0
+        args, kwargs = mock_fanout.call_args
+        assert args[1] == [temp_dir / "sub1.nii.gz", temp_dir / "sub2.nii.gz"]
+        assert kwargs["max_workers"] == 2
+        assert kwargs["total_threads"] == 8
+        assert kwargs["skip_existing"]
+        lines = report.read_text().splitlines()
+        assert lines[0].startswith("subject,floating,status")
+        assert len(lines) == 3
+
+
+def test_fanout_registration_options(mock_nifti_image, temp_dir):
+    """Test fanout passes the registration options to both registrations."""
+    (temp_dir / "sub1.nii.gz").touch()
+
+    with (
+        patch("niftyregw.commands.fanout.setup_logger"),
+        patch("niftyregw.commands.fanout._fanout", return_value=iter([])) as mock,
+    ):
+        app = typer.Typer()
+        app.command()(fanout)
+        result = runner.invoke(
+            app,
+            [
+                "-r",
+                str(mock_nifti_image),
+                "-f",
+                str(temp_dir / "sub1.nii.gz"),
+                "--floating-mask",
+                "masks/{subject}_mask.nii.gz",
+                "--num-levels",
+                "4",
+                "--num-levels-to-perform",
+                "2",
+                "--spacing-x",
+                "-3",
+                "--bending-energy",
+                "0.01",
+                "--omp-threads",
+                "2",
+            ],
+        )
+
+        assert result.exit_code == 0
+        kwargs = mock.call_args[1]
+        assert kwargs["floating_mask"] == "masks/{subject}_mask.nii.gz"
+        assert kwargs["aladin_options"] == {
+            "num_levels": 4,
+            "num_levels_to_perform": 2,
+            "omp_threads": 2,
+        }
+        assert kwargs["f3d_options"] == {
+            "num_levels": 4,
+            "num_levels_to_perform": 2,
+            "omp_threads": 2,
+            "spacing_x": -3.0,
+            "bending_energy": 0.01,
+        }
+
+
+def test_fanout_requires_floating(mock_nifti_image):
+    """Test fanout exits with an error without floating images."""
+    with patch("niftyregw.commands.fanout.setup_logger"):
+        app = typer.Typer()
+        app.command()(fanout)
+        result = runner.invoke(app, ["-r", str(mock_nifti_image)])
+        assert result.exit_code == 1
+
+
+def test_pairwise(temp_dir):
+    """Test pairwise checkpoints in the output directory by default."""
+    import numpy as np
+
+    from niftyregw.pairwise import CompletionMatrix
+
+    images = [temp_dir / f"atlas{i}.nii.gz" for i in range(3)]
+    matrix = CompletionMatrix(images)
+    matrix.done[:] = True
+
+    with (
+        patch("niftyregw.commands.pairwise.setup_logger"),
+        patch(
+            "niftyregw.commands.pairwise.register_all_pairs", return_value=matrix
+        ) as mock_register,
+    ):
+        app = typer.Typer()
+        app.command()(pairwise)
+        args = [arg for path in images for arg in ("-i", str(path))]
+        result = runner.invoke(
+            app, [*args, "-o", str(temp_dir / "out"), "--rigid-only", "--workers", "3"]
+        )
+        assert result.exit_code == 0
+        call_args, kwargs = mock_register.call_args
+        assert call_args[0] == images
+        assert kwargs["checkpoint"] == temp_dir / "out" / "completion.json"
+        assert kwargs["max_workers"] == 3
+        assert kwargs["aladin_options"] == {"rigid_only": True}
+
+        matrix.done[0, 1] = matrix.done[1, 0] = False
+        result = runner.invoke(app, args)
+        assert result.exit_code == 1
+        assert not np.all(matrix.done)
+
+
 def test_jacobian_minimal(temp_dir):
     """Test jacobian with minimal arguments."""
     trans = temp_dir / "trans.nii"
@@ -156,6 +417,58 @@ def test_jacobian_all_outputs(temp_dir):
         assert result.exit_code == 0
 
 
+def test_jacobian_stats(temp_dir):
+    """Test jacobian --stats writes a statistics table."""
+    trans = temp_dir / "trans.nii"
+    stats = temp_dir / "stats.csv"
+    trans.touch()
+    rows = [{"subject": str(trans), "label": None, "voxels": 8, "folded": 0}]
+
+    with (
+        patch("niftyregw.commands.jacobian.setup_logger"),
+        patch("niftyregw.commands.jacobian.run") as mock_run,
+        patch("niftyregw.jacobian.jacobian_stats", return_value=rows) as mock_stats,
+    ):
+        app = typer.Typer()
+        app.command()(jacobian)
+        result = runner.invoke(app, ["-t", str(trans), "--stats", str(stats)])
+
+        assert result.exit_code == 0
+        mock_run.assert_not_called()
+        mock_stats.assert_called_once()
+        assert stats.read_text().splitlines()[0] == "subject,label,voxels,folded"
+
+        result = runner.invoke(
+            app,
+            [
+                "-t",
+                str(trans),
+                "--stats",
+                str(stats),
+                "--jacobian-matrix",
+                str(temp_dir / "mat.nii"),
+            ],
+        )
+        assert result.exit_code == 1
+
+
+def test_jacobian_stats_failing_binary(temp_dir, fake_niftyreg):
+    """Test jacobian --stats exits cleanly when reg_jacobian fails."""
+    fake_niftyreg.configure("reg_jacobian", exit_code=2)
+    trans = temp_dir / "trans.nii"
+    trans.touch()
+    stats = temp_dir / "stats.csv"
+
+    with patch("niftyregw.commands.jacobian.setup_logger"):
+        app = typer.Typer()
+        app.command()(jacobian)
+        result = runner.invoke(app, ["-t", str(trans), "--stats", str(stats)])
+
+    assert result.exit_code == 1
+    assert not isinstance(result.exception, RunError)
+    assert not stats.exists()
+
+
 def test_jacobian_help():
     """Test jacobian --help."""
     app = typer.Typer()
@@ -238,7 +551,128 @@ def test_resample_help():
     assert "resample" in result.stdout.lower()
 
 
+def test_resample_batch(mock_nifti_image, temp_dir):
+    """Test resample --batch delegates to resample_many."""
+    ref_img = mock_nifti_image
+    trans = temp_dir / "cpp.nii.gz"
+    trans.touch()
+    batch = temp_dir / "batch.txt"
+    batch.write_text("t1.nii.gz t1_res.nii.gz 3\nlabels.nii.gz labels_res.nii.gz 0\n")
+
+    with (
+        patch("niftyregw.commands.resample.setup_logger"),
+        patch("niftyregw.commands.resample.resample_many") as mock_many,
+        patch("niftyregw.commands.resample.run") as mock_run,
+    ):
+        app = typer.Typer()
+        app.command()(resample)
+        result = runner.invoke(
+            app,
+            ["-r", str(ref_img), "-t", str(trans), "--batch", str(batch)],
+        )
+
+        assert result.exit_code == 0
+        mock_run.assert_not_called()
+        inputs = mock_many.call_args[0][1]
+        assert [item.interpolation for item in inputs] == [3, 0]
+        assert mock_many.call_args[0][2] == trans
+
+
+def test_resample_batch_and_floating_exclusive(mock_nifti_image, temp_dir):
+    """Test resample requires exactly one of --floating and --batch."""
+    ref_img = mock_nifti_image
+    batch = temp_dir / "batch.txt"
+    batch.write_text("flo.nii.gz out.nii.gz\n")
+
+    with (
+        patch("niftyregw.commands.resample.setup_logger"),
+        patch("niftyregw.commands.resample.run"),
+    ):
+        app = typer.Typer()
+        app.command()(resample)
+        result = runner.invoke(app, ["-r", str(ref_img)])
+        assert result.exit_code == 1
+        result = runner.invoke(
+            app, ["-r", str(ref_img), "-f", "flo.nii.gz", "--batch", str(batch)]
+        )
+        assert result.exit_code == 1
+
+
+def test_resample_batch_rejects_single_image_options(mock_nifti_image, temp_dir):
+    """Test resample --batch refuses options it cannot apply to every image."""
+    ref_img = mock_nifti_image
+    batch = temp_dir / "batch.txt"
+    batch.write_text("flo.nii.gz out.nii.gz\n")
+
+    with (
+        patch("niftyregw.commands.resample.setup_logger"),
+        patch("niftyregw.commands.resample.resample_many") as mock_many,
+    ):
+        app = typer.Typer()
+        app.command()(resample)
+        for option in (["--psf"], ["--psf-algorithm", "1"], ["--verbose-off"]):
+            result = runner.invoke(
+                app, ["-r", str(ref_img), "--batch", str(batch), *option]
+            )
+            assert result.exit_code == 1
+        mock_many.assert_not_called()
+
+
 # Tools tests
+def test_sweep_grid(mock_nifti_image, temp_dir):
+    """Test sweep runs a grid search and reports every trial."""
+    from niftyregw.sweep import Trial
+
+    report = temp_dir / "trials.csv"
+
+    def _fake_sweep(reference, floating, params, output_dir, **kwargs):
+        for number, values in enumerate(params):
+            yield Trial(number, values, score=number, similarity={"nmi": number})
+
+    with (
+        patch("niftyregw.commands.sweep.setup_logger"),
+        patch(
+            "niftyregw.commands.sweep.run_sweep", side_effect=_fake_sweep
+        ) as mock_sweep,
+    ):
+        app = typer.Typer()
+        app.command()(sweep)
+        result = runner.invoke(
+            app,
+            [
+                "-r",
+                str(mock_nifti_image),
+                "-f",
+                str(mock_nifti_image),
+                "-p",
+                "bending_energy=0.001,0.01",
+                "-p",
+                "spacing=5,10",
+                "--no-prune",
+                "--report",
+                str(report),
+            ],
+        )
+
+        assert result.exit_code == 0
+        params = mock_sweep.call_args[0][2]
+        assert len(params) == 4
+        assert mock_sweep.call_args[1]["pruner"] is None
+        assert len(report.read_text().splitlines()) == 5
+
+
+def test_sweep_invalid_parameter(mock_nifti_image):
+    """Test sweep exits with an error for invalid parameters."""
+    with patch("niftyregw.commands.sweep.setup_logger"):
+        app = typer.Typer()
+        app.command()(sweep)
+        result = runner.invoke(
+            app,
+            ["-r", str(mock_nifti_image), "-f", str(mock_nifti_image), "-p", "be"],
+        )
+        assert result.exit_code == 1
+
+
 def test_tools_minimal(mock_nifti_image, temp_dir):
     """Test tools with minimal arguments."""
     input_img = mock_nifti_image
@@ -307,6 +741,92 @@ def test_tools_downsample(mock_nifti_image, temp_dir):
         assert "-down" in args_str
 
 
+def test_tools_chain(mock_nifti_image, temp_dir):
+    """Test tools --chain runs the steps as a ToolsChain."""
+    output = temp_dir / "out.nii.gz"
+
+    with (
+        patch("niftyregw.commands.tools.setup_logger"),
+        patch("niftyregw.commands.tools.run") as mock_run,
+        patch("niftyregw.tools.ToolsChain.apply") as mock_apply,
+    ):
+        app = typer.Typer()
+        app.command()(tools)
+        result = runner.invoke(
+            app,
+            [
+                "-i",
+                str(mock_nifti_image),
+                "-o",
+                str(output),
+                "--chain",
+                "smooth-gaussian 2 2 2",
+                "--chain",
+                "threshold 0.5",
+            ],
+        )
+
+        assert result.exit_code == 0
+        mock_run.assert_not_called()
+        assert mock_apply.call_args[0] == (mock_nifti_image, output)
+
+
+def test_tools_chain_invalid(mock_nifti_image):
+    """Test tools --chain rejects bad steps and other operations."""
+    with patch("niftyregw.commands.tools.setup_logger"):
+        app = typer.Typer()
+        app.command()(tools)
+        result = runner.invoke(app, ["-i", str(mock_nifti_image), "--chain", "blur 2"])
+        assert result.exit_code == 1
+        result = runner.invoke(
+            app,
+            [
+                "-i",
+                str(mock_nifti_image),
+                "--chain",
+                "binarize",
+                "--remove-nan-inf",
+                "0",
+            ],
+        )
+        assert result.exit_code == 1
+
+
+def test_tools_elementwise_in_process(temp_dir):
+    """Test a single element-wise operation runs without reg_tools on request."""
+    import nibabel as nib
+    import numpy as np
+
+    input_img = temp_dir / "in.nii.gz"
+    output = temp_dir / "out.nii.gz"
+    nib.save(nib.Nifti1Image(np.ones((2, 2, 2), np.float32), np.eye(4)), input_img)
+
+    with (
+        patch("niftyregw.commands.tools.setup_logger"),
+        patch("niftyregw.commands.tools.run") as mock_run,
+    ):
+        app = typer.Typer()
+        app.command()(tools)
+        args = ["-i", str(input_img), "--in-process"]
+        result = runner.invoke(app, [*args, "-o", str(output), "--multiply", "3"])
+        assert result.exit_code == 0
+        mock_run.assert_not_called()
+        assert np.asarray(nib.load(output).dataobj).max() == 3
+
+        result = runner.invoke(app, [*args, "--rms", str(output)])
+        assert result.exit_code == 0
+        assert float(result.stdout) == 2
+        mock_run.assert_not_called()
+
+        # reg_tools runs by default, and keeps the type of the input
+        result = runner.invoke(app, ["-i", str(input_img), "--multiply", "3"])
+        assert result.exit_code == 0
+        assert "-mul" in mock_run.call_args[0]
+
+        result = runner.invoke(app, [*args, "--multiply", "3", "--downsample"])
+        assert result.exit_code == 1
+
+
 def test_tools_help():
     """Test tools --help."""
     app = typer.Typer()
@@ -0,0 +1,190 @@
+"""Tests for niftyregw.fanout module."""
+
+import shutil
+from pathlib import Path
+from unittest.mock import patch
+
+import nibabel as nib
+import numpy as np
+import pytest
+
+from niftyregw import fanout as fanout_module
+from niftyregw.fanout import (
+    OutputTemplates,
+    fanout,
+    subject_name,
+    threads_per_worker,
+)
+
+
+def _save(path, data):
+    nib.save(nib.Nifti1Image(np.asarray(data, np.float32), np.eye(4)), path)
+    return path
+
+
+@pytest.fixture
+def images(temp_dir):
+    rng = np.random.default_rng(0)
+    reference = _save(temp_dir / "atlas.nii.gz", rng.random((6, 6, 6)))
+    floatings = [
+        _save(temp_dir / f"sub{i}.nii.gz", rng.random((6, 6, 6))) for i in range(3)
+    ]
+    return reference, floatings
+
+
+def _fake_reg_aladin(reference, floating, *, output_affine, output_result, **kwargs):
+    Path(output_affine).write_text("1 0 0 0\n0 1 0 0\n0 0 1 0\n0 0 0 1\n")
+    if output_result is not None:
+        shutil.copyfile(reference, output_result)
+    return 0
+
+
+def _fake_reg_f3d(reference, floating, *, output_cpp, output_result, **kwargs):
+    shutil.copyfile(floating, output_cpp)
+    shutil.copyfile(reference, output_result)
+    return 1 if "sub1" in str(floating) else 0
+
+
+@pytest.fixture
+def fake_registrations():
+    with (
+        patch.object(fanout_module, "reg_aladin", side_effect=_fake_reg_aladin) as a,
+        patch.object(fanout_module, "reg_f3d", side_effect=_fake_reg_f3d) as f,
+    ):
+        yield a, f
+
+
+def test_fanout(temp_dir, images, fake_registrations):
+    """Test every subject runs reg_aladin then reg_f3d with its own outputs."""
+    reference, floatings = images
+    aladin, f3d = fake_registrations
+    templates = OutputTemplates(cpp="{subject}/{reference}_cpp.nii.gz")
+    results = list(
+        fanout(
+            reference,
+            floatings,
+            temp_dir / "out",
+            templates=templates,
+            max_workers=2,
+            total_threads=8,
+        )
+    )
+
+    assert [result.subject for result in results] == ["sub0", "sub1", "sub2"]
+    assert [result.status for result in results] == ["done", "failed", "done"]
+    assert results[1].f3d_exit_code == 1
+    assert "exited with code 1" in results[1].error
+    assert results[1].similarity == {}
+
+    done = results[0]
+    assert done.aladin_exit_code == done.f3d_exit_code == 0
+    assert done.cpp == temp_dir / "out" / "sub0" / "atlas_cpp.nii.gz"
+    assert done.similarity["ncc"] == pytest.approx(1)
+    assert set(done.as_row()) >= {"aladin_seconds", "f3d_seconds", "ncc", "nmi"}
+
+    # Workers run concurrently, so calls are found by floating image
+    f3d_kwargs = next(c[1] for c in f3d.call_args_list if c[0][1] == floatings[0])
+    assert f3d_kwargs["input_affine"] == temp_dir / "out" / "sub0_affine.txt"
+    assert f3d_kwargs["omp_threads"] == 4
+    assert all(c[1]["output_result"] is None for c in aladin.call_args_list)
+
+
+def test_fanout_floating_mask(temp_dir, images, fake_registrations):
+    """Test the floating mask template is formatted for each subject."""
+    reference, floatings = images
+    aladin, f3d = fake_registrations
+    template = str(temp_dir / "masks" / "{subject}_mask.nii.gz")
+    output_dir = temp_dir / "out"
+    list(
+        fanout(reference, floatings[:1], output_dir, floating_mask=template, metrics=())
+    )
+
+    expected = temp_dir / "masks" / "sub0_mask.nii.gz"
+    assert aladin.call_args[1]["floating_mask"] == expected
+    assert f3d.call_args[1]["floating_mask"] == expected
+
+
+def test_fanout_skip_existing(temp_dir, images, fake_registrations):
+    """Test steps whose outputs exist are not rerun."""
+    reference, floatings = images
+    aladin, f3d = fake_registrations
+    output_dir = temp_dir / "out"
+    list(fanout(reference, floatings[:1], output_dir, metrics=()))
+    (output_dir / "sub0_cpp.nii.gz").unlink()
+
+    results = list(fanout(reference, floatings[:1], output_dir, skip_existing=True))
+    assert aladin.call_count == 1
+    assert f3d.call_count == 2
+    assert results[0].status == "done"
+    assert results[0].aladin_exit_code is None
+
+    results = list(fanout(reference, floatings[:1], output_dir, skip_existing=True))
+    assert results[0].status == "skipped"
+    assert "nmi" in results[0].similarity
+
+
+def test_fanout_skip_existing_reruns_f3d_after_aladin(
+    temp_dir, images, fake_registrations
+):
+    """Test a new affine is not paired with a grid built from the old one."""
+    reference, floatings = images
+    aladin, f3d = fake_registrations
+    output_dir = temp_dir / "out"
+    list(fanout(reference, floatings[:1], output_dir, metrics=()))
+    (output_dir / "sub0_affine.txt").unlink()
+
+    results = list(
+        fanout(reference, floatings[:1], output_dir, skip_existing=True, metrics=())
+    )
+    assert aladin.call_count == f3d.call_count == 2
+    assert results[0].status == "done"
+
+
+def test_fanout_affine_only_and_errors(temp_dir, images, fake_registrations):
+    """Test affine-only runs and that exceptions only fail their subject."""
+    reference, floatings = images
+    aladin, f3d = fake_registrations
+
+    def _fail_first(reference, floating, **kwargs):
+        if "sub0" in str(floating):
+            raise RuntimeError("boom")
+        return _fake_reg_aladin(reference, floating, **kwargs)
+
+    aladin.side_effect = _fail_first
+    results = list(
+        fanout(reference, floatings, temp_dir, affine_only=True, metrics=["ssd"])
+    )
+
+    f3d.assert_not_called()
+    assert results[0].status == "failed"
+    assert results[0].error == "RuntimeError: boom"
+    assert results[0].cpp is None
+    assert [result.status for result in results[1:]] == ["done", "done"]
+    assert results[1].similarity == {"ssd": 0}
+    assert (
+        aladin.call_args_list[1][1]["output_result"] == temp_dir / "sub1_result.nii.gz"
+    )
+
+
+def test_fanout_invalid_metric(temp_dir, images):
+    """Test unknown measures are rejected before registering."""
+    reference, floatings = images
+    with pytest.raises(ValueError, match="Unknown metrics"):
+        list(fanout(reference, floatings, temp_dir, metrics=["mi"]))
+
+
+@pytest.mark.parametrize(
+    ("name", "expected"),
+    [("a/sub.nii.gz", "sub"), ("sub.hdr", "sub"), ("sub.v1.nii", "sub.v1")],
+)
+def test_subject_name(name, expected):
+    """Test NIfTI suffixes are removed from subject names."""
+    assert subject_name(Path(name)) == expected
+
+
+def test_threads_per_worker():
+    """Test the thread budget is split among the workers."""
+    assert threads_per_worker(8, 3) == 2
+    assert threads_per_worker(2, 4) == 1
+    with patch("os.cpu_count", return_value=12):
+        assert threads_per_worker(None, 4) == 3
@@ -0,0 +1,110 @@
+"""Tests for niftyregw.hooks module."""
+
+import os
+import sys
+from importlib.metadata import EntryPoint
+
+import pytest
+from loguru import logger
+
+from niftyregw import hooks
+from niftyregw.hooks import RunHook, load_entry_point_hooks, register_hook
+from niftyregw.wrapper import run
+
+
+@pytest.fixture(autouse=True)
+def no_hooks(monkeypatch):
+    """Start every test without hooks or entry points."""
+    monkeypatch.setattr(hooks, "_hooks", [])
+    monkeypatch.setattr(hooks, "_entry_points_loaded", True)
+
+
+class _Recorder(RunHook):
+    def __init__(self, prefix=()):
+        self.prefix = list(prefix)
+        self.lines = []
+        self.results = []
+
+    def before_spawn(self, context):
+        context.argv[:0] = self.prefix
+        context.set_env(NIFTYREGW_HOOKED="1")
+        context.state["lines"] = 0
+
+    def on_line(self, context, line):
+        context.state["lines"] += 1
+        self.lines.append(line)
+
+    def after_exit(self, context, result):
+        self.results.append((result, context.state["lines"]))
+
+
+@pytest.mark.skipif(sys.platform == "win32", reason="Uses a shell script")
+def test_hooks_rewrite_and_observe(temp_dir, fake_niftyreg):
+    """Test hooks prefix the command, set its environment and see its results."""
+    fake_niftyreg.configure("reg_tools", lines=5, exit_code=2)
+    wrapper_script = temp_dir / "wrap.sh"
+    wrapper_script.write_text(
+        f'#!/bin/sh\necho "$NIFTYREGW_HOOKED $(basename $1)" > {temp_dir}/wrapped\n'
+        'exec "$@"\n'
+    )
+    wrapper_script.chmod(0o755)
+    recorder = register_hook(_Recorder([str(wrapper_script)]))
+
+    assert run("reg_tools", "-in", "a.nii") == 2
+
+    assert (temp_dir / "wrapped").read_text() == "1 reg_tools\n"
+    assert fake_niftyreg.calls("reg_tools") == [["-in", "a.nii"]]
+    assert len(recorder.lines) == 6
+    ((result, lines),) = recorder.results
+    assert lines == 6
+    assert result.tool == "reg_tools"
+    assert result.argv[0] == str(wrapper_script)
+    assert result.returncode == 2
+    assert result.wall_seconds > 0
+    if hasattr(os, "wait4"):
+        assert result.usage.cpu_seconds > 0
+
+
+def test_hook_errors(fake_niftyreg):
+    """Test line and exit hook errors are logged, spawn errors stop the run."""
+
+    class _Broken(RunHook):
+        def on_line(self, context, line):
+            raise RuntimeError("line")
+
+        def after_exit(self, context, result):
+            raise RuntimeError("exit")
+
+    errors = []
+    handler = logger.add(lambda m: errors.append(m.record["message"]), level="ERROR")
+    try:
+        register_hook(_Broken())
+        fake_niftyreg.configure("reg_tools", lines=3)
+        assert run("reg_tools") == 0
+    finally:
+        logger.remove(handler)
+    assert errors == ["_Broken.on_line failed"] * 3 + ["_Broken.after_exit failed"]
+
+    class _Refuse(RunHook):
+        def before_spawn(self, context):
+            raise PermissionError("not staged")
+
+    register_hook(_Refuse())
+    with pytest.raises(PermissionError, match="not staged"):
+        run("reg_tools")
+
+
+def test_entry_points(monkeypatch):
+    """Test hooks are loaded from entry points, skipping broken ones."""
+    group = hooks.ENTRY_POINT_GROUP
+    points = [
+        EntryPoint("base", "niftyregw.hooks:RunHook", group),
+        EntryPoint("broken", "niftyregw_missing_plugin:Hook", group),
+    ]
+    monkeypatch.setattr(hooks, "entry_points", lambda group: points)
+    monkeypatch.setattr(hooks, "_entry_points_loaded", False)
+
+    (hook,) = hooks.get_hooks()
+    assert type(hook) is RunHook
+    assert hooks.get_hooks() == (hook,)
+    assert load_entry_point_hooks() == [hooks.get_hooks()[1]]
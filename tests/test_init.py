@@ -19,6 +19,7 @@ def test_exported_functions():
     assert hasattr(niftyregw, "download_niftyreg")
     assert hasattr(niftyregw, "get_platform")
     assert hasattr(niftyregw, "reg_aladin")
+    assert hasattr(niftyregw, "reg_f3d")
     assert hasattr(niftyregw, "run")
 
 
@@ -27,8 +28,9 @@ def test_all_exports():
     assert "download_niftyreg" in niftyregw.__all__
     assert "get_platform" in niftyregw.__all__
     assert "reg_aladin" in niftyregw.__all__
+    assert "reg_f3d" in niftyregw.__all__
     assert "run" in niftyregw.__all__
-    assert len(niftyregw.__all__) == 4
+    assert len(niftyregw.__all__) == 5
 
 
 def test_callable_exports():
@@ -36,4 +38,5 @@ def test_callable_exports():
     assert callable(niftyregw.download_niftyreg)
     assert callable(niftyregw.get_platform)
     assert callable(niftyregw.reg_aladin)
+    assert callable(niftyregw.reg_f3d)
     assert callable(niftyregw.run)
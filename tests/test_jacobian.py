@@ -0,0 +1,179 @@
+"""Tests for niftyregw.jacobian module."""
+
+from pathlib import Path
+from unittest.mock import patch
+
+import nibabel as nib
+import numpy as np
+import pytest
+
+from niftyregw import jacobian
+from niftyregw.jacobian import (
+    FoldCheck,
+    count_folded_voxels,
+    jacobian_stats,
+    summarise_jacobian_map,
+)
+from niftyregw.wrapper import RunError
+
+
+def _save(path, data):
+    nib.save(nib.Nifti1Image(np.asarray(data), np.eye(4)), path)
+    return path
+
+
+@pytest.fixture
+def determinant():
+    rng = np.random.default_rng(0)
+    data = np.exp(rng.normal(0, 0.2, size=(10, 9, 20))).astype(np.float32)
+    data[0, 0, :5] = -0.5
+    data[1, 1, 3] = 0
+    data[2, 2, 2] = np.nan
+    return data
+
+
+@pytest.fixture
+def labels():
+    data = np.zeros((10, 9, 20), np.int16)
+    data[:5] = 1
+    data[5:, :, 10:] = 7
+    return data
+
+
+def _expected(values, percentiles=(5, 50, 95)):
+    values = values[np.isfinite(values)]
+    positive = values[values > 0]
+    log_det = np.log(positive.astype(np.float64))
+    return {
+        "voxels": values.size,
+        "folded": int((values <= 0).sum()),
+        "mean": log_det.mean(),
+        "std": log_det.std(),
+        "percentiles": np.percentile(log_det, percentiles),
+    }
+
+
+def _check(row, expected):
+    assert row["voxels"] == expected["voxels"]
+    assert row["folded"] == expected["folded"]
+    assert row["folded_fraction"] == pytest.approx(
+        expected["folded"] / expected["voxels"]
+    )
+    assert row["log_jacobian_mean"] == pytest.approx(expected["mean"])
+    assert row["log_jacobian_std"] == pytest.approx(expected["std"])
+    for q, value in zip((5, 50, 95), expected["percentiles"]):
+        assert row[f"log_jacobian_p{q}"] == pytest.approx(value, abs=0.01)
+
+
+@pytest.mark.parametrize("slab_size", [1, 3, 16, 100])
+def test_summarise_whole_image(temp_dir, determinant, slab_size):
+    """Test whole-image statistics do not depend on the slab size."""
+    path = _save(temp_dir / "jac.nii", determinant)
+    rows = summarise_jacobian_map(path, slab_size=slab_size)
+    assert len(rows) == 1
+    assert rows[0]["label"] is None
+    _check(rows[0], _expected(determinant))
+
+
+def test_summarise_per_label(temp_dir, determinant, labels):
+    """Test per-label statistics ignore the background label."""
+    path = _save(temp_dir / "jac.nii", determinant)
+    parcellation = _save(temp_dir / "labels.nii.gz", labels)
+    rows = summarise_jacobian_map(path, parcellation=parcellation, slab_size=4)
+    assert [row["label"] for row in rows] == [1, 7]
+    for row in rows:
+        _check(row, _expected(determinant[labels == row["label"]]))
+
+
+def test_summarise_custom_percentiles(temp_dir, determinant):
+    """Test requested percentiles become columns."""
+    path = _save(temp_dir / "jac.nii", determinant)
+    row = summarise_jacobian_map(path, percentiles=(1, 99.5))[0]
+    assert "log_jacobian_p1" in row
+    assert "log_jacobian_p99.5" in row
+
+
+def test_summarise_shape_mismatch(temp_dir, determinant):
+    """Test the parcellation must be on the map grid."""
+    path = _save(temp_dir / "jac.nii", determinant)
+    parcellation = _save(temp_dir / "labels.nii.gz", np.ones((4, 4, 4), np.int16))
+    with pytest.raises(ValueError, match="does not match"):
+        summarise_jacobian_map(path, parcellation=parcellation)
+
+
+def test_summarise_all_folded(temp_dir):
+    """Test statistics of a fully folded map."""
+    path = _save(temp_dir / "jac.nii", -np.ones((3, 3, 3), np.float32))
+    row = summarise_jacobian_map(path)[0]
+    assert row["folded_fraction"] == 1
+    assert np.isnan(row["log_jacobian_mean"])
+    assert np.isnan(row["log_jacobian_p50"])
+
+
+def _fake_reg_jacobian(data):
+    def _run(tool, *args, **kwargs):
+        _save(Path(args[args.index("-jac") + 1]), data)
+        return 0
+
+    return _run
+
+
+def test_jacobian_stats_deletes_map(temp_dir, determinant):
+    """Test the intermediate map lives in a temporary directory."""
+    outputs = []
+
+    def _run(tool, *args, **kwargs):
+        outputs.append(Path(args[args.index("-jac") + 1]))
+        return _fake_reg_jacobian(determinant)(tool, *args, **kwargs)
+
+    with patch.object(jacobian, "run", side_effect=_run) as mock_run:
+        rows = jacobian_stats(Path("cpp.nii.gz"), Path("ref.nii.gz"), omp_threads=2)
+
+    args = mock_run.call_args[0]
+    assert args[0] == "reg_jacobian"
+    assert args[args.index("-ref") + 1] == "ref.nii.gz"
+    assert args[args.index("-omp") + 1] == "2"
+    assert outputs[0].suffix == ".nii"
+    assert not outputs[0].exists()
+    assert rows[0]["subject"] == "cpp.nii.gz"
+    _check(rows[0], _expected(determinant))
+
+
+def test_jacobian_stats_keep_map(temp_dir, determinant):
+    """Test the map can be kept and the subject named."""
+    keep = temp_dir / "jac.nii"
+    with patch.object(jacobian, "run", side_effect=_fake_reg_jacobian(determinant)):
+        rows = jacobian_stats(Path("cpp.nii.gz"), subject="sub-01", keep_map=keep)
+    assert keep.exists()
+    assert rows[0]["subject"] == "sub-01"
+
+
+@pytest.mark.parametrize("slab_size", [1, 7, 100])
+def test_count_folded_voxels(temp_dir, determinant, slab_size):
+    """Test non-positive, but not non-finite, voxels are counted."""
+    path = _save(temp_dir / "jac.nii", determinant)
+    assert count_folded_voxels(path, slab_size=slab_size) == 6
+
+
+def test_fold_check_count_folded(determinant):
+    """Test the fold check computes the map of the grid in scratch."""
+    with patch.object(jacobian, "run", side_effect=_fake_reg_jacobian(determinant)):
+        folded = FoldCheck().count_folded(Path("cpp.nii"), Path("ref.nii"))
+    assert folded == 6
+
+
+def test_fold_check_reg_jacobian_fails():
+    """Test the fold check raises instead of reading a missing map."""
+    with (
+        patch.object(jacobian, "run", return_value=1),
+        pytest.raises(RunError, match="reg_jacobian exited with code 1"),
+    ):
+        FoldCheck().count_folded(Path("cpp.nii"), Path("ref.nii"))
+
+
+def test_fold_check_escalate():
+    """Test regularisation weights grow by the factor on each retry."""
+    check = FoldCheck(factor=2, jacobian_log_weight=0.1)
+    assert check.escalate(None, None) == pytest.approx((0.002, 0.1))
+    assert check.escalate(0.01, 0) == pytest.approx((0.02, 0.1))
+    assert check.escalate(0.01, 0.5) == pytest.approx((0.02, 1.0))
@@ -0,0 +1,71 @@
+"""Tests for niftyregw.joblog module."""
+
+import io
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+from loguru import logger
+
+from niftyregw import joblog
+from niftyregw.commands import setup_logger
+from niftyregw.enums import LogLevel
+from niftyregw.joblog import install_job_routing, job_context
+from niftyregw.wrapper import run
+
+
+@pytest.fixture
+def router(monkeypatch):
+    """Install job routing with a default destination, then remove it."""
+    monkeypatch.setattr(joblog, "_router", None)
+    default = io.StringIO()
+    yield install_job_routing(default=default)
+    logger.remove()
+
+
+def test_concurrent_jobs_are_routed(temp_dir, router, fake_niftyreg):
+    """Test the records of concurrent jobs, with their output, reach their file."""
+    fake_niftyreg.configure("reg_tools", lines=50, line_rate=500)
+
+    def _job(job_id):
+        with job_context(job_id, temp_dir / f"{job_id}.log"):
+            logger.bind(executable="niftyregw").info(f"Starting {job_id}")
+            run("reg_tools", job_id, tool_logger=logger.bind(executable="reg_tools"))
+
+    with ThreadPoolExecutor(4) as executor:
+        list(executor.map(_job, [f"job{i}" for i in range(4)]))
+    logger.info("Outside")
+
+    for i in range(4):
+        lines = (temp_dir / f"job{i}.log").read_text().splitlines()
+        assert f"Starting job{i}" in lines[0]
+        assert len(lines) == 51
+        assert all("| niftyregw |" in line or "reg_tools" in line for line in lines)
+    assert "Outside" in router.default.getvalue()
+    assert router.jobs() == []
+
+
+def test_sinks_are_kept(router):
+    """Test routing adds one sink, which setup_logger leaves alone."""
+    handlers = dict(logger._core.handlers)
+    assert len(handlers) == 1
+    assert install_job_routing() is router
+    setup_logger(LogLevel.INFO)
+    assert dict(logger._core.handlers) == handlers
+
+
+def test_log_file_requires_routing(temp_dir, monkeypatch):
+    """Test job_context only tags records without routing."""
+    monkeypatch.setattr(joblog, "_router", None)
+    records = []
+    handler = logger.add(lambda m: records.append(m.record["extra"]["job_id"]))
+    try:
+        with job_context(7):
+            logger.info("tagged")
+        with (
+            pytest.raises(RuntimeError, match="install_job_routing"),
+            job_context(8, temp_dir / "8.log"),
+        ):
+            pass
+    finally:
+        logger.remove(handler)
+    assert records == [7]
@@ -0,0 +1,263 @@
+"""Tests for niftyregw.jobqueue module."""
+
+import os
+import sqlite3
+import subprocess
+import sys
+import time
+from unittest.mock import patch
+
+import pytest
+
+from niftyregw import jobqueue
+from niftyregw.jobqueue import JobQueue, execute, run_worker
+
+
+@pytest.fixture
+def queue(temp_dir):
+    return JobQueue(temp_dir / "jobs.db", lease_seconds=60, retry_delay=0)
+
+
+def test_submit_claim_complete(queue):
+    """Test jobs are claimed in order, once, and completed."""
+    first = queue.submit("run", {"tool": "reg_tools", "args": ["-in", "a.nii"]})
+    second = queue.submit("reg_aladin", {"reference": "r.nii", "floating": "f.nii"})
+
+    job = queue.claim("w1")
+    assert job.id == first
+    assert job.payload == {"tool": "reg_tools", "args": ["-in", "a.nii"]}
+    assert job.attempts == 1
+    assert queue.claim("w2").id == second
+    assert queue.claim("w3") is None
+
+    assert not queue.complete(first, "w2")
+    assert queue.complete(first, "w1")
+    assert queue.counts() == {"pending": 0, "running": 1, "done": 1, "failed": 0}
+
+
+def test_retries_with_backoff(temp_dir):
+    """Test failed attempts wait before a retry and finally fail."""
+    queue = JobQueue(temp_dir / "jobs.db", retry_delay=1000)
+    job_id = queue.submit("run", {"tool": "reg_tools"}, max_attempts=2)
+    queue.claim("w1")
+    assert queue.fail(job_id, "w1", "boom", returncode=1)
+    # The retry is not due yet
+    assert queue.claim("w1") is None
+
+    with patch.object(jobqueue.time, "time", return_value=time.time() + 1001):
+        assert queue.claim("w1").attempts == 2
+        queue.fail(job_id, "w1", "boom again")
+    (job,) = queue.jobs("failed")
+    assert job.error == "boom again"
+
+
+def test_dead_worker_recovery(temp_dir):
+    """Test jobs whose lease expired are given to another worker."""
+    queue = JobQueue(temp_dir / "jobs.db", lease_seconds=0.05, retry_delay=0)
+    job_id = queue.submit("run", {"tool": "reg_tools"})
+    queue.claim("dead")
+    assert queue.heartbeat(job_id, "dead")
+    time.sleep(0.1)
+
+    job = queue.claim("alive")
+    assert job.id == job_id
+    assert job.attempts == 2
+    assert "dead lost its lease" in job.error
+    assert not queue.heartbeat(job_id, "dead")
+    assert not queue.complete(job_id, "dead")
+    assert queue.complete(job_id, "alive")
+
+
+@pytest.mark.parametrize(
+    ("kind", "payload", "match"),
+    [
+        ("reg_tools", {}, "Unknown job kind"),
+        ("run", {"args": []}, "'tool'"),
+        ("reg_f3d", {"reference": "r.nii"}, "'floating'"),
+    ],
+)
+def test_submit_invalid(queue, kind, payload, match):
+    """Test invalid jobs are rejected."""
+    with pytest.raises(ValueError, match=match):
+        queue.submit(kind, payload)
+
+
+def test_execute_dispatches_to_wrapper(queue):
+    """Test jobs run through run, reg_aladin and reg_f3d."""
+    queue.submit("run", {"tool": "reg_tools", "args": ["-in", 1]})
+    queue.submit("reg_f3d", {"reference": "r.nii", "floating": "f.nii", "be": 1})
+    with (
+        patch.object(jobqueue, "run", return_value=0) as mock_run,
+        patch.object(jobqueue, "reg_f3d", return_value=0) as mock_f3d,
+    ):
+        assert execute(queue.claim("w")) == 0
+        execute(queue.claim("w"))
+    assert mock_run.call_args[0] == ("reg_tools", "-in", "1")
+    mock_f3d.assert_called_once_with(
+        reference="r.nii", floating="f.nii", be=1, on_line=None
+    )
+
+
+def test_run_worker(queue):
+    """Test a worker completes, retries and fails jobs until the queue is empty."""
+    ok = queue.submit("run", {"tool": "ok"})
+    flaky = queue.submit("run", {"tool": "flaky"}, max_attempts=2)
+    broken = queue.submit("run", {"tool": "broken"}, max_attempts=1)
+    attempts = []
+
+    def _run(tool, *args, **kwargs):
+        attempts.append(tool)
+        if tool == "broken":
+            raise FileNotFoundError("broken not found")
+        return 1 if tool == "flaky" and attempts.count("flaky") == 1 else 0
+
+    with patch.object(jobqueue, "run", side_effect=_run):
+        count = run_worker(queue, worker="w", poll_interval=0.01, exit_when_empty=True)
+
+    assert count == 4
+    jobs = {job.id: job for job in queue.jobs()}
+    assert jobs[ok].status == jobs[flaky].status == "done"
+    assert jobs[flaky].attempts == 2
+    assert jobs[broken].status == "failed"
+    assert jobs[broken].error == "FileNotFoundError: broken not found"
+
+
+def test_run_worker_counts_only_when_needed(queue):
+    """Test jobs are counted when the queue is empty, or after every claim."""
+    for _ in range(3):
+        queue.submit("run", {"tool": "ok"})
+    with (
+        patch.object(jobqueue, "run", return_value=0),
+        patch.object(queue, "counts", wraps=queue.counts) as mock_counts,
+    ):
+        run_worker(queue, worker="w", exit_when_empty=True)
+        assert mock_counts.call_count == 1
+        queue.submit("run", {"tool": "ok"})
+        run_worker(queue, worker="w", exit_when_empty=True, metrics=True)
+        assert mock_counts.call_count == 3
+
+
+def test_run_worker_lost_lease(temp_dir):
+    """Test a job whose lease is lost is terminated and left to other workers."""
+    queue = JobQueue(temp_dir / "jobs.db", lease_seconds=0.03)
+    job_id = queue.submit("run", {"tool": "reg_tools"})
+    terminated = []
+
+    def _run(tool, *args, on_line=None, **kwargs):
+        # Prints a line every 10 ms until on_line asks to terminate
+        for _ in range(500):
+            if on_line("line"):
+                terminated.append(tool)
+                return -15
+            time.sleep(0.01)
+        return 0
+
+    with (
+        patch.object(jobqueue, "run", side_effect=_run),
+        patch.object(queue, "heartbeat", return_value=False),
+    ):
+        assert run_worker(queue, worker="w", max_jobs=1) == 1
+
+    assert terminated == ["reg_tools"]
+    (job,) = queue.jobs()
+    assert job.id == job_id
+    # Neither completed nor failed by the worker that lost the lease
+    assert job.status == "running"
+    assert job.returncode is None
+
+
+def test_run_worker_database_errors(temp_dir):
+    """Test database errors give up the lease and do not stop the worker."""
+    queue = JobQueue(temp_dir / "jobs.db", lease_seconds=0.03)
+    queue.submit("run", {"tool": "reg_tools"})
+    queue.submit("run", {"tool": "reg_tools"})
+    terminated = []
+
+    def _run(tool, *args, on_line=None, **kwargs):
+        for _ in range(500):
+            if on_line("line"):
+                terminated.append(tool)
+                return -15
+            time.sleep(0.01)
+        return 0
+
+    locked = sqlite3.OperationalError("database is locked")
+    with (
+        patch.object(jobqueue, "run", side_effect=_run),
+        patch.object(queue, "heartbeat", side_effect=locked),
+        patch.object(queue, "complete", side_effect=locked),
+    ):
+        assert run_worker(queue, worker="w", max_jobs=1) == 1
+    assert terminated == ["reg_tools"]
+
+    with (
+        patch.object(jobqueue, "run", return_value=0),
+        patch.object(queue, "complete", side_effect=locked) as mock_complete,
+    ):
+        assert run_worker(queue, worker="w", max_jobs=1) == 1
+    mock_complete.assert_called_once()
+
+
+def test_run_worker_log_dir(queue, temp_dir, fake_niftyreg, monkeypatch):
+    """Test a worker writes the output of every job to its own log file."""
+    from loguru import logger
+
+    from niftyregw import joblog
+
+    monkeypatch.setattr(joblog, "_router", None)
+    fake_niftyreg.configure("reg_tools", lines=5, stderr_ratio=0)
+    ids = [queue.submit("run", {"tool": "reg_tools", "args": [a]}) for a in "ab"]
+    try:
+        run_worker(queue, worker="w", exit_when_empty=True, log_dir=temp_dir / "logs")
+    finally:
+        logger.remove()
+
+    for job_id in ids:
+        lines = (temp_dir / "logs" / f"job_{job_id}.log").read_text().splitlines()
+        assert len(lines) == 5
+        assert all("| reg_tools |" in line for line in lines)
+
+
+@pytest.mark.skipif(sys.platform == "win32", reason="Uses a shell script")
+def test_several_worker_processes(temp_dir):
+    """Test local worker processes share the queue and run every job once."""
+    bin_dir = temp_dir / "bin"
+    bin_dir.mkdir()
+    tool = bin_dir / "reg_tools"
+    # Fails once if given a marker, then appends to its output
+    tool.write_text(
+        '#!/bin/sh\nif [ -n "$2" ] && [ ! -e "$2" ]; then touch "$2"; exit 1; fi\n'
+        'echo ok >> "$1"\n'
+    )
+    tool.chmod(0o755)
+
+    queue_path = temp_dir / "jobs.db"
+    queue = JobQueue(queue_path)
+    outputs = [temp_dir / f"out{i}.txt" for i in range(12)]
+    jobs = [("run", {"tool": "reg_tools", "args": [str(path)]}) for path in outputs]
+    jobs[0][1]["args"].append(str(temp_dir / "marker"))
+    queue.submit_many(jobs)
+
+    env = {**os.environ, "PATH": f"{bin_dir}{os.pathsep}{os.environ['PATH']}"}
+    command = [
+        sys.executable,
+        "-m",
+        "niftyregw",
+        "worker",
+        "--queue",
+        str(queue_path),
+        "--poll-interval",
+        "0.05",
+        "--retry-delay",
+        "0",
+        "--exit-when-empty",
+        "--log",
+        "WARNING",
+    ]
+    workers = [subprocess.Popen(command, env=env) for _ in range(3)]
+    for process in workers:
+        assert process.wait(timeout=60) == 0
+
+    assert queue.counts()["done"] == 12
+    assert [path.read_text() for path in outputs] == ["ok\n"] * 12
+    assert queue.jobs()[0].attempts == 2
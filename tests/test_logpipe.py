@@ -0,0 +1,100 @@
+"""Tests for niftyregw.logpipe module."""
+
+import contextvars
+import sys
+import time
+
+import pytest
+
+from niftyregw import logpipe, wrapper
+from niftyregw.logpipe import LogPipeline
+
+
+def _slow_sink(logged):
+    def _log(message):
+        time.sleep(0.005)
+        logged.append(message)
+
+    return _log
+
+
+def test_slow_sink_does_not_block_readers():
+    """Test lines are dropped instead of waiting, except warnings."""
+    pipeline = LogPipeline(maxsize=5, policy="drop")
+    logged, warnings = [], []
+    start = time.perf_counter()
+    for i in range(100):
+        pipeline.submit(_slow_sink(logged), f"line {i}")
+    pipeline.submit(warnings.append, "warning", important=True)
+    assert time.perf_counter() - start < 0.4
+
+    pipeline.flush()
+    stats = pipeline.stats()
+    assert warnings == ["warning"]
+    assert stats.lines == 101
+    assert stats.dropped > 0
+    assert stats.emitted + stats.dropped == 101
+    assert logged == sorted(logged, key=lambda line: int(line.split()[1]))
+
+
+def test_block_and_sample_policies():
+    """Test stalls are counted and one line in N is kept when sampling."""
+    pipeline = LogPipeline(maxsize=2, policy="block")
+    logged = []
+    for i in range(20):
+        pipeline.submit(_slow_sink(logged), str(i))
+    pipeline.flush()
+    stats = pipeline.stats()
+    assert logged == [str(i) for i in range(20)]
+    assert stats.stalls > 0
+    assert stats.stall_seconds > 0
+    assert stats.dropped == 0
+
+    pipeline = LogPipeline(maxsize=1, policy="sample", sample_every=5)
+    logged = []
+    for i in range(1, 51):
+        pipeline.submit(_slow_sink(logged), str(i))
+    pipeline.flush()
+    # Lines kept under pressure are multiples of 5
+    assert {str(i) for i in range(5, 51, 5)} <= set(logged)
+    assert pipeline.stats().dropped == 50 - len(logged) > 0
+
+    with pytest.raises(ValueError, match="Unknown policy"):
+        LogPipeline(policy="wait")
+
+
+def test_lines_are_logged_in_their_context():
+    """Test lines are logged in the context given, or the submitting one."""
+    job = contextvars.ContextVar("job", default=None)
+    pipeline = LogPipeline()
+    logged = []
+
+    def _log(message):
+        logged.append((message, job.get()))
+
+    job.set("a")
+    context = contextvars.copy_context()
+    job.set("b")
+    pipeline.submit(_log, "given", context=context)
+    pipeline.submit(_log, "current")
+    pipeline.flush()
+    assert logged == [("given", "a"), ("current", "b")]
+
+
+@pytest.mark.skipif(sys.platform == "win32", reason="The fake binaries are scripts")
+def test_run_logs_every_line_before_returning(fake_niftyreg):
+    """Test run drains the pipes into the queue and emits lines before it returns."""
+    fake_niftyreg.configure("reg_tools", lines=300, stderr_ratio=0)
+    pipeline = logpipe.configure_log_pipeline(maxsize=50, policy="block")
+    logged = []
+    try:
+        wrapper.run("reg_tools", tool_logger=_Logger(logged))
+    finally:
+        logpipe.configure_log_pipeline()
+    assert logged == [f"reg_tools step {i}" for i in range(1, 301)]
+    assert pipeline.stats().emitted == 300
+
+
+class _Logger:
+    def __init__(self, logged):
+        self.info = logged.append
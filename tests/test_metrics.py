@@ -0,0 +1,107 @@
+"""Tests for niftyregw.metrics module."""
+
+import urllib.request
+
+import pytest
+
+from niftyregw import metrics, wrapper
+from niftyregw.logpipe import LogStats
+from niftyregw.metrics import (
+    MetricsRegistry,
+    ResourceUsage,
+    TextfileExporter,
+    serve_metrics,
+)
+
+
+@pytest.fixture
+def registry(monkeypatch):
+    """Replace the registry used by run."""
+    registry = MetricsRegistry()
+    monkeypatch.setattr(metrics, "_registry", registry)
+    return registry
+
+
+def _value(text, line_start):
+    (line,) = [line for line in text.splitlines() if line.startswith(line_start)]
+    return float(line.rsplit(" ", 1)[1])
+
+
+def test_runs_are_recorded(registry, fake_niftyreg):
+    """Test run records invocations, failures, time and resources per binary."""
+    fake_niftyreg.configure("reg_tools", cpu_seconds=0.2, lines=1)
+    fake_niftyreg.configure("reg_jacobian", exit_code=1, lines=1)
+    wrapper.run("reg_tools")
+    wrapper.run("reg_tools")
+    wrapper.run("reg_jacobian")
+
+    text = registry.render()
+    assert _value(text, 'niftyregw_runs_total{binary="reg_tools"}') == 2
+    assert _value(text, 'niftyregw_run_failures_total{binary="reg_tools"}') == 0
+    assert _value(text, 'niftyregw_run_failures_total{binary="reg_jacobian"}') == 1
+    cpu = _value(text, 'niftyregw_run_cpu_seconds_sum{binary="reg_tools"}')
+    assert 0.4 <= cpu < 5
+    # The fake binaries are Python interpreters, so more than 1 MiB
+    rss = _value(text, 'niftyregw_run_peak_rss_bytes_sum{binary="reg_jacobian"}')
+    assert rss > 1024**2
+    assert _value(text, 'niftyregw_run_wall_seconds_count{binary="reg_tools"}') == 2
+    assert _value(text, "niftyregw_log_lines_dropped_total") == 0
+
+
+def test_log_pipeline_counters(monkeypatch):
+    """Test the dropped lines and stalls of the log pipeline are exported."""
+    stats = LogStats(lines=10, dropped=2, stalls=3, stall_seconds=1.5)
+    monkeypatch.setattr(metrics, "get_log_pipeline", lambda: _Pipeline(stats))
+    text = MetricsRegistry().render()
+    assert _value(text, "niftyregw_log_lines_dropped_total") == 2
+    assert _value(text, "niftyregw_log_stalls_total") == 3
+    assert _value(text, "niftyregw_log_stall_seconds_total") == 1.5
+    assert "# TYPE niftyregw_log_stalls_total counter" in text
+
+
+class _Pipeline:
+    def __init__(self, stats):
+        self._stats = stats
+
+    def stats(self):
+        return self._stats
+
+
+def test_histogram_and_queue():
+    """Test histogram buckets are cumulative and queue counts are gauges."""
+    registry = MetricsRegistry()
+    usage = ResourceUsage(
+        cpu_seconds=3.0, peak_rss_bytes=100 * 1024**2, read_bytes=512, written_bytes=0
+    )
+    for seconds in (0.5, 10, 10000):
+        registry.record_run("reg_f3d", 0, seconds, usage)
+    registry.set_queue_jobs({"pending": 4, "running": 1})
+
+    text = registry.render()
+    wall = 'niftyregw_run_wall_seconds_bucket{binary="reg_f3d",le='
+    assert _value(text, wall + '"1"}') == 1
+    assert _value(text, wall + '"15"}') == 2
+    assert _value(text, wall + '"7200"}') == 2
+    assert _value(text, wall + '"+Inf"}') == 3
+    assert _value(text, 'niftyregw_run_read_bytes_total{binary="reg_f3d"}') == 1536
+    assert _value(text, 'niftyregw_queue_jobs{status="pending"}') == 4
+    assert "# TYPE niftyregw_run_wall_seconds histogram" in text
+
+
+def test_textfile_and_http(temp_dir):
+    """Test the exporter writes the file on exit and the server serves it."""
+    registry = MetricsRegistry()
+    path = temp_dir / "niftyregw.prom"
+    with TextfileExporter(path, interval=0.01, registry=registry):
+        registry.record_run("reg_aladin", 0, 2.0)
+    assert 'niftyregw_runs_total{binary="reg_aladin"} 1' in path.read_text()
+    assert [p.name for p in temp_dir.iterdir()] == ["niftyregw.prom"]
+
+    server = serve_metrics(registry=registry)
+    try:
+        host, port = server.server_address[:2]
+        with urllib.request.urlopen(f"http://{host}:{port}/metrics") as response:
+            assert response.read().decode() == registry.render()
+    finally:
+        server.shutdown()
+        server.server_close()
@@ -0,0 +1,110 @@
+"""Tests for niftyregw.pairwise module."""
+
+import json
+from pathlib import Path
+from unittest.mock import patch
+
+import numpy as np
+import pytest
+
+from niftyregw import pairwise
+from niftyregw.chain import read_affine, write_affine
+from niftyregw.pairwise import CompletionMatrix, pair_order, register_all_pairs
+
+
+def _matrix(i, j):
+    matrix = np.eye(4)
+    matrix[:3, 3] = [i, j, i * j]
+    matrix[0, 1] = 0.1 * (j - i)
+    return matrix
+
+
+def _fake_reg_aladin(reference, floating, *, output_affine, **kwargs):
+    i, j = int(Path(reference).name[3]), int(Path(floating).name[3])
+    write_affine(_matrix(i, j), output_affine)
+    return 0
+
+
+@pytest.fixture
+def images(temp_dir):
+    paths = [temp_dir / f"img{i}.nii.gz" for i in range(4)]
+    for path in paths:
+        path.touch()
+    return paths
+
+
+def test_pair_order():
+    """Test each pair appears once and consecutive jobs share an image."""
+    pairs = pair_order(5)
+    assert sorted(pairs) == [(i, j) for i in range(5) for j in range(i + 1, 5)]
+    assert all(set(a) & set(b) for a, b in zip(pairs, pairs[1:]))
+    assert pair_order(1) == []
+
+
+def test_register_all_pairs(temp_dir, images):
+    """Test one registration runs per pair and the inverse gives the other."""
+    output_dir = temp_dir / "out"
+    checkpoint = temp_dir / "done.json"
+    with patch.object(
+        pairwise, "reg_aladin", side_effect=_fake_reg_aladin
+    ) as mock_aladin:
+        matrix = register_all_pairs(
+            images, output_dir, checkpoint=checkpoint, max_workers=2, total_threads=4
+        )
+
+    assert matrix.complete
+    assert mock_aladin.call_count == 6
+    assert mock_aladin.call_args[1]["omp_threads"] == 2
+    forward = read_affine(output_dir / "img3_to_img1_affine.txt")
+    backward = read_affine(output_dir / "img1_to_img3_affine.txt")
+    np.testing.assert_allclose(forward, _matrix(1, 3))
+    np.testing.assert_allclose(backward @ forward, np.eye(4), atol=1e-9)
+    assert np.asarray(json.loads(checkpoint.read_text())["done"]).all()
+
+    # A completed run is skipped entirely
+    with patch.object(pairwise, "reg_aladin") as mock_aladin:
+        register_all_pairs(images, output_dir, checkpoint=checkpoint)
+    mock_aladin.assert_not_called()
+
+
+def test_register_all_pairs_resumes(temp_dir, images):
+    """Test failed pairs stay undone and are retried from the checkpoint."""
+    checkpoint = temp_dir / "done.json"
+
+    def _fail_one(reference, floating, **kwargs):
+        if (
+            Path(floating).name == "img2.nii.gz"
+            and Path(reference).name == "img0.nii.gz"
+        ):
+            return 1
+        return _fake_reg_aladin(reference, floating, **kwargs)
+
+    with patch.object(pairwise, "reg_aladin", side_effect=_fail_one):
+        matrix = register_all_pairs(images, temp_dir, checkpoint=checkpoint)
+    assert not matrix.complete
+    assert not matrix.done[0, 2] and not matrix.done[2, 0]
+    assert matrix.done.sum() == 16 - 2
+
+    with patch.object(
+        pairwise, "reg_aladin", side_effect=_fake_reg_aladin
+    ) as mock_aladin:
+        matrix = register_all_pairs(images, temp_dir, checkpoint=checkpoint)
+    assert matrix.complete
+    assert mock_aladin.call_count == 1
+
+
+def test_checkpoint_for_other_images(temp_dir, images):
+    """Test a checkpoint of a different image list is rejected."""
+    checkpoint = temp_dir / "done.json"
+    CompletionMatrix(images[:3], checkpoint).mark(0, 1)
+    with pytest.raises(ValueError, match="different image list"):
+        CompletionMatrix(images, checkpoint)
+
+
+def test_register_all_pairs_validation(temp_dir, images):
+    """Test asymmetric registrations and duplicate names are rejected."""
+    with pytest.raises(ValueError, match="symmetric"):
+        register_all_pairs(images, temp_dir, aladin_options={"no_symmetric": True})
+    duplicate = temp_dir / "sub" / "img0.nii"
+    with pytest.raises(ValueError, match="unique"):
+        register_all_pairs([*images, duplicate], temp_dir)
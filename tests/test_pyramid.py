@@ -0,0 +1,173 @@
+"""Tests for niftyregw.pyramid module."""
+
+from pathlib import Path
+from unittest.mock import patch
+
+import nibabel as nib
+import numpy as np
+import pytest
+
+from niftyregw import pyramid, tools
+from niftyregw.pyramid import PyramidCache, reg_aladin_pyramid
+from niftyregw.wrapper import RunError
+
+
+def _save(path, data):
+    nib.save(nib.Nifti1Image(np.asarray(data, np.float32), np.eye(4)), path)
+    return path
+
+
+def _load(path):
+    return np.asarray(nib.load(path).dataobj)
+
+
+def _fake_reg_tools(tool, *args, **kwargs):
+    data = _load(args[args.index("-in") + 1])
+    if "-down" in args:
+        data = (data[::2, ::2, ::2] + data[1::2, 1::2, 1::2]) / 2
+    if "-smoG" in args:
+        data = data + 100
+    _save(args[args.index("-out") + 1], data)
+    return 0
+
+
+@pytest.fixture
+def image(temp_dir):
+    data = np.zeros((16, 16, 16), np.float32)
+    data[4:12, 4:12, 4:12] = 1
+    return _save(temp_dir / "image.nii.gz", data)
+
+
+@pytest.fixture
+def fake_reg_tools():
+    with patch.object(tools, "run", side_effect=_fake_reg_tools) as mock_run:
+        yield mock_run
+
+
+def test_levels_are_built_once(temp_dir, image, fake_reg_tools):
+    """Test each level is downsampled from the previous one and reused."""
+    cache = PyramidCache(temp_dir / "cache")
+    levels = cache.levels(image, 3)
+
+    assert levels[0] == image
+    assert [_load(path).shape for path in levels[1:]] == [(8, 8, 8), (4, 4, 4)]
+    assert fake_reg_tools.call_count == 2
+    assert cache.misses == 2
+
+    # A copy of the image shares its pyramid
+    copy = temp_dir / "copy.nii.gz"
+    copy.write_bytes(image.read_bytes())
+    assert PyramidCache(temp_dir / "cache").levels(copy, 3)[1:] == levels[1:]
+    assert fake_reg_tools.call_count == 2
+
+
+def test_smoothed_and_mask_levels(temp_dir, image, fake_reg_tools):
+    """Test smoothing is applied at level 0 and masks stay binary."""
+    with PyramidCache() as cache:
+        smoothed = cache.level(image, 1, smooth=2)
+        assert _load(smoothed).min() >= 100
+        args = fake_reg_tools.call_args_list[0][0]
+        assert args[args.index("-smoG") + 1 :][:3] == ("2", "2", "2")
+
+        mask = _load(cache.level(image, 2, mask=True))
+        assert set(np.unique(mask)) <= {0, 1}
+        assert cache.level(image, 1) != cache.level(image, 1, mask=True)
+        directory = cache.directory
+    assert not directory.exists()
+
+
+def test_clear_keeps_other_images(temp_dir, image, fake_reg_tools):
+    """Test clear only removes the levels the cache wrote."""
+    other = _save(temp_dir / "ref.nii", np.zeros((2, 2, 2)))
+    cache = PyramidCache(temp_dir)
+    levels = [
+        *cache.levels(image, 3, smooth=-2),
+        cache.level(image, 1, mask=True),
+    ]
+    cache.clear()
+    assert not any(path.exists() for path in levels)
+    assert other.exists() and image.exists()
+
+
+def test_negative_level(image):
+    """Test levels must be non-negative."""
+    with pytest.raises(ValueError, match="non-negative"):
+        PyramidCache().level(image, -1)
+
+
+def _fake_reg_aladin(reference, floating, *, output_affine, **kwargs):
+    Path(output_affine).write_text(f"{Path(reference).name}\n")
+    return 0
+
+
+def test_reg_aladin_pyramid(temp_dir, image, fake_reg_tools):
+    """Test levels run coarse to fine, each initialised by the previous one."""
+    floating = _save(temp_dir / "floating.nii", _load(image))
+    output = temp_dir / "affine.txt"
+    with (
+        patch.object(pyramid, "reg_aladin", side_effect=_fake_reg_aladin) as aladin,
+        patch.object(pyramid, "resample_image") as resample,
+    ):
+        result = reg_aladin_pyramid(
+            image,
+            floating,
+            cache=PyramidCache(temp_dir / "cache"),
+            num_levels=3,
+            num_levels_to_perform=2,
+            output_affine=output,
+            output_result=temp_dir / "result.nii",
+            reference_mask=image,
+            rigid_only=True,
+            interpolation=0,
+            padding=-1.0,
+        )
+
+    assert result == output
+    assert aladin.call_count == 2
+    (coarse_args, coarse), (fine_args, fine) = aladin.call_args_list
+    assert _load(coarse_args[0]).shape == (4, 4, 4)
+    assert _load(fine_args[0]).shape == (8, 8, 8)
+    assert _load(coarse["reference_mask"]).shape == (4, 4, 4)
+    assert coarse["input_affine"] is None
+    assert fine["input_affine"] == coarse["output_affine"]
+    assert coarse["num_levels"] == fine["num_levels"] == 1
+    assert fine["rigid_only"]
+    assert output.read_text() == f"{Path(fine_args[0]).name}\n"
+    assert resample.call_args[0][:3] == (image, floating, temp_dir / "result.nii")
+    assert resample.call_args[1]["interpolation"] == 0
+    assert resample.call_args[1]["padding"] == -1.0
+    assert fine["interpolation"] == 0
+
+
+def test_reg_aladin_pyramid_level_fails(temp_dir, image, fake_reg_tools):
+    """Test a failed level is not chained into the next one."""
+    with (
+        patch.object(pyramid, "reg_aladin", return_value=1) as aladin,
+        patch.object(pyramid, "resample_image") as resample,
+        pytest.raises(RunError, match="reg_aladin exited with code 1"),
+    ):
+        reg_aladin_pyramid(
+            image,
+            image,
+            cache=PyramidCache(temp_dir / "cache"),
+            output_affine=temp_dir / "affine.txt",
+            output_result=temp_dir / "result.nii",
+        )
+    assert aladin.call_count == 1
+    resample.assert_not_called()
+    assert not (temp_dir / "affine.txt").exists()
+
+
+def test_reg_aladin_pyramid_validation(temp_dir, image):
+    """Test outputs and the number of levels to perform are checked."""
+    cache = PyramidCache(temp_dir / "cache")
+    with pytest.raises(ValueError, match="required"):
+        reg_aladin_pyramid(image, image, cache=cache)
+    with pytest.raises(ValueError, match="between 1 and 3"):
+        reg_aladin_pyramid(
+            image,
+            image,
+            cache=cache,
+            num_levels_to_perform=4,
+            output_affine=temp_dir / "affine.txt",
+        )
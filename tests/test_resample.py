@@ -0,0 +1,137 @@
+"""Tests for niftyregw.resample module."""
+
+from pathlib import Path
+from unittest.mock import patch
+
+import pytest
+
+from niftyregw import resample
+from niftyregw.resample import ResampleInput, read_batch_file, resample_many
+from niftyregw.wrapper import RunError
+
+
+def _tools_called(mock_run):
+    return [call[0][0] for call in mock_run.call_args_list]
+
+
+def test_is_nifti():
+    """Test NIfTI filename detection."""
+    assert resample.is_nifti(Path("cpp.nii"))
+    assert resample.is_nifti(Path("cpp.nii.gz"))
+    assert resample.is_nifti(Path("IMG.HDR"))
+    assert not resample.is_nifti(Path("affine.txt"))
+
+
+def test_read_batch_file(temp_dir):
+    """Test batch file parsing with comments and default interpolation."""
+    batch = temp_dir / "batch.txt"
+    batch.write_text(
+        "# modality output order\n"
+        "t1.nii.gz t1_res.nii.gz 3\n"
+        "\n"
+        "labels.nii.gz labels_res.nii.gz 0\n"
+        "mask.nii.gz mask_res.nii.gz\n"
+    )
+    inputs = read_batch_file(batch, default_interpolation=1)
+    assert inputs == [
+        ResampleInput(Path("t1.nii.gz"), Path("t1_res.nii.gz"), 3),
+        ResampleInput(Path("labels.nii.gz"), Path("labels_res.nii.gz"), 0),
+        ResampleInput(Path("mask.nii.gz"), Path("mask_res.nii.gz"), 1),
+    ]
+
+
+def test_read_batch_file_invalid_line(temp_dir):
+    """Test batch file parsing rejects malformed lines."""
+    batch = temp_dir / "batch.txt"
+    batch.write_text("only_one_column.nii.gz\n")
+    with pytest.raises(ValueError, match="batch.txt:1"):
+        read_batch_file(batch)
+
+
+def test_resample_many_computes_deformation_once(temp_dir):
+    """Test a CPP is converted to a deformation field once for all inputs."""
+    inputs = [
+        ResampleInput(Path("t1.nii.gz"), temp_dir / "t1_res.nii.gz", 3),
+        ResampleInput(Path("t2.nii.gz"), temp_dir / "t2_res.nii.gz", 3),
+        ResampleInput(Path("labels.nii.gz"), temp_dir / "labels_res.nii.gz", 0),
+    ]
+    scratch = temp_dir / "scratch"
+
+    with patch.object(resample, "run", return_value=0) as mock_run:
+        outputs = resample_many(
+            Path("ref.nii.gz"),
+            inputs,
+            Path("cpp.nii.gz"),
+            scratch_dir=scratch,
+            max_workers=2,
+        )
+
+    assert outputs == [item.output for item in inputs]
+    tools = _tools_called(mock_run)
+    assert tools.count("reg_transform") == 1
+    assert tools.count("reg_resample") == 3
+    assert tools[0] == "reg_transform"
+
+    field = str(scratch / "deformation.nii")
+    assert field in mock_run.call_args_list[0][0]
+    for call in mock_run.call_args_list[1:]:
+        args = call[0]
+        assert args[args.index("-trans") + 1] == field
+
+    orders = {
+        call[0][call[0].index("-flo") + 1]: call[0][call[0].index("-inter") + 1]
+        for call in mock_run.call_args_list[1:]
+    }
+    assert orders == {"t1.nii.gz": "3", "t2.nii.gz": "3", "labels.nii.gz": "0"}
+
+
+def test_resample_many_affine_passthrough(temp_dir):
+    """Test affine transformations are not converted to a field."""
+    inputs = [ResampleInput(Path("t1.nii.gz"), temp_dir / "t1_res.nii.gz")]
+
+    with patch.object(resample, "run", return_value=0) as mock_run:
+        resample_many(Path("ref.nii.gz"), inputs, Path("affine.txt"), padding=0.0)
+
+    assert _tools_called(mock_run) == ["reg_resample"]
+    args = mock_run.call_args[0]
+    assert args[args.index("-trans") + 1] == "affine.txt"
+    assert "-inter" not in args
+    assert args[args.index("-pad") + 1] == "0.0"
+
+
+def test_resample_many_without_transformation(temp_dir):
+    """Test identity resampling omits -trans."""
+    inputs = [ResampleInput(Path("t1.nii.gz"), temp_dir / "t1_res.nii.gz", 1)]
+
+    with patch.object(resample, "run", return_value=0) as mock_run:
+        resample_many(Path("ref.nii.gz"), inputs, omp_threads=2)
+
+    args = mock_run.call_args[0]
+    assert "-trans" not in args
+    assert args[args.index("-omp") + 1] == "2"
+
+
+def test_resample_many_reg_transform_fails(temp_dir):
+    """Test a failed field computation stops the batch before resampling."""
+    inputs = [ResampleInput(Path("t1.nii.gz"), temp_dir / "t1_res.nii.gz")]
+
+    with (
+        patch.object(resample, "run", return_value=1) as mock_run,
+        pytest.raises(RunError, match="reg_transform exited with code 1"),
+    ):
+        resample_many(Path("ref.nii.gz"), inputs, Path("cpp.nii.gz"))
+
+    assert _tools_called(mock_run) == ["reg_transform"]
+
+
+def test_resample_image_fails(temp_dir):
+    """Test a failed reg_resample run raises with its exit code."""
+    with (
+        patch.object(resample, "run", return_value=2),
+        pytest.raises(RunError) as exc_info,
+    ):
+        resample.resample_image(
+            Path("ref.nii.gz"), Path("flo.nii.gz"), temp_dir / "out.nii.gz"
+        )
+    assert exc_info.value.tool == "reg_resample"
+    assert exc_info.value.returncode == 2
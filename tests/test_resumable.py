@@ -0,0 +1,153 @@
+"""Tests for niftyregw.resumable module."""
+
+from unittest.mock import patch
+
+import nibabel as nib
+import numpy as np
+import pytest
+
+from niftyregw import resumable
+from niftyregw.resumable import refine_control_point_grid, reg_f3d_resumable
+
+
+def _identity_grid(path, shape, spacing=4.0):
+    affine = np.diag([spacing, spacing, spacing, 1.0])
+    affine[:3, 3] = -spacing
+    indices = np.stack(np.meshgrid(*map(np.arange, shape), indexing="ij"), -1)
+    data = indices * spacing - spacing
+    data = data.reshape((*shape, 1, 3)).astype(np.float32)
+    nib.save(nib.Nifti1Image(data, affine), path)
+    return path
+
+
+def _bspline(points, x):
+    i = int(np.floor(x))
+    t = x - i
+    weights = [
+        (1 - t) ** 3 / 6,
+        (3 * t**3 - 6 * t**2 + 4) / 6,
+        (-3 * t**3 + 3 * t**2 + 3 * t + 1) / 6,
+        t**3 / 6,
+    ]
+    return sum(w * points[i + k] for w, k in zip(weights, (-1, 0, 1, 2)))
+
+
+def test_refine_control_point_grid(temp_dir):
+    """Test refined grids describe the same transformation."""
+    cpp = _identity_grid(temp_dir / "cpp.nii.gz", (6, 5, 4))
+    refined = nib.load(refine_control_point_grid(cpp, temp_dir / "refined.nii.gz"))
+    assert refined.shape == (9, 7, 5, 1, 3)
+    assert np.allclose(refined.header.get_zooms()[:3], 2)
+    assert np.allclose(refined.affine[:3, 3], -2)
+    # The identity is still the identity
+    coordinates = nib.affines.apply_affine(
+        refined.affine, np.stack(np.indices(refined.shape[:3]), -1)
+    )
+    assert np.allclose(np.asarray(refined.dataobj)[..., 0, :], coordinates)
+
+    rng = np.random.default_rng(0)
+    points = rng.random(7)
+    nib.save(
+        nib.Nifti1Image(points.reshape(7, 1, 1, 1, 1), np.eye(4)), temp_dir / "1d.nii"
+    )
+    refined = refine_control_point_grid(temp_dir / "1d.nii", temp_dir / "1d_r.nii")
+    refined_points = np.asarray(nib.load(refined).dataobj).ravel()
+    for x in np.linspace(1, 4.9, 20):
+        # Old control point x is new control point 2x-1
+        assert _bspline(refined_points, 2 * x - 1) == pytest.approx(_bspline(points, x))
+
+
+def _fake_reg_f3d(reference, floating, *, output_cpp, output_result, **kwargs):
+    # The output grid has the spacing of the input one
+    shape = (4, 4, 4)
+    if "input_cpp" in kwargs:
+        shape = nib.load(kwargs["input_cpp"]).shape[:3]
+    _identity_grid(output_cpp, shape)
+    nib.save(nib.Nifti1Image(np.zeros((4, 4, 4), np.float32), np.eye(4)), output_result)
+    return 0
+
+
+def test_resume_after_crash(temp_dir, mock_nifti_image):
+    """Test levels run one at a time and completed levels are not run again."""
+    floating = temp_dir / "flo.nii.gz"
+    floating.write_bytes(mock_nifti_image.read_bytes())
+    affine = temp_dir / "affine.txt"
+    affine.write_text("1 0 0 0\n0 1 0 0\n0 0 1 0\n0 0 0 1\n")
+    checkpoint = temp_dir / "checkpoint"
+    calls = []
+
+    def _crash_at_level_2(*args, **kwargs):
+        calls.append(kwargs)
+        if len(calls) == 2:
+            msg = "preempted"
+            raise RuntimeError(msg)
+        return _fake_reg_f3d(*args, **kwargs)
+
+    arguments = {
+        "input_affine": affine,
+        "spacing_x": 5,
+        "bending_energy": 0.01,
+        "output_cpp": temp_dir / "cpp.nii",
+    }
+    with patch.object(resumable, "reg_f3d", side_effect=_crash_at_level_2):
+        with pytest.raises(RuntimeError, match="preempted"):
+            reg_f3d_resumable(mock_nifti_image, floating, checkpoint, **arguments)
+        assert (checkpoint / "level_1_cpp.nii.gz").exists()
+        assert not (checkpoint / "level_2_cpp.nii.gz").exists()
+
+        assert (
+            reg_f3d_resumable(
+                mock_nifti_image, floating, checkpoint, omp_threads=2, **arguments
+            )
+            == 0
+        )
+
+    first, crashed, second, third = calls
+    assert first["num_levels"] == 3
+    assert first["num_levels_to_perform"] == 1
+    assert first["input_affine"] == affine
+    assert first["spacing_x"] == first["spacing_z"] == 20
+    assert first["bending_energy"] == 0.01
+    assert "input_cpp" not in first
+    assert crashed["num_levels"] == second["num_levels"] == 2
+    assert second["input_cpp"] == checkpoint / "level_1_refined_cpp.nii.gz"
+    assert "input_affine" not in second
+    assert third["num_levels"] == 1
+    assert nib.load(temp_dir / "cpp.nii").shape[:3] == (7, 7, 7)
+
+
+def test_levels_to_perform(temp_dir, mock_nifti_image):
+    """Test the first grid is coarse enough to reach the final spacing."""
+    calls = []
+
+    def _record(*args, **kwargs):
+        calls.append(kwargs)
+        return _fake_reg_f3d(*args, **kwargs)
+
+    with patch.object(resumable, "reg_f3d", side_effect=_record):
+        reg_f3d_resumable(
+            mock_nifti_image,
+            mock_nifti_image,
+            temp_dir / "checkpoint",
+            spacing_x=5,
+            num_levels=3,
+            num_levels_to_perform=2,
+        )
+
+    first, second = calls
+    # Refined once, to the final spacing of 5 at the second level
+    assert first["spacing_x"] == first["spacing_y"] == first["spacing_z"] == 10
+    assert first["num_levels"] == 3
+    assert second["num_levels"] == 2
+    assert second["input_cpp"].name == "level_1_refined_cpp.nii.gz"
+
+
+def test_resume_with_other_arguments(temp_dir, mock_nifti_image):
+    """Test a checkpoint directory cannot be reused with other arguments."""
+    checkpoint = temp_dir / "checkpoint"
+    with patch.object(resumable, "reg_f3d", side_effect=_fake_reg_f3d):
+        reg_f3d_resumable(mock_nifti_image, mock_nifti_image, checkpoint)
+        with pytest.raises(ValueError, match="other inputs"):
+            reg_f3d_resumable(
+                mock_nifti_image, mock_nifti_image, checkpoint, bending_energy=0.1
+            )
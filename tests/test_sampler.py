@@ -0,0 +1,79 @@
+"""Tests for niftyregw.sampler module."""
+
+import sys
+
+import pytest
+
+from niftyregw import sampler
+from niftyregw.sampler import ProcessSampler, RunTimeline, sampling
+from niftyregw.wrapper import run
+
+linux_only = pytest.mark.skipif(
+    not sys.platform.startswith("linux"), reason="Reads /proc"
+)
+
+
+def test_observe_levels_and_iterations():
+    """Test progress events are parsed from reg_f3d and reg_aladin lines."""
+    process_sampler = ProcessSampler("reg_f3d", [])
+    for line in (
+        "[NiftyReg F3D] Current level: 1 / 3",
+        "[NiftyReg F3D] [1] Current objective function: -0.9",
+        "[NiftyReg F3D] [2] Current objective function: -0.8",
+        "[NiftyReg INFO] Current level 2 / 3",
+        "[NiftyReg F3D] Reference image size: 64x64x64 voxels",
+        "[NiftyReg F3D] [1] Current objective function: -0.7",
+    ):
+        process_sampler.observe(line)
+    events = process_sampler.timeline.events
+    assert [(e.level, e.iteration) for e in events] == [
+        (1, None),
+        (1, 1),
+        (1, 2),
+        (2, None),
+        (2, 1),
+    ]
+    assert all(a.time <= b.time for a, b in zip(events, events[1:], strict=False))
+
+
+@linux_only
+def test_run_is_sampled(temp_dir, fake_niftyreg):
+    """Test samples of a busy binary are saved and lined up with its levels."""
+    fake_niftyreg.configure(
+        "reg_f3d", lines=60, line_rate=200, cpu_seconds=0.3, write_outputs=False
+    )
+    with sampling(temp_dir / "timelines", interval=0.02) as active:
+        assert run("reg_f3d", "-ln", "3") == 0
+    assert sampler.get_sampling() is None
+
+    (path,) = active.timelines
+    timeline = RunTimeline.load(path)
+    assert timeline.tool == "reg_f3d"
+    assert timeline.args == ["-ln", "3"]
+    assert timeline.returncode == 0
+    assert [e.level for e in timeline.events if e.iteration is None] == [1, 2, 3]
+    assert len(timeline.samples) > 5
+    assert all(s.rss_bytes > 0 and s.threads >= 1 for s in timeline.samples)
+    # The binary prints its levels, then keeps a core busy at the last one
+    busy = timeline.samples[-3:]
+    assert all(s.level == 3 for s in busy)
+    assert max(s.cpu_percent for s in busy) > 50
+    assert set(timeline.cpu_by_level()) >= {3}
+
+
+def test_reused_pid_keeps_both_timelines(temp_dir):
+    """Test two runs with the same process ID are saved to different files."""
+    active = sampler.Sampling(temp_dir)
+    first = active.save(RunTimeline("reg_f3d", [], pid=42, start=1000.0))
+    second = active.save(RunTimeline("reg_f3d", [], pid=42, start=1000.5))
+
+    assert first != second
+    assert active.timelines == [first, second]
+    assert RunTimeline.load(first).start == 1000.0
+    assert second.name.startswith("reg_f3d_") and second.name.endswith("_42.json")
+
+
+@linux_only
+def test_read_proc_of_exited_process():
+    """Test nothing is read from a process that does not exist."""
+    assert sampler.read_proc(2**22 + 1) is None
@@ -0,0 +1,173 @@
+"""Tests for niftyregw.similarity module."""
+
+import nibabel as nib
+import numpy as np
+import pytest
+
+from niftyregw import similarity
+
+
+@pytest.fixture
+def images():
+    rng = np.random.default_rng(0)
+    reference = rng.normal(size=(12, 10, 8))
+    floating = 2 * reference + 0.5 * rng.normal(size=reference.shape)
+    return reference, floating
+
+
+def _save(path, data):
+    nib.save(nib.Nifti1Image(np.asarray(data, np.float32), np.eye(4)), path)
+    return path
+
+
+def test_ncc_matches_pearson(images):
+    """Test NCC is the Pearson correlation coefficient."""
+    reference, floating = images
+    expected = np.corrcoef(reference.ravel(), floating.ravel())[0, 1]
+    assert similarity.ncc(reference, floating) == pytest.approx(expected)
+    assert similarity.ncc(reference, -reference) == pytest.approx(-1)
+
+
+def test_ncc_constant_image_is_zero(images):
+    """Test NCC is zero when an image has no variance."""
+    reference, _ = images
+    assert similarity.ncc(reference, np.ones_like(reference)) == 0
+
+
+def test_ssd_is_mean_squared_difference(images):
+    """Test SSD is normalised by the number of voxels."""
+    reference, floating = images
+    expected = np.mean((reference - floating) ** 2)
+    assert similarity.ssd(reference, floating) == pytest.approx(expected)
+
+
+def test_mask_and_non_finite_voxels_are_ignored(images):
+    """Test masked-out and NaN voxels do not contribute."""
+    reference, floating = images
+    mask = np.zeros(reference.shape, bool)
+    mask[:6] = True
+    corrupted = floating.copy()
+    corrupted[8:] = np.nan
+    corrupted[0, 0, 0] = np.inf
+    valid = mask & np.isfinite(corrupted)
+    expected = np.mean((reference[valid] - corrupted[valid]) ** 2)
+    assert similarity.ssd(reference, corrupted, mask) == pytest.approx(expected)
+    expected = np.corrcoef(reference[valid], corrupted[valid])[0, 1]
+    assert similarity.ncc(reference, corrupted, mask) == pytest.approx(expected)
+
+
+def test_nmi_ordering(images):
+    """Test NMI is highest for identical images and lowest for noise."""
+    reference, floating = images
+    noise = np.random.default_rng(1).normal(size=reference.shape)
+    identical = similarity.nmi(reference, reference)
+    related = similarity.nmi(reference, floating)
+    unrelated = similarity.nmi(reference, noise)
+    assert identical > related > unrelated
+    assert 1 <= unrelated < 1.05
+    assert identical <= 2
+
+
+def test_nmi_invariant_to_intensity_rescaling(images):
+    """Test NMI only depends on the binned intensities."""
+    reference, floating = images
+    assert similarity.nmi(reference, 3 * floating + 7) == pytest.approx(
+        similarity.nmi(reference, floating)
+    )
+
+
+def test_lncc(images):
+    """Test LNCC bounds for identical, related and inverted images."""
+    reference, floating = images
+    assert similarity.lncc(reference, reference) == pytest.approx(1)
+    assert similarity.lncc(reference, -reference) == pytest.approx(-1)
+    assert 0.8 < similarity.lncc(reference, floating, sigma=2) < 1
+
+
+@pytest.mark.parametrize("name", similarity.METRICS)
+def test_batch_matches_single(images, name):
+    """Test a stacked batch gives the same values as individual calls."""
+    reference, floating = images
+    function = getattr(similarity, name)
+    batch = np.stack([floating, reference, -floating])
+    values = function(reference, batch)
+    assert isinstance(values, np.ndarray)
+    expected = [function(reference, image) for image in batch]
+    np.testing.assert_allclose(values, expected)
+
+
+def test_shape_mismatch(images):
+    """Test floating images must be on the reference grid."""
+    reference, _ = images
+    with pytest.raises(ValueError, match="does not match"):
+        similarity.ncc(reference, reference[:-1])
+
+
+def test_measure_arrays_unknown_metric(images):
+    """Test unknown metric names are rejected."""
+    reference, floating = images
+    with pytest.raises(ValueError, match="Unknown metrics"):
+        similarity.measure_arrays(reference, floating, ["mi"])
+
+
+def test_load_image_squeezes_trailing_axes(temp_dir):
+    """Test singleton time axes are dropped and multi-volume images rejected."""
+    path = _save(temp_dir / "img.nii.gz", np.zeros((4, 4, 4, 1)))
+    assert similarity.load_image(path).shape == (4, 4, 4)
+    path = _save(temp_dir / "img4d.nii.gz", np.zeros((4, 4, 4, 2)))
+    with pytest.raises(ValueError, match="single-volume"):
+        similarity.load_image(path)
+
+
+def test_measure_many(temp_dir, images):
+    """Test batched file evaluation matches in-memory evaluation."""
+    reference, floating = images
+    mask = np.zeros(reference.shape)
+    mask[2:10] = 1
+    ref_path = _save(temp_dir / "ref.nii.gz", reference)
+    mask_path = _save(temp_dir / "mask.nii.gz", mask)
+    floatings = [_save(temp_dir / f"flo{i}.nii.gz", floating + i) for i in range(5)]
+
+    results = list(
+        similarity.measure_many(ref_path, floatings, mask=mask_path, batch_size=2)
+    )
+
+    assert [path for path, _ in results] == floatings
+    ref32 = reference.astype(np.float32)
+    for index, (_, values) in enumerate(results):
+        flo32 = (floating + index).astype(np.float32)
+        expected = similarity.measure_arrays(ref32, flo32, mask=mask != 0)
+        assert values.keys() == set(similarity.METRICS)
+        for name in similarity.METRICS:
+            assert values[name] == pytest.approx(expected[name])
+
+
+def test_measure_many_with_workers(temp_dir, images):
+    """Test the worker pool keeps input order and values."""
+    reference, floating = images
+    ref_path = _save(temp_dir / "ref.nii.gz", reference)
+    floatings = [_save(temp_dir / f"flo{i}.nii.gz", floating * i) for i in range(7)]
+
+    sequential = list(similarity.measure_many(ref_path, floatings, batch_size=2))
+    parallel = list(
+        similarity.measure_many(ref_path, floatings, batch_size=2, max_workers=2)
+    )
+    assert parallel == sequential
+
+
+def test_measure_many_skips_bad_images(temp_dir, images):
+    """Test an image on another grid gets NaN values without stopping the rest."""
+    reference, floating = images
+    ref_path = _save(temp_dir / "ref.nii.gz", reference)
+    good = _save(temp_dir / "good.nii.gz", floating)
+    bad = _save(temp_dir / "bad.nii.gz", floating[:-1])
+
+    results = list(
+        similarity.measure_many(ref_path, [bad, good, bad], ["ncc"], batch_size=2)
+    )
+
+    assert [path for path, _ in results] == [bad, good, bad]
+    assert np.isnan(results[0][1]["ncc"])
+    assert np.isnan(results[2][1]["ncc"])
+    expected = similarity.ncc(reference.astype(np.float32), floating.astype(np.float32))
+    assert results[1][1]["ncc"] == pytest.approx(expected)
@@ -0,0 +1,153 @@
+"""Tests for niftyregw.sweep module."""
+
+import shutil
+from unittest.mock import patch
+
+import nibabel as nib
+import numpy as np
+import pytest
+
+from niftyregw import sweep
+from niftyregw.jacobian import FoldCheck
+from niftyregw.sweep import (
+    MedianPruner,
+    Uniform,
+    _ObjectiveParser,
+    best_trial,
+    grid_search,
+    parse_parameter,
+    random_search,
+    run_sweep,
+)
+
+
+def _f3d_output(objectives):
+    """Lines printed by reg_f3d with the given objective values per level."""
+    lines = []
+    for level, values in enumerate(objectives, start=1):
+        lines.append(f"[NiftyReg F3D] Current level: {level} / {len(objectives)}")
+        lines.append(f"[NiftyReg F3D] Initial objective function: {values[0] - 1:g}")
+        lines.extend(
+            f"[NiftyReg F3D] [{i}] Current objective function: {value:g}"
+            f" = (wSIM){value:g} - (wBE)0.001 [+ 0.5 mm]"
+            for i, value in enumerate(values, start=1)
+        )
+    lines.append(f"[NiftyReg F3D] Final objective function: {objectives[-1][-1]:g}")
+    return lines
+
+
+def test_grid_and_random_search():
+    """Test grid searches run every combination and random ones sample."""
+    space = {"bending_energy": [0.001, 0.01], "spacing": [5, 10, 15]}
+    assert len(grid_search(space)) == 6
+    assert grid_search(space)[1] == {"bending_energy": 0.001, "spacing": 10}
+
+    space = {
+        "bending_energy": Uniform(1e-4, 1e-1, log=True),
+        "num_levels": Uniform(2, 4),
+    }
+    trials = random_search(space, 20, seed=0)
+    assert trials == random_search(space, 20, seed=0)
+    assert all(1e-4 <= trial["bending_energy"] <= 1e-1 for trial in trials)
+    assert {trial["num_levels"] for trial in trials} <= {2, 3, 4}
+    with pytest.raises(ValueError, match="Grid searches"):
+        grid_search(space)
+
+
+@pytest.mark.parametrize(
+    ("text", "expected"),
+    [
+        ("bending_energy=0.001,0.01", ("bending_energy", [0.001, 0.01])),
+        ("lncc-sigma=-5", ("lncc_sigma", [-5])),
+        ("spacing=2:10", ("spacing", Uniform(2, 10))),
+        ("bending_energy=log:1e-4:0.1", ("bending_energy", Uniform(1e-4, 0.1, True))),
+    ],
+)
+def test_parse_parameter(text, expected):
+    """Test parameters are parsed from the command line."""
+    assert parse_parameter(text) == expected
+
+
+@pytest.mark.parametrize("text", ["bending_energy", "spacing=a,b", "be=1:2:3"])
+def test_parse_parameter_invalid(text):
+    """Test invalid parameters are rejected."""
+    with pytest.raises(ValueError, match="Expected"):
+        parse_parameter(text)
+
+
+def test_objective_parser_prunes_at_coarse_levels():
+    """Test trials below the median when a level finishes are pruned."""
+    pruner = MedianPruner(min_trials=2)
+    for good in ([[1.0, 2.0], [3.0]], [[1.0, 3.0], [4.0]]):
+        parser = _ObjectiveParser(pruner)
+        assert not any(parser(line) for line in _f3d_output(good))
+    assert parser.objectives == {1: 3.0, 2: 4.0}
+
+    parser = _ObjectiveParser(pruner)
+    answers = [parser(line) for line in _f3d_output([[0.5, 1.0], [9.0]])]
+    assert parser.pruned_at == 1
+    # reg_f3d is stopped when the next level starts
+    assert answers.index(True) == 4
+
+    # The last level is never pruned
+    parser = _ObjectiveParser(pruner)
+    assert not any(parser(line) for line in _f3d_output([[5.0], [0.0]]))
+
+
+def _save(path, data):
+    nib.save(nib.Nifti1Image(np.asarray(data, np.float32), np.eye(4)), path)
+    return path
+
+
+def _fake_reg_f3d(reference, floating, *, output_cpp, output_result, on_line, **kwargs):
+    # Larger bending energies give a worse coarse objective and a better result
+    be = kwargs["bending_energy"]
+    for line in _f3d_output([[be], [be]]):
+        if on_line(line):
+            return -15
+    shutil.copyfile(reference, output_cpp)
+    data = np.asarray(nib.load(reference).dataobj)
+    _save(output_result, data + np.linspace(0, 1 / be, data.size).reshape(data.shape))
+    return 0
+
+
+def test_run_sweep(temp_dir):
+    """Test trials are scored, rejected when folding and pruned."""
+    rng = np.random.default_rng(0)
+    reference = _save(temp_dir / "ref.nii", rng.random((6, 6, 6)))
+    floating = _save(temp_dir / "flo.nii", rng.random((6, 6, 6)))
+    params = grid_search({"bending_energy": [4, 3, 2, 1], "spacing": [5]})
+
+    with (
+        patch.object(sweep, "reg_f3d", side_effect=_fake_reg_f3d) as mock_f3d,
+        patch.object(FoldCheck, "count_folded", side_effect=[0, 5, 0]),
+    ):
+        trials = list(
+            run_sweep(
+                reference,
+                floating,
+                params,
+                temp_dir / "sweep",
+                metric="ssd",
+                pruner=MedianPruner(min_trials=3),
+                total_threads=2,
+                f3d_options={"input_affine": None},
+            )
+        )
+
+    kwargs = mock_f3d.call_args_list[0][1]
+    assert kwargs["spacing_x"] == kwargs["spacing_z"] == 5
+    assert "spacing" not in kwargs
+    assert kwargs["omp_threads"] == 2
+    assert [trial.status for trial in trials] == [
+        "complete",
+        "folded",
+        "complete",
+        "pruned",
+    ]
+    assert trials[1].folded == 5
+    assert trials[0].score == -trials[0].similarity["ssd"]
+    assert trials[3].objectives == {1: 1}
+    assert best_trial(trials) is trials[0]
+    # Only the outputs of the best trial are kept
+    assert [path.name for path in (temp_dir / "sweep").iterdir()] == ["trial_0000"]
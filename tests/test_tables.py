@@ -0,0 +1,68 @@
+"""Tests for niftyregw.tables module."""
+
+import csv
+import sys
+from pathlib import Path
+from unittest.mock import patch
+
+import pytest
+
+from niftyregw.tables import read_path_list, write_table
+
+
+def test_read_path_list(temp_dir):
+    """Test path lists skip blank lines and comments."""
+    path_list = temp_dir / "files.txt"
+    path_list.write_text("# cohort\na.nii.gz\n\n  b.nii.gz  \n")
+    assert read_path_list(path_list) == [Path("a.nii.gz"), Path("b.nii.gz")]
+
+
+def test_write_csv(temp_dir):
+    """Test rows are written as CSV with a header."""
+    output = temp_dir / "results.csv"
+    rows = [
+        {"floating": Path("a.nii.gz"), "ncc": 0.5},
+        {"floating": Path("b.nii.gz"), "ncc": 0.25},
+    ]
+    assert write_table(iter(rows), output) == 2
+    with open(output, newline="") as f:
+        assert list(csv.DictReader(f)) == [
+            {"floating": "a.nii.gz", "ncc": "0.5"},
+            {"floating": "b.nii.gz", "ncc": "0.25"},
+        ]
+
+
+def test_write_tsv(temp_dir):
+    """Test the .tsv suffix selects tab delimiters."""
+    output = temp_dir / "results.tsv"
+    write_table([{"a": 1, "b": 2}], output)
+    assert output.read_text().splitlines() == ["a\tb", "1\t2"]
+
+
+def test_write_empty(temp_dir):
+    """Test no rows produce an empty file."""
+    output = temp_dir / "results.csv"
+    assert write_table([], output) == 0
+    assert output.read_text() == ""
+
+
+def test_write_empty_with_columns(temp_dir):
+    """Test the header is written without rows when the columns are given."""
+    output = temp_dir / "results.csv"
+    assert write_table([], output, ["floating", "ncc"]) == 0
+    assert output.read_text().splitlines() == ["floating,ncc"]
+
+
+def test_write_parquet_without_pyarrow(temp_dir):
+    """Test a helpful error is raised when pyarrow is missing."""
+    with patch.dict(sys.modules, {"pyarrow": None, "pyarrow.parquet": None}):
+        with pytest.raises(ImportError, match=r"niftyregw\[parquet\]"):
+            write_table([{"a": 1}], temp_dir / "results.parquet")
+
+
+def test_write_parquet(temp_dir):
+    """Test Parquet output when pyarrow is available."""
+    pq = pytest.importorskip("pyarrow.parquet")
+    output = temp_dir / "results.parquet"
+    write_table([{"floating": Path("a.nii.gz"), "ncc": 0.5}], output)
+    assert pq.read_table(output).to_pylist() == [{"floating": "a.nii.gz", "ncc": 0.5}]
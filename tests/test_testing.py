@@ -0,0 +1,95 @@
+"""Tests for niftyregw.testing module."""
+
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import nibabel as nib
+import numpy as np
+import pytest
+
+from niftyregw.cache import is_spline_grid
+from niftyregw.resample import compute_deformation
+from niftyregw.wrapper import reg_aladin, reg_f3d, run
+
+pytestmark = pytest.mark.skipif(
+    sys.platform == "win32", reason="The fake binaries are scripts"
+)
+
+
+@pytest.fixture
+def reference(temp_dir):
+    path = temp_dir / "ref.nii.gz"
+    nib.save(nib.Nifti1Image(np.ones((10, 12, 8), np.float32), np.eye(4)), path)
+    return path
+
+
+def test_registrations_write_outputs(temp_dir, fake_niftyreg, reference):
+    """Test fake registrations log lines and write plausible outputs."""
+    lines = []
+    assert (
+        reg_f3d(
+            reference,
+            reference,
+            output_cpp=temp_dir / "cpp.nii.gz",
+            output_result=temp_dir / "result.nii",
+            num_levels=2,
+            on_line=lines.append,
+        )
+        == 0
+    )
+    assert is_spline_grid(temp_dir / "cpp.nii.gz")
+    assert nib.load(temp_dir / "result.nii").shape == (10, 12, 8)
+    assert "[NiftyReg F3D] Current level: 2 / 2" in lines
+    assert any(line.startswith("[NiftyReg WARNING]") for line in lines)
+
+    field = compute_deformation(
+        temp_dir / "cpp.nii.gz", reference, temp_dir / "def.nii.gz"
+    )
+    positions = np.asarray(nib.load(field).dataobj)
+    assert positions.shape == (10, 12, 8, 1, 3)
+    assert np.array_equal(positions[3, 4, 5, 0], [3, 4, 5])
+
+    reg_aladin(reference, reference, output_affine=temp_dir / "affine.txt")
+    assert np.array_equal(np.loadtxt(temp_dir / "affine.txt"), np.eye(4))
+    assert fake_niftyreg.calls("reg_aladin")[0][:2] == ["-ref", str(reference)]
+    assert len(fake_niftyreg.calls()) == 3
+
+
+def test_exit_codes_and_timing(fake_niftyreg):
+    """Test the exit code, sleep and line rate of the binaries."""
+    fake_niftyreg.configure("reg_tools", exit_code=3, sleep=0.2, lines=5)
+    start = time.perf_counter()
+    assert run("reg_tools") == 3
+    assert time.perf_counter() - start >= 0.2
+    assert run("reg_measure") == 0
+
+    fake_niftyreg.configure(lines=10, line_rate=50)
+    start = time.perf_counter()
+    run("reg_measure")
+    assert time.perf_counter() - start >= 0.2
+
+    with pytest.raises(ValueError, match="Unknown binary"):
+        fake_niftyreg.configure("reg_nothing", lines=1)
+
+
+def test_terminated_through_pipe(fake_niftyreg):
+    """Test on_line stops a binary that is still printing."""
+    fake_niftyreg.configure("reg_tools", lines=1000, line_rate=100)
+    start = time.perf_counter()
+    assert run("reg_tools", on_line=lambda line: "step 3" in line) != 0
+    assert time.perf_counter() - start < 5
+    assert fake_niftyreg.calls("reg_tools") == []
+
+
+def test_concurrent_runs_read_every_line(fake_niftyreg):
+    """Test concurrent runs with large outputs do not lose or block lines."""
+    fake_niftyreg.configure("reg_tools", lines=5000, stderr_ratio=0.5)
+    lines = [[] for _ in range(4)]
+
+    def _run(i):
+        return run("reg_tools", on_line=lines[i].append)
+
+    with ThreadPoolExecutor(4) as executor:
+        assert list(executor.map(_run, range(4))) == [0] * 4
+    assert [len(run_lines) for run_lines in lines] == [5000] * 4
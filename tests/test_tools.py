@@ -0,0 +1,175 @@
+"""Tests for niftyregw.tools module."""
+
+from pathlib import Path
+from unittest.mock import patch
+
+import nibabel as nib
+import numpy as np
+import pytest
+
+from niftyregw import tools
+from niftyregw.tools import ToolsChain, parse_step
+from niftyregw.wrapper import RunError
+
+
+def _save(path, data, affine=None):
+    affine = np.diag([2.0, 2.0, 2.0, 1.0]) if affine is None else affine
+    nib.save(nib.Nifti1Image(np.asarray(data), affine), path)
+    return path
+
+
+def _load(path):
+    image = nib.load(path)
+    return np.asarray(image.dataobj), image
+
+
+@pytest.fixture
+def image(temp_dir):
+    data = np.arange(24, dtype=np.float32).reshape(2, 3, 4) - 5
+    data[0, 0, 0] = np.nan
+    data[1, 2, 3] = np.inf
+    return _save(temp_dir / "in.nii.gz", data)
+
+
+def _fake_reg_tools(function):
+    def _run(tool, *args, **kwargs):
+        data, image = _load(Path(args[args.index("-in") + 1]))
+        output = Path(args[args.index("-out") + 1])
+        nib.save(nib.Nifti1Image(function(data), image.affine), output)
+        return 0
+
+    return _run
+
+
+def test_numpy_only_chain(temp_dir, image):
+    """Test element-wise steps run in order without calling reg_tools."""
+    output = temp_dir / "out.nii.gz"
+    chain = (
+        ToolsChain()
+        .remove_nan_inf(0)
+        .multiply(2)
+        .add(temp_dir / "in.nii.gz")
+        .threshold(10)
+    )
+    with patch.object(tools, "run") as mock_run:
+        result = chain.apply(image, output)
+
+    mock_run.assert_not_called()
+    assert result == output
+    original, _ = _load(image)
+    expected = np.nan_to_num(original, nan=0, posinf=0) * 2 + original
+    expected = np.where(expected < 10, 0, 1)
+    data, saved = _load(output)
+    np.testing.assert_array_equal(data, expected)
+    np.testing.assert_array_equal(saved.affine, np.diag([2.0, 2.0, 2.0, 1.0]))
+    assert data.dtype == np.float32
+
+
+def test_binarize_and_nan_mask(temp_dir, image):
+    """Test binarisation and masking follow reg_tools semantics."""
+    mask = np.ones((2, 3, 4), np.uint8)
+    mask[1] = 0
+    mask_path = _save(temp_dir / "mask.nii.gz", mask)
+    output = temp_dir / "out.nii"
+    ToolsChain().binarize().nan_mask(mask_path).apply(image, output)
+
+    data, _ = _load(output)
+    original, _ = _load(image)
+    assert np.isnan(data[1]).all()
+    np.testing.assert_array_equal(data[0], (original[0] != 0).astype(np.float32))
+
+
+def test_no_scaling_reads_raw_values(temp_dir):
+    """Test the header scaling is ignored when requested."""
+    image = nib.Nifti1Image(np.full((2, 2, 2), 3, np.int16), np.eye(4))
+    image.header.set_slope_inter(2, 1)
+    path = temp_dir / "scaled.nii"
+    nib.save(image, path)
+
+    ToolsChain().no_scaling().apply(path, temp_dir / "raw.nii")
+    ToolsChain().to_float().apply(path, temp_dir / "scaled_out.nii")
+    assert _load(temp_dir / "raw.nii")[0].max() == 3
+    assert _load(temp_dir / "scaled_out.nii")[0].max() == 7
+
+
+def test_no_scaling_after_element_wise_step_is_rejected(temp_dir, image):
+    """Test no-scaling cannot follow a step that already read the scaled image."""
+    chain = ToolsChain().multiply(2).no_scaling()
+    with pytest.raises(ValueError, match="no-scaling must be the first step"):
+        chain.apply(image, temp_dir / "out.nii")
+    assert not (temp_dir / "out.nii").exists()
+
+
+def test_mixed_chain_calls_reg_tools_once(temp_dir, image):
+    """Test only reg_tools steps go through disk, once each."""
+    output = temp_dir / "out.nii.gz"
+    chain = ToolsChain.from_strings(
+        ["remove-nan-inf 0", "smooth-gaussian 2 2 2", "threshold 1", "binarize"]
+    )
+    with patch.object(
+        tools, "run", side_effect=_fake_reg_tools(lambda data: data + 1)
+    ) as mock_run:
+        chain.apply(image, output, omp_threads=2, scratch_dir=temp_dir / "scratch")
+
+    mock_run.assert_called_once()
+    args = mock_run.call_args[0]
+    assert args[0] == "reg_tools"
+    assert args[args.index("-smoG") + 1 : args.index("-smoG") + 4] == ("2", "2", "2")
+    assert args[args.index("-omp") + 1] == "2"
+    assert Path(args[args.index("-in") + 1]).parent == temp_dir / "scratch"
+
+    original, _ = _load(image)
+    expected = np.where(np.nan_to_num(original, nan=0, posinf=0) + 1 < 1, 0, 1)
+    np.testing.assert_array_equal(_load(output)[0], expected)
+
+
+def test_last_reg_tools_step_writes_output(temp_dir, image):
+    """Test reg_tools writes the output directly when it runs last."""
+    output = temp_dir / "out.nii.gz"
+    chain = ToolsChain().add(1).downsample()
+    with patch.object(tools, "run", side_effect=_fake_reg_tools(lambda d: d)) as run:
+        chain.apply(image, output)
+
+    args = run.call_args[0]
+    assert args[args.index("-out") + 1] == str(output)
+    assert "-down" in args
+
+
+def test_empty_chain(temp_dir, image):
+    """Test an empty chain is rejected."""
+    with pytest.raises(ValueError, match="empty"):
+        ToolsChain().apply(image, temp_dir / "out.nii")
+
+
+@pytest.mark.parametrize(
+    ("text", "expected"),
+    [
+        ("binarize", ("binarize", ())),
+        ("--smooth-gaussian 1 2 3", ("smooth-gaussian", ("1", "2", "3"))),
+        ("remove_nan_inf 0", ("remove-nan-inf", ("0",))),
+    ],
+)
+def test_parse_step(text, expected):
+    """Test chain steps are parsed from option-like strings."""
+    assert parse_step(text) == expected
+
+
+@pytest.mark.parametrize(
+    ("text", "match"),
+    [("blur 2", "Unknown step"), ("threshold", "takes 1"), ("", "Empty")],
+)
+def test_parse_step_invalid(text, match):
+    """Test invalid chain steps are rejected."""
+    with pytest.raises(ValueError, match=match):
+        parse_step(text)
+
+
+def test_reg_tools_step_fails(temp_dir, image):
+    """Test a failed reg_tools step stops the chain."""
+    chain = ToolsChain().smooth_gaussian((2, 2, 2)).multiply(2)
+    with (
+        patch.object(tools, "run", return_value=1),
+        pytest.raises(RunError, match="reg_tools exited with code 1"),
+    ):
+        chain.apply(image, temp_dir / "out.nii")
+    assert not (temp_dir / "out.nii").exists()
@@ -0,0 +1,79 @@
+"""Tests for niftyregw.trace module."""
+
+import json
+import os
+import socket
+import threading
+
+from niftyregw import trace
+from niftyregw.jobqueue import JobQueue, run_worker
+from niftyregw.trace import merge_traces, span, tracing
+from niftyregw.wrapper import run
+
+
+def test_runs_are_traced(temp_dir, fake_niftyreg):
+    """Test every run from every thread is a span in the saved trace."""
+    fake_niftyreg.configure("reg_tools", lines=5, sleep=0.05)
+    fake_niftyreg.configure("reg_jacobian", exit_code=3)
+    path = temp_dir / "trace.json"
+    with tracing(path):
+        threads = [
+            threading.Thread(target=run, args=("reg_tools", "-in", str(i)))
+            for i in range(3)
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        run("reg_jacobian")
+    assert trace.get_tracer() is None
+
+    events = json.loads(path.read_text())["traceEvents"]
+    spans = [e for e in events if e["ph"] == "X"]
+    tools = [e for e in spans if e["name"] == "reg_tools"]
+    assert len(tools) == 3
+    assert len({e["tid"] for e in tools}) == 3
+    assert all(e["dur"] >= 50_000 and e["cat"] == "run" for e in tools)
+    assert {e["args"]["args"] for e in tools} == {"-in 0", "-in 1", "-in 2"}
+    (jacobian,) = [e for e in spans if e["name"] == "reg_jacobian"]
+    assert jacobian["args"]["returncode"] == 3
+    names = {e["tid"]: e["args"]["name"] for e in events if e["name"] == "thread_name"}
+    assert {names[e["tid"]] for e in tools} == {t.name for t in threads}
+
+    (process,) = [e for e in events if e["name"] == "process_name"]
+    assert process["args"]["name"] == f"{socket.gethostname()}:{os.getpid()}"
+
+    merged = merge_traces([path, path], temp_dir / "merged.json")
+    merged_events = json.loads(merged.read_text())["traceEvents"]
+    assert len(merged_events) == 2 * len(events)
+    # The same process ID in two inputs becomes two processes
+    assert {e["pid"] for e in merged_events[: len(events)]} == {1}
+    assert {e["pid"] for e in merged_events[len(events) :]} == {2}
+
+
+def test_queue_wait_and_jobs(temp_dir, fake_niftyreg):
+    """Test a worker records the queue wait and the run of every job."""
+    queue = JobQueue(temp_dir / "jobs.db")
+    ids = [queue.submit("run", {"tool": "reg_tools"}) for _ in range(2)]
+    with tracing() as tracer:
+        run_worker(queue, worker="node1:1", exit_when_empty=True)
+    events = tracer.events()
+
+    waits = [e for e in events if e["name"] == "queue wait"]
+    assert [e["args"]["job"] for e in waits] == ids
+    jobs = [e for e in events if e.get("cat") == "job"]
+    assert [e["name"] for e in jobs] == [f"job {i}" for i in ids]
+    # Each job starts after its wait and contains its run
+    runs = [e for e in events if e["name"] == "reg_tools"]
+    for wait, job, run_event in zip(waits, jobs, runs, strict=True):
+        assert wait["ts"] + wait["dur"] <= job["ts"] + 1
+        assert job["ts"] <= run_event["ts"]
+        assert run_event["ts"] + run_event["dur"] <= job["ts"] + job["dur"]
+    assert {"name": "node1:1"} in [e["args"] for e in events if e["ph"] == "M"]
+
+
+def test_span_without_tracing():
+    """Test spans record nothing when tracing is off."""
+    with span("stage", "stage", subject="a") as args:
+        args["status"] = "done"
+    assert trace.get_tracer() is None
@@ -0,0 +1,135 @@
+"""Tests for niftyregw.voxels module."""
+
+import nibabel as nib
+import numpy as np
+import pytest
+
+from niftyregw import voxels
+
+
+def _save(path, data, affine=None):
+    affine = np.diag([1.5, 1.5, 2.0, 1.0]) if affine is None else affine
+    nib.save(nib.Nifti1Image(np.asarray(data), affine), path)
+    return path
+
+
+def _load(path):
+    image = nib.load(path)
+    return np.asarray(image.dataobj), image
+
+
+@pytest.fixture
+def volume():
+    rng = np.random.default_rng(0)
+    data = rng.normal(size=(5, 4, 7, 3)).astype(np.float32)
+    data[0, 0, 0, 0] = np.nan
+    data[1, 1, 1, 1] = -np.inf
+    data[2, 2, 2, 2] = 0
+    return data
+
+
+@pytest.mark.parametrize("shape", [(5, 4), (5, 4, 7), (5, 4, 7, 3), (2, 2, 3, 2, 2)])
+@pytest.mark.parametrize("chunk_voxels", [1, 40, 10**6])
+def test_iter_chunks_covers_image(shape, chunk_voxels):
+    """Test chunks cover every voxel exactly once within the budget."""
+    counts = np.zeros(shape, int)
+    for index in voxels.iter_chunks(shape, chunk_voxels):
+        counts[index[: len(shape)]] += 1
+        plane = shape[0] * shape[1]
+        assert counts[index[: len(shape)]].size <= max(chunk_voxels, plane)
+    assert (counts == 1).all()
+
+
+@pytest.mark.parametrize("chunk_voxels", [20, 10**6])
+@pytest.mark.parametrize(
+    ("name", "operand", "expected"),
+    [
+        ("add", 2.5, lambda d, o: d + 2.5),
+        ("subtract", "1", lambda d, o: d - 1),
+        ("multiply", "image", lambda d, o: d * o),
+        ("divide", "image", lambda d, o: d / o),
+        ("binarize", None, lambda d, o: (d != 0).astype(np.float32)),
+        ("threshold", 0.1, lambda d, o: np.where(d < 0.1, 0, 1)),
+        ("remove_nan_inf", -1, lambda d, o: np.where(np.isfinite(d), d, -1)),
+    ],
+)
+def test_operations_match_numpy(
+    temp_dir, volume, name, operand, expected, chunk_voxels
+):
+    """Test chunked operations match whole-array NumPy on a 4D image."""
+    image = _save(temp_dir / "in.nii.gz", volume)
+    other = np.abs(volume[..., ::-1]) + 1
+    args = [] if operand is None else [operand]
+    if operand == "image":
+        args = [_save(temp_dir / "other.nii", other)]
+    output = temp_dir / "out.nii.gz"
+
+    result = getattr(voxels, name)(image, *args, output, chunk_voxels=chunk_voxels)
+
+    assert result == output
+    data, saved = _load(output)
+    with np.errstate(invalid="ignore"):
+        np.testing.assert_allclose(data, expected(volume, other), rtol=1e-6)
+    assert data.dtype == np.float32
+    np.testing.assert_array_equal(saved.affine, np.diag([1.5, 1.5, 2.0, 1.0]))
+
+
+def test_3d_operand_applies_to_each_volume(temp_dir, volume):
+    """Test a 3D image operand is broadcast over the volumes of a 4D image."""
+    image = _save(temp_dir / "in.nii", volume)
+    mask = np.ones(volume.shape[:3], np.uint8)
+    mask[:, :, :3] = 0
+    voxels.nan_mask(image, _save(temp_dir / "mask.nii", mask), temp_dir / "out.nii")
+    data, _ = _load(temp_dir / "out.nii")
+    assert np.isnan(data[:, :, :3]).all()
+    np.testing.assert_array_equal(data[:, :, 3:], volume[:, :, 3:])
+
+
+def test_array_operand_and_shape_mismatch(temp_dir, volume):
+    """Test arrays are valid operands and shapes are checked."""
+    image = _save(temp_dir / "in.nii", volume)
+    voxels.add(image, np.ones(volume.shape, np.float32), temp_dir / "out.nii")
+    np.testing.assert_array_equal(_load(temp_dir / "out.nii")[0], volume + 1)
+    with pytest.raises(ValueError, match="does not match"):
+        voxels.add(image, np.ones((2, 2, 2)), temp_dir / "out.nii")
+
+
+def test_in_place(temp_dir, volume):
+    """Test the output can overwrite the input."""
+    image = _save(temp_dir / "in.nii", volume)
+    voxels.multiply(image, 2, image, chunk_voxels=20)
+    np.testing.assert_array_equal(_load(image)[0], volume * 2)
+
+
+def test_float64_and_scaling(temp_dir):
+    """Test float64 is preserved and header scaling can be ignored."""
+    float64 = _save(temp_dir / "f64.nii", np.ones((3, 3, 3)))
+    voxels.add(float64, 1, temp_dir / "out64.nii")
+    assert _load(temp_dir / "out64.nii")[0].dtype == np.float64
+
+    image = nib.Nifti1Image(np.full((3, 3, 3), 4, np.int16), np.eye(4))
+    image.header.set_slope_inter(0.5, 10)
+    nib.save(image, temp_dir / "scaled.nii")
+    voxels.map_voxels(
+        voxels.OPERATIONS["to-float"],
+        temp_dir / "scaled.nii",
+        temp_dir / "raw.nii",
+        unscaled=True,
+    )
+    voxels.add(temp_dir / "scaled.nii", 0, temp_dir / "scaled_out.nii")
+    assert _load(temp_dir / "raw.nii")[0].max() == pytest.approx(4)
+    assert _load(temp_dir / "scaled_out.nii")[0].max() == pytest.approx(12)
+
+
+@pytest.mark.parametrize("chunk_voxels", [1, 10**6])
+def test_rms(temp_dir, volume, chunk_voxels):
+    """Test the RMS is the mean voxel-wise norm over volumes."""
+    first = np.nan_to_num(volume, nan=0, neginf=0)
+    second = first[::-1]
+    expected = np.sqrt(((first - second) ** 2).sum(axis=-1)).mean()
+    value = voxels.rms(
+        _save(temp_dir / "a.nii", first),
+        _save(temp_dir / "b.nii.gz", second),
+        chunk_voxels=chunk_voxels,
+    )
+    assert value == pytest.approx(expected, rel=1e-6)
@@ -1,5 +1,6 @@
 """Tests for niftyregw.wrapper module."""
 
+import os
 from pathlib import Path
 from unittest.mock import Mock, patch
 
@@ -66,6 +67,33 @@ def test_run_with_logger(temp_dir):
         mock_warning.assert_called_once_with("warning message")
 
 
+def test_run_on_line_terminates(temp_dir):
+    """Test run passes lines to on_line and stops the binary when it asks."""
+    tool_path = temp_dir / "reg_f3d"
+
+    mock_process = Mock()
+    mock_process.stdout = iter(["level 1\n", "stop\n"])
+    mock_process.stderr = iter([])
+    mock_process.wait.return_value = -15
+    mock_process.__enter__ = Mock(return_value=mock_process)
+    mock_process.__exit__ = Mock(return_value=False)
+    lines = []
+
+    def on_line(line):
+        lines.append(line)
+        return line == "stop"
+
+    with (
+        patch.object(wrapper, "_get_path", return_value=tool_path),
+        patch("niftyregw.wrapper.Popen", return_value=mock_process),
+    ):
+        returncode = wrapper.run("reg_f3d", on_line=on_line)
+
+    assert lines == ["level 1", "stop"]
+    mock_process.terminate.assert_called_once()
+    assert returncode == -15
+
+
 def test_run_strips_backslashes_and_newlines():
     """Test run strips backslashes and newlines from arguments."""
     tool_path = Path("/usr/bin/reg_aladin")
@@ -586,3 +614,154 @@ def test_read_stream_formats_matrices(temp_dir):
 
     # Check that the last matrix line is formatted
     assert len(captured_lines[3].split()) == 4
+
+
+def test_reg_f3d_flags(temp_dir):
+    """Test reg_f3d maps keyword arguments to reg_f3d flags."""
+    with patch.object(wrapper, "run", return_value=0) as mock_run:
+        wrapper.reg_f3d(
+            temp_dir / "ref.nii",
+            temp_dir / "flo.nii",
+            output_cpp=temp_dir / "cpp.nii",
+            spacing_x=-5,
+            bending_energy=0.01,
+            use_nmi=True,
+            reference_lower_threshold=0,
+            landmarks_weight=0.5,
+            landmarks_file=temp_dir / "landmarks.txt",
+        )
+    args = mock_run.call_args[0]
+    assert args[0] == "reg_f3d"
+    args_str = " ".join(args)
+    assert f"-cpp {temp_dir / 'cpp.nii'}" in args_str
+    assert "-sx -5" in args_str
+    assert "-be 0.01" in args_str
+    assert "--nmi" in args_str
+    assert "--rLwTh 0" in args_str
+    assert f"-land 0.5 {temp_dir / 'landmarks.txt'}" in args_str
+
+
+def test_reg_f3d_paths_with_spaces(temp_dir):
+    """Test reg_f3d passes paths containing spaces as single arguments."""
+    reference = temp_dir / "my ref.nii"
+    cpp = temp_dir / "c p p.nii"
+    with patch.object(wrapper, "run", return_value=0) as mock_run:
+        wrapper.reg_f3d(reference, temp_dir / "flo.nii", output_cpp=cpp)
+    args = mock_run.call_args[0]
+    assert args[args.index("-ref") + 1] == str(reference)
+    assert args[args.index("-cpp") + 1] == str(cpp)
+
+
+def test_reg_f3d_temporary_directory_only_for_fold_check(temp_dir):
+    """Test no temporary directory is made unless the fold check needs a grid."""
+    with (
+        patch.object(wrapper, "run", return_value=0),
+        patch.object(wrapper.tempfile, "TemporaryDirectory") as mock_tmp,
+    ):
+        wrapper.reg_f3d(temp_dir / "ref.nii", temp_dir / "flo.nii")
+    mock_tmp.assert_not_called()
+
+
+def test_reg_f3d_landmarks_validation(temp_dir):
+    """Test reg_f3d requires landmarks weight and file together."""
+    with pytest.raises(ValueError, match="together"):
+        wrapper.reg_f3d(temp_dir / "ref.nii", temp_dir / "flo.nii", landmarks_weight=1)
+
+
+def test_reg_f3d_fold_check_retries(temp_dir):
+    """Test reg_f3d reruns with stronger regularisation while folding."""
+    from niftyregw.jacobian import FoldCheck
+
+    fold_check = FoldCheck(retries=2, factor=10)
+    with (
+        patch.object(wrapper, "run", return_value=0) as mock_run,
+        patch.object(FoldCheck, "count_folded", side_effect=[12, 3, 0]) as mock_count,
+    ):
+        wrapper.reg_f3d(
+            temp_dir / "ref.nii",
+            temp_dir / "flo.nii",
+            output_cpp=temp_dir / "cpp.nii",
+            fold_check=fold_check,
+        )
+    assert mock_run.call_count == 3
+    assert mock_count.call_args[0] == (temp_dir / "cpp.nii", temp_dir / "ref.nii")
+    first, second, third = (c[0] for c in mock_run.call_args_list)
+    assert "-be" not in first
+    assert second[-4:] == ("-be", "0.01", "-jl", "0.01")
+    assert third[-4:] == ("-be", "0.1", "-jl", "0.1")
+
+
+def test_reg_f3d_fold_check_fails(temp_dir):
+    """Test reg_f3d raises once the retries are exhausted."""
+    from niftyregw.jacobian import FoldCheck
+
+    with (
+        patch.object(wrapper, "run", return_value=0) as mock_run,
+        patch.object(FoldCheck, "count_folded", return_value=4),
+        pytest.raises(wrapper.FoldingError, match="4 voxels") as exc_info,
+    ):
+        wrapper.reg_f3d(
+            temp_dir / "ref.nii",
+            temp_dir / "flo.nii",
+            fold_check=FoldCheck(max_folded_voxels=3, retries=1),
+        )
+    assert mock_run.call_count == 2
+    # A scratch grid is checked when no output grid is requested
+    assert exc_info.value.transformation.name == "cpp.nii"
+    assert exc_info.value.folded == 4
+
+
+def test_reg_f3d_fold_check_skipped_on_failure(temp_dir):
+    """Test a failed registration is neither checked nor run again."""
+    from niftyregw.jacobian import FoldCheck
+
+    with (
+        patch.object(wrapper, "run", return_value=1) as mock_run,
+        patch.object(FoldCheck, "count_folded") as mock_count,
+    ):
+        returncode = wrapper.reg_f3d(
+            temp_dir / "ref.nii",
+            temp_dir / "flo.nii",
+            fold_check=FoldCheck(retries=2),
+        )
+    assert returncode == 1
+    assert mock_run.call_count == 1
+    mock_count.assert_not_called()
+
+
+def test_run_output_to_file(temp_dir, fake_niftyreg):
+    """Test run sends the output to a file without reader threads."""
+    fake_niftyreg.configure("reg_tools", lines=10, stderr_ratio=0.5)
+    log = temp_dir / "job.log"
+    log.write_text("previous job\n")
+    with patch.object(wrapper, "Thread") as mock_thread:
+        assert wrapper.run("reg_tools", output=log) == 0
+    mock_thread.assert_not_called()
+    lines = log.read_text().splitlines()
+    assert lines[0] == "previous job"
+    assert len(lines) == 11
+    assert sum("WARNING" in line for line in lines) == 5
+
+
+def test_run_output_tail_on_error(fake_niftyreg):
+    """Test run logs the last lines of a failing binary even to /dev/null."""
+    fake_niftyreg.configure("reg_tools", lines=100, exit_code=2)
+    messages = []
+    handler = logger.add(messages.append, format="{message}", level="ERROR")
+    try:
+        assert wrapper.run("reg_tools", output=os.devnull) == 2
+    finally:
+        logger.remove(handler)
+    (message,) = messages
+    assert message.startswith("reg_tools exited with code 2.")
+    assert "[NiftyReg ERROR] reg_tools failed" in message
+    assert len(message.splitlines()) <= wrapper._TAIL_LINES + 2
+
+
+def test_run_output_and_on_line():
+    """Test run rejects on_line with an output file."""
+    with (
+        patch.object(wrapper, "_get_path", return_value=Path("/usr/bin/reg_tools")),
+        pytest.raises(ValueError, match="on_line"),
+    ):
+        wrapper.run("reg_tools", output="job.log", on_line=print)